@@ -10,11 +10,19 @@ from services.retry_service import retry_service
 from services.token_service import token_service
 from services.bot_config_service import bot_config_service
 from services.notification_config_service import notification_config_service
+from services.tracing import tracer
+from services.registry import lazy_service, registry, shared
+from utils.logging_config import configure_logging, get_logger, mask_phone
 from utils.phone_utils import normalize_phone_for_database
 from datetime import datetime
+import functools
 import json
 import re
 
+# Logging estructurado: se configura una sola vez al arrancar (LOG_LEVEL, LOG_FORMAT)
+configure_logging()
+logger = get_logger(__name__)
+
 app=Flask(__name__)
 app.config.from_object(Config)
 
@@ -24,7 +32,7 @@ CORS(app, resources={
     r"/api/web/chat": {
         "origins": "*",  # Temporalmente permitir todos los orígenes para debug
         "methods": ["POST", "OPTIONS"],
-        "allow_headers": ["Content-Type"]
+        "allow_headers": ["Content-Type", tracer.PROFILE_HEADER, tracer.TOKEN_HEADER]
     },
     r"/api/bot-config": {
         "origins": "*",
@@ -38,11 +46,34 @@ CORS(app, resources={
     }
 })
 
-WhatsApp_service=WhatsAppService()
-citas_service=CitasService()
-conversation_manager=ConversationManager()  # Nuevo gestor de conversaciones con ML
+# Se construyen en la primera solicitud: el worker arranca sin conectar a Firebase/Twilio
+WhatsApp_service=lazy_service('whatsapp_service', lambda: shared(WhatsAppService))
+citas_service=lazy_service('citas_service', lambda: shared(CitasService))
+conversation_manager=lazy_service('conversation_manager', ConversationManager)  # Nuevo gestor de conversaciones con ML
 user_states={}
 
+def traced_route(name):
+    """
+    Abre la traza de la solicitud (services.tracing); el perfilador por muestreo se
+    activa con el header X-Debug-Profile: 1 (más X-Debug-Token) o con TRACE_PROFILE=1
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with tracer.trace(name, profile=tracer.profile_requested(request.headers), path=request.path):
+                return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def debug_only(view):
+    """Endpoints de depuración: requieren X-Debug-Token igual a DEBUG_ADMIN_TOKEN"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not tracer.debug_authorized(request.headers):
+            return jsonify({"success": False, "error": "No autorizado"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
 # J.RNF16: Validación de números inválidos
 def is_valid_phone_number(phone: str) -> bool:
     """Valida que el número de teléfono sea válido"""
@@ -66,7 +97,7 @@ def is_valid_phone_number(phone: str) -> bool:
 def verify_webhook():
     """Verificación de webhook para Twilio (opcional, Twilio no requiere GET)"""
     # Twilio no usa verificación GET como Meta, pero mantenemos por compatibilidad
-    print("GET request recibido en /webhook")
+    logger.debug('GET request recibido en /webhook')
     return "OK", 200
 
 @app.route('/health',methods=['GET'])
@@ -77,8 +108,11 @@ def health_check():
     """
     try:
         # Verificar que los schedulers estén corriendo
-        from scheduler.reminder_scheduler import reminder_scheduler
-        scheduler_running = reminder_scheduler.scheduler.running if hasattr(reminder_scheduler, 'scheduler') else False
+        # No construir el scheduler desde el health check
+        scheduler_running = False
+        if registry.is_built('reminder_scheduler'):
+            from scheduler.reminder_scheduler import reminder_scheduler
+            scheduler_running = reminder_scheduler.scheduler.running if hasattr(reminder_scheduler, 'scheduler') else False
         
         return jsonify({
             "status": "ok",
@@ -102,6 +136,32 @@ def ping():
     """
     return jsonify({"status": "pong", "timestamp": datetime.now().isoformat()}), 200
 
+@app.route('/api/ml/token-usage', methods=['GET'])
+@debug_only
+def ml_token_usage():
+    """
+    Tokens de OpenAI (prompt, completion y servidos desde cache) por tipo de llamada
+    en este worker
+    """
+    from services.prompt_builder import token_usage_tracker
+    return jsonify({
+        "success": True,
+        "usage": token_usage_tracker.get_stats(),
+        "timestamp": datetime.now().isoformat()
+    }), 200
+
+@app.route('/api/debug/traces', methods=['GET'])
+@debug_only
+def debug_traces():
+    """
+    Percentiles por etapa (p50/p90/p99) y últimas trazas de solicitudes en este worker
+    """
+    return jsonify({
+        "success": True,
+        "traces": tracer.get_stats(),
+        "timestamp": datetime.now().isoformat()
+    }), 200
+
 # J.RF16, J.RNF18: Endpoints para configuración del bot
 @app.route('/api/bot-config', methods=['GET', 'OPTIONS'])
 def get_bot_config():
@@ -116,7 +176,7 @@ def get_bot_config():
             'config': config
         }), 200
     except Exception as e:
-        print(f"Error obteniendo configuración del bot: {e}")
+        logger.error('Error obteniendo configuración del bot: %s', e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -153,7 +213,7 @@ def update_bot_config():
             }), 500
             
     except Exception as e:
-        print(f"Error actualizando configuración del bot: {e}")
+        logger.error('Error actualizando configuración del bot: %s', e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -184,7 +244,7 @@ def get_notification_settings():
         }), 200
         
     except Exception as e:
-        print(f"Error obteniendo configuración de notificaciones: {e}")
+        logger.error('Error obteniendo configuración de notificaciones: %s', e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -228,7 +288,7 @@ def update_notification_settings():
             }), 500
             
     except Exception as e:
-        print(f"Error actualizando configuración de notificaciones: {e}")
+        logger.error('Error actualizando configuración de notificaciones: %s', e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -274,7 +334,7 @@ def request_medical_history_access():
         return jsonify(result), 200 if result.get('success') else 400
         
     except Exception as e:
-        print(f"Error en request_medical_history_access: {e}")
+        logger.error('Error en request_medical_history_access: %s', e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # RF11: Endpoint para procesar respuesta de autorización
@@ -311,7 +371,7 @@ def process_medical_history_authorization():
         return jsonify(result), 200 if result.get('success') else 400
         
     except Exception as e:
-        print(f"Error en process_medical_history_authorization: {e}")
+        logger.error('Error en process_medical_history_authorization: %s', e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # RNF16: Endpoint para obtener números bloqueados
@@ -334,7 +394,7 @@ def get_blocked_phones():
         }), 200
         
     except Exception as e:
-        print(f"Error obteniendo teléfonos bloqueados: {e}")
+        logger.error('Error obteniendo teléfonos bloqueados: %s', e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # RNF16: Endpoint para desbloquear un número
@@ -366,7 +426,7 @@ def unblock_phone():
         }), 200 if success else 400
         
     except Exception as e:
-        print(f"Error desbloqueando teléfono: {e}")
+        logger.error('Error desbloqueando teléfono: %s', e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # RNF16: Endpoint para verificar si un número está bloqueado
@@ -394,7 +454,7 @@ def check_phone_blocked():
         }), 200
         
     except Exception as e:
-        print(f"Error verificando teléfono: {e}")
+        logger.error('Error verificando teléfono: %s', e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # RF9: Endpoint para notificar reasignación de cita
@@ -448,7 +508,7 @@ def notify_appointment_reassignment():
         }), 200 if result else 400
         
     except Exception as e:
-        print(f"Error notificando reasignación: {e}")
+        logger.error('Error notificando reasignación: %s', e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/web/chat', methods=['OPTIONS'])
@@ -456,107 +516,179 @@ def web_chat_options():
     """Manejar preflight CORS"""
     return '', 200
 
+def _parse_web_chat_request():
+    """Lee y valida el JSON del chat web. Retorna (params, error_response)"""
+    data = request.get_json(silent=True)
+    if not data:
+        logger.error('ERROR: No se recibió JSON en el request')
+        return None, (jsonify({'success': False, 'error': 'Invalid JSON'}), 400)
+    
+    params = {
+        'message_body': data.get('message'),
+        'session_id': data.get('session_id'),
+        'platform': data.get('platform', 'web'),  # 'web' por defecto
+        'user_id': data.get('user_id'),  # ID del usuario autenticado
+        'phone': data.get('phone'),  # Teléfono del usuario
+        'user_name': data.get('user_name')  # Nombre del usuario
+    }
+    
+    if not params['message_body'] or not params['session_id']:
+        logger.error('ERROR: Faltan parámetros - message: %s, session_id: %s', bool(params['message_body']), bool(params['session_id']))
+        return None, (jsonify({'success': False, 'error': 'Message and session_id are required'}), 400)
+    
+    logger.debug('WEB CHAT RECIBIDO - Session ID: %s, Message: %s, User ID: %s, Phone: %s', params['session_id'], params['message_body'], params['user_id'], params['phone'])
+    return params, None
+
+def _run_web_chat(message_body, session_id, platform, user_id=None, phone=None,
+                  user_name=None, stream_callback=None):
+    """
+    Procesa un mensaje del chat web y retorna el texto de respuesta.
+    stream_callback (opcional) recibe los fragmentos de la respuesta de IA conforme llegan;
+    las respuestas de menú no pasan por él.
+    """
+    # SIEMPRE usar sistema de menús - ignorar modo agente
+    # Procesar el mensaje usando el sistema de menús estructurado
+    bot_response_text = ''
+    try:
+        response_data = conversation_manager.process_message(
+            session_id=session_id,
+            message=message_body,
+            user_id=user_id,
+            phone=phone,
+            user_name=user_name,
+            mode='hybrid',  # Modo híbrido inteligente
+            stream_callback=stream_callback
+        )
+        bot_response_text = response_data.get('response', '')
+        logger.debug('Sistema de menús procesó correctamente - Response: %s...', bot_response_text[:100])
+    except Exception as menu_error:
+        logger.exception('Error en sistema de menús, usando fallback: %s', menu_error)
+        # Fallback al sistema anterior si falla
+        bot_response_text = process_web_message(session_id, message_body, platform, user_id=user_id, phone=phone, user_name=user_name)
+
+    # Si la respuesta está vacía o es solo "...", usar un mensaje por defecto
+    if not bot_response_text or bot_response_text.strip() == "" or bot_response_text.strip() == "...":
+        logger.debug('WEB CHAT RESPUESTA VACÍA - Usando mensaje por defecto')
+        bot_response_text = "Lo siento, no pude procesar tu mensaje. Por favor, intenta nuevamente o escribe *menu* para ver las opciones disponibles."
+    
+    logger.debug('WEB CHAT RESPUESTA - Response: %s...', bot_response_text[:200])
+    return bot_response_text
+
 @app.route('/api/web/chat', methods=['POST'])
+@traced_route('web_chat')
 def web_chat():
     """Endpoint para el chat web con ML mejorado"""
     try:
-        print(f"WEB CHAT REQUEST - Headers: {dict(request.headers)}")
-        print(f"WEB CHAT REQUEST - Origin: {request.headers.get('Origin', 'No Origin')}")
+        logger.debug('WEB CHAT REQUEST - Origin: %s', request.headers.get('Origin', 'No Origin'))
         
-        data = request.get_json()
-        if not data:
-            print("ERROR: No se recibió JSON en el request")
-            return jsonify({'success': False, 'error': 'Invalid JSON'}), 400
-            
-        message_body = data.get('message')
-        session_id = data.get('session_id')
-        platform = data.get('platform', 'web')  # 'web' por defecto
-        user_id = data.get('user_id')  # ID del usuario autenticado
-        phone = data.get('phone')  # Teléfono del usuario
-        user_name = data.get('user_name')  # Nombre del usuario
-
-        if not message_body or not session_id:
-            print(f"ERROR: Faltan parámetros - message: {bool(message_body)}, session_id: {bool(session_id)}")
-            return jsonify({'success': False, 'error': 'Message and session_id are required'}), 400
-
-        print(f"WEB CHAT RECIBIDO - Session ID: {session_id}, Message: {message_body}, User ID: {user_id}, Phone: {phone}")
-
-        # SIEMPRE usar sistema de menús - ignorar modo agente
-        # Procesar el mensaje usando el sistema de menús estructurado
-        bot_response_text = ''
-        try:
-            response_data = conversation_manager.process_message(
-                session_id=session_id,
-                message=message_body,
-                user_id=user_id,
-                phone=phone,
-                user_name=user_name,
-                mode='hybrid'  # Modo híbrido inteligente
-            )
-            bot_response_text = response_data.get('response', '')
-            print(f"Sistema de menús procesó correctamente - Response: {bot_response_text[:100]}...")
-        except Exception as menu_error:
-            print(f"Error en sistema de menús, usando fallback: {menu_error}")
-            import traceback
-            traceback.print_exc()
-            # Fallback al sistema anterior si falla
-            bot_response_text = process_web_message(session_id, message_body, platform, user_id=user_id, phone=phone, user_name=user_name)
-
-        # Si la respuesta está vacía o es solo "...", usar un mensaje por defecto
-        if not bot_response_text or bot_response_text.strip() == "" or bot_response_text.strip() == "...":
-            print(f"WEB CHAT RESPUESTA VACÍA - Usando mensaje por defecto")
-            bot_response_text = "Lo siento, no pude procesar tu mensaje. Por favor, intenta nuevamente o escribe *menu* para ver las opciones disponibles."
+        params, error_response = _parse_web_chat_request()
+        if error_response:
+            return error_response
         
-        print(f"WEB CHAT RESPUESTA - Response: {bot_response_text[:200]}...")
+        bot_response_text = _run_web_chat(**params)
 
         return jsonify({
             'success': True,
             'response': bot_response_text,
-            'session_id': session_id,
+            'session_id': params['session_id'],
             'mode': 'hybrid'
         })
 
     except Exception as e:
-        print(f"ERROR en web_chat: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception('ERROR en web_chat: %s', e)
         return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/web/chat/stream', methods=['OPTIONS'])
+def web_chat_stream_options():
+    """Manejar preflight CORS"""
+    return '', 200
+
+@app.route('/api/web/chat/stream', methods=['POST'])
+def web_chat_stream():
+    """
+    Variante en streaming (Server-Sent Events) del chat web.
+    Eventos (una línea "data: {json}" cada uno):
+    - {"type": "token", "text": "..."}: fragmento de la respuesta de IA conforme llega
+    - {"type": "done", "success": true, "response": "...", "session_id": ..., "mode": "hybrid", "streamed": bool}
+    El evento "done" siempre trae la respuesta final completa y es la que vale; las respuestas
+    de menú llegan solo en ese evento (streamed = false).
+    """
+    from flask import Response
+    import queue
+    import threading
+    
+    params, error_response = _parse_web_chat_request()
+    if error_response:
+        return error_response
+    
+    events = queue.Queue()
+    streamed = {'value': False}
+    
+    def on_token(text):
+        streamed['value'] = True
+        events.put({'type': 'token', 'text': text})
+    
+    def worker():
+        try:
+            bot_response_text = _run_web_chat(stream_callback=on_token, **params)
+            events.put({
+                'type': 'done',
+                'success': True,
+                'response': bot_response_text,
+                'session_id': params['session_id'],
+                'mode': 'hybrid',
+                'streamed': streamed['value']
+            })
+        except Exception as e:
+            logger.error('ERROR en web_chat_stream: %s', e)
+            events.put({'type': 'done', 'success': False, 'error': str(e),
+                        'session_id': params['session_id'], 'streamed': streamed['value']})
+    
+    # El procesamiento corre en su propio hilo; este generador solo reenvía eventos
+    threading.Thread(target=worker, daemon=True).start()
+    
+    def generate():
+        while True:
+            try:
+                event = events.get(timeout=15)
+            except queue.Empty:
+                # Comentario SSE para mantener viva la conexión a través de proxies
+                yield ": keep-alive\n\n"
+                continue
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+            if event['type'] == 'done':
+                break
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Evitar buffering en proxies (nginx/Render)
+    })
     
 @app.route('/',methods=['POST'])
 @app.route('/webhook',methods=['POST'])
+@traced_route('webhook')
 def webhook():
     """Webhook para recibir mensajes de Twilio"""
     try:
-        # Log de depuración - ver qué está llegando
-        print("="*60)
-        print("WEBHOOK RECIBIDO")
-        print(f"URL: {request.url}")
-        print(f"Path: {request.path}")
-        print("="*60)
-        print(f"Request method: {request.method}")
-        print(f"Content-Type: {request.content_type}")
-        print(f"Form data: {dict(request.form)}")
-        print(f"Values: {dict(request.values)}")
-        print("="*60)
-        
         # Twilio envía datos como form-data, no JSON
         from_number = request.values.get('From', '') or request.form.get('From', '')
         message_body = request.values.get('Body', '') or request.form.get('Body', '')
         message_sid = request.values.get('MessageSid', '') or request.form.get('MessageSid', '')
         num_media = request.values.get('NumMedia', '0') or request.form.get('NumMedia', '0')
         
-        print(f"Webhook Twilio recibido:")
-        print(f"  From: {from_number}")
-        print(f"  Body: {message_body}")
-        print(f"  MessageSid: {message_sid}")
+        # Sin volcar el form completo (PII); el teléfono se enmascara
+        logger.info('Webhook Twilio recibido', extra={
+            'path': request.path, 'message_sid': message_sid,
+            'from': mask_phone(from_number), 'num_media': num_media
+        })
         
         # Si no hay datos, puede ser que Twilio esté enviando en otro formato
         if not from_number and not message_body:
-            print("ADVERTENCIA: No se recibieron datos del webhook")
+            logger.warning('ADVERTENCIA: No se recibieron datos del webhook')
             # Intentar leer como JSON por si acaso
             try:
                 json_data = request.get_json()
-                print(f"Datos JSON recibidos: {json_data}")
+                logger.debug('Datos JSON recibidos: %s', json_data)
             except:
                 pass
         
@@ -564,15 +696,15 @@ def webhook():
         # (quitar prefijo "whatsapp:" y el "1" extra si existe)
         if from_number:
             from_number = normalize_phone_for_database(from_number)
-            print(f"Número normalizado para búsqueda: {from_number}")
+            logger.debug('Número normalizado para búsqueda: %s', from_number)
         
         # Procesar el mensaje
         if message_body:
-            print(f"Procesando mensaje: {message_body}")
+            logger.debug('Procesando mensaje: %s', message_body)
             
             # J.RNF16: Validar número de teléfono
             if not is_valid_phone_number(from_number):
-                print(f"Número inválido detectado: {from_number}")
+                logger.warning('Número inválido detectado: %s', mask_phone(from_number))
                 # No responder a números inválidos
                 response = """<?xml version="1.0" encoding="UTF-8"?>
 <Response>
@@ -585,7 +717,7 @@ def webhook():
             paciente_id = None
             try:
                 from services.actions_service import ActionsService
-                actions_service = ActionsService()
+                actions_service = shared(ActionsService)
                 user_info = actions_service.get_user_info(phone=from_number)
                 paciente_id = user_info.get('uid') if user_info else None
             except:
@@ -596,7 +728,7 @@ def webhook():
             rate_check = rate_limiter.check_rate_limit(rate_limit_id)
             
             if not rate_check['allowed']:
-                print(f"Rate limit excedido para {rate_limit_id}: {rate_check['message']}")
+                logger.warning('Rate limit excedido para %s: %s', rate_limit_id, rate_check['message'])
                 # Enviar mensaje de rate limit
                 limit_message = f"Has alcanzado el límite de mensajes. {rate_check['message']}"
                 WhatsApp_service.send_text_message(from_number, limit_message)
@@ -663,7 +795,7 @@ def webhook():
             media_url = None
             if int(num_media) > 0:
                 media_url = request.values.get('MediaUrl0', '') or request.form.get('MediaUrl0', '')
-                print(f"Multimedia recibido: {media_url}")
+                logger.debug('Multimedia recibido: %s', media_url)
                 # Si viene solo la foto, el body puede estar vacío
                 if not message_body:
                     message_body = "[MEDIA_RECEIVED]"
@@ -672,14 +804,14 @@ def webhook():
             
             # Intentar obtener user_id desde Firestore usando el teléfono
             from services.actions_service import ActionsService
-            actions_service = ActionsService()
+            actions_service = shared(ActionsService)
             user_info = actions_service.get_user_info(phone=from_number)
             user_id = user_info.get('uid') if user_info else None
             user_name = user_info.get('nombre') if user_info else None
             
             # SIEMPRE usar conversation_manager para procesar mensajes (incluye números)
             # Esto asegura que el flujo del menú funcione correctamente
-            print(f"Procesando mensaje con conversation_manager: '{message_body}'")
+            logger.debug("Procesando mensaje con conversation_manager: '%s'", message_body)
             try:
                 response_data = conversation_manager.process_message(
                     session_id=from_number,
@@ -691,7 +823,7 @@ def webhook():
                     context_extras={'media_url': media_url} if media_url else None
                 )
                 response_text = response_data.get('response', '')
-                print(f"[APP] Respuesta del conversation_manager: tiene texto={bool(response_text)}, longitud={len(response_text) if response_text else 0}")
+                logger.debug('[APP] Respuesta del conversation_manager: tiene texto=%s, longitud=%s', bool(response_text), len(response_text) if response_text else 0)
                 
                 if response_text:
                     # Enviar mensaje con logging y retry
@@ -721,19 +853,17 @@ def webhook():
                         )
                 else:
                     # Si no hay respuesta, usar fallback
-                    print(f"[APP] No se generó respuesta, usando fallback")
+                    logger.debug('[APP] No se generó respuesta, usando fallback')
                     # Verificar si el mensaje coincide con el texto de un botón (fallback)
                     message_clean = message_body.strip()
                     if message_clean in button_text_to_id:
                         button_id = button_text_to_id[message_clean]
-                        print(f"Botón detectado por texto (fallback): '{message_clean}' -> {button_id}")
+                        logger.debug("Botón detectado por texto (fallback): '%s' -> %s", message_clean, button_id)
                         handle_button_response_extended(from_number, button_id)
                     else:
                         handle_text_message_extended(from_number, message_body)
             except Exception as ml_error:
-                print(f"Error en conversation_manager, usando fallback: {ml_error}")
-                import traceback
-                traceback.print_exc()
+                logger.exception('Error en conversation_manager, usando fallback: %s', ml_error)
                 # Fallback al sistema anterior si falla
                 message_clean = message_body.strip()
                 if message_clean in button_text_to_id:
@@ -744,20 +874,18 @@ def webhook():
                 else:
                     handle_text_message_extended(from_number, message_body)
         else:
-            print("ADVERTENCIA: message_body está vacío")
+            logger.warning('ADVERTENCIA: message_body está vacío')
         
         # Responder a Twilio (requerido)
         response = """<?xml version="1.0" encoding="UTF-8"?>
 <Response>
     <Message></Message>
 </Response>"""
-        print("Respondiendo a Twilio con XML")
+        logger.debug('Respondiendo a Twilio con XML')
         return response, 200, {'Content-Type': 'text/xml'}
         
     except Exception as e:
-        print(f"ERROR en webhook Twilio: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception('ERROR en webhook Twilio: %s', e)
         # Aún así responder a Twilio para que no reintente
         response = """<?xml version="1.0" encoding="UTF-8"?>
 <Response>
@@ -774,7 +902,7 @@ def process_message(message_data):
             from_number = message['from']
             message_type = message['type']
             
-            print(f"mensaje desde {from_number}, de tipo: {message_type}")
+            logger.debug('mensaje desde %s, de tipo: %s', from_number, message_type)
             
             if message_type == 'text':
                 text_content = message['text']['body']
@@ -785,9 +913,9 @@ def process_message(message_data):
                 handle_interactive_message(from_number, interactive_content)
             
             else:
-                print(f"tipo de mensaje invalido: {message_type}")
+                logger.debug('tipo de mensaje invalido: %s', message_type)
     except Exception as e:
-        print(f"error procesando mensaje: {e}")
+        logger.error('error procesando mensaje: %s', e)
 
 def handle_text_message(from_number,text):
     try:
@@ -853,14 +981,14 @@ def handle_text_message(from_number,text):
                 from_number,"¡Hola! Soy tu asistente densorita.\n\nEscribe *menu* para ver las opciones disponibles."
             )
     except Exception as e:
-        print(f"error manejando mensaje de texto: {e}")
+        logger.error('error manejando mensaje de texto: %s', e)
         WhatsApp_service.send_text_message(
             from_number,"Ocurrio un error, escribe *menu* para volver al menu principal"
         )
 def handle_interactive_message(from_number,interactive_data):
     try:
         interaction_type=interactive_data['type']
-        print(f'Interaccion: {interaction_type}')
+        logger.debug('Interaccion: %s', interaction_type)
 
         if interaction_type=='button_reply':
             button_id=interactive_data['button_reply']['id']
@@ -869,7 +997,7 @@ def handle_interactive_message(from_number,interactive_data):
             list_id=interactive_data['list_reply']['id']
             handle_list_response(from_number,list_id)
     except Exception as e:
-        print(f"error manejado interracion: {e}")
+        logger.error('error manejado interracion: %s', e)
 def handle_button_response(from_number,button_id):
     try:
         # Si viene como button_X, extraer el número
@@ -877,45 +1005,45 @@ def handle_button_response(from_number,button_id):
             button_num = button_id.replace('button_', '')
             # Mapear número a botón según el último mensaje enviado
             # Por ahora, manejamos respuestas numéricas directamente
-            print(f"Respuesta numerica recibida: {button_num}")
+            logger.debug('Respuesta numerica recibida: %s', button_num)
             # Convertir respuesta numérica a acción según contexto
             # Esto se manejará en handle_text_message_extended
             return
         
-        print(f"boton presionado: {button_id}")
+        logger.debug('boton presionado: %s', button_id)
         if button_id=='agendar_cita':
             # Obtener fechas dinámicas del último consultorio
             from database.models import CitaRepository
-            cita_repo = CitaRepository()
+            cita_repo = shared(CitaRepository)
             
             # Obtener user_id y phone del estado si están disponibles (para web)
             state = user_states.get(from_number, {})
             user_id = state.get('user_id')
             phone = state.get('phone')
             
-            print(f"AGENDAR_CITA - from_number: {from_number}, user_id: {user_id}, phone: {phone}")
+            logger.debug('AGENDAR_CITA - from_number: %s, user_id: %s, phone: %s', from_number, user_id, phone)
             
             # Obtener paciente por ID o teléfono, priorizando user_id
             paciente = None
             if user_id:
-                print(f"Buscando paciente por user_id: {user_id}")
+                logger.debug('Buscando paciente por user_id: %s', user_id)
                 paciente = cita_repo.obtener_paciente_por_id(user_id)
-                print(f"Paciente encontrado por ID: {paciente is not None}")
+                logger.debug('Paciente encontrado por ID: %s', paciente is not None)
             
             if not paciente and (phone or from_number):
                 telefono_buscar = phone or from_number
-                print(f"Buscando paciente por teléfono: {telefono_buscar}")
+                logger.debug('Buscando paciente por teléfono: %s', telefono_buscar)
                 paciente = cita_repo.obtener_paciente_por_telefono(telefono_buscar)
-                print(f"Paciente encontrado por teléfono: {paciente is not None}")
+                logger.debug('Paciente encontrado por teléfono: %s', paciente is not None)
             
             fechas_disponibles = []
             
             if paciente:
-                print(f"Paciente encontrado: {paciente.uid if hasattr(paciente, 'uid') else 'N/A'}")
+                logger.debug('Paciente encontrado: %s', paciente.uid if hasattr(paciente, 'uid') else 'N/A')
                 try:
                     ultimo_consultorio = cita_repo.obtener_ultimo_consultorio_paciente(paciente.uid)
                     if ultimo_consultorio:
-                        print(f"Último consultorio encontrado: {ultimo_consultorio}")
+                        logger.debug('Último consultorio encontrado: %s', ultimo_consultorio)
                         from datetime import datetime
                         fecha_base = datetime.now()
                         fecha_timestamp = datetime.combine(fecha_base.date(), datetime.min.time())
@@ -926,7 +1054,7 @@ def handle_button_response(from_number,button_id):
                             fecha_timestamp,
                             cantidad=3
                         )
-                        print(f"Fechas disponibles encontradas: {len(fechas_disponibles)}")
+                        logger.debug('Fechas disponibles encontradas: %s', len(fechas_disponibles))
                         # Guardar fechas en estado para mapeo numérico
                         user_states[from_number] = {
                             'step': 'seleccionando_fecha',
@@ -937,7 +1065,7 @@ def handle_button_response(from_number,button_id):
                             'ultimo_consultorio': ultimo_consultorio
                         }
                     else:
-                        print("No se encontró último consultorio para el paciente")
+                        logger.debug('No se encontró último consultorio para el paciente')
                         user_states[from_number] = {
                             'step': 'seleccionando_fecha',
                             'user_id': user_id,
@@ -945,16 +1073,14 @@ def handle_button_response(from_number,button_id):
                             'paciente_uid': paciente.uid
                         }
                 except Exception as e:
-                    print(f"Error obteniendo último consultorio: {e}")
-                    import traceback
-                    traceback.print_exc()
+                    logger.exception('Error obteniendo último consultorio: %s', e)
                     user_states[from_number] = {
                         'step': 'seleccionando_fecha',
                         'user_id': user_id,
                         'phone': phone
                     }
             else:
-                print(f"Paciente no encontrado - user_id: {user_id}, phone: {phone or from_number}")
+                logger.debug('Paciente no encontrado - user_id: %s, phone: %s', user_id, phone or from_number)
                 user_states[from_number] = {
                     'step': 'seleccionando_fecha',
                     'user_id': user_id,
@@ -967,14 +1093,12 @@ def handle_button_response(from_number,button_id):
             state = user_states.get(from_number, {})
             user_id = state.get('user_id')
             phone = state.get('phone')
-            print(f"VER CITAS - from_number: {from_number}, user_id: {user_id}, phone: {phone}")
+            logger.debug('VER CITAS - from_number: %s, user_id: %s, phone: %s', from_number, user_id, phone)
             try:
                 # Pasar WhatsApp_service para que use el servicio correcto (puede ser WebResponseCaptureService)
                 citas_service.obtener_citas_usuario(from_number,'ver', user_id=user_id, whatsapp_service=WhatsApp_service)
             except Exception as e:
-                print(f"Error en ver_citas: {e}")
-                import traceback
-                traceback.print_exc()
+                logger.exception('Error en ver_citas: %s', e)
                 WhatsApp_service.send_text_message(from_number, f"Error al obtener tus citas: {str(e)}")
         elif button_id=='gestionar_citas':
             WhatsApp_service.send_management_menu(from_number)
@@ -998,7 +1122,7 @@ def handle_button_response(from_number,button_id):
             
             # Obtener horarios dinámicos del último consultorio
             from database.models import CitaRepository
-            cita_repo = CitaRepository()
+            cita_repo = shared(CitaRepository)
             
             # Obtener user_id y phone del estado si están disponibles (para web)
             state = user_states.get(from_number, {})
@@ -1067,7 +1191,7 @@ def handle_button_response(from_number,button_id):
             }
             # Obtener fechas dinámicas
             from database.models import CitaRepository
-            cita_repo = CitaRepository()
+            cita_repo = shared(CitaRepository)
             
             # Obtener user_id y phone del estado si están disponibles (para web)
             state = user_states.get(from_number, {})
@@ -1112,10 +1236,10 @@ def handle_button_response(from_number,button_id):
             }
             # No cancelar todavía, solo guardar el estado para confirmación
     except Exception as e:
-        print(f"error con el bototn: {e}")
+        logger.error('error con el bototn: %s', e)
 def handle_list_response(from_number,list_id):
     try:
-        print(f"Lista seleccionada: {list_id}")
+        logger.debug('Lista seleccionada: %s', list_id)
         if '_' in list_id:
             action,cita_id=list_id.split('_',1)
             if action=='ver':
@@ -1127,7 +1251,7 @@ def handle_list_response(from_number,list_id):
                 }
                 # Obtener fechas dinámicas
                 from database.models import CitaRepository
-                cita_repo = CitaRepository()
+                cita_repo = shared(CitaRepository)
                 paciente = cita_repo.obtener_paciente_por_telefono(from_number)
                 fechas_disponibles = []
                 
@@ -1155,13 +1279,13 @@ def handle_list_response(from_number,list_id):
                     'cita_id':cita_id
                 }
     except Exception as e:
-        print(f"error manejando lista: {e}")
+        logger.error('error manejando lista: %s', e)
 def handle_reagendamiento(from_number, button_id):
     try:
         state = user_states.get(from_number, {})
         current_step = state.get('step', '')
         
-        print(f"handle_reagendamiento - from_number: {from_number}, button_id: {button_id}, step: {current_step}")
+        logger.debug('handle_reagendamiento - from_number: %s, button_id: %s, step: %s', from_number, button_id, current_step)
         
         # Solo procesar si estamos en un paso de reagendamiento
         if current_step == 'reagendando_fecha' and button_id.startswith('fecha_'):
@@ -1171,7 +1295,7 @@ def handle_reagendamiento(from_number, button_id):
             
             # Obtener horarios dinámicos
             from database.models import CitaRepository
-            cita_repo = CitaRepository()
+            cita_repo = shared(CitaRepository)
             
             # Obtener user_id y phone del estado si están disponibles (para web)
             state = user_states.get(from_number, {})
@@ -1241,13 +1365,11 @@ def handle_reagendamiento(from_number, button_id):
             return True
         
         # Si no es un paso de reagendamiento, retornar False para que continúe con handle_button_response
-        print(f"handle_reagendamiento - No es paso de reagendamiento, retornando False")
+        logger.debug('handle_reagendamiento - No es paso de reagendamiento, retornando False')
         return False
     
     except Exception as e:
-        print(f"Error en reagendamiento: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception('Error en reagendamiento: %s', e)
         return False
 def handle_cancelacion(from_number, text):
     try:
@@ -1292,7 +1414,7 @@ def handle_cancelacion(from_number, text):
             return True
     
     except Exception as e:
-        print(f"Error manejando cancelación: {e}")
+        logger.error('Error manejando cancelación: %s', e)
         return False
     
 def handle_text_message_extended(from_number, text):
@@ -1318,7 +1440,7 @@ def process_web_button_response(session_id, button_id, response_messages, user_i
     # Crear servicio de captura
     class WebResponseCaptureService:
         def send_text_message(self, to_number, message):
-            print(f"WebResponseCaptureService.send_text_message: {message[:100]}")
+            logger.debug('WebResponseCaptureService.send_text_message: %s', message[:100])
             response_messages.append(message)
         def send_main_menu(self, to_number):
             menu_text = """¡Hola! Bienvenido a Densora.
@@ -1331,13 +1453,13 @@ def process_web_button_response(session_id, button_id, response_messages, user_i
 3. Gestionar Citas
 
 Escribe el *número* de la opción que deseas (1, 2 o 3)."""
-            print(f"WebResponseCaptureService.send_main_menu")
+            logger.debug('WebResponseCaptureService.send_main_menu')
             response_messages.append(menu_text)
         def send_management_menu(self, to_number):
-            print(f"WebResponseCaptureService.send_management_menu")
+            logger.debug('WebResponseCaptureService.send_management_menu')
             response_messages.append("¿Qué deseas gestionar?\n1. Reagendar Cita\n2. Cancelar Cita\n3. Volver al Menú Principal")
         def send_date_selection(self, to_number, dates):
-            print(f"WebResponseCaptureService.send_date_selection: {len(dates) if dates else 0} fechas")
+            logger.debug('WebResponseCaptureService.send_date_selection: %s fechas', len(dates) if dates else 0)
             if not dates or len(dates) == 0:
                 response_messages.append("Lo siento, no hay fechas disponibles en este momento.\n\nPor favor, contacta directamente con el consultorio o intenta más tarde.\n\nEscribe *menu* para volver al menú principal.")
             else:
@@ -1345,15 +1467,15 @@ Escribe el *número* de la opción que deseas (1, 2 o 3)."""
                 response_messages.append(f"Por favor, selecciona una fecha:\n{date_options}")
         def send_time_selection(self, to_number, date, times):
             time_options = "\n".join([f"{i+1}. {t.get('horaInicio', t.get('inicio', ''))}" for i, t in enumerate(times)]) if times else "No hay horarios disponibles"
-            print(f"WebResponseCaptureService.send_time_selection: {len(times) if times else 0} horarios")
+            logger.debug('WebResponseCaptureService.send_time_selection: %s horarios', len(times) if times else 0)
             response_messages.append(f"Para la fecha {date}, selecciona una hora:\n{time_options}")
         def send_confirmation_message(self, to_number, cita, is_new):
             action = "creada" if is_new else "reagendada"
             fecha_formatted = datetime.strptime(cita.fecha, '%Y-%m-%d').strftime('%d/%m/%Y') if isinstance(cita.fecha, str) else cita.fecha.strftime('%d/%m/%Y')
-            print(f"WebResponseCaptureService.send_confirmation_message")
+            logger.debug('WebResponseCaptureService.send_confirmation_message')
             response_messages.append(f"Tu cita ha sido {action} con éxito:\n*Cliente:* {cita.nombre_cliente}\n*Fecha:* {fecha_formatted}\n*Hora:* {cita.horaInicio or cita.hora}"),
         def send_citas_list(self, to_number, citas, action_type):
-            print(f"WebResponseCaptureService.send_citas_list: {len(citas)} citas, action_type: {action_type}")
+            logger.debug('WebResponseCaptureService.send_citas_list: %s citas, action_type: %s', len(citas), action_type)
             if not citas:
                 response_messages.append("No tienes citas programadas.\n\nEscribe *menu* para agendar una nueva cita.")
                 return
@@ -1376,9 +1498,7 @@ Escribe el *número* de la opción que deseas (1, 2 o 3)."""
                     nombre = cita.nombre_cliente or 'Sin nombre'
                     list_items.append(f"{i+1}. {nombre} - {fecha_str} {hora}")
                 except Exception as e:
-                    print(f"Error formateando cita {i+1}: {e}")
-                    import traceback
-                    traceback.print_exc()
+                    logger.exception('Error formateando cita %s: %s', i+1, e)
                     list_items.append(f"{i+1}. Cita {i+1}")
             
             action_messages = {
@@ -1390,12 +1510,12 @@ Escribe el *número* de la opción que deseas (1, 2 o 3)."""
             response_messages.append(f"{header}\n" + "\n".join(list_items) + "\n\nEscribe el *número* de la cita para ver más detalles.")
         def send_cita_details(self, to_number, cita):
             fecha_formatted = cita.fecha.strftime('%d/%m/%Y') if isinstance(cita.fecha, datetime) else cita.fecha
-            print(f"WebResponseCaptureService.send_cita_details")
+            logger.debug('WebResponseCaptureService.send_cita_details')
             response_messages.append(f"*Detalles de la Cita*\n*Cliente:* {cita.nombre_cliente}\n*Fecha:* {fecha_formatted}\n*Hora:* {cita.horaInicio or cita.hora}\n*Motivo:* {cita.motivo}\n*Estado:* {cita.estado}")
         def send_interactive_buttons(self, to_number, header, body, buttons, content_sid=None):
             # Para web, convertir botones a texto numerado
             button_text = "\n".join([f"{i+1}. {btn.get('title', btn.get('id', ''))}" for i, btn in enumerate(buttons)])
-            print(f"WebResponseCaptureService.send_interactive_buttons")
+            logger.debug('WebResponseCaptureService.send_interactive_buttons')
             response_messages.append(f"{header}\n\n{body}\n\n{button_text}")
     
     # Reemplazar WhatsAppService temporalmente
@@ -1408,7 +1528,7 @@ Escribe el *número* de la opción que deseas (1, 2 o 3)."""
         # Crear un identificador temporal que será usado por handle_button_response
         user_identifier = phone or user_id or session_id
         
-        print(f"PROCESS_WEB_BUTTON_RESPONSE - user_identifier: {user_identifier}, button_id: {button_id}")
+        logger.debug('PROCESS_WEB_BUTTON_RESPONSE - user_identifier: %s, button_id: %s', user_identifier, button_id)
         
         # Si tenemos user_id o phone, actualizar el estado tanto con session_id como con user_identifier
         # Esto asegura que handle_button_response pueda encontrar el estado
@@ -1422,18 +1542,18 @@ Escribe el *número* de la opción que deseas (1, 2 o 3)."""
             # También guardar el estado con user_identifier para que handle_button_response lo encuentre
             if user_identifier != session_id:
                 user_states[user_identifier] = state.copy()
-            print(f"Estado actualizado: user_id={user_id}, phone={phone}, guardado con session_id y user_identifier")
+            logger.debug('Estado actualizado: user_id=%s, phone=%s, guardado con session_id y user_identifier', user_id, phone)
         
         # Usar la misma lógica que handle_button_response_extended
         if handle_reagendamiento(session_id, button_id):
-            print(f"handle_reagendamiento retornó True, response_messages tiene {len(response_messages)} mensajes")
+            logger.debug('handle_reagendamiento retornó True, response_messages tiene %s mensajes', len(response_messages))
             if len(response_messages) == 0:
                 response_messages.append("Error procesando reagendamiento. Por favor, intenta nuevamente.")
             return
         
-        print(f"Llamando handle_button_response con user_identifier: {user_identifier}, button_id: {button_id}")
+        logger.debug('Llamando handle_button_response con user_identifier: %s, button_id: %s', user_identifier, button_id)
         handle_button_response(user_identifier, button_id)
-        print(f"Después de handle_button_response, response_messages tiene {len(response_messages)} mensajes")
+        logger.debug('Después de handle_button_response, response_messages tiene %s mensajes', len(response_messages))
         
         # Sincronizar el estado de vuelta al session_id después de handle_button_response
         if user_identifier != session_id and user_identifier in user_states:
@@ -1441,12 +1561,10 @@ Escribe el *número* de la opción que deseas (1, 2 o 3)."""
         
         # Si no hay mensajes, agregar un mensaje de error
         if len(response_messages) == 0:
-            print(f"ERROR: No se generaron mensajes para button_id: {button_id}")
+            logger.error('ERROR: No se generaron mensajes para button_id: %s', button_id)
             response_messages.append("Lo siento, hubo un error procesando tu solicitud. Por favor, intenta nuevamente o escribe *menu* para volver al menú principal.")
     except Exception as e:
-        print(f"ERROR en process_web_button_response: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception('ERROR en process_web_button_response: %s', e)
         if len(response_messages) == 0:
             response_messages.append(f"Error procesando tu solicitud: {str(e)}\n\nEscribe *menu* para volver al menú principal.")
     finally:
@@ -1501,7 +1619,7 @@ def process_web_message(session_id, message_body, platform, user_id=None, phone=
         elif current_step == 'seleccionando_cita_reagendar' or current_step == 'seleccionando_cita_cancelar':
             # Obtener citas y mapear número a cita_id
             from services.citas_service import CitasService
-            citas_service_temp = CitasService()
+            citas_service_temp = shared(CitasService)
             # Usar phone o user_id si están disponibles, sino usar session_id como fallback
             user_identifier = phone or user_id or session_id
             citas = citas_service_temp.obtener_citas_usuario_web(user_identifier, user_id=user_id, phone=phone)
@@ -1518,11 +1636,11 @@ def process_web_message(session_id, message_body, platform, user_id=None, phone=
         
         # Si se identificó un botón, procesarlo como respuesta de botón
         if button_id:
-            print(f"Procesando button_id: {button_id} para session_id: {session_id}")
+            logger.debug('Procesando button_id: %s para session_id: %s', button_id, session_id)
             # Procesar como respuesta de botón usando la misma lógica que WhatsApp
             process_web_button_response(session_id, button_id, response_messages, user_id=user_id, phone=phone)
             result = "\n".join(response_messages) if response_messages else "Lo siento, hubo un error procesando tu solicitud. Por favor, intenta nuevamente o escribe *menu*."
-            print(f"Resultado de process_web_button_response: {len(response_messages)} mensajes, resultado: {result[:100]}")
+            logger.debug('Resultado de process_web_button_response: %s mensajes, resultado: %s', len(response_messages), result[:100])
             return result
 
     # Crear servicio de captura (reutilizar el mismo que en process_web_button_response)
@@ -1576,7 +1694,7 @@ Escribe el *número* de la opción que deseas (1, 2 o 3)."""
                     nombre = cita.nombre_cliente or 'Sin nombre'
                     list_items.append(f"{i+1}. {nombre} - {fecha_str} {hora}")
                 except Exception as e:
-                    print(f"Error formateando cita {i+1}: {e}")
+                    logger.error('Error formateando cita %s: %s', i+1, e)
                     list_items.append(f"{i+1}. Cita {i+1}")
             
             action_messages = {
@@ -1604,9 +1722,7 @@ Escribe el *número* de la opción que deseas (1, 2 o 3)."""
         # Esto asegura que funcione exactamente igual que WhatsApp
         handle_text_message_extended(session_id, message_body)
     except Exception as e:
-        print(f"ERROR en process_web_message: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception('ERROR en process_web_message: %s', e)
         if len(response_messages) == 0:
             response_messages.append(f"Error procesando tu mensaje: {str(e)}\n\nEscribe *menu* para volver al menú principal.")
     finally:
@@ -1614,7 +1730,7 @@ Escribe el *número* de la opción que deseas (1, 2 o 3)."""
         WhatsApp_service = original_whatsapp_service
 
     result = "\n".join(response_messages) if response_messages else "Lo siento, no pude procesar tu mensaje. Por favor, intenta nuevamente o escribe *menu*."
-    print(f"process_web_message retornando: {len(response_messages)} mensajes, resultado: {result[:100]}")
+    logger.debug('process_web_message retornando: %s mensajes, resultado: %s', len(response_messages), result[:100])
     return result
 
 # Iniciar el sistema de recordatorios y reintentos automáticamente
@@ -1622,14 +1738,15 @@ def init_schedulers():
     """Inicia todos los schedulers automáticamente"""
     try:
         from scheduler.reminder_scheduler import start_reminder_system
-        print("Iniciando schedulers automáticos...")
+        logger.info('Iniciando schedulers automáticos...')
         start_reminder_system()
-        print("Schedulers iniciados correctamente")
+        # Mantener el resumen de completitud del historial médico (historial_medico_completo)
+        from services.medical_history_check_service import medical_history_check_service
+        medical_history_check_service.start_completeness_watch()
+        logger.info('Schedulers iniciados correctamente')
         return True
     except Exception as e:
-        print(f"Error iniciando schedulers: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception('Error iniciando schedulers: %s', e)
         return False
 
 # Variable global para trackear si los schedulers están iniciados
@@ -1661,9 +1778,9 @@ if __name__ != '__test__':
 if __name__ == '__main__':
     import os
     port = int(os.environ.get('PORT', Config.PORT))
-    print(f"Puerto: {port}")
-    print(f"Debug: {Config.DEBUG}")
-    print("Servidor listo")
+    logger.info('Puerto: %s', port)
+    logger.info('Debug: %s', Config.DEBUG)
+    logger.info('Servidor listo')
     
     app.run(
         debug=Config.DEBUG,
@@ -0,0 +1,165 @@
+"""
+Micro-benchmark de extracción de entidades por reglas.
+Compara el costo por mensaje de la versión anterior de MLService.extract_entities
+(patrones reconstruidos y decenas de re.search por llamada) contra
+services.entity_extractor (patrones precompilados, un solo recorrido).
+
+Uso:
+    python benchmarks/bench_entity_extraction.py [iteraciones]
+"""
+
+import os
+import re
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.entity_extractor import entity_extractor
+
+MENSAJES = [
+    "hola",
+    "quiero agendar una cita",
+    "quiero una cita mañana a las 3 de la tarde con el doctor Pérez",
+    "agendar el viernes 10:30",
+    "15/11 a las 4pm por dolor de muela",
+    "cancelar mi cita 2",
+    "reagendar la segunda cita para pasado mañana",
+    "necesito limpieza dental el próximo lunes a las 10am",
+    "me duele una muela desde ayer, ¿tienen espacio hoy?",
+    "cita el 15/01/27 a las 9 am con dra lopez porque me duele mucho",
+]
+
+
+def legacy_extract(message):
+    """Copia de la versión anterior del fallback por regex (sin prints)"""
+    entities = {'fecha': None, 'hora': None, 'nombre_dentista': None,
+                'motivo': None, 'numero_cita': None, 'consultorio': None}
+    message_lower = message.lower()
+
+    fecha_patterns = {'mañana': 1, 'tomorrow': 1, 'pasado mañana': 2,
+                      'day after tomorrow': 2, 'hoy': 0, 'today': 0}
+    for pattern, days_offset in fecha_patterns.items():
+        if pattern in message_lower:
+            entities['fecha'] = (datetime.now() + timedelta(days=days_offset)).strftime('%Y-%m-%d')
+            break
+
+    dias_semana = {'lunes': 0, 'martes': 1, 'miércoles': 2, 'miercoles': 2,
+                   'jueves': 3, 'viernes': 4, 'sábado': 5, 'sabado': 5, 'domingo': 6}
+    for dia, dia_num in dias_semana.items():
+        patterns = [f'el {dia}', f'este {dia}', f'próximo {dia}', f'proximo {dia}', dia]
+        for pattern in patterns:
+            if pattern in message_lower and not entities.get('fecha'):
+                today = datetime.now()
+                days_ahead = dia_num - today.weekday()
+                if days_ahead <= 0:
+                    days_ahead += 7
+                entities['fecha'] = (today + timedelta(days=days_ahead)).strftime('%Y-%m-%d')
+                break
+        if entities.get('fecha'):
+            break
+
+    for pattern in [r'(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?', r'(\d{1,2})-(\d{1,2})(?:-(\d{2,4}))?']:
+        match = re.search(pattern, message)
+        if match and not entities.get('fecha'):
+            day, month, year = match.groups()
+            year = year or datetime.now().year
+            if len(str(year)) == 2:
+                year = 2000 + int(year)
+            try:
+                entities['fecha'] = datetime(int(year), int(month), int(day)).strftime('%Y-%m-%d')
+                break
+            except Exception:
+                pass
+
+    hora_patterns = [r'(\d{1,2}):(\d{2})\s*(am|pm)?', r'a las (\d{1,2})\s*(am|pm)?',
+                     r'(\d{1,2})\s*(am|pm)', r'(\d{1,2})\s*de la\s+(mañana|tarde|noche)',
+                     r'(\d{1,2})\s*horas?']
+    for pattern in hora_patterns:
+        match = re.search(pattern, message_lower)
+        if match:
+            hora_str = match.group(0)
+            hora_num = int(match.group(1))
+            if ':' in hora_str:
+                periodo = match.group(3)
+                if periodo == 'pm' and hora_num < 12:
+                    hora_num += 12
+                elif periodo == 'am' and hora_num == 12:
+                    hora_num = 0
+                entities['hora'] = f"{hora_num:02d}:{match.group(2)}"
+            elif 'am' in hora_str or 'pm' in hora_str:
+                if 'pm' in hora_str and hora_num < 12:
+                    hora_num += 12
+                elif 'am' in hora_str and hora_num == 12:
+                    hora_num = 0
+                entities['hora'] = f"{hora_num:02d}:00"
+            elif 'tarde' in hora_str or 'noche' in hora_str:
+                if hora_num < 12:
+                    hora_num += 12
+                entities['hora'] = f"{hora_num:02d}:00"
+            elif hora_num < 24:
+                entities['hora'] = f"{hora_num:02d}:00"
+            break
+
+    for pattern in [r'(?:doctor|dr\.?|doctora|dra\.?)\s+([a-záéíóúñ]+)',
+                    r'con\s+(?:el\s+)?(?:doctor|dr\.?|doctora|dra\.?)?\s*([a-záéíóúñ]+)']:
+        match = re.search(pattern, message_lower)
+        if match:
+            entities['nombre_dentista'] = match.group(1).title()
+            break
+
+    for pattern in [r'cita\s*(\d+)', r'la\s*(\d+)[a-z]*\s*cita', r'primera\s*cita',
+                    r'segunda\s*cita', r'tercera\s*cita']:
+        match = re.search(pattern, message_lower)
+        if match:
+            if 'primera' in match.group(0):
+                entities['numero_cita'] = 1
+            elif 'segunda' in match.group(0):
+                entities['numero_cita'] = 2
+            elif 'tercera' in match.group(0):
+                entities['numero_cita'] = 3
+            elif match.groups():
+                entities['numero_cita'] = int(match.group(1))
+            break
+
+    for keyword in ['por', 'para', 'motivo', 'razón', 'necesito', 'quiero', 'porque', 'por qué']:
+        if keyword in message_lower:
+            idx = message_lower.find(keyword)
+            motivo_text = message[idx + len(keyword):].strip()
+            if len(motivo_text) > 5:
+                entities['motivo'] = motivo_text[:200]
+                break
+
+    return entities
+
+
+def _bench(func, iteraciones):
+    total = timeit.timeit(lambda: [func(m) for m in MENSAJES], number=iteraciones)
+    return total / (iteraciones * len(MENSAJES)) * 1e6  # µs por mensaje
+
+
+def main():
+    iteraciones = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    # Con el cache de re caliente (caso favorable para la versión anterior)
+    antes = _bench(legacy_extract, iteraciones)
+    despues = _bench(entity_extractor.extract, iteraciones)
+
+    print(f"Mensajes: {len(MENSAJES)} x {iteraciones} iteraciones")
+    print(f"Antes   (regex por llamada): {antes:8.2f} µs/mensaje")
+    print(f"Después (un solo recorrido): {despues:8.2f} µs/mensaje")
+    print(f"Mejora: {antes / despues:.2f}x")
+
+    diferencias = 0
+    for mensaje in MENSAJES:
+        a, b = legacy_extract(mensaje), entity_extractor.extract(mensaje)
+        if a != b:
+            diferencias += 1
+            cambios = {k: (a[k], b[k]) for k in a if a[k] != b[k]}
+            print(f"  Difiere: {mensaje!r} -> {cambios}")
+    print(f"Mensajes con resultado distinto: {diferencias}/{len(MENSAJES)}")
+
+
+if __name__ == '__main__':
+    main()
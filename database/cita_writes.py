@@ -0,0 +1,224 @@
+"""
+ESCRITURA ÚNICA DE CITAS
+Cada cita existe en pacientes/{pacienteId}/citas/{citaId} (fuente de verdad) y en la
+colección global citas/{citaId}, siempre con el mismo ID. Toda mutación pasa por aquí:
+- Ambas ubicaciones se escriben en un solo batch (un commit, atómico)
+- En el mismo batch se registra el cambio en cita_changes/{auto} para que cachés,
+  índices y procesos externos lo consuman. Es un registro de corto plazo: expiresAt
+  (CITA_CHANGES_TTL_DAYS, 30 por defecto) y la política TTL de firestore.indexes.json
+  lo limpian; un consumidor que procese el registro debe hacerlo dentro de ese plazo
+- Tras el commit se notifica a los listeners en proceso (on_cita_change)
+
+Copias globales legacy: create_appointment creaba la copia global con add() (ID
+aleatorio, pacienteCitaId = ID de la subcolección). Hasta que database/migrations.py
+las re-indexe y marque schema_migrations/citas_global_rekey, las actualizaciones
+buscan la copia por pacienteCitaId cuando citas/{citaId} no existe.
+"""
+
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+from google.cloud.firestore import SERVER_TIMESTAMP
+from utils.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+CHANGES_COLLECTION = 'cita_changes'
+CHANGES_TTL_DAYS = int(os.getenv('CITA_CHANGES_TTL_DAYS', '30'))
+CITAS_POR_BATCH = 150  # 3 escrituras por cita; Firestore admite 500 por commit
+REKEY_MIGRATION = ('schema_migrations', 'citas_global_rekey')
+REKEY_RECHECK_SECONDS = 600
+
+_rekey_state = {'done': False, 'checked_at': 0.0}
+
+_listeners: List[Callable[[Dict], None]] = []
+
+
+def on_cita_change(callback: Callable[[Dict], None]) -> Callable[[Dict], None]:
+    """Registra un callback(cambio) que se ejecuta después de cada commit"""
+    _listeners.append(callback)
+    return callback
+
+
+def cita_refs(db, paciente_id: str, cita_id: str):
+    """(ref en subcolección del paciente, ref en colección global)"""
+    return (db.collection('pacientes').document(paciente_id).collection('citas').document(cita_id),
+            db.collection('citas').document(cita_id))
+
+
+def _rekey_completo(db) -> bool:
+    """True cuando la migración de copias globales legacy ya se ejecutó (se recuerda en proceso)"""
+    if _rekey_state['done']:
+        return True
+    now = time.monotonic()
+    if _rekey_state['checked_at'] and now - _rekey_state['checked_at'] < REKEY_RECHECK_SECONDS:
+        return False
+    _rekey_state['checked_at'] = now
+    doc = db.collection(REKEY_MIGRATION[0]).document(REKEY_MIGRATION[1]).get()
+    _rekey_state['done'] = bool(doc.exists and (doc.to_dict() or {}).get('completedAt'))
+    return _rekey_state['done']
+
+
+def copia_global(db, cita_id: str):
+    """
+    Ref de la copia global de la cita, o None si no existe.
+    Primero citas/{cita_id}; si no existe y la migración aún no corrió, la copia legacy
+    con ID aleatorio se localiza por pacienteCitaId.
+    """
+    ref = db.collection('citas').document(cita_id)
+    if ref.get().exists:
+        return ref
+    if _rekey_completo(db):
+        return None
+    for doc in db.collection('citas').where('pacienteCitaId', '==', cita_id).limit(1).stream():
+        return doc.reference
+    return None
+
+
+def nuevo_cita_id(db, paciente_id: str) -> str:
+    """ID nuevo generado en la subcolección del paciente (se reutiliza en la global)"""
+    return db.collection('pacientes').document(paciente_id).collection('citas').document().id
+
+
+def registrar_cambio(writer, db, paciente_id: str, cita_id: str, tipo: str, campos: List[str]) -> Dict:
+    """Agrega el registro cita_changes al batch o transacción en curso"""
+    cambio = {
+        'citaId': cita_id,
+        'pacienteId': paciente_id,
+        'tipo': tipo,
+        'campos': sorted(campos),
+    }
+    expira = datetime.now(timezone.utc) + timedelta(days=CHANGES_TTL_DAYS)
+    writer.set(db.collection(CHANGES_COLLECTION).document(),
+               dict(cambio, at=SERVER_TIMESTAMP, expiresAt=expira))
+    return cambio
+
+
+def notificar_cambio(cambio: Dict):
+    """Ejecuta los listeners en proceso; llamar solo después del commit"""
+    for listener in list(_listeners):
+        try:
+            listener(cambio)
+        except Exception as e:
+            logger.error('Error en listener de cambios de cita: %s', e)
+
+
+def _commit(db, batch, paciente_id: str, cita_id: str, tipo: str, campos: List[str]) -> Dict:
+    cambio = registrar_cambio(batch, db, paciente_id, cita_id, tipo, campos)
+    batch.commit()
+    notificar_cambio(cambio)
+    return cambio
+
+
+def escribir_creacion(writer, db, paciente_id: str, cita_id: str, datos_paciente: Dict,
+                      datos_globales: Optional[Dict] = None) -> Dict:
+    """
+    Escribe la cita nueva en ambas ubicaciones usando un batch o una transacción
+    (no hace commit). Retorna el cambio a notificar tras el commit.
+    """
+    paciente_ref, global_ref = cita_refs(db, paciente_id, cita_id)
+    globales = dict(datos_globales if datos_globales is not None else datos_paciente)
+    globales.update({'id': cita_id, 'pacienteId': paciente_id, 'pacienteCitaId': cita_id})
+
+    writer.set(paciente_ref, datos_paciente)
+    writer.set(global_ref, globales)
+    return registrar_cambio(writer, db, paciente_id, cita_id, 'created', list(datos_paciente))
+
+
+def crear_cita(db, paciente_id: str, cita_id: str, datos_paciente: Dict,
+               datos_globales: Optional[Dict] = None) -> Dict:
+    """
+    Crea la cita en ambas ubicaciones.
+    datos_globales None -> la copia global lleva los mismos datos que la del paciente
+    """
+    batch = db.batch()
+    cambio = escribir_creacion(batch, db, paciente_id, cita_id, datos_paciente, datos_globales)
+    batch.commit()
+    notificar_cambio(cambio)
+    return cambio
+
+
+def escribir_actualizacion(writer, db, paciente_id: str, cita_id: str, cambios: Dict,
+                           cambios_globales: Optional[Dict] = None, tipo: str = 'updated',
+                           update_time=None, global_ref=None) -> Dict:
+    """
+    Agrega la actualización de ambas ubicaciones al batch (no hace commit).
+    global_ref: copia global ya leída por el llamador; si no se da, se resuelve con copia_global.
+    update_time: precondición sobre la copia global leída; si cambió desde entonces,
+    el commit falla en lugar de pisar el cambio.
+    Nunca crea una copia global: si no existe, solo se actualiza la del paciente.
+    """
+    paciente_ref = cita_refs(db, paciente_id, cita_id)[0]
+    globales = dict(cambios_globales if cambios_globales is not None else cambios)
+    if global_ref is None:
+        global_ref = copia_global(db, cita_id)
+
+    writer.update(paciente_ref, cambios)
+    if global_ref is None:
+        logger.warning('Cita %s sin copia global en citas; solo se actualiza la del paciente', cita_id)
+    elif update_time is not None:
+        writer.update(global_ref, globales, option=db.write_option(last_update_time=update_time))
+    else:
+        writer.update(global_ref, globales)
+    return registrar_cambio(writer, db, paciente_id, cita_id, tipo, list(set(cambios) | set(globales)))
+
+
+def actualizar_cita(db, paciente_id: str, cita_id: str, cambios: Dict,
+                    cambios_globales: Optional[Dict] = None, tipo: str = 'updated') -> Dict:
+    """
+    Actualiza la cita en ambas ubicaciones.
+    La del paciente debe existir; la global se actualiza donde esté (ver copia_global).
+    """
+    batch = db.batch()
+    cambio = escribir_actualizacion(batch, db, paciente_id, cita_id, cambios, cambios_globales, tipo)
+    batch.commit()
+    notificar_cambio(cambio)
+    return cambio
+
+
+def actualizar_citas(db, actualizaciones: List[Dict], tipo: str = 'updated') -> List[str]:
+    """
+    Aplica cambios a muchas citas con el menor número de commits.
+    Cada actualización: {'pacienteId', 'citaId', 'cambios', 'cambiosGlobales'?, 'updateTime'?,
+    'globalRef'?}. citaId es el ID en pacientes/{id}/citas.
+    Si un batch falla (p. ej. una cita cambió desde que se leyó) se reintenta cita por
+    cita para no bloquear al resto. Retorna los IDs actualizados.
+    """
+    def commit_grupo(grupo):
+        batch = db.batch()
+        cambios = [escribir_actualizacion(batch, db, a['pacienteId'], a['citaId'], a['cambios'],
+                                          a.get('cambiosGlobales'), tipo, a.get('updateTime'),
+                                          a.get('globalRef'))
+                   for a in grupo]
+        batch.commit()
+        return cambios
+
+    aplicadas = []
+    for i in range(0, len(actualizaciones), CITAS_POR_BATCH):
+        grupo = actualizaciones[i:i + CITAS_POR_BATCH]
+        try:
+            cambios = commit_grupo(grupo)
+        except Exception as e:
+            logger.warning('Batch de %s citas falló (%s); aplicando una por una', len(grupo), e)
+            cambios = []
+            for actualizacion in grupo:
+                try:
+                    cambios.extend(commit_grupo([actualizacion]))
+                except Exception as e:
+                    logger.error('Error actualizando cita %s: %s', actualizacion['citaId'], e)
+        for cambio in cambios:
+            notificar_cambio(cambio)
+            aplicadas.append(cambio['citaId'])
+    return aplicadas
+
+
+def eliminar_cita(db, paciente_id: str, cita_id: str) -> Dict:
+    """Elimina la cita de ambas ubicaciones"""
+    paciente_ref = cita_refs(db, paciente_id, cita_id)[0]
+    global_ref = copia_global(db, cita_id)
+    batch = db.batch()
+    batch.delete(paciente_ref)
+    if global_ref is not None:
+        batch.delete(global_ref)
+    return _commit(db, batch, paciente_id, cita_id, 'deleted', [])
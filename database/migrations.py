@@ -0,0 +1,89 @@
+"""
+MIGRACIONES DE DATOS (una sola vez)
+Uso: python -m database.migrations citas_global_rekey [--dry-run]
+
+citas_global_rekey: create_appointment creaba la copia global con add(), es decir
+citas/{ID aleatorio} con pacienteCitaId = ID de pacientes/{id}/citas. La escritura única
+(database/cita_writes.py) usa el mismo ID en ambas ubicaciones; esta migración mueve
+cada copia legacy a citas/{pacienteCitaId} y al terminar marca
+schema_migrations/citas_global_rekey, con lo que cita_writes deja de buscar por
+pacienteCitaId.
+"""
+
+import sys
+from typing import Dict
+
+from google.cloud import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+from database.cita_writes import REKEY_MIGRATION
+from utils.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+def rekey_citas_globales(db, dry_run: bool = False, page_size: int = 200) -> Dict:
+    """
+    Re-indexa las copias globales legacy: citas/{aleatorio} -> citas/{pacienteCitaId}.
+    Si ya existe un documento en el ID destino (escrito por una actualización posterior),
+    sus campos son más recientes y se conservan sobre los de la copia legacy.
+    Retorna {'revisadas', 'movidas'}.
+    """
+    stats = {'revisadas': 0, 'movidas': 0}
+    citas = db.collection('citas')
+    cursor = None
+    while True:
+        query = citas.order_by(FieldPath.document_id())
+        if cursor:
+            query = query.start_after({FieldPath.document_id(): cursor})
+        docs = list(query.limit(page_size).stream())
+        if not docs:
+            break
+
+        # 2 escrituras por cita movida: una página de 200 cabe en un batch de 500
+        batch = db.batch()
+        movidas = 0
+        for doc in docs:
+            stats['revisadas'] += 1
+            data = doc.to_dict() or {}
+            destino_id = data.get('pacienteCitaId')
+            if not destino_id or destino_id == doc.id:
+                continue
+
+            destino_ref = citas.document(destino_id)
+            existente = destino_ref.get()
+            datos = dict(data)
+            if existente.exists:
+                datos.update(existente.to_dict() or {})
+            datos['id'] = destino_id
+
+            batch.set(destino_ref, datos)
+            batch.delete(doc.reference)
+            movidas += 1
+
+        if movidas and not dry_run:
+            batch.commit()
+        stats['movidas'] += movidas
+        logger.info('citas_global_rekey: %s revisadas, %s movidas', stats['revisadas'], stats['movidas'])
+
+        cursor = docs[-1].id
+        if len(docs) < page_size:
+            break
+
+    if not dry_run:
+        db.collection(REKEY_MIGRATION[0]).document(REKEY_MIGRATION[1]).set(
+            dict(stats, completedAt=firestore.SERVER_TIMESTAMP))
+    return stats
+
+
+MIGRATIONS = {
+    'citas_global_rekey': rekey_citas_globales,
+}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in MIGRATIONS:
+        print(f"Uso: python -m database.migrations <{'|'.join(MIGRATIONS)}> [--dry-run]")
+        sys.exit(1)
+    from database.database import FirebaseConfig
+    resultado = MIGRATIONS[sys.argv[1]](FirebaseConfig.get_db(), dry_run='--dry-run' in sys.argv)
+    print(f"{sys.argv[1]}: {resultado}")
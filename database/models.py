@@ -2,6 +2,11 @@ from database.database import FirebaseConfig
 from datetime import datetime
 from typing import List, Optional, Dict
 from utils.phone_utils import normalize_phone_for_database
+from utils.logging_config import get_logger
+from services.registry import shared
+from database import cita_writes, slots
+
+logger = get_logger(__name__)
 
 class Paciente:
     def __init__(self, uid=None, nombre=None, apellidos=None, telefono=None, 
@@ -99,21 +104,21 @@ class PacienteRepository:
             # Normalizar el número de teléfono para que coincida con el formato en Firestore
             # (quitar prefijo "whatsapp:" y el "1" extra si existe)
             telefono_normalizado = normalize_phone_for_database(telefono)
-            print(f"Buscando paciente con teléfono normalizado: {telefono_normalizado} (original: {telefono})")
+            logger.debug('Buscando paciente con teléfono normalizado: %s (original: %s)', telefono_normalizado, telefono)
             
             query = self.collection.where('telefono', '==', telefono_normalizado).limit(1)
             docs = query.stream()
 
             for doc in docs:
                 paciente = Paciente.from_dict(doc.id, doc.to_dict())
-                print(f"Paciente encontrado: {paciente.nombreCompleto}")
+                logger.debug('Paciente encontrado: %s', paciente.nombreCompleto)
                 return paciente
             
-            print(f"No existe paciente con teléfono: {telefono_normalizado}")
+            logger.debug('No existe paciente con teléfono: %s', telefono_normalizado)
             return None
             
         except Exception as e:
-            print(f"Error buscando paciente: {e}")
+            logger.error('Error buscando paciente: %s', e)
             return None
     
     def obtener_por_uid(self, uid: str) -> Optional[Paciente]:
@@ -126,7 +131,7 @@ class PacienteRepository:
             return None
             
         except Exception as e:
-            print(f"Error obteniendo paciente {uid}: {e}")
+            logger.error('Error obteniendo paciente %s: %s', uid, e)
             return None
     
     def buscar_por_id(self, paciente_id: str) -> Optional[Paciente]:
@@ -137,7 +142,7 @@ class PacienteRepository:
 class CitaRepository:
     def __init__(self):
         self.db = FirebaseConfig.get_db()
-        self.paciente_repo = PacienteRepository()
+        self.paciente_repo = shared(PacienteRepository)
     
     def obtener_paciente_por_telefono(self, telefono: str):
         """Obtiene el paciente por su número de teléfono"""
@@ -161,8 +166,8 @@ class CitaRepository:
         """Obtiene el último consultorio usado por el paciente basado en su última cita"""
         try:
             # Primero intentar en subcolección de pacientes (no requiere índice compuesto)
-            print(f"Buscando último consultorio para paciente: {paciente_uid}")
-            print("Buscando en subcolección de pacientes primero...")
+            logger.debug('Buscando último consultorio para paciente: %s', paciente_uid)
+            logger.debug('Buscando en subcolección de pacientes primero...')
             citas_ref = self.db.collection('pacientes')\
                               .document(paciente_uid)\
                               .collection('citas')
@@ -174,7 +179,7 @@ class CitaRepository:
                 consultorio_id = cita_data.get('consultorioID') or cita_data.get('consultorioId')
                 dentista_id = cita_data.get('dentistaId')
                 if consultorio_id and dentista_id:
-                    print(f"Encontrado último consultorio en subcolección: {consultorio_id}")
+                    logger.debug('Encontrado último consultorio en subcolección: %s', consultorio_id)
                     
                     # Obtener nombre del consultorio desde la colección
                     consultorio_doc = self.db.collection('consultorio').document(consultorio_id).get()
@@ -195,10 +200,10 @@ class CitaRepository:
                         for dentista_doc in dentistas_ref.stream():
                             dentista_data = dentista_doc.to_dict()
                             dentista_name = dentista_data.get('nombreCompleto', dentista_name)
-                            print(f"Nombre del dentista obtenido de subcolección: {dentista_name}")
+                            logger.debug('Nombre del dentista obtenido de subcolección: %s', dentista_name)
                             break
                     except Exception as e:
-                        print(f"Error obteniendo nombre del dentista: {e}")
+                        logger.error('Error obteniendo nombre del dentista: %s', e)
                     
                     return {
                         'consultorioId': consultorio_id,
@@ -208,20 +213,18 @@ class CitaRepository:
                     }
             
             # Si no hay citas previas, buscar cualquier consultorio activo
-            print("No se encontraron citas previas, usando consultorio por defecto")
+            logger.debug('No se encontraron citas previas, usando consultorio por defecto')
             return self._obtener_consultorio_por_defecto()
             
         except Exception as e:
-            print(f"Error obteniendo último consultorio: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception('Error obteniendo último consultorio: %s', e)
             # Fallback: buscar cualquier consultorio activo
             return self._obtener_consultorio_por_defecto()
     
     def _obtener_consultorio_por_defecto(self) -> Optional[Dict]:
         """Obtiene un consultorio activo por defecto si no hay historial"""
         try:
-            print("Buscando consultorio por defecto...")
+            logger.debug('Buscando consultorio por defecto...')
             consultorios_ref = self.db.collection('consultorio')
             query = consultorios_ref.where('activo', '==', True).limit(1)
             
@@ -229,7 +232,7 @@ class CitaRepository:
                 consultorio_data = doc.to_dict()
                 consultorio_id = doc.id
                 consultorio_nombre = consultorio_data.get('nombre', 'Consultorio')
-                print(f"Consultorio encontrado: {consultorio_id}, nombre: {consultorio_nombre}")
+                logger.debug('Consultorio encontrado: %s, nombre: %s', consultorio_id, consultorio_nombre)
                 
                 # Buscar el dentista en la subcolección de dentistas
                 dentistas_ref = self.db.collection('consultorio')\
@@ -245,7 +248,7 @@ class CitaRepository:
                     dentista_data = dentista_doc.to_dict()
                     dentista_id = dentista_data.get('dentistaId')
                     dentista_name = dentista_data.get('nombreCompleto', 'Dentista')
-                    print(f"Dentista encontrado en subcolección: {dentista_id}, nombre: {dentista_name}")
+                    logger.debug('Dentista encontrado en subcolección: %s, nombre: %s', dentista_id, dentista_name)
                     break
                 
                 if dentista_id:
@@ -256,14 +259,12 @@ class CitaRepository:
                         'dentistaName': dentista_name or 'Dentista'
                     }
                 else:
-                    print(f"No se encontró dentista activo para el consultorio {consultorio_id}")
+                    logger.debug('No se encontró dentista activo para el consultorio %s', consultorio_id)
             
-            print("No se encontró ningún consultorio activo")
+            logger.debug('No se encontró ningún consultorio activo')
             return None
         except Exception as e:
-            print(f"Error obteniendo consultorio por defecto: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception('Error obteniendo consultorio por defecto: %s', e)
             return None
     
     def obtener_citas_usuario(self, usuario_whatsapp: str) -> List[Cita]:
@@ -272,12 +273,12 @@ class CitaRepository:
             # Buscar paciente por teléfono
             paciente = self.paciente_repo.buscar_por_telefono(usuario_whatsapp)
             if not paciente:
-                print(f"No se encontró paciente con teléfono: {usuario_whatsapp}")
+                logger.debug('No se encontró paciente con teléfono: %s', usuario_whatsapp)
                 return []
             
             return self.obtener_citas_paciente(paciente.uid)
         except Exception as e:
-            print(f"Error obteniendo citas usuario: {e}")
+            logger.error('Error obteniendo citas usuario: %s', e)
             return []
     
     def obtener_citas_paciente(self, paciente_uid: str) -> List[Cita]:
@@ -293,11 +294,11 @@ class CitaRepository:
                 cita = Cita.from_dict(doc.id, doc.to_dict())
                 citas.append(cita)
             
-            print(f"Encontradas {len(citas)} citas para paciente {paciente_uid}")
+            logger.debug('Encontradas %s citas para paciente %s', len(citas), paciente_uid)
             return citas
             
         except Exception as e:
-            print(f"Error obteniendo citas: {e}")
+            logger.error('Error obteniendo citas: %s', e)
             return []
     
     def obtener_citas_proximas(self, fecha_limite: str) -> List[Cita]:
@@ -321,11 +322,11 @@ class CitaRepository:
                 cita = Cita.from_dict(doc.id, cita_data)
                 citas.append(cita)
             
-            print(f"Encontradas {len(citas)} citas próximas hasta {fecha_limite}")
+            logger.debug('Encontradas %s citas próximas hasta %s', len(citas), fecha_limite)
             return citas
             
         except Exception as e:
-            print(f"Error obteniendo citas próximas: {e}")
+            logger.error('Error obteniendo citas próximas: %s', e)
             return []
     
     def obtener_por_id(self, cita_id: str) -> Optional[Cita]:
@@ -338,7 +339,7 @@ class CitaRepository:
                 return Cita.from_dict(doc.id, doc.to_dict())
             return None
         except Exception as e:
-            print(f"Error obteniendo cita por ID {cita_id}: {e}")
+            logger.error('Error obteniendo cita por ID %s: %s', cita_id, e)
             return None
     
     def obtener_cita_por_id(self, paciente_uid: str, cita_id: str) -> Optional[Cita]:
@@ -355,7 +356,7 @@ class CitaRepository:
             return None
             
         except Exception as e:
-            print(f"Error obteniendo cita {cita_id}: {e}")
+            logger.error('Error obteniendo cita %s: %s', cita_id, e)
             return None
     
     def obtener_cita(self, usuario_whatsapp: str, cita_id: str) -> Optional[Cita]:
@@ -367,7 +368,7 @@ class CitaRepository:
             
             return self.obtener_cita_por_id(paciente.uid, cita_id)
         except Exception as e:
-            print(f"Error obteniendo cita: {e}")
+            logger.error('Error obteniendo cita: %s', e)
             return None
     
     def crear_cita(self, usuario_whatsapp: str, datos_cita: dict, paciente_id: str = None, consultorio_especifico: dict = None) -> Optional[str]:
@@ -383,17 +384,17 @@ class CitaRepository:
                 paciente = self.paciente_repo.buscar_por_telefono(usuario_whatsapp)
             
             if not paciente:
-                print(f"No se encontró paciente con teléfono: {usuario_whatsapp} o ID: {paciente_id}")
+                logger.debug('No se encontró paciente con teléfono: %s o ID: %s', usuario_whatsapp, paciente_id)
                 return None
             
             # Usar consultorio específico si se proporciona, sino obtener último consultorio usado
             if consultorio_especifico:
                 ultimo_consultorio = consultorio_especifico
-                print(f"Usando consultorio específico: {ultimo_consultorio.get('consultorioName')} - {ultimo_consultorio.get('dentistaName')}")
+                logger.debug('Usando consultorio específico: %s - %s', ultimo_consultorio.get('consultorioName'), ultimo_consultorio.get('dentistaName'))
             else:
                 ultimo_consultorio = self.obtener_ultimo_consultorio_paciente(paciente.uid)
                 if not ultimo_consultorio:
-                    print(f"No se encontró consultorio previo para el paciente")
+                    logger.debug('No se encontró consultorio previo para el paciente')
                     return None
             
             # Convertir fecha string a timestamp
@@ -516,17 +517,10 @@ class CitaRepository:
                 'updatedAt': SERVER_TIMESTAMP
             }
             
-            # Agregar a subcolección del paciente
-            doc_ref = self.db.collection('pacientes')\
-                            .document(paciente.uid)\
-                            .collection('citas')\
-                            .document()
-            
-            doc_ref.set(cita_data)
-            cita_id = doc_ref.id
+            # Mismo ID en la subcolección del paciente y en la colección global
+            cita_id = cita_writes.nuevo_cita_id(self.db, paciente.uid)
             
-            # También crear en colección global de citas (citas minúscula, estándar)
-            # Preparar datos completos como la web
+            # Datos completos de la copia global (citas minúscula, estándar), como la web
             fecha_hora_completa = datetime.combine(fecha_dt.date(), hora_obj)
             
             cita_global_data = {
@@ -559,6 +553,7 @@ class CitaRepository:
                 'paymentMethod': payment_method,
                 'paymentStatus': 'pending',
                 'paymentDeadline': payment_deadline,  # Fecha de expiración de pago
+                'paymentReminderSent': False,  # Lo marca el procesador de vencimientos de pago
                 'validacionesCompletadas': {
                     'otpVerified': False,  # En chatbot no se requiere OTP
                     'conflictsChecked': True,
@@ -574,13 +569,17 @@ class CitaRepository:
                 'createdAt': SERVER_TIMESTAMP,
                 'updatedAt': SERVER_TIMESTAMP
             }
-            self.db.collection('citas').document(cita_id).set(cita_global_data)
+            # Reservar el horario del dentista y crear la cita en la misma transacción
+            if not slots.reservar_cita(self.db, ultimo_consultorio['dentistaId'], fecha_hora_completa,
+                                       paciente.uid, cita_id, cita_data, cita_global_data):
+                logger.info('Horario %s %s ya no está disponible', fecha_str, hora_inicio)
+                return None
             
-            print(f"Cita creada: {cita_id}")
+            logger.debug('Cita creada: %s', cita_id)
             return cita_id
             
         except Exception as e:
-            print(f"Error creando cita: {e}")
+            logger.error('Error creando cita: %s', e)
             return None
     
     def actualizar_cita_por_id(self, paciente_id: str, cita_id: str, nueva_fecha: str, nueva_hora: str) -> bool:
@@ -598,22 +597,14 @@ class CitaRepository:
             hora_fin_dt = hora_dt + timedelta(minutes=30)
             hora_fin = hora_fin_dt.strftime('%H:%M')
             
-            # Actualizar en subcolección del paciente
-            cita_ref = self.db.collection('pacientes')\
-                              .document(paciente_id)\
-                              .collection('citas')\
-                              .document(cita_id)
-            
-            cita_ref.update({
+            # Horario nuevo (slot), subcolección del paciente y colección global en una transacción
+            nueva_fecha_hora_completa = datetime.combine(fecha_dt.date(), hora_obj)
+            if not slots.reagendar_cita(self.db, paciente_id, cita_id, nueva_fecha_hora_completa, {
                 'fecha': fecha_timestamp,
                 'horaInicio': nueva_hora,
                 'horaFin': hora_fin,
                 'updatedAt': datetime.now()
-            })
-            
-            # También actualizar en colección global (citas minúscula, estándar)
-            nueva_fecha_hora_completa = datetime.combine(fecha_dt.date(), hora_obj)
-            self.db.collection('citas').document(cita_id).update({
+            }, {
                 'fecha': fecha_timestamp,
                 'fechaHora': nueva_fecha_hora_completa,
                 'appointmentDate': nueva_fecha_hora_completa.isoformat(),
@@ -623,12 +614,13 @@ class CitaRepository:
                 'estado': 'confirmado',
                 'status': 'confirmado',
                 'updatedAt': datetime.now()
-            })
+            }):
+                return False
             
-            print(f"Cita {cita_id} actualizada")
+            logger.debug('Cita %s actualizada', cita_id)
             return True
         except Exception as e:
-            print(f"Error actualizando cita: {e}")
+            logger.error('Error actualizando cita: %s', e)
             return False
     
     def actualizar_cita(self, usuario_whatsapp: str, cita_id: str, nueva_fecha: str, nueva_hora: str) -> bool:
@@ -651,59 +643,44 @@ class CitaRepository:
             hora_fin_dt = hora_dt + timedelta(minutes=30)
             hora_fin = hora_fin_dt.strftime('%H:%M')
             
-            # Actualizar en subcolección
-            self.db.collection('pacientes')\
-                  .document(paciente.uid)\
-                  .collection('citas')\
-                  .document(cita_id)\
-                  .update({
-                      'fecha': fecha_timestamp,
-                      'horaInicio': nueva_hora,
-                      'horaFin': hora_fin,
-                      'estado': 'confirmado',
-                      'updatedAt': SERVER_TIMESTAMP
-                  })
-            
-            # Actualizar en colección global (citas minúscula, estándar)
+            # Horario nuevo (slot), subcolección del paciente y colección global en una transacción
             nueva_fecha_hora_completa = datetime.combine(fecha_dt.date(), hora_obj)
-            self.db.collection('citas')\
-                  .document(cita_id)\
-                  .update({
-                      'fecha': fecha_timestamp,
-                      'fechaHora': nueva_fecha_hora_completa,
-                      'appointmentDate': nueva_fecha_hora_completa.isoformat(),
-                      'appointmentTime': nueva_hora,
-                      'horaInicio': nueva_hora,
-                      'horaFin': hora_fin,
-                      'estado': 'confirmado',
-                      'status': 'confirmado',
-                      'updatedAt': SERVER_TIMESTAMP
-                  })
-            
-            print(f"Cita {cita_id} actualizada")
+            if not slots.reagendar_cita(self.db, paciente.uid, cita_id, nueva_fecha_hora_completa, {
+                'fecha': fecha_timestamp,
+                'horaInicio': nueva_hora,
+                'horaFin': hora_fin,
+                'estado': 'confirmado',
+                'updatedAt': SERVER_TIMESTAMP
+            }, {
+                'fecha': fecha_timestamp,
+                'fechaHora': nueva_fecha_hora_completa,
+                'appointmentDate': nueva_fecha_hora_completa.isoformat(),
+                'appointmentTime': nueva_hora,
+                'horaInicio': nueva_hora,
+                'horaFin': hora_fin,
+                'estado': 'confirmado',
+                'status': 'confirmado',
+                'updatedAt': SERVER_TIMESTAMP
+            }):
+                return False
+            
+            logger.debug('Cita %s actualizada', cita_id)
             return True
             
         except Exception as e:
-            print(f"Error actualizando cita: {e}")
+            logger.error('Error actualizando cita: %s', e)
             return False
     
     def eliminar_cita_por_id(self, paciente_id: str, cita_id: str) -> bool:
         """Elimina una cita por paciente_id y cita_id"""
         try:
-            # Eliminar de subcolección del paciente
-            cita_ref = self.db.collection('pacientes')\
-                              .document(paciente_id)\
-                              .collection('citas')\
-                              .document(cita_id)
-            cita_ref.delete()
-            
-            # También eliminar de colección global (citas minúscula, estándar)
-            self.db.collection('citas').document(cita_id).delete()
+            # Subcolección del paciente y colección global (citas minúscula, estándar)
+            cita_writes.eliminar_cita(self.db, paciente_id, cita_id)
             
-            print(f"Cita {cita_id} eliminada")
+            logger.debug('Cita %s eliminada', cita_id)
             return True
         except Exception as e:
-            print(f"Error eliminando cita: {e}")
+            logger.error('Error eliminando cita: %s', e)
             return False
     
     def eliminar_cita(self, usuario_whatsapp: str, cita_id: str) -> bool:
@@ -716,54 +693,28 @@ class CitaRepository:
             return self.cancelar_cita(paciente.uid, cita_id)
             
         except Exception as e:
-            print(f"Error eliminando cita: {e}")
+            logger.error('Error eliminando cita: %s', e)
             return False
     
     def cancelar_cita(self, paciente_uid: str, cita_id: str) -> bool:
         try:
             from google.cloud.firestore import SERVER_TIMESTAMP
             
-            self.db.collection('pacientes')\
-                  .document(paciente_uid)\
-                  .collection('citas')\
-                  .document(cita_id)\
-                  .update({
-                      'estado': 'cancelada',
-                      'updatedAt': SERVER_TIMESTAMP
-                  })
-            
-            print(f"Cita {cita_id} cancelada en subcolección")
-            # Actualizar en colección global (citas minúscula, estándar)
-            # Buscar por pacienteId y cita_id
-            cita_global_ref = self.db.collection('citas').document(cita_id)
-            cita_global_doc = cita_global_ref.get()
-            
-            if cita_global_doc.exists:
-                cita_global_ref.update({
-                    'estado': 'cancelada',
-                    'status': 'cancelada',
-                    'updatedAt': SERVER_TIMESTAMP
-                })
-                print(f"Cita actualizada en colección global citas")
-            else:
-                # Fallback: buscar por pacienteId
-                global_query = self.db.collection('citas')\
-                                     .where('pacienteId', '==', paciente_uid)\
-                                     .where('id', '==', cita_id)\
-                                     .limit(1)
-                
-                for doc in global_query.stream():
-                    self.db.collection('citas').document(doc.id).update({
-                        'estado': 'cancelada',
-                        'status': 'cancelada',
-                        'updatedAt': SERVER_TIMESTAMP
-                    })
-                    print(f"Cita actualizada en colección global citas (fallback)")
+            # Subcolección del paciente y colección global (citas minúscula, estándar)
+            cita_writes.actualizar_cita(self.db, paciente_uid, cita_id, {
+                'estado': 'cancelada',
+                'updatedAt': SERVER_TIMESTAMP
+            }, {
+                'estado': 'cancelada',
+                'status': 'cancelada',
+                'updatedAt': SERVER_TIMESTAMP
+            }, tipo='cancelled')
             
+            logger.debug('Cita %s cancelada', cita_id)
             return True
             
         except Exception as e:
-            print(f"Error cancelando cita: {e}")
+            logger.error('Error cancelando cita: %s', e)
             return False
     
     def obtener_horarios_disponibles(self, dentista_id: str, consultorio_id: str, fecha_timestamp) -> List[Dict]:
@@ -775,7 +726,7 @@ class CitaRepository:
             dias_semana = ['lunes', 'martes', 'miércoles', 'jueves', 'viernes', 'sábado', 'domingo']
             dia_nombre = dias_semana[fecha_dt.weekday()]
             
-            print(f"Buscando horarios para {dia_nombre} (consultorio: {consultorio_id}, dentista: {dentista_id})")
+            logger.debug('Buscando horarios para %s (consultorio: %s, dentista: %s)', dia_nombre, consultorio_id, dentista_id)
             
             # Intentar buscar por ID del documento primero (más directo)
             horarios_doc_ref = self.db.collection('consultorio')\
@@ -787,10 +738,10 @@ class CitaRepository:
             
             if horarios_doc_snap.exists:
                 horarios_doc = horarios_doc_snap.to_dict()
-                print(f"Horarios encontrados por ID del documento para {dia_nombre}")
+                logger.debug('Horarios encontrados por ID del documento para %s', dia_nombre)
             else:
                 # Si no se encuentra por ID, intentar buscar por campo 'dia'
-                print(f"No se encontró por ID, intentando por campo 'dia'...")
+                logger.debug("No se encontró por ID, intentando por campo 'dia'...")
                 horarios_ref = self.db.collection('consultorio')\
                                      .document(consultorio_id)\
                                      .collection('horarios')\
@@ -800,11 +751,11 @@ class CitaRepository:
                 
                 for doc in horarios_ref.stream():
                     horarios_doc = doc.to_dict()
-                    print(f"Horarios encontrados por campo 'dia' para {dia_nombre}")
+                    logger.debug("Horarios encontrados por campo 'dia' para %s", dia_nombre)
                     break
             
             if not horarios_doc:
-                print(f"No se encontró documento de horarios para {dia_nombre}")
+                logger.debug('No se encontró documento de horarios para %s', dia_nombre)
                 # Intentar listar todos los documentos de horarios para debug
                 try:
                     all_horarios = self.db.collection('consultorio')\
@@ -812,19 +763,19 @@ class CitaRepository:
                                          .collection('horarios')\
                                          .stream()
                     dias_disponibles = [doc.id for doc in all_horarios]
-                    print(f"Días disponibles en horarios: {dias_disponibles}")
+                    logger.debug('Días disponibles en horarios: %s', dias_disponibles)
                 except Exception as e:
-                    print(f"Error listando horarios: {e}")
+                    logger.error('Error listando horarios: %s', e)
                 return []
             
             if 'horarios' not in horarios_doc:
-                print(f"Documento de horarios no tiene campo 'horarios': {list(horarios_doc.keys())}")
+                logger.debug("Documento de horarios no tiene campo 'horarios': %s", list(horarios_doc.keys()))
                 return []
             
             # horarios es un array, tomar el primer elemento
             horarios_array = horarios_doc['horarios']
             if not horarios_array or len(horarios_array) == 0:
-                print(f"Array de horarios vacío para {dia_nombre}")
+                logger.debug('Array de horarios vacío para %s', dia_nombre)
                 return []
             
             # Tomar el primer bloque de horarios (puede haber múltiples bloques)
@@ -832,7 +783,7 @@ class CitaRepository:
             hora_inicio_consultorio = primer_horario.get('inicio', '09:00')  # "09:00"
             hora_fin_consultorio = primer_horario.get('fin', '18:00')  # "18:00"
             
-            print(f"Horario consultorio: {hora_inicio_consultorio} - {hora_fin_consultorio}")
+            logger.debug('Horario consultorio: %s - %s', hora_inicio_consultorio, hora_fin_consultorio)
             
             # Convertir fecha_timestamp a formato compatible con Firestore
             # Las citas usan fechaHora como timestamp, pero también pueden usar fecha como string
@@ -841,89 +792,31 @@ class CitaRepository:
             # Buscar citas existentes - intentar múltiples formatos
             citas_existentes = []
             
-            # Buscar citas existentes en TODAS las ubicaciones (como lo hace la web)
-            # 1. Buscar en colección principal citas
-            try:
-                citas_por_timestamp = self.db.collection('citas')\
-                                             .where('dentistaId', '==', dentista_id)\
-                                             .where('estado', 'in', ['programada', 'confirmado', 'en proceso', 'pendiente'])\
-                                             .stream()
-                for doc in citas_por_timestamp:
-                    cita_data = doc.to_dict()
-                    # Verificar si la fecha coincide
-                    fecha_hora = cita_data.get('fechaHora')
-                    if fecha_hora:
-                        # Convertir timestamp a datetime
-                        if hasattr(fecha_hora, 'to_datetime'):
-                            cita_datetime = fecha_hora.to_datetime()
-                        elif hasattr(fecha_hora, 'date'):
-                            # Es un Timestamp de Firestore
-                            from google.cloud.firestore import Timestamp
-                            if isinstance(fecha_hora, Timestamp):
-                                cita_datetime = fecha_hora.to_datetime()
-                            else:
-                                continue
-                        elif isinstance(fecha_hora, dict) and '_seconds' in fecha_hora:
-                            cita_datetime = datetime.fromtimestamp(fecha_hora['_seconds'])
-                        else:
-                            continue
-                        
-                        if cita_datetime.date() == fecha_dt.date():
-                            citas_existentes.append(cita_data)
-            except Exception as e:
-                print(f"Error buscando citas por timestamp en colección principal: {e}")
-            
-            # 2. Buscar también en subcolecciones de pacientes (estructura usada por la web)
-            # Usar filtro por rango de fecha para ser más eficiente
+            # Buscar citas existentes en TODAS las ubicaciones (como lo hace la web):
+            # una consulta collection group cubre la colección principal y las
+            # subcolecciones de pacientes, filtrada por dentista, estado y rango del día
             try:
-                from google.cloud.firestore import Timestamp
+                from database.queries import citas_de_dentista
                 inicio_dia = datetime.combine(fecha_dt.date(), datetime.min.time())
                 fin_dia = datetime.combine(fecha_dt.date(), datetime.max.time())
-                inicio_timestamp = Timestamp.from_datetime(inicio_dia)
-                fin_timestamp = Timestamp.from_datetime(fin_dia)
                 
-                pacientes_ref = self.db.collection('pacientes')
-                pacientes_docs = pacientes_ref.stream()
-                
-                for paciente_doc in pacientes_docs:
-                    paciente_id = paciente_doc.id
-                    try:
-                        citas_sub_ref = self.db.collection('pacientes').document(paciente_id).collection('citas')
-                        # Filtrar por dentista, estado y rango de fecha
-                        citas_sub_query = citas_sub_ref.where('dentistaId', '==', dentista_id)\
-                                                       .where('fechaHora', '>=', inicio_timestamp)\
-                                                       .where('fechaHora', '<=', fin_timestamp)\
-                                                       .where('estado', 'in', ['programada', 'confirmado', 'en proceso', 'pendiente'])\
-                                                       .stream()
-                        
-                        for cita_doc in citas_sub_query:
-                            cita_data = cita_doc.to_dict()
-                            fecha_hora = cita_data.get('fechaHora')
-                            if fecha_hora:
-                                # Convertir timestamp a datetime
-                                if hasattr(fecha_hora, 'to_datetime'):
-                                    cita_datetime = fecha_hora.to_datetime()
-                                elif isinstance(fecha_hora, Timestamp):
-                                    cita_datetime = fecha_hora.to_datetime()
-                                elif isinstance(fecha_hora, dict) and '_seconds' in fecha_hora:
-                                    cita_datetime = datetime.fromtimestamp(fecha_hora['_seconds'])
-                                else:
-                                    continue
-                                
-                                # Verificar que la fecha coincida (doble verificación)
-                                if cita_datetime.date() == fecha_dt.date():
-                                    # Evitar duplicados
-                                    cita_id = cita_doc.id
-                                    if not any(c.get('_id') == cita_id for c in citas_existentes):
-                                        cita_data['_id'] = cita_id
-                                        citas_existentes.append(cita_data)
-                    except Exception as paciente_error:
-                        # Continuar con el siguiente paciente si hay error
+                for cita_doc in citas_de_dentista(self.db, dentista_id, inicio_dia, fin_dia,
+                                                  ['programada', 'confirmado', 'en proceso', 'pendiente']):
+                    cita_data = cita_doc.to_dict()
+                    fecha_hora = cita_data.get('fechaHora')
+                    if hasattr(fecha_hora, 'to_datetime'):
+                        cita_datetime = fecha_hora.to_datetime()
+                    elif hasattr(fecha_hora, 'date'):
+                        cita_datetime = fecha_hora
+                    else:
                         continue
+                    
+                    # Verificar que la fecha coincida (doble verificación)
+                    if cita_datetime.date() == fecha_dt.date():
+                        cita_data['_id'] = cita_doc.id
+                        citas_existentes.append(cita_data)
             except Exception as e:
-                print(f"Error buscando citas en subcolecciones: {e}")
-                import traceback
-                traceback.print_exc()
+                logger.error('Error buscando citas del dentista: %s', e)
             
             # Extraer horas ocupadas de las citas encontradas
             horas_ocupadas = []
@@ -968,7 +861,7 @@ class CitaRepository:
                         'fin': hora_fin_str
                     })
             
-            print(f"Horas ocupadas: {len(horas_ocupadas)}")
+            logger.debug('Horas ocupadas: %s', len(horas_ocupadas))
             slots_disponibles = []
             hora_actual = datetime.strptime(hora_inicio_consultorio, '%H:%M')
             hora_limite = datetime.strptime(hora_fin_consultorio, '%H:%M')
@@ -993,11 +886,11 @@ class CitaRepository:
                 
                 hora_actual = hora_fin_slot
             
-            print(f"Slots disponibles: {len(slots_disponibles)}")
+            logger.debug('Slots disponibles: %s', len(slots_disponibles))
             return slots_disponibles
             
         except Exception as e:
-            print(f"Error obteniendo horarios disponibles: {e}")
+            logger.error('Error obteniendo horarios disponibles: %s', e)
             return []
     
     def obtener_fechas_disponibles(self, dentista_id: str, consultorio_id: str,fecha_original_timestamp, cantidad: int = 3) -> List:
@@ -1058,94 +951,52 @@ class CitaRepository:
                     fecha_timestamp = datetime.combine(fecha_actual.date(), datetime.min.time())
                     fechas_disponibles.append(fecha_timestamp)
             
-            print(f"Encontradas {len(fechas_disponibles)} fechas disponibles")
+            logger.debug('Encontradas %s fechas disponibles', len(fechas_disponibles))
             return fechas_disponibles
             
         except Exception as e:
-            print(f"Error obteniendo fechas disponibles: {e}")
+            logger.error('Error obteniendo fechas disponibles: %s', e)
             return []
     
     def reagendar_cita(self, paciente_uid: str, cita_id: str,nueva_fecha, nueva_hora_inicio: str,nueva_hora_fin: str) -> bool:
         try:
             from google.cloud.firestore import SERVER_TIMESTAMP
+            from datetime import datetime
 
-            self.db.collection('pacientes')\
-                  .document(paciente_uid)\
-                  .collection('citas')\
-                  .document(cita_id)\
-                  .update({
-                      'fecha': nueva_fecha,
-                      'horaInicio': nueva_hora_inicio,
-                      'horaFin': nueva_hora_fin,
-                      'estado': 'confirmado',
-                      'updatedAt': SERVER_TIMESTAMP
-                  })
-            
-            print(f"Cita {cita_id} reagendada en subcolección")
-
-            # Actualizar en colección global (citas minúscula, estándar)
-            # Intentar actualizar directamente por ID
-            cita_global_ref = self.db.collection('citas').document(cita_id)
-            cita_global_doc = cita_global_ref.get()
-            
-            if cita_global_doc.exists:
-                # Calcular fechaHora completa
-                from datetime import datetime
-                if isinstance(nueva_fecha, str):
-                    fecha_dt = datetime.strptime(nueva_fecha, '%Y-%m-%d')
-                else:
-                    fecha_dt = nueva_fecha
-                hora_dt = datetime.strptime(nueva_hora_inicio, '%H:%M')
-                hora_obj = hora_dt.time()  # Extraer solo la hora (time object)
-                nueva_fecha_hora_completa = datetime.combine(fecha_dt.date(), hora_obj)
-                
-                cita_global_ref.update({
-                    'fecha': nueva_fecha,
-                    'fechaHora': nueva_fecha_hora_completa,
-                    'appointmentDate': nueva_fecha_hora_completa.isoformat(),
-                    'appointmentTime': nueva_hora_inicio,
-                    'horaInicio': nueva_hora_inicio,
-                    'horaFin': nueva_hora_fin,
-                    'estado': 'confirmado',
-                    'status': 'confirmado',
-                    'updatedAt': SERVER_TIMESTAMP
-                })
-                print(f"Cita actualizada en colección global citas: {cita_id}")
+            # Calcular fechaHora completa para la colección global
+            if isinstance(nueva_fecha, str):
+                fecha_dt = datetime.strptime(nueva_fecha, '%Y-%m-%d')
             else:
-                # Fallback: buscar por pacienteId
-                global_query = self.db.collection('citas')\
-                                     .where('pacienteId', '==', paciente_uid)\
-                                     .where('id', '==', cita_id)\
-                                     .limit(1)
-                
-                for doc in global_query.stream():
-                    from datetime import datetime
-                    if isinstance(nueva_fecha, str):
-                        fecha_dt = datetime.strptime(nueva_fecha, '%Y-%m-%d')
-                    else:
-                        fecha_dt = nueva_fecha
-                    hora_dt = datetime.strptime(nueva_hora_inicio, '%H:%M')
-                    hora_obj = hora_dt.time()  # Extraer solo la hora (time object)
-                    nueva_fecha_hora_completa = datetime.combine(fecha_dt.date(), hora_obj)
-                    
-                    self.db.collection('citas').document(doc.id).update({
-                        'fecha': nueva_fecha,
-                        'fechaHora': nueva_fecha_hora_completa,
-                        'appointmentDate': nueva_fecha_hora_completa.isoformat(),
-                        'appointmentTime': nueva_hora_inicio,
-                        'horaInicio': nueva_hora_inicio,
-                        'horaFin': nueva_hora_fin,
-                        'estado': 'confirmado',
-                        'status': 'confirmado',
-                        'updatedAt': SERVER_TIMESTAMP
-                    })
-                    print(f"Cita actualizada en colección global citas (fallback): {doc.id}")
-                    break 
+                fecha_dt = nueva_fecha
+            hora_dt = datetime.strptime(nueva_hora_inicio, '%H:%M')
+            hora_obj = hora_dt.time()  # Extraer solo la hora (time object)
+            nueva_fecha_hora_completa = datetime.combine(fecha_dt.date(), hora_obj)
+
+            # Horario nuevo (slot), subcolección del paciente y colección global en una transacción
+            if not slots.reagendar_cita(self.db, paciente_uid, cita_id, nueva_fecha_hora_completa, {
+                'fecha': nueva_fecha,
+                'horaInicio': nueva_hora_inicio,
+                'horaFin': nueva_hora_fin,
+                'estado': 'confirmado',
+                'updatedAt': SERVER_TIMESTAMP
+            }, {
+                'fecha': nueva_fecha,
+                'fechaHora': nueva_fecha_hora_completa,
+                'appointmentDate': nueva_fecha_hora_completa.isoformat(),
+                'appointmentTime': nueva_hora_inicio,
+                'horaInicio': nueva_hora_inicio,
+                'horaFin': nueva_hora_fin,
+                'estado': 'confirmado',
+                'status': 'confirmado',
+                'updatedAt': SERVER_TIMESTAMP
+            }):
+                return False
             
+            logger.debug('Cita %s reagendada', cita_id)
             return True
             
         except Exception as e:
-            print(f"Error reagendando cita: {e}")
+            logger.error('Error reagendando cita: %s', e)
             return False
     
     def _calculate_payment_deadline(self, payment_method: str):
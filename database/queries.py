@@ -0,0 +1,95 @@
+"""
+CONSULTAS ENTRE PADRES (COLLECTION GROUP)
+Las citas viven en pacientes/{id}/citas (y una copia en la colección global 'citas'),
+las reseñas en dentistas/{id}/resenas y los historiales en pacientes/{id}/historialMedico.
+Las búsquedas "todas las citas del dentista X" o "todas las reseñas del paciente Y"
+se hacen con una consulta collection group en lugar de recorrer cada padre.
+
+Índices requeridos (definidos en firestore.indexes.json):
+- citas (COLLECTION_GROUP): dentistaId ASC, estado ASC, fechaHora ASC
+- citas (COLLECTION_GROUP): campo pacienteId con índice de collection group
+- resenas (COLLECTION_GROUP): campos pacienteId y userId con índice de collection group
+- historialMedico (COLLECTION_GROUP): campo citaId con índice de collection group
+
+Los filtros 'in' aceptan hasta 30 valores: las funciones que reciben listas parten
+la consulta en grupos de 30.
+"""
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from utils.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+IN_QUERY_LIMIT = 30
+
+
+def _chunks(values: List, size: int = IN_QUERY_LIMIT) -> Iterator[List]:
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def parent_id(doc) -> Optional[str]:
+    """ID del documento padre (paciente o dentista); None en colecciones de primer nivel"""
+    parent = doc.reference.parent.parent
+    return parent.id if parent is not None else None
+
+
+def citas_de_dentista(db, dentista_id: str, desde, hasta, estados: List[str] = None) -> List:
+    """
+    Citas de un dentista con fechaHora en [desde, hasta], de todas las ubicaciones
+    (subcolecciones de pacientes y colección global), sin duplicados por ID
+    """
+    query = db.collection_group('citas').where('dentistaId', '==', dentista_id)
+    if estados:
+        query = query.where('estado', 'in', estados)
+    query = query.where('fechaHora', '>=', desde).where('fechaHora', '<=', hasta)
+
+    citas = {}
+    for doc in query.stream():
+        # La copia de pacientes/{id}/citas tiene prioridad sobre la global
+        if doc.id not in citas or parent_id(doc) is not None:
+            citas[doc.id] = doc
+    return list(citas.values())
+
+
+def citas_de_pacientes(db, paciente_ids: Iterable[str]) -> Iterator[Tuple[str, object]]:
+    """(paciente_id, doc) de las citas en pacientes/{id}/citas de varios pacientes"""
+    ids = list(paciente_ids)
+    wanted = set(ids)
+    for grupo in _chunks(ids):
+        for doc in db.collection_group('citas').where('pacienteId', 'in', grupo).stream():
+            owner = parent_id(doc)
+            # La colección global 'citas' duplica los documentos: solo subcolecciones
+            if owner in wanted:
+                yield owner, doc
+
+
+def historiales_de_citas(db, cita_ids: Iterable[str]) -> Iterator[Tuple[Optional[str], str]]:
+    """(paciente_id, cita_id) de cada historialMedico asociado a alguna de las citas"""
+    for grupo in _chunks(list(cita_ids)):
+        for doc in db.collection_group('historialMedico').where('citaId', 'in', grupo).stream():
+            yield parent_id(doc), (doc.to_dict() or {}).get('citaId')
+
+
+def resenas_de_pacientes(db, paciente_ids: Iterable[str]) -> Iterator[Tuple[str, Dict]]:
+    """(paciente_id, datos) de las reseñas escritas por varios pacientes"""
+    for grupo in _chunks(list(paciente_ids)):
+        for doc in db.collection_group('resenas').where('pacienteId', 'in', grupo).stream():
+            data = doc.to_dict() or {}
+            yield data.get('pacienteId'), data
+
+
+def resenas_de_paciente(db, paciente_id: str, limit: int = None) -> List:
+    """
+    Reseñas de un paciente en todos los dentistas (por pacienteId o userId),
+    sin duplicados
+    """
+    resenas = {}
+    for field in ('pacienteId', 'userId'):
+        query = db.collection_group('resenas').where(field, '==', paciente_id)
+        if limit:
+            query = query.limit(limit)
+        for doc in query.stream():
+            resenas.setdefault(doc.reference.path, doc)
+    docs = list(resenas.values())
+    return docs[:limit] if limit else docs
@@ -0,0 +1,221 @@
+"""
+RESERVA DE HORARIOS (SLOTS)
+Cada horario de un dentista tiene un documento slots/{dentistaId}_{YYYYMMDDTHHMM}.
+- Hold: al elegir una hora en el menú se aparta el horario por SLOT_HOLD_MINUTES
+  (expiresAt). Si el usuario abandona el flujo el hold simplemente expira; la
+  política TTL sobre expiresAt (firestore.indexes.json) limpia los documentos viejos
+  (los reservados expiran un día después de la cita).
+- Booked: al crear la cita, el slot se marca como reservado en la MISMA transacción
+  que escribe la cita (pacientes/{id}/citas y citas). Dos pacientes confirmando el
+  mismo horario desde workers distintos: solo una transacción gana.
+- Un slot reservado cuya cita fue cancelada o movida a otro horario se considera
+  libre: se valida contra citas/{citaId} dentro de la transacción, así cancelar o
+  reagendar no necesita liberar el slot explícitamente.
+- Reagendar (reagendar_cita) reserva el horario nuevo y mueve la cita en la misma
+  transacción; el hold del paciente sobre ese horario se convierte en la reserva.
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Optional, Set
+
+from google.cloud import firestore
+from database import cita_writes
+from utils.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+SLOTS_COLLECTION = 'slots'
+HOLD_MINUTES = int(os.getenv('SLOT_HOLD_MINUTES', '10'))
+ESTADOS_CANCELADOS = ('cancelada', 'cancelado', 'cancelled')
+
+
+def fecha_hora_de(fecha, hora: str) -> datetime:
+    """Combina fecha ('YYYY-MM-DD' o datetime) y hora ('HH:MM') en un datetime"""
+    if isinstance(fecha, str):
+        fecha = datetime.strptime(fecha, '%Y-%m-%d')
+    dia = fecha.date() if isinstance(fecha, datetime) else fecha
+    return datetime.combine(dia, datetime.strptime(hora, '%H:%M').time())
+
+
+def slot_id(dentista_id: str, fecha_hora: datetime) -> str:
+    return f"{dentista_id}_{fecha_hora.strftime('%Y%m%dT%H%M')}"
+
+
+def _slot_libre(slot: Optional[Dict], holder: str, now: datetime,
+                cita: Optional[Dict] = None, cita_id: Optional[str] = None) -> bool:
+    """
+    True si holder puede tomar el slot.
+    cita: datos de citas/{slot.citaId} cuando el slot está reservado (None si no existe)
+    cita_id: la cita que se reagenda; el slot que ya ocupa ella misma no cuenta como ocupado
+    """
+    if not slot:
+        return True
+    if slot.get('status') == 'hold':
+        expires_at = slot.get('expiresAt')
+        return slot.get('holder') == holder or expires_at is None or expires_at <= now
+    if slot.get('status') == 'booked':
+        if cita_id and slot.get('citaId') == cita_id:
+            return True
+        if not cita or cita.get('estado') in ESTADOS_CANCELADOS:
+            return True
+        fecha_hora = cita.get('fechaHora')
+        # La cita se reagendó a otro horario o dentista: el slot quedó huérfano
+        return (fecha_hora is None or cita.get('dentistaId') != slot.get('dentistaId')
+                or fecha_hora.strftime('%Y%m%dT%H%M') != slot.get('key'))
+    return True
+
+
+def _disponible(transaction, db, slot_ref, holder: str, now: datetime,
+                cita_id: Optional[str] = None) -> bool:
+    """Lee el slot y, si está reservado, la cita que lo ocupa (dentro de la transacción)"""
+    snapshot = slot_ref.get(transaction=transaction)
+    slot = snapshot.to_dict() if snapshot.exists else None
+    cita = None
+    if (slot and slot.get('status') == 'booked' and slot.get('citaId')
+            and slot['citaId'] != cita_id):
+        cita_doc = db.collection('citas').document(slot['citaId']).get(transaction=transaction)
+        cita = cita_doc.to_dict() if cita_doc.exists else None
+    return _slot_libre(slot, holder, now, cita, cita_id)
+
+
+def apartar_slot(db, dentista_id: str, fecha_hora: datetime, holder: str,
+                 minutes: int = None) -> bool:
+    """Aparta el horario para holder por unos minutos. False si otro lo tiene"""
+    slot_ref = db.collection(SLOTS_COLLECTION).document(slot_id(dentista_id, fecha_hora))
+
+    @firestore.transactional
+    def apartar(transaction):
+        now = datetime.now(timezone.utc)
+        if not _disponible(transaction, db, slot_ref, holder, now):
+            return False
+        transaction.set(slot_ref, {
+            'status': 'hold',
+            'dentistaId': dentista_id,
+            'key': fecha_hora.strftime('%Y%m%dT%H%M'),
+            'fechaHora': fecha_hora,
+            'holder': holder,
+            'expiresAt': now + timedelta(minutes=minutes or HOLD_MINUTES),
+            'updatedAt': now
+        })
+        return True
+
+    return apartar(db.transaction())
+
+
+def liberar_slot(db, dentista_id: str, fecha_hora: datetime, holder: str) -> bool:
+    """Libera un hold propio (si el usuario cambia de hora o cancela el flujo)"""
+    slot_ref = db.collection(SLOTS_COLLECTION).document(slot_id(dentista_id, fecha_hora))
+
+    @firestore.transactional
+    def liberar(transaction):
+        snapshot = slot_ref.get(transaction=transaction)
+        data = snapshot.to_dict() if snapshot.exists else None
+        if not data or data.get('status') != 'hold' or data.get('holder') != holder:
+            return False
+        transaction.delete(slot_ref)
+        return True
+
+    return liberar(db.transaction())
+
+
+def slots_apartados_por_otros(db, dentista_id: str, fechas_hora: Iterable[datetime],
+                              holder: str) -> Set[str]:
+    """Claves 'YYYYMMDDTHHMM' de los horarios con hold vigente de otro usuario (una lectura)"""
+    refs = [db.collection(SLOTS_COLLECTION).document(slot_id(dentista_id, fh)) for fh in fechas_hora]
+    if not refs:
+        return set()
+    now = datetime.now(timezone.utc)
+    apartados = set()
+    for snapshot in db.get_all(refs):
+        data = snapshot.to_dict() if snapshot.exists else None
+        if data and data.get('status') == 'hold' and not _slot_libre(data, holder, now):
+            apartados.add(data.get('key'))
+    return apartados
+
+
+def reservar_cita(db, dentista_id: str, fecha_hora: datetime, paciente_id: str, cita_id: str,
+                  datos_paciente: Dict, datos_globales: Optional[Dict] = None) -> Optional[Dict]:
+    """
+    Reserva el slot y crea la cita en una sola transacción.
+    El hold del mismo paciente se respeta. Retorna el cambio registrado, o None si el
+    horario ya está ocupado.
+    """
+    slot_ref = db.collection(SLOTS_COLLECTION).document(slot_id(dentista_id, fecha_hora))
+
+    @firestore.transactional
+    def reservar(transaction):
+        now = datetime.now(timezone.utc)
+        if not _disponible(transaction, db, slot_ref, paciente_id, now):
+            return None
+        transaction.set(slot_ref, {
+            'status': 'booked',
+            'dentistaId': dentista_id,
+            'key': fecha_hora.strftime('%Y%m%dT%H%M'),
+            'fechaHora': fecha_hora,
+            'citaId': cita_id,
+            'pacienteId': paciente_id,
+            'expiresAt': fecha_hora + timedelta(days=1),  # TTL: limpiar después de la cita
+            'updatedAt': now
+        })
+        return cita_writes.escribir_creacion(transaction, db, paciente_id, cita_id,
+                                             datos_paciente, datos_globales)
+
+    cambio = reservar(db.transaction())
+    if cambio is None:
+        logger.info('Horario %s ya reservado', slot_id(dentista_id, fecha_hora))
+        return None
+    cita_writes.notificar_cambio(cambio)
+    return cambio
+
+
+def reagendar_cita(db, paciente_id: str, cita_id: str, fecha_hora: datetime, cambios: Dict,
+                   cambios_globales: Optional[Dict] = None) -> Optional[Dict]:
+    """
+    Reserva el horario nuevo y actualiza ambas copias de la cita en una sola transacción.
+    El dentista es el de la cita; el hold del mismo paciente se respeta y queda como
+    reserva. El slot anterior se libera solo (la cita ya no apunta a él, ver _slot_libre).
+    Retorna el cambio registrado, o None si el horario ya está ocupado.
+    """
+    paciente_ref = cita_writes.cita_refs(db, paciente_id, cita_id)[0]
+    global_ref = cita_writes.copia_global(db, cita_id)
+
+    @firestore.transactional
+    def reagendar(transaction):
+        now = datetime.now(timezone.utc)
+        cita = {}
+        if global_ref is not None:
+            snapshot = global_ref.get(transaction=transaction)
+            cita = snapshot.to_dict() if snapshot.exists else {}
+        dentista_id = cita.get('dentistaId')
+        if not dentista_id:
+            snapshot = paciente_ref.get(transaction=transaction)
+            dentista_id = (snapshot.to_dict() or {}).get('dentistaId') if snapshot.exists else None
+
+        if dentista_id:
+            slot_ref = db.collection(SLOTS_COLLECTION).document(slot_id(dentista_id, fecha_hora))
+            if not _disponible(transaction, db, slot_ref, paciente_id, now, cita_id):
+                return None
+            transaction.set(slot_ref, {
+                'status': 'booked',
+                'dentistaId': dentista_id,
+                'key': fecha_hora.strftime('%Y%m%dT%H%M'),
+                'fechaHora': fecha_hora,
+                'citaId': cita_id,
+                'pacienteId': paciente_id,
+                'expiresAt': fecha_hora + timedelta(days=1),
+                'updatedAt': now
+            })
+        else:
+            logger.warning('Cita %s sin dentistaId: se reagenda sin reservar horario', cita_id)
+        return cita_writes.escribir_actualizacion(transaction, db, paciente_id, cita_id, cambios,
+                                                  cambios_globales, 'rescheduled',
+                                                  global_ref=global_ref)
+
+    cambio = reagendar(db.transaction())
+    if cambio is None:
+        logger.info('Horario %s ya reservado; no se reagenda la cita %s',
+                    fecha_hora.strftime('%Y%m%dT%H%M'), cita_id)
+        return None
+    cita_writes.notificar_cambio(cambio)
+    return cambio
@@ -9,8 +9,15 @@ from datetime import datetime, timedelta
 import pytz
 from database.models import CitaRepository, PacienteRepository
 from database.database import FirebaseConfig
+from database import cita_writes
 from services.whatsapp_service import WhatsAppService
 from typing import List, Dict
+from services.registry import lazy_service, shared
+from utils.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+PAYMENT_REMINDER_HOURS = 12
 
 class ReminderScheduler:
     """
@@ -19,9 +26,9 @@ class ReminderScheduler:
     
     def __init__(self):
         self.scheduler = BackgroundScheduler(timezone=pytz.timezone('America/Mexico_City'))
-        self.whatsapp = WhatsAppService()
-        self.cita_repo = CitaRepository()
-        self.paciente_repo = PacienteRepository()
+        self.whatsapp = shared(WhatsAppService)
+        self.cita_repo = shared(CitaRepository)
+        self.paciente_repo = shared(PacienteRepository)
         self.db = FirebaseConfig.get_db()
         self.mexico_tz = pytz.timezone('America/Mexico_City')
         
@@ -46,12 +53,21 @@ class ReminderScheduler:
             replace_existing=True
         )
         
-        # Verificar pagos pendientes (cada 6 horas)
+        # Vencimientos de pago: recordatorios y cancelación automática (cada 30 minutos)
+        self.scheduler.add_job(
+            func=self.process_payment_deadlines,
+            trigger=CronTrigger(minute='15,45', timezone=self.mexico_tz),
+            id='payment_deadlines',
+            name='Procesar vencimientos de pago',
+            replace_existing=True
+        )
+        
+        # Resumen de completitud para pacientes sin él (antes del recordatorio de las 10 AM)
         self.scheduler.add_job(
-            func=self.check_pending_payments,
-            trigger=CronTrigger(hour='*/6', timezone=self.mexico_tz),
-            id='check_payments',
-            name='Verificar pagos pendientes',
+            func=self.backfill_medical_history_completeness,
+            trigger=CronTrigger(hour=9, minute=30, timezone=self.mexico_tz),
+            id='medical_history_completeness_backfill',
+            name='Completitud de historial médico',
             replace_existing=True
         )
         
@@ -73,15 +89,6 @@ class ReminderScheduler:
             replace_existing=True
         )
         
-        # Cancelación automática de citas sin pago (cada 2 horas)
-        self.scheduler.add_job(
-            func=self.auto_cancel_unpaid_appointments,
-            trigger=CronTrigger(hour='*/2', timezone=self.mexico_tz),
-            id='auto_cancel_unpaid',
-            name='Cancelar citas sin pago',
-            replace_existing=True
-        )
-        
         # J.RF10, J.RNF15: Procesar reintentos de mensajes fallidos (cada 30 minutos)
         self.scheduler.add_job(
             func=self.process_message_retries,
@@ -193,75 +200,113 @@ class ReminderScheduler:
             import traceback
             traceback.print_exc()
     
-    def check_pending_payments(self):
-        """Verifica pagos pendientes y envía recordatorios"""
+    def process_payment_deadlines(self):
+        """
+        Procesa los vencimientos de pago en una sola pasada. Solo lee las citas cuyo
+        estado de pago cambia en esta ejecución (consultas por rango de paymentDeadline):
+        - Vencidas: se cancelan en batch y se avisa al paciente
+        - Por vencer en las próximas PAYMENT_REMINDER_HOURS horas y sin recordatorio:
+          se envía el recordatorio y se marca paymentReminderSent
+        Las citas sin paymentDeadline (efectivo, tarjeta) no entran en ninguna consulta.
+        """
         try:
-            
             now = datetime.now(self.mexico_tz)
-            
-            # Obtener citas con pago pendiente
-            citas_ref = self.db.collection('citas')\
-                .where('paymentStatus', 'in', ['pending', 'pendiente'])\
-                .where('estado', '==', 'confirmado')\
-                .stream()
-            
-            recordatorios_enviados = 0
-            for cita_doc in citas_ref:
-                cita_data = cita_doc.to_dict()
-                cita_id = cita_doc.id
-                
-                # Verificar que tenga método de pago que requiera pago previo
-                metodo_pago = cita_data.get('metodoPago', '').lower()
-                if metodo_pago == 'efectivo':
-                    continue
-                
-                # Calcular tiempo restante
-                payment_deadline = cita_data.get('paymentDeadline') or cita_data.get('payment_deadline')
-                if not payment_deadline:
-                    # Calcular deadline basado en fecha de cita y método
-                    continue
-                
-                # Convertir deadline
-                if isinstance(payment_deadline, str):
-                    deadline_dt = datetime.fromisoformat(payment_deadline)
-                else:
-                    deadline_dt = payment_deadline
-                
-                # Asegurar timezone
-                if deadline_dt.tzinfo is None:
-                    deadline_dt = self.mexico_tz.localize(deadline_dt)
-                
-                horas_restantes = (deadline_dt - now).total_seconds() / 3600
-                
-                # Enviar recordatorio si quedan menos de 12 horas y no se ha enviado hoy
-                if 0 < horas_restantes <= 12:
-                    if not self._ya_enviado_recordatorio(cita_id, 'payment_reminder', hoy=True):
-                        # Obtener paciente
-                        paciente_id = cita_data.get('pacienteId') or cita_data.get('paciente_id')
-                        paciente = self.paciente_repo.buscar_por_id(paciente_id)
-                        
-                        if paciente and paciente.telefono:
-                            mensaje = self._construir_mensaje_pago_pendiente(cita_data, horas_restantes)
-                            
-                            exito = self.whatsapp.enviar_mensaje_twilio(
-                                to_number=paciente.telefono,
-                                message=mensaje
-                            )
-                            
-                            if exito:
-                                self._registrar_recordatorio_enviado(cita_id, 'payment_reminder')
-                                recordatorios_enviados += 1
-                
-                # Auto-cancelar si expiró
-                elif horas_restantes <= 0:
-                    self._auto_cancel_cita_sin_pago(cita_id, cita_data)
-            
-            
-            
-        except Exception as e:
-            
-            import traceback
-            traceback.print_exc()
+            canceladas = self._cancel_expired_payments(now)
+            recordatorios = self._send_payment_reminders(now)
+            logger.info('Vencimientos de pago: %s citas canceladas, %s recordatorios enviados',
+                        canceladas, recordatorios)
+        except Exception:
+            logger.exception('Error procesando vencimientos de pago')
+    
+    def _pending_payment_query(self):
+        """Citas de la colección global con pago pendiente (índice paymentStatus, estado, ...)"""
+        return self.db.collection('citas')\
+            .where('paymentStatus', 'in', ['pending', 'pendiente'])\
+            .where('estado', '==', 'confirmado')
+    
+    def _telefono_paciente(self, cita_data: Dict) -> str:
+        telefono = cita_data.get('patientPhone')
+        if telefono:
+            return telefono
+        paciente_id = cita_data.get('pacienteId') or cita_data.get('paciente_id')
+        paciente = self.paciente_repo.buscar_por_id(paciente_id) if paciente_id else None
+        return paciente.telefono if paciente else None
+    
+    def _cancel_expired_payments(self, now: datetime) -> int:
+        """Cancela en batch las citas con paymentDeadline vencido y avisa a los pacientes"""
+        docs = list(self._pending_payment_query().where('paymentDeadline', '<=', now).stream())
+        if not docs:
+            return 0
+        
+        cambios = {
+            'estado': 'cancelada',
+            'status': 'cancelada',
+            'motivo_cancelacion': 'Pago no confirmado a tiempo',
+            'cancelado_automaticamente': True,
+            'fecha_cancelacion': now,
+            'updatedAt': now
+        }
+        actualizaciones = []
+        actualizadas = {}
+        for doc in docs:
+            cita_data = doc.to_dict() or {}
+            paciente_id = cita_data.get('pacienteId')
+            if not paciente_id:
+                logger.warning('Cita %s sin pacienteId: no se puede cancelar automáticamente', doc.id)
+                continue
+            # Copias legacy: el ID global no coincide con el de la subcolección
+            cita_id = cita_data.get('pacienteCitaId') or doc.id
+            actualizadas[cita_id] = cita_data
+            # updateTime: si el pago se confirmó después de leerla, no se cancela
+            actualizaciones.append({'pacienteId': paciente_id, 'citaId': cita_id, 'cambios': cambios,
+                                    'updateTime': doc.update_time, 'globalRef': doc.reference})
+        canceladas = cita_writes.actualizar_citas(self.db, actualizaciones, tipo='cancelled')
+        
+        avisos = []
+        for cita_id in canceladas:
+            cita_data = actualizadas[cita_id]
+            telefono = self._telefono_paciente(cita_data)
+            if telefono:
+                avisos.append((telefono, self._construir_mensaje_cancelacion_pago(cita_data)))
+        self.whatsapp.send_bulk(avisos)
+        return len(canceladas)
+    
+    def _send_payment_reminders(self, now: datetime) -> int:
+        """Envía un recordatorio por cita antes de que venza su pago"""
+        docs = list(self._pending_payment_query()
+                    .where('paymentReminderSent', '==', False)
+                    .where('paymentDeadline', '>', now)
+                    .where('paymentDeadline', '<=', now + timedelta(hours=PAYMENT_REMINDER_HOURS))
+                    .stream())
+        
+        pendientes = []
+        for doc in docs:
+            cita_data = doc.to_dict() or {}
+            telefono = self._telefono_paciente(cita_data)
+            if not telefono:
+                continue
+            horas_restantes = (cita_data['paymentDeadline'] - now).total_seconds() / 3600
+            pendientes.append((doc, telefono, self._construir_mensaje_pago_pendiente(cita_data, horas_restantes)))
+        
+        resultados = self.whatsapp.send_bulk([(telefono, mensaje) for _, telefono, mensaje in pendientes])
+        enviados = [doc for (doc, _, _), resultado in zip(pendientes, resultados) if resultado]
+        
+        # Marca operativa solo en la copia global (es la que se consulta)
+        for i in range(0, len(enviados), 500):
+            batch = self.db.batch()
+            for doc in enviados[i:i + 500]:
+                batch.update(doc.reference, {'paymentReminderSent': True, 'paymentReminderSentAt': now})
+            batch.commit()
+        return len(enviados)
+    
+    def backfill_medical_history_completeness(self):
+        """Materializa historial_medico_completo en pacientes que aún no lo tienen"""
+        try:
+            from services.medical_history_check_service import medical_history_check_service
+            resultado = medical_history_check_service.backfill_completeness()
+            logger.info('Completitud de historial médico: %s', resultado)
+        except Exception:
+            logger.exception('Error en backfill de completitud de historial')
     
     def remind_pending_medical_history(self):
         """Recuerda a pacientes completar su historial médico"""
@@ -387,54 +432,6 @@ Es rápido (2 minutos) y seguro. Tu información está encriptada.
             import traceback
             traceback.print_exc()
     
-    def auto_cancel_unpaid_appointments(self):
-        """Cancela automáticamente citas sin pago después del deadline"""
-        try:
-            
-            now = datetime.now(self.mexico_tz)
-            
-            # Obtener citas con pago pendiente vencido
-            citas_ref = self.db.collection('citas')\
-                .where('paymentStatus', 'in', ['pending', 'pendiente'])\
-                .where('estado', '==', 'confirmado')\
-                .stream()
-            
-            canceladas = 0
-            for cita_doc in citas_ref:
-                cita_data = cita_doc.to_dict()
-                cita_id = cita_doc.id
-                
-                # Verificar método de pago
-                metodo_pago = cita_data.get('metodoPago', '').lower()
-                if metodo_pago == 'efectivo':
-                    continue
-                
-                # Verificar deadline
-                payment_deadline = cita_data.get('paymentDeadline') or cita_data.get('payment_deadline')
-                if not payment_deadline:
-                    continue
-                
-                if isinstance(payment_deadline, str):
-                    deadline_dt = datetime.fromisoformat(payment_deadline)
-                else:
-                    deadline_dt = payment_deadline
-                
-                if deadline_dt.tzinfo is None:
-                    deadline_dt = self.mexico_tz.localize(deadline_dt)
-                
-                # Si expiró, cancelar
-                if deadline_dt < now:
-                    self._auto_cancel_cita_sin_pago(cita_id, cita_data)
-                    canceladas += 1
-            
-            
-            
-        except Exception as e:
-            
-            import traceback
-            traceback.print_exc()
-
-    
     def _get_citas_en_rango(self, start_time: datetime, end_time: datetime) -> List:
         """Obtiene citas en un rango de tiempo específico"""
         try:
@@ -609,40 +606,15 @@ Para pagar o confirmar, responde: *"ya pagué"*"""
         except Exception as e:
             print(f"Error registrando recordatorio: {e}")
     
-    def _auto_cancel_cita_sin_pago(self, cita_id: str, cita_data: Dict):
-        """Cancela automáticamente una cita sin pago"""
-        try:
-            # Actualizar estado
-            self.db.collection('citas').document(cita_id).update({
-                'estado': 'cancelada',
-                'motivo_cancelacion': 'Pago no confirmado a tiempo',
-                'cancelado_automaticamente': True,
-                'fecha_cancelacion': datetime.now(self.mexico_tz),
-                'actualizado': datetime.now(self.mexico_tz)
-            })
-            
-            # Notificar al paciente
-            paciente_id = cita_data.get('pacienteId') or cita_data.get('paciente_id')
-            if paciente_id:
-                paciente = self.paciente_repo.buscar_por_id(paciente_id)
-                if paciente and paciente.telefono:
-                    mensaje = f"""*Cita Cancelada*
+    def _construir_mensaje_cancelacion_pago(self, cita_data: Dict) -> str:
+        """Construye el aviso de cancelación por falta de pago"""
+        return f"""*Cita Cancelada*
 
 Tu cita del {cita_data.get('fecha', 'N/A')} a las {cita_data.get('horaInicio', 'N/A')} fue cancelada por falta de confirmación de pago.
 
 Si deseas agendar nuevamente, escribe *"agendar cita"*.
 
 Disculpa las molestias."""
-                    
-                    result = self.whatsapp.send_text_message(
-                        to_number=paciente.telefono,
-                        message=mensaje
-                    )
-            
-            
-            
-        except Exception as e:
-            print(f"Error auto-cancelando cita: {e}")
     
     def process_message_retries(self):
         """
@@ -659,7 +631,7 @@ Disculpa las molestias."""
             traceback.print_exc()
 
 # Instancia global del scheduler
-reminder_scheduler = ReminderScheduler()
+reminder_scheduler = lazy_service('reminder_scheduler', ReminderScheduler)
 
 
 def start_reminder_system():
@@ -5,9 +5,11 @@ Integra con Firestore para realizar todas las acciones del sistema
 
 from database.models import CitaRepository, PacienteRepository
 from database.database import FirebaseConfig
+from services.tracing import traced
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 import re
+from services.registry import shared
 try:
     from utils.encryption import decrypt_medical_history
 except ImportError:
@@ -20,9 +22,10 @@ class ActionsService:
     
     def __init__(self):
         self.db = FirebaseConfig.get_db()
-        self.cita_repo = CitaRepository()
-        self.paciente_repo = PacienteRepository()
+        self.cita_repo = shared(CitaRepository)
+        self.paciente_repo = shared(PacienteRepository)
     
+    @traced('firestore.get_user_info')
     def get_user_info(self, user_id: str = None, phone: str = None) -> Optional[Dict]:
         """Obtiene información del usuario"""
         try:
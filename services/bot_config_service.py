@@ -7,6 +7,7 @@ J.RNF18: Configuración de firma del bot
 from database.database import FirebaseConfig
 from datetime import datetime
 from typing import Dict, Optional
+from services.registry import lazy_service
 
 class BotConfigService:
     """
@@ -96,5 +97,5 @@ class BotConfigService:
         return f"{message}\n\n— {signature}"
 
 # Instancia global
-bot_config_service = BotConfigService()
+bot_config_service = lazy_service('bot_config_service', BotConfigService)
 
@@ -0,0 +1,173 @@
+"""
+EJECUTOR DE CAMPAÑAS POR LOTES
+Recorre una colección por páginas (orden por ID de documento) y procesa cada página
+con un pool acotado de hilos:
+- Checkpoint por página en campaign_runs/{campaignId}: si el proceso muere, la
+  siguiente ejecución continúa desde el último cursor (a lo sumo se repite la página
+  que estaba en curso)
+- Lease: solo un worker ejecuta la campaña a la vez; una campaña completada no se
+  vuelve a ejecutar. is_stalled() detecta una ejecución caída (lease vencido sin
+  completar) para que un job de recuperación la reanude
+- Prefetch por página: los datos relacionados se cargan con pocas consultas por
+  página en lugar de varias por elemento
+- Progreso y throughput en el log y en el documento de la campaña
+"""
+
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from google.cloud import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from utils.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+class CampaignRunner:
+    """
+    Ejecuta una campaña identificada por campaign_id (p. ej. weekly_summary_2026-W43)
+    """
+
+    def __init__(self, db, campaign_id: str, page_size: int = 100, max_workers: int = None,
+                 lease_seconds: int = 600):
+        self.db = db
+        self.campaign_id = campaign_id
+        self.page_size = page_size
+        self.max_workers = max_workers or int(os.getenv('CAMPAIGN_WORKERS', '8'))
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.run_ref = db.collection('campaign_runs').document(campaign_id)
+
+    # ------------------------------------------------------------------
+    # Estado de la campaña
+    # ------------------------------------------------------------------
+
+    def _start_state(self, data: Optional[Dict], now: datetime) -> Optional[Dict]:
+        """
+        Estado con el que arranca esta ejecución, o None si no debe correr
+        (ya completada o con lease vigente de otro worker)
+        """
+        if data is None:
+            return {
+                'status': 'running', 'cursor': None, 'processed': 0, 'succeeded': 0, 'failed': 0,
+                'owner': self.owner, 'leaseUntil': now + timedelta(seconds=self.lease_seconds),
+                'startedAt': now, 'updatedAt': now
+            }
+        if data.get('status') == 'completed':
+            return None
+        lease_until = data.get('leaseUntil')
+        if data.get('owner') != self.owner and lease_until is not None and lease_until > now:
+            return None
+        state = dict(data)
+        state.update({
+            'status': 'running',
+            'owner': self.owner,
+            'leaseUntil': now + timedelta(seconds=self.lease_seconds),
+            'resumedAt': now if data.get('cursor') else None,
+            'updatedAt': now
+        })
+        return state
+
+    def _acquire(self) -> Optional[Dict]:
+        @firestore.transactional
+        def tomar(transaction):
+            snapshot = self.run_ref.get(transaction=transaction)
+            state = self._start_state(snapshot.to_dict() if snapshot.exists else None,
+                                      datetime.now(timezone.utc))
+            if state is not None:
+                transaction.set(self.run_ref, state)
+            return state
+
+        return tomar(self.db.transaction())
+
+    @staticmethod
+    def _stalled(data: Optional[Dict], now: datetime) -> bool:
+        if not data or data.get('status') == 'completed':
+            return False
+        lease_until = data.get('leaseUntil')
+        return lease_until is None or lease_until <= now
+
+    def is_stalled(self) -> bool:
+        """True si la campaña empezó, no terminó y nadie la está ejecutando (lease vencido)"""
+        snapshot = self.run_ref.get()
+        return self._stalled(snapshot.to_dict() if snapshot.exists else None,
+                             datetime.now(timezone.utc))
+
+    # ------------------------------------------------------------------
+    # Ejecución
+    # ------------------------------------------------------------------
+
+    def fetch_page(self, collection: str, cursor: Optional[str]) -> List:
+        """Siguiente página de una colección ordenada por ID de documento"""
+        query = self.db.collection(collection).order_by(FieldPath.document_id())
+        if cursor:
+            query = query.start_after({FieldPath.document_id(): cursor})
+        return list(query.limit(self.page_size).stream())
+
+    def run(self, collection: str, prefetch: Callable[[List], Any],
+            handle: Callable[[Any, Any], bool]) -> Dict:
+        """
+        Procesa toda la colección.
+        prefetch(docs_de_la_página) -> contexto compartido por la página
+        handle(doc, contexto) -> True si se procesó con éxito
+        Retorna el estado final de la campaña.
+        """
+        state = self._acquire()
+        if state is None:
+            logger.info(f"Campaña {self.campaign_id}: ya completada o en ejecución en otro worker")
+            return {'skipped': True}
+
+        if state.get('cursor'):
+            logger.info(f"Campaña {self.campaign_id}: reanudando después de {state['cursor']} "
+                        f"({state.get('processed', 0)} ya procesados)")
+
+        started = time.monotonic()
+        processed_here = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers,
+                                thread_name_prefix=f"campaign-{self.campaign_id}") as pool:
+            while True:
+                docs = self.fetch_page(collection, state.get('cursor'))
+                if not docs:
+                    break
+
+                context = prefetch(docs)
+
+                def procesar(doc):
+                    try:
+                        return bool(handle(doc, context))
+                    except Exception:
+                        logger.exception(f"Campaña {self.campaign_id}: error en {doc.id}")
+                        return False
+
+                results = list(pool.map(procesar, docs))
+                succeeded = sum(1 for ok in results if ok)
+                processed_here += len(docs)
+                elapsed = max(time.monotonic() - started, 1e-6)
+
+                now = datetime.now(timezone.utc)
+                state.update({
+                    'cursor': docs[-1].id,
+                    'processed': state.get('processed', 0) + len(docs),
+                    'succeeded': state.get('succeeded', 0) + succeeded,
+                    'failed': state.get('failed', 0) + len(docs) - succeeded,
+                    'throughputPerSecond': round(processed_here / elapsed, 2),
+                    'leaseUntil': now + timedelta(seconds=self.lease_seconds),
+                    'updatedAt': now
+                })
+                self.run_ref.set(dict(state))
+                logger.info(f"Campaña {self.campaign_id}: {state['processed']} procesados "
+                            f"({state['succeeded']} ok, {state['failed']} con error), "
+                            f"{state['throughputPerSecond']}/s")
+
+                if len(docs) < self.page_size:
+                    break
+
+        state.update({'status': 'completed', 'completedAt': datetime.now(timezone.utc),
+                      'leaseUntil': None})
+        self.run_ref.set(state)
+        return state
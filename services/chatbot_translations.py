@@ -61,6 +61,7 @@ TRANSLATIONS = {
         
         'step_time': '*Paso 5/6: Selecciona un horario:*',
         'no_times': 'No hay horarios disponibles para esta fecha.',
+        'slot_taken': 'Ese horario acaba de ser apartado por otro paciente. Elige otro:',
         
         'step_payment': '*Paso 6/6: Selecciona el método de pago:*',
         'payment_cash': 'Efectivo',
@@ -343,6 +344,7 @@ TRANSLATIONS = {
         
         'step_time': '*Step 5/6: Select a time:*',
         'no_times': 'No times available for this date.',
+        'slot_taken': 'That time was just taken by another patient. Please choose another:',
         
         'step_payment': '*Step 6/6: Select payment method:*',
         'payment_cash': 'Cash',
@@ -3,11 +3,12 @@ from datetime import datetime
 from database.models import Cita, CitaRepository
 from services.whatsapp_service import WhatsAppService
 from services.event_notifier import event_notifier
+from services.registry import shared
 
 class CitasService:
     def __init__(self):
-        self.cita_repo=CitaRepository()
-        self.whatsapp=WhatsAppService()
+        self.cita_repo=shared(CitaRepository)
+        self.whatsapp=shared(WhatsAppService)
 
     @staticmethod
     def _run_async(coro):
@@ -104,7 +105,7 @@ class CitasService:
                 # Si tenemos paciente_id, buscar por paciente_id, sino por usuario_whatsapp
                 if paciente_id:
                     from database.models import CitaRepository
-                    cita_repo_temp = CitaRepository()
+                    cita_repo_temp = shared(CitaRepository)
                     cita = cita_repo_temp.obtener_cita_por_id(paciente_id, cita_id)
                 else:
                     cita = self.cita_repo.obtener_cita(usuario_whatsapp, cita_id)
@@ -8,8 +8,14 @@ from services.ml_service import MLService
 from services.actions_service import ActionsService
 from services.payment_service import PaymentService
 from services.language_service import language_service
-from typing import Dict, Optional
+from services.knowledge_index import knowledge_index
+from services.tracing import tracer, span
+from utils.logging_config import get_logger
+from typing import Callable, Dict, Optional
 from datetime import datetime
+from services.registry import shared
+
+logger = get_logger(__name__)
 
 class ConversationManager:
     """
@@ -18,7 +24,7 @@ class ConversationManager:
     
     def __init__(self):
         self.ml_service = MLService()
-        self.actions_service = ActionsService()
+        self.actions_service = shared(ActionsService)
         self.payment_service = PaymentService()
         self.menu_system = MenuSystem()
         self.conversations = {}  # Almacena el contexto de cada conversación
@@ -56,29 +62,40 @@ class ConversationManager:
     def process_message(self, session_id: str, message: str, 
                        user_id: str = None, phone: str = None,
                        user_name: str = None, mode: str = 'hybrid',
-                       context_extras: Dict = None) -> Dict:
+                       context_extras: Dict = None,
+                       stream_callback: Callable[[str], None] = None) -> Dict:
         """
         Procesa mensajes usando un enfoque HÍBRIDO inteligente:
         1. Si el usuario está en un flujo específico (ej: agendando), sigue el flujo.
         2. Si el mensaje es un número, lo trata como opción de menú.
         3. Si es texto natural, usa IA para entender intención/problema.
+        
+        Cada etapa se mide con span() dentro de la traza de la solicitud (services.tracing).
         """
+        with tracer.trace('process_message', profile=tracer.profile_requested()):
+            return self._process_message(session_id, message, user_id, phone, user_name,
+                                         mode, context_extras, stream_callback)
+    
+    def _process_message(self, session_id: str, message: str, user_id: str, phone: str,
+                         user_name: str, mode: str, context_extras: Optional[Dict],
+                         stream_callback: Optional[Callable[[str], None]]) -> Dict:
         # Obtener contexto
         context = self.get_conversation_context(session_id)
         current_step = context.get('step', 'inicial')
         
-        print(f"[CONVERSATION_MANAGER] process_message - session_id={session_id}, msg='{message}', step={current_step}, mode={mode}")
+        logger.debug("[CONVERSATION_MANAGER] process_message - session_id=%s, msg='%s', step=%s, mode=%s", session_id, message, current_step, mode)
         
         # Actualizar datos del usuario
         if user_id or phone:
             from services.actions_service import ActionsService
             # Solo instanciar si no existe para ahorrar recursos
             if not hasattr(self, 'actions_service'):
-                self.actions_service = ActionsService()
+                self.actions_service = shared(ActionsService)
             
             # Actualizar datos si es necesario (no en cada mensaje para optimizar)
             if not context.get('user_data'):
-                user_data = self.actions_service.get_user_info(user_id=user_id, phone=phone)
+                with span('stage.user_lookup'):
+                    user_data = self.actions_service.get_user_info(user_id=user_id, phone=phone)
                 if user_data:
                     context['user_data'] = user_data
                     # Update language from user preferences
@@ -96,10 +113,11 @@ class ConversationManager:
         if context_extras:
             context.update(context_extras)
             if '[MEDIA_RECEIVED]' in message:
-                print(f"[CONVERSATION_MANAGER] Multimedia detectada: {context_extras.get('media_url')}")
+                logger.debug('[CONVERSATION_MANAGER] Multimedia detectada: %s', context_extras.get('media_url'))
                 # Si estamos pagando, asumir que es comprobante
                 if context.get('intent') == 'confirmar_pago' or 'pago' in message.lower():
-                     return self._handle_confirm_payment(session_id, {}, context, user_id, phone)
+                    with span('stage.multimedia'):
+                        return self._handle_confirm_payment(session_id, {}, context, user_id, phone)
                 
                 # Respuesta genérica para imágenes
                 return {
@@ -112,13 +130,15 @@ class ConversationManager:
         
         # 1. Si es un comando de sistema, procesarlo siempre
         if message.lower().strip() in ['menu', 'menú', 'salir', 'cancelar', 'inicio']:
-             result = self.menu_system.process_message(session_id, message, context, user_id, phone)
+             with span('stage.system_command'):
+                 result = self.menu_system.process_message(session_id, message, context, user_id, phone)
              self._update_context_and_history(session_id, result)
              return result
 
         # 1.1 J.RF12: Keyword-based quick responses
         # Check for predefined keywords that trigger helpful responses
-        keyword_result = self._handle_keyword_response(message, context, user_id, phone)
+        with span('stage.keywords'):
+            keyword_result = self._handle_keyword_response(message, context, user_id, phone)
         if keyword_result:
             self._update_context_and_history(session_id, keyword_result)
             return keyword_result
@@ -129,11 +149,13 @@ class ConversationManager:
         if not user_id and context.get('step') != 'registro_nombre':
             # Verificar si ya le pedimos el nombre
             if not context.get('registro_iniciado'):
-                print(f"[CONVERSATION_MANAGER] Usuario nuevo detectado (sin ID). Iniciando flujo de registro.")
+                logger.debug('[CONVERSATION_MANAGER] Usuario nuevo detectado (sin ID). Iniciando flujo de registro.')
+                with span('stage.new_user_intent'):
+                    intent_pendiente = self.ml_service.classify_intent(message, context)['intent']
                 self.update_conversation_context(session_id, {
                     'step': 'registro_nombre',
                     'registro_iniciado': True,
-                    'last_intent_pending': self.ml_service.classify_intent(message, context)['intent'] # Guardar intención original
+                    'last_intent_pending': intent_pendiente # Guardar intención original
                 })
                 language = context.get('language', 'es')
                 return {
@@ -154,8 +176,9 @@ class ConversationManager:
                 }
             
             # Registrar usuario
-            print(f"[CONVERSATION_MANAGER] Registrando usuario: {nombre}, {phone}")
-            nuevo_usuario = self.actions_service.quick_register_user(phone, nombre)
+            logger.debug('[CONVERSATION_MANAGER] Registrando usuario: %s, %s', nombre, phone)
+            with span('stage.registration'):
+                nuevo_usuario = self.actions_service.quick_register_user(phone, nombre)
             
             if nuevo_usuario:
                 # Actualizar contexto con nuevo ID
@@ -178,7 +201,7 @@ class ConversationManager:
                         'next_step': 'inicial'
                     }
                 except Exception as e:
-                    print(f"Error procesando nuevo usuario: {e}")
+                    logger.error('Error procesando nuevo usuario: %s', e)
             
             return {
                 'response': language_service.t('register_error', language),
@@ -197,7 +220,8 @@ class ConversationManager:
         if current_step in steps_requiring_input:
             # Intentar procesar con sistema de menús primero
             # Si el sistema de menús dice "opción inválida" y es texto largo, quizás es una duda
-            result = self.menu_system.process_message(session_id, message, context, user_id, phone)
+            with span('stage.flow_input', step=current_step):
+                result = self.menu_system.process_message(session_id, message, context, user_id, phone)
             
             # Si el resultado es válido o avanza el paso, usarlo
             if result.get('next_step') != current_step or (result.get('action') and result.get('action') != 'error'):
@@ -207,7 +231,7 @@ class ConversationManager:
             # Si el menú no lo entendió (ej: usuario preguntó algo en medio del flujo),
             # y es texto natural, dejar que el Agente IA intente ayudar
             if len(message) > 4 and not message.strip().isdigit():
-                print(f"Input no reconocido en flujo {current_step}, intentando con Agente IA...")
+                logger.debug('Input no reconocido en flujo %s, intentando con Agente IA...', current_step)
                 pass # Caer al bloque de Agente
             else:
                 self._update_context_and_history(session_id, result)
@@ -215,13 +239,16 @@ class ConversationManager:
 
         # 3. Si el mensaje es NUMÉRICO, priorizar menú (navegación rápida)
         if message.strip().isdigit():
-             result = self.menu_system.process_message(session_id, message, context, user_id, phone)
+             with span('stage.numeric', step=current_step):
+                 result = self.menu_system.process_message(session_id, message, context, user_id, phone)
              self._update_context_and_history(session_id, result)
              return result
 
         # 4. Para todo lo demás (texto natural, dudas, problemas), usar MODO AGENTE (IA)
-        print("Usando MODO AGENTE para procesamiento de lenguaje natural")
-        result = self._process_agent_mode(session_id, message, context, user_id, phone)
+        logger.debug('Usando MODO AGENTE para procesamiento de lenguaje natural')
+        with span('stage.agent'):
+            result = self._process_agent_mode(session_id, message, context, user_id, phone,
+                                              stream_callback=stream_callback)
         
         self._update_context_and_history(session_id, result)
         return result
@@ -317,7 +344,7 @@ class ConversationManager:
             return None
         
         # Generate response based on type
-        print(f"[KEYWORD_HANDLER] Matched keyword type: {matched_type}")
+        logger.debug('[KEYWORD_HANDLER] Matched keyword type: %s', matched_type)
         
         if matched_type == 'help':
             greeting = f"Hola {user_name}, " if user_name else "Hola, "
@@ -596,7 +623,7 @@ Escribe *"menu"* para volver al menú principal."""
         # Si detecta una intención clara de agendar/reagendar/cancelar/ver citas, procesarla
         # Aunque esté en modo menú, si el usuario habla naturalmente, ayudarlo
         if intent in ['agendar_cita', 'reagendar_cita', 'cancelar_cita', 'ver_citas'] and confidence > 0.6:
-            print(f"Modo menú detectó intención clara: {intent} (confianza: {confidence})")
+            logger.debug('Modo menú detectó intención clara: %s (confianza: %s)', intent, confidence)
             entities = self.ml_service.extract_entities(message, intent, context)
             response_data = self._handle_intent(session_id, intent, entities, context)
             if response_data.get('response'):
@@ -620,8 +647,13 @@ Escribe *"menu"* para volver al menú principal."""
         }
     
     def _process_agent_mode(self, session_id: str, message: str, context: Dict,
-                           user_id: str, phone: str) -> Dict:
-        """Procesa mensajes en modo agente (ML completo)"""
+                           user_id: str, phone: str,
+                           stream_callback: Callable[[str], None] = None) -> Dict:
+        """
+        Procesa mensajes en modo agente (ML completo)
+        stream_callback solo se usa cuando la respuesta generada por IA se envía tal cual;
+        si puede ser reemplazada por la respuesta de un flujo, se genera completa.
+        """
         # Clasificar intención usando ML completo
         intent_result = self.ml_service.classify_intent(message, context)
         intent = intent_result['intent']
@@ -650,7 +682,7 @@ Escribe *"menu"* para volver al menú principal."""
         
         # Robustez: Si la confianza es muy baja, ofrecer menú o ayuda
         elif confidence < 0.4:
-            print(f"Confianza baja ({confidence}) para intent '{intent}'. Ofreciendo menú.")
+            logger.debug("Confianza baja (%s) para intent '%s'. Ofreciendo menú.", confidence, intent)
             language = context.get('language', 'es')
             return {
                 'response': f"{language_service.t('ai_confidence_low', language)}\n\n{self.menu_system.get_main_menu(language)}",
@@ -660,13 +692,23 @@ Escribe *"menu"* para volver al menú principal."""
             }
             
         else:
+            # Si la intención es agendar/reagendar/cancelar, la respuesta de IA compite con la del flujo
+            flow_intent = intent in ['agendar_cita', 'reagendar_cita', 'cancelar_cita']
+            
+            # Preguntas informativas: intentar primero con el índice local (sin llamar a OpenAI)
+            response = None
+            if intent in ['consultar_informacion', 'consultar_servicios']:
+                response = knowledge_index.answer(message, language=context.get('language', 'es'))
+            
             # Generar respuesta usando ML mejorado con historial completo
-            response = self.ml_service.generate_response(
-                intent, entities, context, context.get('user_data'), conversation_history
-            )
+            if not response:
+                response = self.ml_service.generate_response(
+                    intent, entities, context, context.get('user_data'), conversation_history,
+                    stream_callback=None if flow_intent else stream_callback
+                )
             
             # Si la intención es agendar/reagendar/cancelar pero no es clara, intentar procesarla
-            if intent in ['agendar_cita', 'reagendar_cita', 'cancelar_cita']:
+            if flow_intent:
                 response_data = self._handle_intent(session_id, intent, entities, context)
                 # Mejorar respuesta con IA
                 if response and len(response) > len(response_data.get('response', '')):
@@ -904,7 +946,7 @@ Soy Densorita, tu asistente virtual. Puedo ayudarte a:
         question = entities.get('motivo', '')
         if question:
             # Intentar responder la pregunta específica
-            answer = self.ml_service.answer_question(question)
+            answer = self.ml_service.answer_question(question, language=context.get('language', 'es'))
             response = answer
         else:
             user_data = context.get('user_data', {})
@@ -945,13 +987,13 @@ Soy Densorita, tu asistente virtual. Puedo ayudarte a:
                 # Si es fecha relativa, convertirla
                 if fecha_lower in ['mañana', 'tomorrow']:
                     fecha = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
-                    print(f"Fecha relativa convertida: 'mañana' -> {fecha}")
+                    logger.debug("Fecha relativa convertida: 'mañana' -> %s", fecha)
                 elif fecha_lower in ['pasado mañana', 'day after tomorrow']:
                     fecha = (datetime.now() + timedelta(days=2)).strftime('%Y-%m-%d')
-                    print(f"Fecha relativa convertida: 'pasado mañana' -> {fecha}")
+                    logger.debug("Fecha relativa convertida: 'pasado mañana' -> %s", fecha)
                 elif fecha_lower in ['hoy', 'today']:
                     fecha = datetime.now().strftime('%Y-%m-%d')
-                    print(f"Fecha relativa convertida: 'hoy' -> {fecha}")
+                    logger.debug("Fecha relativa convertida: 'hoy' -> %s", fecha)
                 
                 # Validar formato
                 try:
@@ -966,7 +1008,7 @@ Soy Densorita, tu asistente virtual. Puedo ayudarte a:
 
         # Si el usuario dio fecha Y hora desde el principio, CREAR LA CITA DIRECTAMENTE
         if fecha and hora:
-            print(f"CASO COMPLETO: Tenemos fecha ({fecha}) y hora ({hora}), creando cita directamente...")
+            logger.debug('CASO COMPLETO: Tenemos fecha (%s) y hora (%s), creando cita directamente...', fecha, hora)
             
             # Validar que la hora esté disponible
             horarios_disponibles = self.actions_service.get_available_times(
@@ -1029,7 +1071,7 @@ Soy Densorita, tu asistente virtual. Puedo ayudarte a:
                     payment_info = f"\n\nMétodo de pago: Efectivo (se paga al momento de la cita)"
                 
                 response_text = f"¡Perfecto! Tu cita ha sido agendada exitosamente.\n\nFecha: {fecha}\nHora: {hora}\nDentista: {dentista_usado}\nConsultorio: {consultorio_usado}\nPaciente: {nombre}\nMotivo: {motivo}{payment_info}\n\nTe enviaremos un recordatorio antes de tu cita. ¡Gracias por usar Densora!"
-                print(f"Cita creada exitosamente, retornando respuesta: {response_text[:100]}...")
+                logger.debug('Cita creada exitosamente, retornando respuesta: %s...', response_text[:100])
                 return {
                     'response': response_text,
                     'action': 'appointment_created',
@@ -1037,7 +1079,7 @@ Soy Densorita, tu asistente virtual. Puedo ayudarte a:
                 }
             else:
                 error_msg = result.get('error', 'Error desconocido')
-                print(f"Error creando cita: {error_msg}")
+                logger.error('Error creando cita: %s', error_msg)
                 return {
                     'response': f"Lo siento, no pude agendar tu cita: {error_msg}\n\nPor favor intenta nuevamente.",
                     'action': None,
@@ -1046,7 +1088,7 @@ Soy Densorita, tu asistente virtual. Puedo ayudarte a:
 
         # Si tenemos fecha pero no hora, mostrar horarios disponibles
         if fecha and not hora:
-            print(f"CASO PARCIAL: Tenemos fecha ({fecha}) pero no hora, mostrando horarios...")
+            logger.debug('CASO PARCIAL: Tenemos fecha (%s) pero no hora, mostrando horarios...', fecha)
             
             self.update_conversation_context(session_id, {
                 'step': 'selecionando_hora',
@@ -1490,9 +1532,7 @@ Tu confirmación fue recibida. El consultorio verificará tu pago y te notificar
             }
             
         except Exception as e:
-            print(f"Error en _handle_confirm_payment: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception('Error en _handle_confirm_payment: %s', e)
             return {
                 'response': "Hubo un error al procesar tu confirmación. Por favor contacta directamente con el consultorio.",
                 'action': None,
@@ -1562,9 +1602,7 @@ Tu confirmación fue recibida. El consultorio verificará tu pago y te notificar
             }
             
         except Exception as e:
-            print(f"Error en _handle_check_payment_time: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception('Error en _handle_check_payment_time: %s', e)
             return {
                 'response': "Hubo un error al consultar el tiempo restante. Por favor intenta nuevamente.",
                 'action': None,
@@ -1778,7 +1816,7 @@ Los precios varían según el tratamiento. Para obtener un presupuesto exacto, a
             }
             
         except Exception as e:
-            print(f"Error en _handle_appointment_history: {e}")
+            logger.error('Error en _handle_appointment_history: %s', e)
             return {
                 'response': "Hubo un error al consultar tu historial. Por favor intenta nuevamente.",
                 'action': None,
@@ -1836,7 +1874,7 @@ Los precios varían según el tratamiento. Para obtener un presupuesto exacto, a
                 }
 
         except Exception as e:
-            print(f"Error en _handle_confirm_payment: {e}")
+            logger.error('Error en _handle_confirm_payment: %s', e)
             return {
                 'response': "Lo siento, ocurrió un error procesando tu solicitud. Por favor contacta al consultorio.",
                 'action': 'error',
@@ -1929,7 +1967,7 @@ Los precios varían según el tratamiento. Para obtener un presupuesto exacto, a
             }
             
         except Exception as e:
-            print(f"Error en _handle_check_payment_time: {e}")
+            logger.error('Error en _handle_check_payment_time: %s', e)
             return {
                 'response': "Lo siento, hubo un error al consultar el tiempo de pago. Por favor intenta nuevamente.",
                 'action': None,
@@ -1988,7 +2026,7 @@ Los precios varían según el tratamiento. Para obtener un presupuesto exacto, a
             }
             
         except Exception as e:
-            print(f"Error en _handle_services_info: {e}")
+            logger.error('Error en _handle_services_info: %s', e)
             return {
                 'response': "Servicios de Densora\n\nEn Densora ofrecemos:\n• Limpieza dental\n• Ortodoncia\n• Estética dental\n• Endodoncia\n• Implantes\n• Odontopediatría\n• Y más...\n\n¿Te gustaría agendar una cita? Escribe 'agendar cita'.",
                 'action': None,
@@ -2085,7 +2123,7 @@ Los precios varían según el tratamiento. Para obtener un presupuesto exacto, a
             }
             
         except Exception as e:
-            print(f"Error en _handle_appointment_history: {e}")
+            logger.error('Error en _handle_appointment_history: %s', e)
             return {
                 'response': "Lo siento, hubo un error al consultar tu historial. Por favor intenta nuevamente.",
                 'action': None,
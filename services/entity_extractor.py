@@ -0,0 +1,238 @@
+"""
+EXTRACTOR DE ENTIDADES POR REGLAS
+Patrones compilados una sola vez a nivel de módulo y un único recorrido del mensaje
+que emite candidatos de fecha, hora, dentista, número de cita y motivo a la vez.
+Es el fallback de MLService.extract_entities cuando la IA no está disponible.
+"""
+
+import re
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+# Fechas relativas -> desplazamiento en días
+_FECHAS_RELATIVAS = {
+    'pasado mañana': 2,
+    'day after tomorrow': 2,
+    'mañana': 1,
+    'tomorrow': 1,
+    'hoy': 0,
+    'today': 0,
+}
+
+# Días de la semana (con y sin acentos) -> weekday()
+_DIAS_SEMANA = {
+    'lunes': 0, 'martes': 1, 'miércoles': 2, 'miercoles': 2,
+    'jueves': 3, 'viernes': 4, 'sábado': 5, 'sabado': 5, 'domingo': 6
+}
+
+_CITA_ORDINALES = {'primera': 1, 'segunda': 2, 'tercera': 3}
+
+# "cita 2" > "la 2da cita" > "primera cita"
+_CITA_PRIORIDAD = {'cita': 0, 'cita_ord': 1, 'cita_pal': 2}
+
+# Orden de prioridad de las palabras clave de motivo (igual que la versión anterior)
+_MOTIVO_PRIORIDAD = {
+    'por': 0, 'para': 1, 'motivo': 2, 'razón': 3, 'razon': 3,
+    'necesito': 4, 'quiero': 5, 'porque': 6, 'por qué': 7, 'por que': 7
+}
+
+_TITULO = r'(?:doctora|doctor|dra|dr)\.?'
+
+# Un solo patrón con grupos nombrados; finditer recorre el mensaje una vez.
+# El \b inicial descarta rápido las posiciones a mitad de palabra.
+# El orden de las alternativas importa cuando dos empiezan en la misma posición.
+_TOKEN_RE = re.compile(
+    r"""
+    \b(?:
+      (?P<cita>cita\s*(?P<cita_n>\d+)(?![/:\-\d]))
+    | (?P<cita_ord>la\s*(?P<cita_ord_n>\d+)[a-z]*\s*cita\b)
+    | (?P<cita_pal>(?P<cita_pal_w>primera|segunda|tercera)\s*cita\b)
+    | (?P<doc>""" + _TITULO + r"""\s+(?P<doc_n>[a-záéíóúñ]+))
+    | (?P<con>con\s+(?:(?:el|la)\s+)?(?:""" + _TITULO + r"""\s*)?(?P<con_n>[a-záéíóúñ]+))
+    | (?P<rel>pasado\s+mañana\b|day\s+after\s+tomorrow\b
+             |(?<!por\sla\s)(?<!en\sla\s)mañana\b|tomorrow\b|hoy\b|today\b)
+    | (?P<dia>(?:lunes|martes|mi[eé]rcoles|jueves|viernes|s[aá]bado|domingo)\b)
+    | (?P<dmy>(?P<dmy_d>\d{1,2})(?P<dmy_sep>[/-])(?P<dmy_m>\d{1,2})(?:(?P=dmy_sep)(?P<dmy_y>\d{2,4}))?\b)
+    | (?P<hora>(?P<hora_alas>a\s+las\s+)?(?P<hora_h>\d{1,2})(?::(?P<hora_min>\d{2}))?
+             (?:\s*(?P<hora_ampm>am|pm)\b
+               |\s*de\s+la\s+(?P<hora_parte>mañana|tarde|noche)\b
+               |\s*(?P<hora_hrs>horas?)\b)?)
+    | (?P<motivo>(?:por\s+qu[eé]|porque|por|para|motivo|raz[oó]n|necesito|quiero)\b)
+    )
+    """,
+    re.VERBOSE
+)
+
+# Normalización de horas que devuelve la IA ("10am", "3 de la tarde", "15")
+_HORA_TEXTO_RE = re.compile(r'(\d{1,2})\s*(am|pm|de la mañana|de la tarde|de la noche)')
+_DIGITOS_RE = re.compile(r'(\d{1,2})')
+
+
+def _hora_24(hora: int, periodo: Optional[str]) -> int:
+    """Convierte una hora de 12h a 24h según el periodo (am/pm/mañana/tarde/noche)"""
+    if not periodo:
+        return hora
+    if periodo in ('pm', 'tarde', 'noche') or periodo.endswith(('tarde', 'noche')):
+        if hora < 12:
+            hora += 12
+    elif periodo == 'am' and hora == 12:
+        hora = 0
+    return hora
+
+
+class EntityExtractor:
+    """
+    Extracción de entidades por reglas en un único recorrido del mensaje
+    """
+
+    def extract(self, message: str, now: datetime = None) -> Dict:
+        """
+        Extrae fecha, hora, nombre de dentista, número de cita y motivo.
+        Devuelve un dict con las mismas claves que MLService.extract_entities.
+        """
+        entities = {
+            'fecha': None,
+            'hora': None,
+            'nombre_dentista': None,
+            'motivo': None,
+            'numero_cita': None,
+            'consultorio': None
+        }
+        if not message:
+            return entities
+
+        now = now or datetime.now()
+        message_lower = message.lower()
+        # lower() puede cambiar la longitud con algunos caracteres Unicode
+        original = message if len(message) == len(message_lower) else message_lower
+
+        fecha_rel = dia = dmy = None
+        doc = con = None
+        cita: Optional[Tuple[int, int]] = None
+        mejor_hora: Optional[Tuple[int, int, int]] = None  # (prioridad, hora, minutos)
+        motivos: List[Tuple[int, int]] = []  # (prioridad, fin del keyword)
+
+        for match in _TOKEN_RE.finditer(message_lower):
+            kind = match.lastgroup
+            if kind == 'hora':
+                candidato = self._hora_candidata(match)
+                if candidato and (mejor_hora is None or candidato[0] < mejor_hora[0]):
+                    mejor_hora = candidato
+            elif kind == 'rel':
+                if fecha_rel is None:
+                    fecha_rel = _FECHAS_RELATIVAS[' '.join(match.group('rel').split())]
+            elif kind == 'dia':
+                if dia is None:
+                    dia = _DIAS_SEMANA[match.group('dia')]
+            elif kind == 'dmy':
+                if dmy is None:
+                    dmy = self._fecha_numerica(match, now)
+            elif kind == 'doc':
+                if doc is None:
+                    doc = match.group('doc_n')
+            elif kind == 'con':
+                if con is None:
+                    con = match.group('con_n')
+            elif kind in _CITA_PRIORIDAD:
+                if cita is None or _CITA_PRIORIDAD[kind] < cita[0]:
+                    cita = (_CITA_PRIORIDAD[kind], self._numero_cita(match, kind))
+            elif kind == 'motivo':
+                keyword = ' '.join(match.group('motivo').split())
+                motivos.append((_MOTIVO_PRIORIDAD[keyword], match.end()))
+
+        # Resolver candidatos con la misma prioridad que la versión anterior:
+        # relativa > día de la semana > DD/MM
+        if fecha_rel is not None:
+            entities['fecha'] = (now + timedelta(days=fecha_rel)).strftime('%Y-%m-%d')
+        elif dia is not None:
+            days_ahead = dia - now.weekday()
+            if days_ahead <= 0:  # Si el día ya pasó esta semana, usar la próxima
+                days_ahead += 7
+            entities['fecha'] = (now + timedelta(days=days_ahead)).strftime('%Y-%m-%d')
+        elif dmy:
+            entities['fecha'] = dmy
+
+        if mejor_hora:
+            entities['hora'] = f"{mejor_hora[1]:02d}:{mejor_hora[2]:02d}"
+
+        nombre = doc or con
+        if nombre:
+            entities['nombre_dentista'] = nombre.title()
+
+        if cita:
+            entities['numero_cita'] = cita[1]
+
+        for _, fin in sorted(motivos):
+            motivo_text = original[fin:].strip()
+            if len(motivo_text) > 5:  # Al menos 5 caracteres
+                entities['motivo'] = motivo_text[:200]  # Limitar a 200 caracteres
+                break
+
+        return entities
+
+    def parse_hora(self, hora: str) -> Optional[str]:
+        """Normaliza una hora en texto libre ("10am", "3 de la tarde") a HH:MM"""
+        if not hora:
+            return None
+        if ':' in hora:
+            return hora
+        hora_lower = hora.lower()
+        match = _HORA_TEXTO_RE.search(hora_lower)
+        if match:
+            return f"{_hora_24(int(match.group(1)), match.group(2)):02d}:00"
+        match = _DIGITOS_RE.search(hora_lower)
+        if match:
+            return f"{int(match.group(1)):02d}:00"
+        return None
+
+    @staticmethod
+    def _hora_candidata(match) -> Optional[Tuple[int, int, int]]:
+        """Devuelve (prioridad, hora, minutos) o None si el número no es una hora"""
+        hora = int(match.group('hora_h'))
+        minutos = match.group('hora_min')
+        ampm = match.group('hora_ampm')
+        parte = match.group('hora_parte')
+
+        # Prioridad: HH:MM > "a las N" > Nam/pm > "N de la tarde" > "N horas"
+        if minutos is not None:
+            prioridad = 0
+        elif match.group('hora_alas'):
+            prioridad = 1
+        elif ampm:
+            prioridad = 2
+        elif parte:
+            prioridad = 3
+        elif match.group('hora_hrs'):
+            prioridad = 4
+        else:
+            return None  # Número suelto, no es una hora
+
+        hora = _hora_24(hora, ampm or parte)
+        minutos = int(minutos or 0)
+        if hora > 23 or minutos > 59:
+            return None
+        return prioridad, hora, minutos
+
+    @staticmethod
+    def _fecha_numerica(match, now: datetime) -> Optional[str]:
+        """Convierte DD/MM[/YYYY] o DD-MM[-YYYY] a YYYY-MM-DD"""
+        year = match.group('dmy_y')
+        year = int(year) if year else now.year
+        if year < 100:
+            year += 2000
+        try:
+            return datetime(year, int(match.group('dmy_m')), int(match.group('dmy_d'))).strftime('%Y-%m-%d')
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _numero_cita(match, kind: str) -> int:
+        if kind == 'cita':
+            return int(match.group('cita_n'))
+        if kind == 'cita_ord':
+            return int(match.group('cita_ord_n'))
+        return _CITA_ORDINALES[match.group('cita_pal_w')]
+
+
+# Instancia global
+entity_extractor = EntityExtractor()
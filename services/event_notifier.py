@@ -17,6 +17,7 @@ from database.database import FirebaseConfig
 from datetime import datetime
 from typing import Dict, Optional
 import pytz
+from services.registry import lazy_service, shared
 
 class EventNotifier:
     """
@@ -25,9 +26,9 @@ class EventNotifier:
     """
     
     def __init__(self):
-        self.whatsapp = WhatsAppService()
-        self.paciente_repo = PacienteRepository()
-        self.cita_repo = CitaRepository()
+        self.whatsapp = shared(WhatsAppService)
+        self.paciente_repo = shared(PacienteRepository)
+        self.cita_repo = shared(CitaRepository)
         self.db = FirebaseConfig.get_db()
         self.timezone = pytz.timezone('America/Mexico_City')
     
@@ -529,5 +530,5 @@ Tu cita ha sido reasignada a otro profesional:
             return None
 
 # Instancia global
-event_notifier = EventNotifier()
+event_notifier = lazy_service('event_notifier', EventNotifier)
 
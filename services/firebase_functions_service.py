@@ -8,7 +8,9 @@ import os
 from typing import Dict, List, Optional
 from datetime import datetime
 from database.database import FirebaseConfig
+from database import cita_writes, slots
 from utils.phone_utils import normalize_phone_for_database
+from services.tracing import traced
 
 class FirebaseFunctionsService:
     """
@@ -23,6 +25,7 @@ class FirebaseFunctionsService:
         # Para llamadas directas a Firestore, usamos Admin SDK
         self.use_direct_firestore = True  # Preferir acceso directo a Firestore
     
+    @traced('firestore.get_user_appointments')
     def get_user_appointments(self, user_id: str = None, phone: str = None, 
                              status: str = 'confirmado') -> List[Dict]:
         """
@@ -456,22 +459,11 @@ class FirebaseFunctionsService:
                 'updatedAt': datetime.now()
             }
             
-            # Crear en subcolección (misma estructura que la web)
-            citas_ref = self.db.collection('pacientes').document(user_id).collection('citas')
-            doc_ref = citas_ref.add(cita_data)
-            cita_id = doc_ref[1].id
-            
-            # También crear en colección principal para compatibilidad
-            try:
-                citas_principal_ref = self.db.collection('citas')
-                cita_principal_data = {
-                    **cita_data,
-                    'id': cita_id,
-                    'pacienteCitaId': cita_id
-                }
-                citas_principal_ref.add(cita_principal_data)
-            except Exception as e:
-                print(f"Error creando cita en colección principal (continuando): {e}")
+            # Subcolección (misma estructura que la web) y colección principal, mismo ID,
+            # en la misma transacción que reserva el horario del dentista
+            cita_id = cita_writes.nuevo_cita_id(self.db, user_id)
+            if not slots.reservar_cita(self.db, dentista_id, fecha_hora, user_id, cita_id, cita_data):
+                return {'success': False, 'error': 'El horario seleccionado ya no está disponible'}
             
             return {
                 'success': True,
@@ -508,28 +500,14 @@ class FirebaseFunctionsService:
             hora_parts = nueva_hora.split(':')
             nueva_fecha_hora = nueva_fecha.replace(hour=int(hora_parts[0]), minute=int(hora_parts[1]))
             
-            # Actualizar cita - Firebase Admin SDK accepts datetime directly
-            cita_ref.update({
+            # Reservar el horario nuevo y actualizar ambas copias en una sola transacción
+            if not slots.reagendar_cita(self.db, user_id, cita_id, nueva_fecha_hora, {
                 'fechaHora': nueva_fecha_hora,
                 'appointmentDate': nueva_fecha.strftime('%Y-%m-%d'),
                 'appointmentTime': nueva_hora,
                 'updatedAt': datetime.now()
-            })
-            
-            # También actualizar en colección principal si existe
-            try:
-                citas_principal_ref = self.db.collection('citas')
-                query = citas_principal_ref.where('pacienteCitaId', '==', cita_id).limit(1)
-                docs = list(query.stream())
-                if docs:
-                    docs[0].reference.update({
-                        'fechaHora': nueva_fecha_hora,
-                        'appointmentDate': nueva_fecha.strftime('%Y-%m-%d'),
-                        'appointmentTime': nueva_hora,
-                        'updatedAt': datetime.now()
-                    })
-            except Exception as e:
-                print(f"Error actualizando cita en colección principal (continuando): {e}")
+            }):
+                return {'success': False, 'error': 'El horario ya no está disponible'}
             
             return {'success': True, 'message': 'Cita reagendada exitosamente'}
             
@@ -560,8 +538,8 @@ class FirebaseFunctionsService:
             if cita_data.get('estado') == 'completada':
                 return {'success': False, 'error': 'No se puede cancelar una cita completada'}
             
-            # Actualizar estado a cancelada - Firebase Admin SDK accepts datetime directly
-            cita_ref.update({
+            # Estado cancelada en subcolección y colección principal - Firebase Admin SDK accepts datetime directly
+            cita_writes.actualizar_cita(self.db, user_id, cita_id, {
                 'estado': 'cancelada',
                 'status': 'cancelada',
                 'cancelacion': {
@@ -570,26 +548,7 @@ class FirebaseFunctionsService:
                     'fecha': datetime.now()
                 },
                 'updatedAt': datetime.now()
-            })
-            
-            # También actualizar en colección principal si existe
-            try:
-                citas_principal_ref = self.db.collection('citas')
-                query = citas_principal_ref.where('pacienteCitaId', '==', cita_id).limit(1)
-                docs = list(query.stream())
-                if docs:
-                    docs[0].reference.update({
-                        'estado': 'cancelada',
-                        'status': 'cancelada',
-                        'cancelacion': {
-                            'motivo': 'Cancelado por el paciente',
-                            'canceladoPor': 'paciente',
-                            'fecha': datetime.now()
-                        },
-                        'updatedAt': datetime.now()
-                    })
-            except Exception as e:
-                print(f"Error actualizando cita en colección principal (continuando): {e}")
+            }, tipo='cancelled')
             
             return {'success': True, 'message': 'Cita cancelada exitosamente'}
             
@@ -599,11 +558,15 @@ class FirebaseFunctionsService:
             traceback.print_exc()
             return {'success': False, 'error': str(e)}
 
-    def get_medical_history(self, user_id: str = None, phone: str = None) -> Dict:
+    @traced('firestore.get_medical_history')
+    def get_medical_history_view(self, user_id: str = None, phone: str = None) -> Dict:
         """
-        Obtiene el historial médico del paciente para mostrar en el chat
-        Lee desde historialMedico/current subcollection (igual que la web)
-        y desencripta los datos si están encriptados
+        Obtiene el historial médico como vista perezosa (MedicalHistoryView)
+        Lee desde historialMedico (igual que la web); los campos cifrados se
+        desencriptan solo cuando la pestaña que se muestra los usa
+        
+        Returns:
+            {'success': True, 'view': MedicalHistoryView} o {'success': False, 'error': str}
         """
         try:
             # Obtener paciente
@@ -673,137 +636,10 @@ class FirebaseFunctionsService:
                 import traceback
                 traceback.print_exc()
             
-            # 2. DESENCRIPTAR si los datos están encriptados
-            #    NOTA: Corregido bug de precedencia de operadores
-            if historial_data and (historial_data.get('_encrypted') or historial_data.get('encryptionEnabled')):
-                try:
-                    from utils.encryption import decrypt_medical_history
-                    print(f"[get_medical_history] Desencriptando historial médico...")
-                    print(f"[get_medical_history] Datos antes de desencriptar: alergias={type(historial_data.get('alergias'))}")
-                    historial_data = decrypt_medical_history(historial_data, paciente_id)
-                    print(f"[get_medical_history] Historial desencriptado exitosamente")
-                    print(f"[get_medical_history] Datos después: alergias={historial_data.get('alergias')}")
-                except ImportError as ie:
-                    print(f"[get_medical_history] Módulo de encryption no disponible: {ie}")
-                except Exception as e:
-                    print(f"[get_medical_history] Error desencriptando: {e}")
-                    import traceback
-                    traceback.print_exc()
-            
-            # 3. Construir nombre completo de diferentes formas posibles
-            nombre = (
-                historial_data.get('nombre') or
-                historial_data.get('nombreCompleto') or
-                paciente_data.get('nombreCompleto') or 
-                f"{paciente_data.get('nombres', paciente_data.get('nombre', ''))} {paciente_data.get('apellidos', paciente_data.get('apellido', ''))}".strip() or
-                'No registrado'
-            )
-            
-            # Combinar apellido si existe
-            apellido = historial_data.get('apellido') or paciente_data.get('apellidos', paciente_data.get('apellido', ''))
-            if apellido and not nombre.endswith(apellido):
-                nombre_completo = f"{nombre} {apellido}".strip()
-            else:
-                nombre_completo = nombre
-            
-            # 4. Extraer datos médicos - priorizar historialMedico sobre paciente_data
-            # Alergias
-            alergias = (
-                historial_data.get('alergias') or 
-                paciente_data.get('alergias') or 
-                []
-            )
-            if isinstance(alergias, str):
-                alergias = [alergias] if alergias.strip() else []
-            
-            # Medicamentos (la web usa 'medicamentosActuales')
-            medicamentos = (
-                historial_data.get('medicamentosActuales') or
-                historial_data.get('medicacionActual') or
-                historial_data.get('medicamentos') or
-                paciente_data.get('medicamentos') or
-                []
-            )
-            if isinstance(medicamentos, str):
-                medicamentos = [medicamentos] if medicamentos.strip() else []
-            
-            # Enfermedades crónicas (la web usa 'condicionesMedicas' y 'enfermedadesGeneticas')
-            enfermedades = (
-                historial_data.get('condicionesMedicas') or
-                historial_data.get('enfermedadesCronicas') or
-                historial_data.get('enfermedadesGeneticas') or
-                paciente_data.get('enfermedadesCronicas') or
-                []
-            )
-            if isinstance(enfermedades, str):
-                enfermedades = [enfermedades] if enfermedades.strip() else []
-            
-            # 5. Calcular completitud usando mismos campos que la web
-            #    Campos de la web: nombre, apellido, edad, sexo, telefono, contactoEmergencia, direccion,
-            #                      alergias, medicamentosActuales, condicionesMedicas, grupoSanguineo, etc.
-            campos_evaluados = [
-                historial_data.get('nombre') or paciente_data.get('nombre') or paciente_data.get('nombres'),
-                historial_data.get('apellido') or paciente_data.get('apellidos') or paciente_data.get('apellido'),
-                historial_data.get('edad') or paciente_data.get('edad'),
-                historial_data.get('sexo') or paciente_data.get('sexo'),
-                historial_data.get('telefono') or paciente_data.get('telefono'),
-                historial_data.get('contactoEmergencia') or paciente_data.get('contactoEmergencia'),
-                historial_data.get('direccion') or paciente_data.get('direccion'),
-                alergias,
-                medicamentos,
-                enfermedades,
-                historial_data.get('grupoSanguineo') or paciente_data.get('grupoSanguineo'),
-                historial_data.get('ultimaCita') or paciente_data.get('ultimaCita'),
-                historial_data.get('observacionesClinicas'),
-                historial_data.get('diagnosticosPrevios'),
-            ]
-            
-            campos_completados = sum(1 for c in campos_evaluados if c)
-            completitud = int((campos_completados / len(campos_evaluados)) * 100)
-            
-            # Si hay valor de completeness guardado en el historial, usarlo
-            if historial_data.get('completeness'):
-                try:
-                    completitud = int(float(historial_data.get('completeness')))
-                except:
-                    pass
-            
-            # 6. Extraer más campos para historia dental
-            motivo_consulta = historial_data.get('motivoConsulta') or historial_data.get('observacionesClinicas') or ''
-            ultima_visita = historial_data.get('ultimaCita') or historial_data.get('ultimaVisitaDentista') or ''
-            dolor_boca = historial_data.get('dolorBoca') or historial_data.get('dolor') or ''
-            sangrado_encias = historial_data.get('sangradoEncias') or historial_data.get('sangrado') or ''
-            
+            from services.medical_history_view import MedicalHistoryView
             return {
                 'success': True,
-                'data': {
-                    'nombre': nombre_completo,
-                    'edad': historial_data.get('edad') or paciente_data.get('edad') or paciente_data.get('fechaNacimiento') or 'No especificada',
-                    'telefono': historial_data.get('telefono') or paciente_data.get('telefono') or 'No registrado',
-                    'email': paciente_data.get('email') or 'No registrado',
-                    'sexo': historial_data.get('sexo') or paciente_data.get('sexo') or '',
-                    'direccion': historial_data.get('direccion') or paciente_data.get('direccion') or '',
-                    'alergias': alergias,
-                    'medicamentos': medicamentos,
-                    'medicamentosActuales': medicamentos,  # Alias para compatibilidad
-                    'enfermedadesCronicas': enfermedades,
-                    'condicionesMedicas': enfermedades,  # Alias para compatibilidad
-                    'grupoSanguineo': historial_data.get('grupoSanguineo') or paciente_data.get('grupoSanguineo') or '',
-                    'antecedentesMedicos': historial_data.get('antecedentesMedicos') or paciente_data.get('antecedentesMedicos') or '',
-                    'contactoEmergencia': historial_data.get('contactoEmergencia') or paciente_data.get('contactoEmergencia') or {},
-                    # Campos de historia dental
-                    'motivoConsulta': motivo_consulta,
-                    'ultimaVisitaDentista': ultima_visita,
-                    'dolorBoca': dolor_boca,
-                    'sangradoEncias': sangrado_encias,
-                    'observacionesClinicas': historial_data.get('observacionesClinicas') or '',
-                    'diagnosticosPrevios': historial_data.get('diagnosticosPrevios') or '',
-                    # Metadata
-                    'historialCompletado': historial_completado,
-                    'completeness': completitud,
-                    'completitud': completitud,  # Alias
-                    'historialExtra': historial_data
-                }
+                'view': MedicalHistoryView(paciente_id, paciente_data, historial_data, historial_completado)
             }
             
         except Exception as e:
@@ -812,6 +648,22 @@ class FirebaseFunctionsService:
             traceback.print_exc()
             return {'success': False, 'error': str(e)}
     
+    def get_medical_history(self, user_id: str = None, phone: str = None) -> Dict:
+        """
+        Obtiene el historial médico completo del paciente para mostrar en el chat
+        (desencripta todos los campos; las pestañas del menú usan get_medical_history_view)
+        """
+        result = self.get_medical_history_view(user_id=user_id, phone=phone)
+        if not result.get('success'):
+            return result
+        try:
+            return {'success': True, 'data': result['view'].to_dict()}
+        except Exception as e:
+            print(f"Error obteniendo historial médico: {e}")
+            import traceback
+            traceback.print_exc()
+            return {'success': False, 'error': str(e)}
+    
     def get_pending_reviews(self, user_id: str = None, phone: str = None) -> List[Dict]:
         """
         Obtiene las citas completadas pendientes de reseña
@@ -843,6 +695,15 @@ class FirebaseFunctionsService:
             citas_completadas = []
             estados_completados = ['completado', 'completada', 'completed', 'finalizada', 'finalizado']
             
+            # Citas ya reseñadas: una consulta collection group en vez de una por cita
+            from database.queries import resenas_de_paciente
+            citas_con_resena = set()
+            try:
+                for resena_doc in resenas_de_paciente(self.db, paciente_id):
+                    citas_con_resena.add((resena_doc.to_dict() or {}).get('citaId'))
+            except Exception as e:
+                print(f"[get_pending_reviews] Error consultando reseñas: {e}")
+            
             for doc in query.stream():
                 data = doc.to_dict()
                 cita_id = doc.id
@@ -855,15 +716,7 @@ class FirebaseFunctionsService:
                     continue
                 
                 # Verificar si ya tiene reseña
-                tiene_resena = False
-                try:
-                    dentista_id = data.get('dentistaId')
-                    if dentista_id:
-                        resenas_ref = self.db.collection('dentistas').document(dentista_id).collection('resenas')
-                        resena_query = resenas_ref.where('citaId', '==', cita_id).limit(1)
-                        tiene_resena = len(list(resena_query.stream())) > 0
-                except:
-                    pass
+                tiene_resena = cita_id in citas_con_resena
                 
                 if not tiene_resena:
                     # Formatear fecha
@@ -896,6 +749,7 @@ class FirebaseFunctionsService:
             traceback.print_exc()
             return []
     
+    @traced('firestore.get_user_reviews')
     def get_user_reviews(self, user_id: str = None, phone: str = None) -> List[Dict]:
         """
         Obtiene las reseñas escritas por el usuario
@@ -921,71 +775,43 @@ class FirebaseFunctionsService:
             print(f"[get_user_reviews] Buscando resenas para paciente_id={paciente_id}")
             reviews = []
             
-            # Buscar en dentistas - limitar a 20 para evitar timeout
-            dentistas_ref = self.db.collection('dentistas')
-            dentistas_docs = list(dentistas_ref.limit(20).stream())
-            
-            for dentista_doc in dentistas_docs:
-                try:
-                    resenas_ref = dentista_doc.reference.collection('resenas')
-                    
-                    # Buscar por pacienteId
-                    query1 = resenas_ref.where('pacienteId', '==', paciente_id).limit(3)
-                    for resena_doc in query1.stream():
-                        data = resena_doc.to_dict()
-                        dentista_data = dentista_doc.to_dict()
-                        
+            # Reseñas del paciente en todos los dentistas (collection group)
+            from database.queries import resenas_de_paciente
+            resenas_docs = resenas_de_paciente(self.db, paciente_id, limit=10)
+            
+            # Nombres de los dentistas en una sola lectura por lotes
+            dentista_refs = {doc.reference.parent.parent.path: doc.reference.parent.parent
+                             for doc in resenas_docs if doc.reference.parent.parent is not None}
+            dentistas = {}
+            if dentista_refs:
+                for dentista_doc in self.db.get_all(list(dentista_refs.values())):
+                    if dentista_doc.exists:
+                        dentistas[dentista_doc.reference.path] = dentista_doc.to_dict()
+            
+            for resena_doc in resenas_docs:
+                data = resena_doc.to_dict()
+                parent = resena_doc.reference.parent.parent
+                dentista_data = dentistas.get(parent.path, {}) if parent is not None else {}
+                
+                fecha_str = ''
+                if data.get('created_at'):
+                    try:
+                        fecha_obj = data['created_at']
+                        if hasattr(fecha_obj, 'strftime'):
+                            fecha_str = fecha_obj.strftime('%d/%m/%Y')
+                        elif hasattr(fecha_obj, 'to_datetime'):
+                            fecha_str = fecha_obj.to_datetime().strftime('%d/%m/%Y')
+                    except:
                         fecha_str = ''
-                        if data.get('created_at'):
-                            try:
-                                fecha_obj = data['created_at']
-                                if hasattr(fecha_obj, 'strftime'):
-                                    fecha_str = fecha_obj.strftime('%d/%m/%Y')
-                                elif hasattr(fecha_obj, 'to_datetime'):
-                                    fecha_str = fecha_obj.to_datetime().strftime('%d/%m/%Y')
-                            except:
-                                fecha_str = ''
-                        
-                        reviews.append({
-                            'id': resena_doc.id,
-                            'dentista': dentista_data.get('Nombre', dentista_data.get('nombre', 'Dentista')),
-                            'calificacion': data.get('calificacion', 0),
-                            'comentario': data.get('comentario', ''),
-                            'fecha': fecha_str,
-                            'anonimo': data.get('anonimo', False)
-                        })
-                    
-                    # Tambien buscar por userId si es diferente
-                    query2 = resenas_ref.where('userId', '==', paciente_id).limit(3)
-                    for resena_doc in query2.stream():
-                        # Evitar duplicados
-                        if resena_doc.id not in [r['id'] for r in reviews]:
-                            data = resena_doc.to_dict()
-                            dentista_data = dentista_doc.to_dict()
-                            
-                            fecha_str = ''
-                            if data.get('created_at'):
-                                try:
-                                    fecha_obj = data['created_at']
-                                    if hasattr(fecha_obj, 'strftime'):
-                                        fecha_str = fecha_obj.strftime('%d/%m/%Y')
-                                    elif hasattr(fecha_obj, 'to_datetime'):
-                                        fecha_str = fecha_obj.to_datetime().strftime('%d/%m/%Y')
-                                except:
-                                    fecha_str = ''
-                            
-                            reviews.append({
-                                'id': resena_doc.id,
-                                'dentista': dentista_data.get('Nombre', dentista_data.get('nombre', 'Dentista')),
-                                'calificacion': data.get('calificacion', 0),
-                                'comentario': data.get('comentario', ''),
-                                'fecha': fecha_str,
-                                'anonimo': data.get('anonimo', False)
-                            })
-                            
-                except Exception as inner_e:
-                    print(f"[get_user_reviews] Error en dentista {dentista_doc.id}: {inner_e}")
-                    continue
+                
+                reviews.append({
+                    'id': resena_doc.id,
+                    'dentista': dentista_data.get('Nombre', dentista_data.get('nombre', 'Dentista')),
+                    'calificacion': data.get('calificacion', 0),
+                    'comentario': data.get('comentario', ''),
+                    'fecha': fecha_str,
+                    'anonimo': data.get('anonimo', False)
+                })
             
             print(f"[get_user_reviews] Encontradas {len(reviews)} resenas")
             return reviews[:10]  # Maximo 10 resenas
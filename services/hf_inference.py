@@ -0,0 +1,204 @@
+"""
+CLIENTE DE INFERENCIA DE HUGGING FACE
+- Intentos acotados con backoff exponencial que respeta un deadline por solicitud
+- Un modelo "frío" (HTTP 503 mientras carga) nunca bloquea al hilo que atiende la
+  solicitud: se responde None de inmediato y un hilo de fondo lo calienta
+- Pings periódicos de calentamiento para los modelos usados recientemente
+- Backend stub local para pruebas (HF_INFERENCE_BACKEND=stub)
+"""
+
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import requests
+
+
+class InferenceResult:
+    """Resultado crudo de un backend: status HTTP, cuerpo JSON y tiempo estimado de carga"""
+
+    def __init__(self, status: int, data=None, estimated_time: float = None, error: str = None):
+        self.status = status
+        self.data = data
+        self.estimated_time = estimated_time
+        self.error = error
+
+
+class HuggingFaceHTTPBackend:
+    """Backend real contra la Inference API de Hugging Face"""
+
+    def __init__(self, api_url: str, api_key: str = ""):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.session = requests.Session()
+
+    def infer(self, model: str, payload: Dict, timeout: float) -> InferenceResult:
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+
+        try:
+            response = self.session.post(f"{self.api_url}/{model}", headers=headers,
+                                         json=payload, timeout=timeout)
+        except requests.RequestException as e:
+            return InferenceResult(0, error=str(e))
+
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+
+        estimated_time = data.get('estimated_time') if isinstance(data, dict) else None
+        error = None if response.status_code == 200 else response.text[:200]
+        return InferenceResult(response.status_code, data, estimated_time, error)
+
+
+class StubInferenceBackend:
+    """
+    Backend local para pruebas. Devuelve respuestas programadas por modelo
+    (lista de InferenceResult que se consumen en orden; el último se repite).
+    """
+
+    def __init__(self, scripted: Dict[str, List[InferenceResult]] = None):
+        self.scripted = scripted or {}
+        self.calls: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def infer(self, model: str, payload: Dict, timeout: float) -> InferenceResult:
+        with self._lock:
+            self.calls.append({'model': model, 'payload': payload, 'timeout': timeout})
+            queue = self.scripted.get(model)
+            if not queue:
+                return InferenceResult(200, [{"generated_text": f"stub:{payload.get('inputs', '')}"}])
+            return queue.pop(0) if len(queue) > 1 else queue[0]
+
+
+class InferenceClient:
+    """
+    Cliente con reintentos acotados, deadline por solicitud y calentamiento en segundo plano
+    """
+
+    # Errores transitorios que vale la pena reintentar dentro del deadline
+    RETRYABLE_STATUS = {0, 429, 500, 502, 504}
+
+    def __init__(self, backend, max_attempts: int = 3, base_backoff: float = 0.25,
+                 max_backoff: float = 2.0, default_deadline: float = 8.0,
+                 warmup_interval: float = 600.0, sleep: Callable[[float], None] = time.sleep):
+        self.backend = backend
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.default_deadline = default_deadline
+        self.warmup_interval = warmup_interval
+        self._sleep = sleep
+
+        self._lock = threading.Lock()
+        self._cold_models: Dict[str, float] = {}  # modelo -> hasta cuándo se considera frío
+        self._last_used: Dict[str, float] = {}
+        self._pending_warmup = set()
+        self._warmup_event = threading.Event()
+        self._warmup_thread: Optional[threading.Thread] = None
+
+    def infer(self, model: str, inputs, parameters: Dict = None,
+              deadline: float = None) -> Optional[Dict]:
+        """
+        Ejecuta la inferencia. Retorna el JSON de la respuesta o None si no se pudo
+        obtener antes del deadline (en segundos desde ahora).
+        """
+        deadline_at = time.monotonic() + (deadline if deadline is not None else self.default_deadline)
+        with self._lock:
+            self._last_used[model] = time.time()
+            cold_until = self._cold_models.get(model, 0)
+        if cold_until > time.time():
+            # Sabemos que el modelo está cargando: no gastar la solicitud esperando
+            self._schedule_warmup(model)
+            return None
+
+        payload = {"inputs": inputs}
+        if parameters:
+            payload["parameters"] = parameters
+
+        for attempt in range(1, self.max_attempts + 1):
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                break
+
+            result = self.backend.infer(model, payload, timeout=remaining)
+            if result.status == 200:
+                with self._lock:
+                    self._cold_models.pop(model, None)
+                return result.data
+
+            if result.status == 503:
+                # Modelo cargándose: marcar como frío y calentarlo en segundo plano
+                estimated = result.estimated_time or 20.0
+                with self._lock:
+                    self._cold_models[model] = time.time() + estimated
+                print(f"Modelo {model} cargándose (~{estimated:.0f}s), se calienta en segundo plano")
+                self._schedule_warmup(model)
+                return None
+
+            if result.status not in self.RETRYABLE_STATUS or attempt == self.max_attempts:
+                print(f"Error llamando Hugging Face: {result.status} - {result.error}")
+                return None
+
+            backoff = min(self.max_backoff, self.base_backoff * (2 ** (attempt - 1)))
+            backoff = backoff * (0.5 + random.random() / 2)  # jitter
+            if time.monotonic() + backoff >= deadline_at:
+                print(f"Hugging Face {model}: sin tiempo para reintentar ({result.status})")
+                return None
+            self._sleep(backoff)
+
+        return None
+
+    def is_cold(self, model: str) -> bool:
+        with self._lock:
+            return self._cold_models.get(model, 0) > time.time()
+
+    # ------------------------------------------------------------------
+    # Calentamiento en segundo plano
+    # ------------------------------------------------------------------
+
+    def _schedule_warmup(self, model: str):
+        with self._lock:
+            self._pending_warmup.add(model)
+            if self._warmup_thread is None or not self._warmup_thread.is_alive():
+                self._warmup_thread = threading.Thread(target=self._warmup_loop,
+                                                       name="hf-warmup", daemon=True)
+                self._warmup_thread.start()
+        self._warmup_event.set()
+
+    def _warmup_loop(self):
+        """Calienta modelos fríos y re-pinga periódicamente los usados en la última hora"""
+        while True:
+            self._warmup_event.wait(timeout=self.warmup_interval)
+            self._warmup_event.clear()
+
+            now = time.time()
+            with self._lock:
+                models = set(self._pending_warmup)
+                self._pending_warmup.clear()
+                models.update(m for m, used in self._last_used.items() if now - used < 3600)
+
+            for model in models:
+                self.warmup(model)
+
+    def warmup(self, model: str, timeout: float = 60.0) -> bool:
+        """Ping de calentamiento (espera a que el modelo cargue; solo se usa fuera de solicitudes)"""
+        payload = {"inputs": "hola", "options": {"wait_for_model": True}}
+        result = self.backend.infer(model, payload, timeout=timeout)
+        if result.status == 200:
+            with self._lock:
+                self._cold_models.pop(model, None)
+            return True
+        print(f"Calentamiento de {model} falló: {result.status} - {result.error}")
+        return False
+
+
+def create_inference_client(api_url: str, api_key: str = "") -> InferenceClient:
+    """Crea el cliente con el backend configurado (HF_INFERENCE_BACKEND=stub para pruebas)"""
+    if os.getenv("HF_INFERENCE_BACKEND", "").lower() == "stub":
+        return InferenceClient(StubInferenceBackend())
+    return InferenceClient(HuggingFaceHTTPBackend(api_url, api_key))
@@ -0,0 +1,244 @@
+"""
+ÍNDICE DE CONOCIMIENTO (RECUPERACIÓN LOCAL)
+Índice invertido con ranking BM25 sobre tokens normalizados (minúsculas, sin acentos,
+sin stopwords y con un stemming ligero). Se construye una sola vez a partir de la base
+de conocimiento de Densora, las preguntas frecuentes y los textos informativos de
+chatbot_translations, para responder preguntas parafraseadas sin llamar a OpenAI.
+"""
+
+import math
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# Base de conocimiento sobre Densora (antes vivía dentro de MLService.answer_question)
+DEFAULT_KNOWLEDGE_BASE = {
+    'qué es densora': 'Densora es una plataforma digital que conecta pacientes con dentistas. Puedes agendar citas, ver tu historial médico y gestionar tus citas desde cualquier lugar.',
+    'cómo funciona': 'Densora funciona así:\n1. Buscas un dentista\n2. Agendas tu cita\n3. Asistes a tu cita\n4. Puedes dejar reseñas\n\nTodo desde tu celular o computadora.',
+    'cómo agendar': 'Para agendar una cita puedes:\n• Usar el chatbot (escribe "agendar cita")\n• Visitar nuestra web\n• Llamar al consultorio directamente',
+    'cómo cancelar': 'Para cancelar una cita:\n• Escribe "cancelar cita" en el chat\n• Selecciona la cita que quieres cancelar\n• Confirma la cancelación',
+    'horarios': 'Los horarios dependen de cada consultorio. Generalmente están disponibles de lunes a viernes de 9 AM a 6 PM.',
+    'precios': 'Los precios varían según el servicio y el consultorio. Puedes ver los precios al buscar dentistas en nuestra plataforma.',
+    'métodos de pago': 'Aceptamos:\n• Efectivo\n• Transferencia bancaria\n• Stripe (tarjeta de crédito/débito)',
+    'qué servicios ofrecen': 'En Densora ofrecemos:\n• Limpieza dental\n• Ortodoncia (brackets, alineadores)\n• Estética dental (blanqueamiento, carillas)\n• Endodoncia (tratamiento de conductos)\n• Implantes dentales\n• Odontopediatría (niños)\n• Prótesis dentales\n• Consulta general',
+}
+
+# Textos de chatbot_translations que responden preguntas: (clave de título/pregunta, clave de respuesta)
+_TRANSLATION_ENTRIES = [
+    ('faq_q1', 'faq_a1'),
+    ('faq_q2', 'faq_a2'),
+    ('faq_q3', 'faq_a3'),
+    ('faq_q4', 'faq_a4'),
+    ('faq_q5', 'faq_a5'),
+    (None, 'cancellation_policy'),
+    ('reviews_info_title', 'reviews_info_text'),
+    ('guide_title', 'guide_content'),
+    ('support_hours_title', 'support_hours_content'),
+    (None, 'keyword_contact_response'),
+]
+
+_STOPWORDS = {
+    # Español
+    'a', 'al', 'algo', 'como', 'con', 'cual', 'cuál', 'de', 'del', 'donde', 'e', 'el', 'en', 'es',
+    'esa', 'ese', 'eso', 'esta', 'este', 'esto', 'hay', 'la', 'las', 'le', 'les', 'lo', 'los', 'me',
+    'mi', 'mis', 'muy', 'no', 'nos', 'o', 'para', 'pero', 'por', 'puedo', 'puede', 'que', 'se',
+    'si', 'sin', 'su', 'sus', 'te', 'tu', 'tus', 'un', 'una', 'uno', 'y', 'ya', 'yo', 'hola',
+    'quiero', 'quisiera', 'saber', 'tengo', 'tienen', 'tiene', 'ustedes', 'favor',
+    'esta', 'estan', 'estoy', 'hago', 'hace', 'hacen', 'hacer', 'cuanto', 'cuando', 'cuales', 'son',
+    # Inglés
+    'an', 'and', 'are', 'can', 'do', 'does', 'for', 'how', 'i', 'in', 'is', 'it', 'my', 'of',
+    'or', 'the', 'to', 'what', 'you', 'your', 'we',
+}
+
+# Sufijos que se recortan (el más largo primero) dejando al menos 3 letras
+_SUFFIXES = ('aciones', 'acion', 'amiento', 'mente', 'arios', 'ario', 'ando', 'iendo',
+             'ados', 'idos', 'ado', 'ido', 'ar', 'er', 'ir', 'as', 'es', 'os', 'a', 'e', 'o', 's')
+
+# Sinónimos frecuentes en las preguntas de pacientes (sobre raíces ya recortadas)
+_SYNONYMS = {
+    'cost': 'preci', 'cuest': 'preci', 'cobr': 'preci', 'tarif': 'preci', 'price': 'preci',
+    'cambi': 'reagend', 'mov': 'reagend', 'reprogram': 'reagend', 'reschedul': 'reagend',
+    'abr': 'hor', 'abren': 'hor', 'cierr': 'hor', 'hour': 'hor', 'open': 'hor',
+    'telefon': 'contact', 'llam': 'contact', 'correo': 'contact', 'email': 'contact', 'phone': 'contact',
+    'tarjet': 'pag', 'efectiv': 'pag', 'transferenci': 'pag', 'pay': 'pag', 'card': 'pag',
+    'opinion': 'resen', 'calific': 'resen', 'review': 'resen',
+    'anul': 'cancel', 'borr': 'cancel',
+}
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def fold_accents(text: str) -> str:
+    """Minúsculas y sin acentos ("Cancelación" -> "cancelacion")"""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _stem(token: str) -> str:
+    for suffix in _SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            token = token[:-len(suffix)]
+            break
+    return _SYNONYMS.get(token, token)
+
+
+def tokenize(text: str) -> List[str]:
+    """Tokens normalizados para indexar y buscar"""
+    if not text:
+        return []
+    folded_stopwords = _FOLDED_STOPWORDS
+    return [_stem(tok) for tok in _TOKEN_RE.findall(fold_accents(text)) if tok not in folded_stopwords]
+
+
+_FOLDED_STOPWORDS = {fold_accents(w) for w in _STOPWORDS}
+
+
+class KnowledgeIndex:
+    """
+    Índice invertido en memoria con ranking BM25 y cache LRU de resultados
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, cache_size: int = 256):
+        self.k1 = k1
+        self.b = b
+        self.cache_size = cache_size
+        # Umbral mínimo de score para responder localmente (por debajo, mejor usar OpenAI)
+        self.min_score = 1.5
+
+        self._lock = threading.Lock()
+        self._built = False
+        self._docs: List[Dict] = []
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}  # token -> [(doc_idx, tf)]
+        self._idf: Dict[str, float] = {}
+        self._avg_len = 0.0
+        self._cache: OrderedDict = OrderedDict()
+
+    # ------------------------------------------------------------------
+    # Construcción
+    # ------------------------------------------------------------------
+
+    def build(self, documents: List[Dict]):
+        """
+        Construye el índice. Cada documento: {'id', 'text', 'answer', 'language', 'source'}
+        'text' es lo que se indexa; 'answer' es lo que se responde.
+        """
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        docs = []
+        for doc in documents:
+            tokens = tokenize(doc['text'])
+            if not tokens:
+                continue
+            idx = len(docs)
+            docs.append(dict(doc, length=len(tokens)))
+            counts: Dict[str, int] = {}
+            for tok in tokens:
+                counts[tok] = counts.get(tok, 0) + 1
+            for tok, tf in counts.items():
+                postings.setdefault(tok, []).append((idx, tf))
+
+        n_docs = len(docs)
+        idf = {
+            tok: math.log(1 + (n_docs - len(plist) + 0.5) / (len(plist) + 0.5))
+            for tok, plist in postings.items()
+        }
+
+        with self._lock:
+            self._docs = docs
+            self._postings = postings
+            self._idf = idf
+            self._avg_len = (sum(d['length'] for d in docs) / n_docs) if n_docs else 0.0
+            self._cache.clear()
+            self._built = True
+
+    def _ensure_built(self):
+        if not self._built:
+            self.build(self._default_documents())
+
+    @staticmethod
+    def _default_documents() -> List[Dict]:
+        """KB de Densora + FAQ y textos informativos de las traducciones"""
+        from services.chatbot_translations import TRANSLATIONS
+
+        documents = []
+        for key, answer in DEFAULT_KNOWLEDGE_BASE.items():
+            documents.append({
+                'id': f"kb:{key}",
+                'text': f"{key} {key} {answer}",  # La pregunta pesa más que la respuesta
+                'answer': answer,
+                'language': 'es',
+                'source': 'kb'
+            })
+
+        for language, strings in TRANSLATIONS.items():
+            for title_key, answer_key in _TRANSLATION_ENTRIES:
+                answer = strings.get(answer_key)
+                if not answer:
+                    continue
+                title = strings.get(title_key, '') if title_key else ''
+                documents.append({
+                    'id': f"t:{language}:{answer_key}",
+                    'text': f"{title} {title} {answer}",
+                    'answer': f"*{title}*\n{answer}" if title else answer,
+                    'language': language,
+                    'source': 'translations'
+                })
+        return documents
+
+    # ------------------------------------------------------------------
+    # Búsqueda
+    # ------------------------------------------------------------------
+
+    def search(self, query: str, language: str = None, top_k: int = 3) -> List[Dict]:
+        """Top-k documentos para la consulta: [{'id', 'answer', 'score', 'source', 'language'}]"""
+        self._ensure_built()
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        cache_key = (tuple(sorted(set(terms))), language, top_k)
+        with self._lock:
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                self._cache.move_to_end(cache_key)
+                return cached
+
+        scores: Dict[int, float] = {}
+        for term in set(terms):
+            plist = self._postings.get(term)
+            if not plist:
+                continue
+            idf = self._idf[term]
+            for doc_idx, tf in plist:
+                doc = self._docs[doc_idx]
+                if language and doc['language'] != language:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * doc['length'] / self._avg_len)
+                scores[doc_idx] = scores.get(doc_idx, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        hits = [{
+            'id': self._docs[i]['id'],
+            'answer': self._docs[i]['answer'],
+            'score': round(score, 3),
+            'source': self._docs[i]['source'],
+            'language': self._docs[i]['language']
+        } for i, score in ranked]
+
+        with self._lock:
+            self._cache[cache_key] = hits
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return hits
+
+    def answer(self, query: str, language: str = 'es') -> Optional[str]:
+        """Mejor respuesta local si supera el umbral; None si conviene usar el LLM"""
+        hits = self.search(query, language=language, top_k=1)
+        if hits and hits[0]['score'] >= self.min_score:
+            return hits[0]['answer']
+        return None
+
+
+# Instancia global (el índice se construye en la primera búsqueda)
+knowledge_index = KnowledgeIndex()
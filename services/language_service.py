@@ -13,6 +13,7 @@ class LanguageService:
     """
     
 from services.chatbot_translations import TRANSLATIONS
+from services.registry import lazy_service, shared
 
 class LanguageService:
     """
@@ -20,9 +21,22 @@ class LanguageService:
     """
     
     def __init__(self):
-        self.paciente_repo = PacienteRepository()
-        self.db = FirebaseConfig.get_db()
+        self._paciente_repo = None
+        self._db = None
         self.translations = TRANSLATIONS
+
+    # t() solo usa las traducciones: Firebase se conecta hasta que se consulta un paciente
+    @property
+    def paciente_repo(self):
+        if self._paciente_repo is None:
+            self._paciente_repo = shared(PacienteRepository)
+        return self._paciente_repo
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = FirebaseConfig.get_db()
+        return self._db
     
     def get_patient_language(self, paciente_id: str) -> str:
         """
@@ -230,5 +244,5 @@ Thank you!"""
         return template
 
 # Instancia global
-language_service = LanguageService()
+language_service = lazy_service('language_service', LanguageService)
 
@@ -10,7 +10,9 @@ from database.models import PacienteRepository
 from database.database import FirebaseConfig
 from datetime import datetime, timedelta
 from typing import Dict, Optional
+from google.cloud import firestore
 import pytz
+from services.registry import lazy_service, shared
 
 class MedicalHistoryAuthService:
     """
@@ -18,8 +20,8 @@ class MedicalHistoryAuthService:
     """
     
     def __init__(self):
-        self.whatsapp = WhatsAppService()
-        self.paciente_repo = PacienteRepository()
+        self.whatsapp = shared(WhatsAppService)
+        self.paciente_repo = shared(PacienteRepository)
         self.db = FirebaseConfig.get_db()
         self.timezone = pytz.timezone('America/Mexico_City')
     
@@ -39,19 +41,27 @@ class MedicalHistoryAuthService:
                     'error': 'Paciente no encontrado o sin teléfono'
                 }
             
+            # ID de la solicitud dentro de los tokens: al responder se abre el documento directo
+            auth_doc_ref = self.db.collection('pacientes')\
+                .document(paciente_id)\
+                .collection('historial_authorizations')\
+                .document()
+            
             # Generar tokens para aprobar y rechazar
             approve_token = token_service.generate_token({
                 'action': 'approve_medical_history',
                 'pacienteId': paciente_id,
                 'dentistaId': dentista_id,
-                'citaId': cita_id
+                'citaId': cita_id,
+                'authId': auth_doc_ref.id
             })
             
             reject_token = token_service.generate_token({
                 'action': 'reject_medical_history',
                 'pacienteId': paciente_id,
                 'dentistaId': dentista_id,
-                'citaId': cita_id
+                'citaId': cita_id,
+                'authId': auth_doc_ref.id
             })
             
             approve_link = f"http://localhost:4321/authorize-history?token={approve_token}" if approve_token else None
@@ -81,10 +91,7 @@ El Dr(a). {dentista_name} del consultorio {consultorio_name} solicita acceso a t
             
             if result:
                 # Guardar solicitud en Firestore
-                self.db.collection('pacientes')\
-                    .document(paciente_id)\
-                    .collection('historial_authorizations')\
-                    .add({
+                auth_doc_ref.set({
                         'dentistaId': dentista_id,
                         'dentistaName': dentista_name,
                         'consultorioName': consultorio_name,
@@ -121,64 +128,76 @@ El Dr(a). {dentista_name} del consultorio {consultorio_name} solicita acceso a t
     async def process_authorization_response(self, token: str, action: str) -> Dict:
         """
         Procesa la respuesta del paciente (aprobar o rechazar)
+        El enlace es de un solo uso por el status de la solicitud: la transición
+        pending -> approved/rejected es transaccional, así que vale en todos los workers.
+        El token solo se marca como consumido (atajo local) después de esa transición;
+        un error de Firestore no quema un enlace válido.
         """
         try:
-            # Validar token
-            token_data = token_service.validate_token(token)
+            # Validar token (firma verificada localmente; un enlace ya usado aquí se rechaza sin Firestore)
+            token_data = None if token_service.is_consumed(token) else token_service.validate_token(token)
             if not token_data:
                 return {
                     'success': False,
-                    'error': 'Token inválido o expirado'
+                    'error': 'Token inválido, expirado o ya utilizado'
                 }
             
             paciente_id = token_data.get('pacienteId')
             dentista_id = token_data.get('dentistaId')
             cita_id = token_data.get('citaId')
+            auth_id = token_data.get('authId')
             
-            # Buscar solicitud pendiente
-            auth_ref = self.db.collection('pacientes')\
+            authorizations = self.db.collection('pacientes')\
                 .document(paciente_id)\
-                .collection('historial_authorizations')\
-                .where('dentistaId', '==', dentista_id)\
-                .where('status', '==', 'pending')\
-                .order_by('requestedAt', direction='DESCENDING')\
-                .limit(1)
-            
-            auth_doc = None
-            for doc in auth_ref.stream():
-                auth_doc = doc
-                break
-            
-            if not auth_doc:
-                return {
-                    'success': False,
-                    'error': 'Solicitud no encontrada o ya procesada'
-                }
+                .collection('historial_authorizations')
+            
+            if auth_id:
+                auth_ref = authorizations.document(auth_id)
+            else:
+                # Tokens emitidos antes de incluir authId: buscar la solicitud pendiente
+                auth_ref = None
+                query = authorizations\
+                    .where('dentistaId', '==', dentista_id)\
+                    .where('status', '==', 'pending')\
+                    .order_by('requestedAt', direction='DESCENDING')\
+                    .limit(1)
+                for doc in query.stream():
+                    auth_ref = doc.reference
+                    break
             
-            # Actualizar estado
             new_status = 'approved' if action == 'approve' else 'rejected'
-            self.db.collection('pacientes')\
-                .document(paciente_id)\
-                .collection('historial_authorizations')\
-                .document(auth_doc.id)\
-                .update({
+            acceso_ref = self.db.collection('dentistas')\
+                .document(dentista_id)\
+                .collection('authorized_patients')\
+                .document(paciente_id)
+            
+            @firestore.transactional
+            def responder(transaction):
+                snapshot = auth_ref.get(transaction=transaction)
+                if not snapshot.exists or (snapshot.to_dict() or {}).get('status') != 'pending':
+                    return False
+                now = datetime.now(self.timezone)
+                transaction.update(auth_ref, {
                     'status': new_status,
-                    'respondedAt': datetime.now(self.timezone),
+                    'respondedAt': now,
                     'response': action
                 })
-            
-            # Si se aprobó, crear registro de acceso
-            if action == 'approve':
-                self.db.collection('dentistas')\
-                    .document(dentista_id)\
-                    .collection('authorized_patients')\
-                    .document(paciente_id)\
-                    .set({
-                        'authorizedAt': datetime.now(self.timezone),
+                # Si se aprobó, crear registro de acceso
+                if action == 'approve':
+                    transaction.set(acceso_ref, {
+                        'authorizedAt': now,
                         'authorizedFor': cita_id or 'general',
                         'status': 'active'
                     })
+                return True
+            
+            if auth_ref is None or not responder(self.db.transaction()):
+                return {
+                    'success': False,
+                    'error': 'Solicitud no encontrada o ya procesada'
+                }
             
+            token_service.consume_token(token)
             return {
                 'success': True,
                 'status': new_status
@@ -192,5 +211,5 @@ El Dr(a). {dentista_name} del consultorio {consultorio_name} solicita acceso a t
             }
 
 # Instancia global
-medical_history_auth_service = MedicalHistoryAuthService()
+medical_history_auth_service = lazy_service('medical_history_auth_service', MedicalHistoryAuthService)
 
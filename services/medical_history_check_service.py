@@ -10,9 +10,21 @@ from services.language_service import language_service
 from services.notification_config_service import notification_config_service
 from database.models import PacienteRepository
 from database.database import FirebaseConfig
-from datetime import datetime, timedelta
-from typing import Dict, Optional, List
+from google.cloud import firestore
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, List, Tuple
+import os
+import socket
+import threading
 import pytz
+from services.registry import lazy_service, shared
+
+# Listener de historialMedico: un solo proceso lo mantiene (lease) y se reanuda
+# desde el último read_time guardado en lugar de reproducir todos los historiales
+WATCH_STATE = ('scheduler_leases', 'historial_completitud')
+WATCH_LEASE_SECONDS = 120
+WATCH_RESTART = timedelta(hours=24)  # renovar la consulta para avanzar el cursor
+WATCH_CURSOR_SKEW = timedelta(minutes=5)
 
 class MedicalHistoryCheckService:
     """
@@ -21,8 +33,8 @@ class MedicalHistoryCheckService:
     """
     
     def __init__(self):
-        self.whatsapp = WhatsAppService()
-        self.paciente_repo = PacienteRepository()
+        self.whatsapp = shared(WhatsAppService)
+        self.paciente_repo = shared(PacienteRepository)
         self.db = FirebaseConfig.get_db()
         self.timezone = pytz.timezone('America/Mexico_City')
         
@@ -42,6 +54,14 @@ class MedicalHistoryCheckService:
             'habitosNocivos',
             'ultimaVisitaDentista'
         ]
+        
+        # Listener de cambios en historialMedico (resumen de completitud materializado)
+        self._watch = None
+        self._watch_started_at = None
+        self._watch_lock = threading.Lock()
+        self._watch_thread = None
+        self._watch_stop = threading.Event()
+        self._watch_owner = f"{socket.gethostname()}:{os.getpid()}"
     
     async def check_medical_history_after_appointment(self, paciente_id: str, cita_id: str,
                                                       dentista_id: Optional[str] = None,
@@ -83,11 +103,8 @@ class MedicalHistoryCheckService:
                     'reason': 'Notificaciones deshabilitadas'
                 }
             
-            # Obtener historial médico del paciente
-            historial = await self._get_medical_history(paciente_id)
-            
-            # Verificar completitud
-            check_result = self._check_completeness(historial)
+            # Verificar completitud (resumen materializado: una lectura de documento)
+            check_result = await self.get_completeness(paciente_id)
             
             if check_result['is_complete']:
                 # Historial completo, no enviar alerta
@@ -138,6 +155,14 @@ class MedicalHistoryCheckService:
         """
         Obtiene el historial médico del paciente desde Firestore
         """
+        return self._current_history(paciente_id)[0]
+    
+    def _current_history(self, paciente_id: str) -> Tuple[Dict, Optional[object]]:
+        """
+        (datos, documento) del historial vigente: el más reciente por fechaActualizacion en
+        la subcolección historialMedico, o el mapa historialMedico del paciente (documento None).
+        Es la única regla de "historial vigente" (verificaciones y resumen materializado).
+        """
         try:
             # Buscar en la subcolección historialMedico del paciente
             historial_ref = self.db.collection('pacientes')\
@@ -149,23 +174,224 @@ class MedicalHistoryCheckService:
             historial_docs = list(historial_ref.stream())
             
             if historial_docs:
-                return historial_docs[0].to_dict()
+                return historial_docs[0].to_dict() or {}, historial_docs[0]
             
             # Si no hay subcolección, buscar en el documento principal
             paciente_doc = self.db.collection('pacientes').document(paciente_id).get()
             if paciente_doc.exists:
                 paciente_data = paciente_doc.to_dict()
-                return paciente_data.get('historialMedico', {})
+                return paciente_data.get('historialMedico', {}), None
             
-            return {}
+            return {}, None
             
         except Exception as e:
             print(f"Error obteniendo historial médico: {e}")
-            return {}
+            return {}, None
+    
+    # ------------------------------------------------------------------
+    # Resumen de completitud materializado en pacientes/{id}
+    #   historialCompletitud: {porcentaje, camposFaltantes, recomendadosFaltantes,
+    #                          version, historialId, verificadoEn}
+    #   historial_medico_completo: bool (lo usa ReminderScheduler en una consulta indexada)
+    # ------------------------------------------------------------------
+    
+    async def get_completeness(self, paciente_id: str) -> Dict:
+        """
+        Completitud del historial desde el resumen materializado del paciente.
+        Si el paciente aún no tiene resumen, se calcula una vez y se guarda.
+        """
+        try:
+            paciente_doc = self.db.collection('pacientes').document(paciente_id).get()
+            resumen = (paciente_doc.to_dict() or {}).get('historialCompletitud') if paciente_doc.exists else None
+            if resumen:
+                return self._summary_to_check(resumen)
+        except Exception as e:
+            print(f"Error leyendo resumen de completitud: {e}")
+        
+        historial, doc = self._current_history(paciente_id)
+        self.update_completeness_summary(paciente_id, historial, historial_id=doc.id if doc else None)
+        return self._check_completeness(historial, paciente_id)
+    
+    def refresh_completeness(self, paciente_id: str, version: Optional[datetime] = None) -> Optional[Dict]:
+        """Recalcula el resumen desde el historial vigente (también si se eliminó el último)"""
+        historial, doc = self._current_history(paciente_id)
+        return self.update_completeness_summary(paciente_id, historial, version=version,
+                                                historial_id=doc.id if doc else None)
+    
+    def _summary_to_check(self, resumen: Dict) -> Dict:
+        missing = list(resumen.get('camposFaltantes', []))
+        return {
+            'is_complete': len(missing) == 0,
+            'completeness_percentage': resumen.get('porcentaje', 0),
+            'missing_fields': missing,
+            'missing_recommended': list(resumen.get('recomendadosFaltantes', []))
+        }
+    
+    def update_completeness_summary(self, paciente_id: str, historial: Dict,
+                                    version: Optional[datetime] = None,
+                                    historial_id: Optional[str] = None) -> Optional[Dict]:
+        """
+        Recalcula y guarda el resumen de un paciente a partir de un documento de historial.
+        Los campos cifrados evaluados se descifran (uno vacío cuenta como faltante).
+        version es el read_time del listener que disparó el cálculo; si ya hay un resumen
+        de una versión igual o más reciente, no se escribe nada.
+        """
+        check_result = self._check_completeness(historial, paciente_id)
+        paciente_ref = self.db.collection('pacientes').document(paciente_id)
+        resumen = {
+            'porcentaje': check_result['completeness_percentage'],
+            'camposFaltantes': check_result['missing_fields'],
+            'recomendadosFaltantes': check_result['missing_recommended'],
+            'version': version,
+            'historialId': historial_id,
+            'verificadoEn': datetime.now(self.timezone)
+        }
+        
+        @firestore.transactional
+        def guardar(transaction):
+            snapshot = paciente_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return False
+            actual = (snapshot.to_dict() or {}).get('historialCompletitud') or {}
+            if not self._is_newer_version(actual, version):
+                return False
+            transaction.update(paciente_ref, {
+                'historialCompletitud': resumen,
+                'historial_medico_completo': check_result['is_complete']
+            })
+            return True
+        
+        try:
+            return resumen if guardar(self.db.transaction()) else None
+        except Exception as e:
+            print(f"Error guardando resumen de completitud de {paciente_id}: {e}")
+            return None
     
-    def _check_completeness(self, historial: Dict) -> Dict:
+    @staticmethod
+    def _is_newer_version(actual: Dict, version: Optional[datetime]) -> bool:
+        """False si el resumen guardado ya es de una versión igual o posterior"""
+        return not (version and actual.get('version') and actual['version'] >= version)
+    
+    def _on_history_snapshot(self, docs, changes, read_time):
+        """
+        Recalcula solo los pacientes cuyo historial cambió. Cualquier cambio (incluido
+        REMOVED) recalcula desde los documentos que quedan, con la misma regla que
+        _current_history; la versión es el read_time del snapshot.
+        """
+        pacientes = set()
+        for change in changes:
+            paciente_ref = change.document.reference.parent.parent
+            if paciente_ref is not None:
+                pacientes.add(paciente_ref.id)
+        for paciente_id in pacientes:
+            self.refresh_completeness(paciente_id, version=read_time)
+        if pacientes:
+            self._watch_state_ref().set({'readTime': read_time}, merge=True)
+    
+    def _watch_state_ref(self):
+        return self.db.collection(WATCH_STATE[0]).document(WATCH_STATE[1])
+    
+    def _watch_lease(self, data: Optional[Dict], now: datetime) -> Optional[Dict]:
+        """Lease renovado para este proceso, o None si otro proceso lo tiene vigente"""
+        data = data or {}
+        lease_until = data.get('leaseUntil')
+        if data.get('owner') not in (None, self._watch_owner) and lease_until and lease_until > now:
+            return None
+        return dict(data, owner=self._watch_owner,
+                    leaseUntil=now + timedelta(seconds=WATCH_LEASE_SECONDS))
+    
+    def _renew_watch_lease(self, now: datetime) -> Optional[Dict]:
+        state_ref = self._watch_state_ref()
+        
+        @firestore.transactional
+        def renovar(transaction):
+            snapshot = state_ref.get(transaction=transaction)
+            state = self._watch_lease(snapshot.to_dict() if snapshot.exists else None, now)
+            if state is not None:
+                transaction.set(state_ref, state)
+            return state
+        
+        return renovar(self.db.transaction())
+    
+    def _tick_watch(self):
+        """Renueva el lease; solo el dueño mantiene el listener, reanudando desde readTime"""
+        now = datetime.now(timezone.utc)
+        state = self._renew_watch_lease(now)
+        with self._watch_lock:
+            if state is None:
+                self._unsubscribe_watch()
+                return
+            if self._watch is not None and now - self._watch_started_at < WATCH_RESTART:
+                return
+            self._unsubscribe_watch()
+            # Sin cursor (primera vez): solo cambios nuevos; los pacientes sin resumen
+            # los cubre backfill_completeness
+            cursor = state.get('readTime') or now
+            query = self.db.collection_group('historialMedico')\
+                .where('fechaActualizacion', '>=', cursor - WATCH_CURSOR_SKEW)
+            self._watch = query.on_snapshot(self._on_history_snapshot)
+            self._watch_started_at = now
+            if not state.get('readTime'):
+                self._watch_state_ref().set({'readTime': now}, merge=True)
+            print(f"Resumen de completitud de historial: escuchando cambios desde {cursor}")
+    
+    def _watch_loop(self):
+        while not self._watch_stop.is_set():
+            try:
+                self._tick_watch()
+            except Exception as e:
+                print(f"Error en listener de historial médico: {e}")
+            self._watch_stop.wait(WATCH_LEASE_SECONDS / 3)
+    
+    def _unsubscribe_watch(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+    
+    def start_completeness_watch(self) -> bool:
+        """
+        Mantiene el resumen de completitud de cada paciente a partir de los cambios en
+        historialMedico. Se llama en cada worker; solo el que tiene el lease escucha.
+        """
+        with self._watch_lock:
+            if self._watch_thread is not None and self._watch_thread.is_alive():
+                return True
+            self._watch_stop.clear()
+            self._watch_thread = threading.Thread(target=self._watch_loop, daemon=True,
+                                                  name='historial-completitud-watch')
+            self._watch_thread.start()
+            return True
+    
+    def stop_completeness_watch(self):
+        self._watch_stop.set()
+        with self._watch_lock:
+            self._unsubscribe_watch()
+    
+    def backfill_completeness(self, campaign_id: Optional[str] = None) -> Dict:
+        """
+        Materializa el resumen de los pacientes que aún no lo tienen (incluidos los que
+        no tienen ningún historial: quedan con historial_medico_completo=False y los
+        encuentra el recordatorio). Paginado y reanudable; una vez al día.
+        """
+        from services.campaign_runner import CampaignRunner
+        
+        runner = CampaignRunner(
+            self.db, campaign_id or f"historial_completitud_{datetime.now(self.timezone):%Y-%m-%d}",
+            page_size=200)
+        
+        def procesar(doc, _):
+            if 'historialCompletitud' in (doc.to_dict() or {}):
+                return True
+            self.refresh_completeness(doc.id)
+            return True
+        
+        return runner.run('pacientes', prefetch=lambda docs: None, handle=procesar)
+    
+    def _check_completeness(self, historial: Dict, paciente_id: Optional[str] = None) -> Dict:
         """
         Verifica la completitud del historial médico
+        Con paciente_id, un historial cifrado se revisa con LazyDecryptedView: solo se
+        descifran los campos evaluados, y un campo cifrado vacío cuenta como faltante.
         
         Returns:
             Dict con:
@@ -182,19 +408,20 @@ class MedicalHistoryCheckService:
                 'missing_recommended': self.recommended_fields.copy()
             }
         
+        if paciente_id and historial.get('_encrypted'):
+            from utils.encryption import LazyDecryptedView
+            vista = LazyDecryptedView(historial, paciente_id)
+            lleno = vista.has_value
+        else:
+            def lleno(field):
+                value = historial.get(field)
+                return bool(value) and not (isinstance(value, str) and value.strip() == '')
+        
         # Verificar campos requeridos
-        missing_required = []
-        for field in self.required_fields:
-            value = historial.get(field)
-            if not value or (isinstance(value, str) and value.strip() == ''):
-                missing_required.append(field)
+        missing_required = [field for field in self.required_fields if not lleno(field)]
         
         # Verificar campos recomendados
-        missing_recommended = []
-        for field in self.recommended_fields:
-            value = historial.get(field)
-            if not value or (isinstance(value, str) and value.strip() == ''):
-                missing_recommended.append(field)
+        missing_recommended = [field for field in self.recommended_fields if not lleno(field)]
         
         # Calcular porcentaje de completitud (solo campos requeridos)
         total_required = len(self.required_fields)
@@ -371,8 +598,7 @@ Esta información es confidencial y solo será utilizada para tu atención médi
                 return {'success': False, 'error': 'Paciente no encontrado'}
             
             # Verificar historial
-            historial = await self._get_medical_history(paciente_id)
-            check_result = self._check_completeness(historial)
+            check_result = await self.get_completeness(paciente_id)
             
             if check_result['is_complete']:
                 return {
@@ -437,4 +663,4 @@ Complétalo ahora para agilizar tu atención:
 
 
 # Instancia global
-medical_history_check_service = MedicalHistoryCheckService()
+medical_history_check_service = lazy_service('medical_history_check_service', MedicalHistoryCheckService)
@@ -0,0 +1,169 @@
+"""
+VISTA DEL HISTORIAL MÉDICO
+Arma los datos que muestra el chat a partir del historial (historialMedico) y del
+documento del paciente. El historial se envuelve en un LazyDecryptedView: cada campo
+se descifra solo cuando una pestaña lo usa; la completitud descifra únicamente los
+campos que evalúa (un valor cifrado vacío no cuenta como lleno).
+"""
+
+from typing import Dict, List
+
+from utils.encryption import LazyDecryptedView
+
+
+class MedicalHistoryView:
+    """
+    Acceso selectivo al historial médico de un paciente (una instancia por solicitud)
+    """
+
+    def __init__(self, paciente_id: str, paciente_data: Dict, historial_data: Dict,
+                 historial_completado: bool = False):
+        self.paciente_id = paciente_id
+        self.paciente = paciente_data or {}
+        self.historial = LazyDecryptedView(historial_data, paciente_id)
+        self.historial_completado = historial_completado
+
+    # ------------------------------------------------------------------
+    # Helpers
+    # ------------------------------------------------------------------
+
+    def _historial(self, *keys):
+        """Primer valor no vacío del historial (descifra solo hasta encontrarlo)"""
+        for key in keys:
+            if self.historial.has_value(key):
+                value = self.historial.get(key)
+                if value:
+                    return value
+        return None
+
+    def _paciente(self, *keys):
+        for key in keys:
+            value = self.paciente.get(key)
+            if value:
+                return value
+        return None
+
+    @staticmethod
+    def _as_list(value) -> List:
+        if isinstance(value, str):
+            return [value] if value.strip() else []
+        return value or []
+
+    # ------------------------------------------------------------------
+    # Campos compuestos (priorizar historialMedico sobre el paciente)
+    # ------------------------------------------------------------------
+
+    def nombre_completo(self) -> str:
+        nombre = (
+            self._historial('nombre', 'nombreCompleto') or
+            self.paciente.get('nombreCompleto') or
+            f"{self.paciente.get('nombres', self.paciente.get('nombre', ''))} {self.paciente.get('apellidos', self.paciente.get('apellido', ''))}".strip() or
+            'No registrado'
+        )
+        apellido = self._historial('apellido') or self.paciente.get('apellidos', self.paciente.get('apellido', ''))
+        if apellido and not nombre.endswith(apellido):
+            return f"{nombre} {apellido}".strip()
+        return nombre
+
+    def alergias(self) -> List:
+        return self._as_list(self._historial('alergias') or self._paciente('alergias'))
+
+    def medicamentos(self) -> List:
+        # La web usa 'medicamentosActuales'
+        return self._as_list(
+            self._historial('medicamentosActuales', 'medicacionActual', 'medicamentos') or
+            self._paciente('medicamentos')
+        )
+
+    def enfermedades(self) -> List:
+        # La web usa 'condicionesMedicas' y 'enfermedadesGeneticas'
+        return self._as_list(
+            self._historial('condicionesMedicas', 'enfermedadesCronicas', 'enfermedadesGeneticas') or
+            self._paciente('enfermedadesCronicas')
+        )
+
+    # ------------------------------------------------------------------
+    # Pestañas
+    # ------------------------------------------------------------------
+
+    def personal_data(self) -> Dict:
+        return {
+            'nombre': self.nombre_completo(),
+            'edad': self._historial('edad') or self._paciente('edad', 'fechaNacimiento') or 'No especificada',
+            'telefono': self._historial('telefono') or self._paciente('telefono') or 'No registrado',
+            'email': self.paciente.get('email') or 'No registrado',
+            'sexo': self._historial('sexo') or self._paciente('sexo') or '',
+            'direccion': self._historial('direccion') or self._paciente('direccion') or '',
+        }
+
+    def medical_details(self) -> Dict:
+        enfermedades = self.enfermedades()
+        medicamentos = self.medicamentos()
+        return {
+            'alergias': self.alergias(),
+            'medicamentos': medicamentos,
+            'medicamentosActuales': medicamentos,  # Alias para compatibilidad
+            'enfermedadesCronicas': enfermedades,
+            'condicionesMedicas': enfermedades,  # Alias para compatibilidad
+            'grupoSanguineo': self._historial('grupoSanguineo') or self._paciente('grupoSanguineo') or '',
+            'antecedentesMedicos': self._historial('antecedentesMedicos') or self._paciente('antecedentesMedicos') or '',
+            'contactoEmergencia': self._historial('contactoEmergencia') or self._paciente('contactoEmergencia') or {},
+        }
+
+    def dental_history(self) -> Dict:
+        return {
+            'motivoConsulta': self._historial('motivoConsulta', 'observacionesClinicas') or '',
+            'ultimaVisitaDentista': self._historial('ultimaCita', 'ultimaVisitaDentista') or '',
+            'dolorBoca': self._historial('dolorBoca', 'dolor') or '',
+            'sangradoEncias': self._historial('sangradoEncias', 'sangrado') or '',
+            'observacionesClinicas': self._historial('observacionesClinicas') or '',
+            'diagnosticosPrevios': self._historial('diagnosticosPrevios') or '',
+        }
+
+    def completeness(self) -> int:
+        """
+        Completitud con los mismos campos que la web. Los campos cifrados evaluados se
+        descifran (memoizados en la vista): un valor cifrado vacío no cuenta como lleno.
+        """
+        stored = self.historial.get('completeness') if self.historial.has_value('completeness') else None
+        if stored:
+            try:
+                return int(float(stored))
+            except (TypeError, ValueError):
+                pass
+
+        def presente(historial_keys, paciente_keys=()):
+            return (any(self.historial.has_value(k) for k in historial_keys) or
+                    self._paciente(*paciente_keys) is not None)
+
+        campos_evaluados = [
+            presente(['nombre'], ['nombre', 'nombres']),
+            presente(['apellido'], ['apellidos', 'apellido']),
+            presente(['edad'], ['edad']),
+            presente(['sexo'], ['sexo']),
+            presente(['telefono'], ['telefono']),
+            presente(['contactoEmergencia'], ['contactoEmergencia']),
+            presente(['direccion'], ['direccion']),
+            presente(['alergias'], ['alergias']),
+            presente(['medicamentosActuales', 'medicacionActual', 'medicamentos'], ['medicamentos']),
+            presente(['condicionesMedicas', 'enfermedadesCronicas', 'enfermedadesGeneticas'], ['enfermedadesCronicas']),
+            presente(['grupoSanguineo'], ['grupoSanguineo']),
+            presente(['ultimaCita'], ['ultimaCita']),
+            presente(['observacionesClinicas']),
+            presente(['diagnosticosPrevios']),
+        ]
+        return int((sum(1 for c in campos_evaluados if c) / len(campos_evaluados)) * 100)
+
+    def to_dict(self) -> Dict:
+        """Todos los campos (mismo formato que get_medical_history)"""
+        completitud = self.completeness()
+        data = self.personal_data()
+        data.update(self.medical_details())
+        data.update(self.dental_history())
+        data.update({
+            'historialCompletado': self.historial_completado,
+            'completeness': completitud,
+            'completitud': completitud,  # Alias
+            'historialExtra': self.historial.to_dict()
+        })
+        return data
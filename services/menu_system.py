@@ -16,6 +16,10 @@ from services.language_service import language_service
 from database.database import FirebaseConfig
 from typing import Dict, Optional
 from datetime import datetime, timedelta
+from utils.logging_config import get_logger
+from services.registry import shared
+
+logger = get_logger(__name__)
 
 class MenuSystem:
     """
@@ -24,8 +28,8 @@ class MenuSystem:
     """
     
     def __init__(self):
-        self.actions_service = ActionsService()
-        self.citas_service = CitasService()
+        self.actions_service = shared(ActionsService)
+        self.citas_service = shared(CitasService)
         self.firebase_service = FirebaseFunctionsService()  # Servicio que usa la misma estructura que la web
         self.db = FirebaseConfig.get_db()  # Acceso directo a Firestore
     
@@ -62,7 +66,7 @@ class MenuSystem:
         # Obtener idioma del contexto
         language = context.get('language', 'es')
         
-        print(f"[MENU_SYSTEM] process_message - session_id={session_id}, message='{message}', current_step={current_step}, user_id={user_id}, phone={phone}, lang={language}")
+        logger.debug("[MENU_SYSTEM] process_message - session_id=%s, message='%s', current_step=%s, user_id=%s, phone=%s, lang=%s", session_id, message, current_step, user_id, phone, language)
         
         # Si es "menu" o "menú", volver al menú principal
         if message_clean in ['menu', 'menú', 'inicio', 'start', '0']:
@@ -90,13 +94,13 @@ class MenuSystem:
         # Si es un número, procesarlo según el paso actual
         if message_clean.isdigit():
             button_num = int(message_clean)
-            print(f"[MENU_SYSTEM] Mensaje numérico detectado: {button_num}, step actual: {current_step}")
+            logger.debug('[MENU_SYSTEM] Mensaje numérico detectado: %s, step actual: %s', button_num, current_step)
             result = self._handle_numeric_input(session_id, button_num, context, user_id, phone)
-            print(f"[MENU_SYSTEM] Resultado de _handle_numeric_input: tiene response={bool(result.get('response'))}")
+            logger.debug('[MENU_SYSTEM] Resultado de _handle_numeric_input: tiene response=%s', bool(result.get('response')))
             return result
         
         # Si no es número ni comando reconocido, mostrar menú y pedir número
-        print(f"[MENU_SYSTEM] Mensaje no reconocido, mostrando menú por defecto")
+        logger.debug('[MENU_SYSTEM] Mensaje no reconocido, mostrando menú por defecto')
         return {
             'response': f"{language_service.t('agent_fallback', language)}\n\n{self.get_main_menu(language)}",
             'action': None,
@@ -108,14 +112,14 @@ class MenuSystem:
                              context: Dict, user_id: str, phone: str) -> Dict:
         """Maneja entrada numérica según el paso actual"""
         current_step = context.get('step', 'menu_principal')
-        print(f"[MENU_SYSTEM] Procesando entrada numérica: button_num={button_num}, current_step={current_step}")
+        logger.debug('[MENU_SYSTEM] Procesando entrada numérica: button_num=%s, current_step=%s', button_num, current_step)
         
         # Menú principal
         if current_step == 'menu_principal' or current_step == 'inicial':
             if button_num == 1:
-                print(f"[MENU_SYSTEM] Opción 1 seleccionada - Agendar cita")
+                logger.debug('[MENU_SYSTEM] Opción 1 seleccionada - Agendar cita')
                 result = self._handle_schedule_appointment(session_id, context, user_id, phone)
-                print(f"[MENU_SYSTEM] Resultado de _handle_schedule_appointment: {result.get('response', '')[:100] if result.get('response') else 'SIN RESPUESTA'}")
+                logger.debug('[MENU_SYSTEM] Resultado de _handle_schedule_appointment: %s', result.get('response', '')[:100] if result.get('response') else 'SIN RESPUESTA')
                 return result
             elif button_num == 2:
                 return self._handle_view_appointments(context, user_id, phone)
@@ -293,6 +297,11 @@ class MenuSystem:
                     hora_seleccionada = slot_seleccionado.get('horaInicio', slot_seleccionado.get('inicio', ''))
                 else:
                     hora_seleccionada = str(slot_seleccionado)
+                if not self._hold_selected_time(context, user_id, hora_seleccionada):
+                    # Otro paciente lo apartó mientras tanto: volver a mostrar horarios
+                    result = self._show_available_times(context, user_id, phone, context.get('fecha_seleccionada'))
+                    result['response'] = f"{language_service.t('slot_taken', language)}\n\n{result['response']}"
+                    return result
                 context['hora_seleccionada'] = hora_seleccionada
                 context['step'] = 'seleccionando_metodo_pago'
                 return self._show_payment_methods(context)
@@ -770,7 +779,7 @@ class MenuSystem:
     def _handle_schedule_appointment(self, session_id: str, context: Dict,
                                     user_id: str, phone: str) -> Dict:
         """Opción 1: Agendar cita - Flujo completo desde selección de consultorio"""
-        print(f"[MENU_SYSTEM] _handle_schedule_appointment - user_id={user_id}, phone={phone}")
+        logger.debug('[MENU_SYSTEM] _handle_schedule_appointment - user_id=%s, phone=%s', user_id, phone)
         
         language = context.get('language', 'es')
         context['step'] = 'seleccionando_consultorio'
@@ -816,9 +825,7 @@ class MenuSystem:
                 'mode': 'menu'
             }
         except Exception as e:
-            print(f"[MENU_SYSTEM] Error en _handle_schedule_appointment: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception('[MENU_SYSTEM] Error en _handle_schedule_appointment: %s', e)
             return {
                 'response': f"{language_service.t('error_generic', language)}\n\n{language_service.t('type_menu', language)}",
                 'action': None,
@@ -882,9 +889,7 @@ class MenuSystem:
                 'mode': 'menu'
             }
         except Exception as e:
-            print(f"[MENU_SYSTEM] Error getting dentists: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception('[MENU_SYSTEM] Error getting dentists: %s', e)
             return {
                 'response': f"{language_service.t('error_generic', language)}\n\n{language_service.t('type_menu', language)}",
                 'action': None,
@@ -929,9 +934,7 @@ class MenuSystem:
                 'mode': 'menu'
             }
         except Exception as e:
-            print(f"[MENU_SYSTEM] Error getting services: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception('[MENU_SYSTEM] Error getting services: %s', e)
             return {
                 'response': f"{language_service.t('error_generic', language)}\n\n{language_service.t('type_menu', language)}",
                 'action': None,
@@ -966,7 +969,7 @@ class MenuSystem:
                 'mode': 'menu'
             }
         except Exception as e:
-            print(f"Error obteniendo citas: {e}")
+            logger.error('Error obteniendo citas: %s', e)
             return {
                 'response': f"{language_service.t('error_fetching_appointments', language)}\n\n{language_service.t('type_menu', language)}",
                 'action': None,
@@ -1005,7 +1008,7 @@ class MenuSystem:
                 'mode': 'menu'
             }
         except Exception as e:
-            print(f"Error obteniendo citas para reagendar: {e}")
+            logger.error('Error obteniendo citas para reagendar: %s', e)
             return {
                 'response': f"{language_service.t('error_fetching_appointments', language)}\n\n{language_service.t('type_menu', language)}",
                 'action': None,
@@ -1044,7 +1047,7 @@ class MenuSystem:
                 'mode': 'menu'
             }
         except Exception as e:
-            print(f"Error obteniendo citas para cancelar: {e}")
+            logger.error('Error obteniendo citas para cancelar: %s', e)
             return {
                 'response': f"{language_service.t('error_fetching_appointments', language)}\n\n{language_service.t('type_menu', language)}",
                 'action': None,
@@ -1058,18 +1061,12 @@ class MenuSystem:
         context['step'] = 'menu_historial_medico'
         
         # Obtener datos del historial médico
-        historial_result = self.firebase_service.get_medical_history(user_id=user_id, phone=phone)
+        historial_result = self.firebase_service.get_medical_history_view(user_id=user_id, phone=phone)
         
         status_text = ""
         if historial_result.get('success'):
-            data = historial_result.get('data', {})
-            # Robust get for completeness
-            completitud = self._get_field_robust(data, ['completeness', 'completitud'], 0)
-            
-            try:
-                completitud = int(float(completitud))
-            except:
-                completitud = 0
+            # La completitud solo prueba presencia de campos, sin desencriptar
+            completitud = historial_result['view'].completeness()
             
             status_label = language_service.t('status', language)
             
@@ -1124,7 +1121,7 @@ class MenuSystem:
             pending_count = len(pending_reviews)
             context['citas_pendientes_resena'] = pending_reviews
         except Exception as e:
-            print(f"Error checking pending reviews: {e}")
+            logger.error('Error checking pending reviews: %s', e)
         
         pending_text = ""
         if pending_count > 0:
@@ -1192,7 +1189,7 @@ class MenuSystem:
             dentista_id = context.get('dentista_id')
             consultorio_id = context.get('consultorio_id')
             
-            print(f"[MENU_SYSTEM] _show_available_dates_for_appointment - dentista_id={dentista_id}, consultorio_id={consultorio_id}")
+            logger.debug('[MENU_SYSTEM] _show_available_dates_for_appointment - dentista_id=%s, consultorio_id=%s', dentista_id, consultorio_id)
             
             if not dentista_id or not consultorio_id:
                 return {
@@ -1204,13 +1201,13 @@ class MenuSystem:
             
             # Obtener fechas disponibles directamente usando el repositorio con los IDs del contexto
             from database.models import CitaRepository
-            cita_repo = CitaRepository()
+            cita_repo = shared(CitaRepository)
             from datetime import datetime
             
             fecha_base = datetime.now()
             fecha_timestamp = datetime.combine(fecha_base.date(), datetime.min.time())
             
-            print(f"[MENU_SYSTEM] Obteniendo fechas para dentista {dentista_id}, consultorio {consultorio_id}")
+            logger.debug('[MENU_SYSTEM] Obteniendo fechas para dentista %s, consultorio %s', dentista_id, consultorio_id)
             fechas = cita_repo.obtener_fechas_disponibles(
                 dentista_id,
                 consultorio_id,
@@ -1218,7 +1215,7 @@ class MenuSystem:
                 cantidad=5
             )
             
-            print(f"[MENU_SYSTEM] Fechas obtenidas: {len(fechas) if fechas else 0}")
+            logger.debug('[MENU_SYSTEM] Fechas obtenidas: %s', len(fechas) if fechas else 0)
             context['fechas_disponibles'] = fechas or []
             
             if not fechas or len(fechas) == 0:
@@ -1247,9 +1244,7 @@ class MenuSystem:
                 'mode': 'menu'
             }
         except Exception as e:
-            print(f"[MENU_SYSTEM] Error obteniendo fechas: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception('[MENU_SYSTEM] Error obteniendo fechas: %s', e)
             return {
                 'response': f"{language_service.t('error_generic', language)}\n\n{language_service.t('type_menu', language)}",
                 'action': None,
@@ -1414,7 +1409,7 @@ class MenuSystem:
                 'mode': 'menu'
             }
         except Exception as e:
-            print(f"Error solicitando OTP: {e}")
+            logger.error('Error solicitando OTP: %s', e)
             return {
                 'response': 'Error al enviar código de verificación. Por favor intenta más tarde.\n\nEscribe "menu" para volver.',
                 'action': None,
@@ -1450,16 +1445,14 @@ class MenuSystem:
             if docs:
                 # Actualizar acceso existente
                 docs[0].reference.update(acceso_data)
-                print(f"Acceso al historial médico actualizado: Nivel {nivel}")
+                logger.debug('Acceso al historial médico actualizado: Nivel %s', nivel)
             else:
                 # Crear nuevo acceso
                 accesos_ref.add(acceso_data)
-                print(f"Acceso al historial médico otorgado: Nivel {nivel}")
+                logger.debug('Acceso al historial médico otorgado: Nivel %s', nivel)
                 
         except Exception as e:
-            print(f"Error otorgando acceso al historial médico: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception('Error otorgando acceso al historial médico: %s', e)
             # No lanzar excepción, solo loggear
     
     def _verify_otp_and_confirm(self, session_id: str, context: Dict, user_id: str, phone: str, otp_code: str) -> Dict:
@@ -1494,9 +1487,7 @@ class MenuSystem:
             return self._confirm_appointment(session_id, context, user_id, phone)
             
         except Exception as e:
-            print(f"Error verificando OTP: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception('Error verificando OTP: %s', e)
             return {
                 'response': 'Error al verificar código. Por favor intenta más tarde.\n\nEscribe "menu" para volver.',
                 'action': None,
@@ -1532,14 +1523,14 @@ class MenuSystem:
             
             # Usar el método de CitaRepository que tiene la misma lógica que la web
             from database.models import CitaRepository
-            cita_repo = CitaRepository()
+            cita_repo = shared(CitaRepository)
             
             # Crear datetime con timezone para pasar a obtener_horarios_disponibles
             # La función solo necesita un objeto con .timestamp() method
             from datetime import datetime, timezone
             fecha_midnight = datetime(fecha_dt.year, fecha_dt.month, fecha_dt.day, 12, 0, 0, tzinfo=timezone.utc)
             
-            print(f"[MENU_SYSTEM] Getting horarios for dentista={dentista_id}, consultorio={consultorio_id}, fecha={fecha_midnight}")
+            logger.debug('[MENU_SYSTEM] Getting horarios for dentista=%s, consultorio=%s, fecha=%s', dentista_id, consultorio_id, fecha_midnight)
             
             horarios_slots = cita_repo.obtener_horarios_disponibles(
                 dentista_id,
@@ -1547,7 +1538,10 @@ class MenuSystem:
                 fecha_midnight  # datetime tiene .timestamp() method
             )
             
-            print(f"[MENU_SYSTEM] Horarios slots received: {len(horarios_slots) if horarios_slots else 0}")
+            logger.debug('[MENU_SYSTEM] Horarios slots received: %s', len(horarios_slots) if horarios_slots else 0)
+            
+            # Ocultar horarios apartados por otros pacientes que están agendando
+            horarios_slots = self._without_held_slots(horarios_slots, dentista_id, fecha_dt, user_id)
             
             # Convertir slots a formato de texto para mostrar
             if not horarios_slots or len(horarios_slots) == 0:
@@ -1579,9 +1573,7 @@ class MenuSystem:
                 'mode': 'menu'
             }
         except Exception as e:
-            print(f"[MENU_SYSTEM] Error obteniendo horarios: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception('[MENU_SYSTEM] Error obteniendo horarios: %s', e)
             return {
                 'response': f"{language_service.t('error_generic', language)}\n\n{language_service.t('type_menu', language)}",
                 'action': None,
@@ -1589,6 +1581,46 @@ class MenuSystem:
                 'mode': 'menu'
             }
     
+    def _without_held_slots(self, horarios_slots, dentista_id: str, fecha, user_id: str):
+        """Quita los horarios con hold vigente de otro usuario (una lectura por fecha)"""
+        if not horarios_slots:
+            return horarios_slots
+        try:
+            from database import slots
+            horas = [slot.get('horaInicio', slot.get('inicio', '')) for slot in horarios_slots]
+            apartados = slots.slots_apartados_por_otros(
+                self.db, dentista_id, [slots.fecha_hora_de(fecha, hora) for hora in horas], user_id or '')
+            return [slot for slot, hora in zip(horarios_slots, horas)
+                    if slots.fecha_hora_de(fecha, hora).strftime('%Y%m%dT%H%M') not in apartados]
+        except Exception as e:
+            logger.error('[MENU_SYSTEM] Error consultando horarios apartados: %s', e)
+            return horarios_slots
+    
+    def _hold_selected_time(self, context: Dict, user_id: str, hora: str) -> bool:
+        """
+        Aparta el horario elegido mientras el usuario termina el flujo; si lo abandona,
+        el hold expira solo. False si otro paciente ya lo tiene.
+        """
+        dentista_id = context.get('dentista_id')
+        fecha = context.get('fecha_seleccionada')
+        if not (user_id and dentista_id and fecha and hora):
+            return True
+        try:
+            from database import slots
+            fecha_hora = slots.fecha_hora_de(fecha, hora)
+            anterior = context.pop('slot_apartado', None)
+            if anterior and anterior != {'dentistaId': dentista_id, 'fechaHora': fecha_hora.isoformat()}:
+                slots.liberar_slot(self.db, anterior['dentistaId'],
+                                   datetime.fromisoformat(anterior['fechaHora']), user_id)
+            if not slots.apartar_slot(self.db, dentista_id, fecha_hora, user_id):
+                return False
+            context['slot_apartado'] = {'dentistaId': dentista_id, 'fechaHora': fecha_hora.isoformat()}
+            return True
+        except Exception as e:
+            # Sin hold, la reserva transaccional al confirmar sigue evitando la doble cita
+            logger.error('[MENU_SYSTEM] Error apartando horario: %s', e)
+            return True
+    
     def _show_available_dates_for_reschedule(self, context: Dict, user_id: str, phone: str) -> Dict:
         """Muestra fechas disponibles para reagendar - Usa dentista/consultorio de la cita original"""
         try:
@@ -1597,12 +1629,12 @@ class MenuSystem:
             dentista_id = cita_reagendar.get('dentistaId')
             consultorio_id = cita_reagendar.get('consultorioId')
             
-            print(f"[_show_available_dates_for_reschedule] cita_reagendar={cita_reagendar}")
-            print(f"[_show_available_dates_for_reschedule] dentista_id={dentista_id}, consultorio_id={consultorio_id}")
+            logger.debug('[_show_available_dates_for_reschedule] cita_reagendar=%s', cita_reagendar)
+            logger.debug('[_show_available_dates_for_reschedule] dentista_id=%s, consultorio_id=%s', dentista_id, consultorio_id)
             
             from database.models import CitaRepository
             from datetime import datetime
-            cita_repo = CitaRepository()
+            cita_repo = shared(CitaRepository)
             fechas = []
             
             # Si tenemos dentista y consultorio, obtener fechas directamente
@@ -1622,7 +1654,7 @@ class MenuSystem:
             
             # Si no hay fechas o no tenemos dentista/consultorio, buscar en el primer consultorio disponible
             if not fechas:
-                print(f"[_show_available_dates_for_reschedule] Buscando fechas alternativas...")
+                logger.debug('[_show_available_dates_for_reschedule] Buscando fechas alternativas...')
                 try:
                     # Buscar el primer consultorio con disponibilidad
                     consultorios = list(self.db.collection('consultorios').limit(3).stream())
@@ -1651,14 +1683,14 @@ class MenuSystem:
                                 fechas = fechas_temp
                                 context['dentista_id'] = dent_id
                                 context['consultorio_id'] = cons_id
-                                print(f"[_show_available_dates_for_reschedule] Encontradas {len(fechas)} fechas en consultorio {cons_id}, dentista {dent_id}")
+                                logger.debug('[_show_available_dates_for_reschedule] Encontradas %s fechas en consultorio %s, dentista %s', len(fechas), cons_id, dent_id)
                                 break
                         
                         if fechas:
                             break
                             
                 except Exception as inner_e:
-                    print(f"[_show_available_dates_for_reschedule] Error en fallback: {inner_e}")
+                    logger.error('[_show_available_dates_for_reschedule] Error en fallback: %s', inner_e)
             
             context['fechas_disponibles'] = fechas
             
@@ -1683,9 +1715,7 @@ class MenuSystem:
                 'mode': 'menu'
             }
         except Exception as e:
-            print(f"Error obteniendo fechas para reagendar: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception('Error obteniendo fechas para reagendar: %s', e)
             return {
                 'response': f"{language_service.t('error_generic', language)}\n\n{language_service.t('type_menu', language)}",
                 'action': None,
@@ -1753,7 +1783,7 @@ class MenuSystem:
                     try:
                         self._grant_medical_history_access(user_id, dentista_id, nivel_acceso)
                     except Exception as e:
-                        print(f"Error registrando acceso al historial médico: {e}")
+                        logger.error('Error registrando acceso al historial médico: %s', e)
                         # No fallar la creación de la cita si esto falla
                 
                 # Mensaje de confirmación completo (RF6, RF9)
@@ -1793,9 +1823,7 @@ class MenuSystem:
                     'mode': 'menu'
                 }
         except Exception as e:
-            print(f"Error confirmando cita: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception('Error confirmando cita: %s', e)
             return {
                 'response': 'Error al confirmar la cita. Por favor intenta más tarde.\n\nEscribe "menu" para volver.',
                 'action': None,
@@ -1892,7 +1920,7 @@ class MenuSystem:
                     'mode': 'menu'
                 }
         except Exception as e:
-            print(f"Error confirmando reagendamiento: {e}")
+            logger.error('Error confirmando reagendamiento: %s', e)
             return {
                 'response': f"{language_service.t('error_generic', language)}\n\n{language_service.t('type_menu', language)}",
                 'action': None,
@@ -1945,7 +1973,7 @@ class MenuSystem:
                     'mode': 'menu'
                 }
         except Exception as e:
-            print(f"Error ejecutando cancelación: {e}")
+            logger.error('Error ejecutando cancelación: %s', e)
             return {
                 'response': f"{language_service.t('error_generic', language)}\n\n{language_service.t('type_menu', language)}",
                 'action': None,
@@ -1968,14 +1996,15 @@ class MenuSystem:
         """Muestra datos personales (Tab 1)"""
         language = context.get('language', 'es')
         try:
-            result = self.firebase_service.get_medical_history(user_id=user_id, phone=phone)
+            result = self.firebase_service.get_medical_history_view(user_id=user_id, phone=phone)
             
             back_mh = language_service.t('back_to_mh', language)
             
             if not result.get('success'):
                 return self._error_response(language, back_mh)
             
-            data = result.get('data', {})
+            # Solo se desencriptan los campos de esta pestaña
+            data = result['view'].personal_data()
             
             # Extract fields robustly
             nombre = self._get_field_robust(data, ['nombreCompleto', 'nombre', 'Nombre'], language_service.t('none_registered', language))
@@ -2015,20 +2044,21 @@ class MenuSystem:
                 'mode': 'menu'
             }
         except Exception as e:
-            print(f"Error mostrando datos personales: {e}")
+            logger.error('Error mostrando datos personales: %s', e)
             return self._error_response(language, "Volver")
 
     def _show_medical_details(self, context: Dict, user_id: str, phone: str) -> Dict:
         """Muestra información médica detallada: Alergias, Enfermedades, Medicamentos (Tab 2)"""
         language = context.get('language', 'es')
         try:
-            result = self.firebase_service.get_medical_history(user_id=user_id, phone=phone)
+            result = self.firebase_service.get_medical_history_view(user_id=user_id, phone=phone)
             back_mh = language_service.t('back_to_mh', language)
             
             if not result.get('success'):
                 return self._error_response(language, back_mh)
             
-            data = result.get('data', {})
+            # Solo se desencriptan los campos de esta pestaña
+            data = result['view'].medical_details()
             
             # Robust extraction - include medicamentosActuales (how web saves it)
             alergias = self._get_field_robust(data, ['alergias', 'allergies', 'Alergias'], [])
@@ -2075,20 +2105,21 @@ class MenuSystem:
                 'mode': 'menu'
             }
         except Exception as e:
-            print(f"Error mostrando detalles médicos: {e}")
+            logger.error('Error mostrando detalles médicos: %s', e)
             return self._error_response(language, "Volver")
 
     def _show_dental_history(self, context: Dict, user_id: str, phone: str) -> Dict:
         """Muestra historia dental (Tab 3)"""
         language = context.get('language', 'es')
         try:
-            result = self.firebase_service.get_medical_history(user_id=user_id, phone=phone)
+            result = self.firebase_service.get_medical_history_view(user_id=user_id, phone=phone)
             back_mh = language_service.t('back_to_mh', language)
             
             if not result.get('success'):
                 return self._error_response(language, back_mh)
             
-            data = result.get('data', {})
+            # Solo se desencriptan los campos de esta pestaña
+            data = result['view'].dental_history()
             
             # Extract dental fields with translations for defaults
             motivo = self._get_field_robust(data, ['motivoConsulta', 'reasonForVisit'], language_service.t('reason_not_specified', language))
@@ -2119,27 +2150,21 @@ class MenuSystem:
                 'mode': 'menu'
             }
         except Exception as e:
-            print(f"Error mostrando historia dental: {e}")
+            logger.error('Error mostrando historia dental: %s', e)
             return self._error_response(language, "Volver")
 
     def _show_medical_completeness(self, context: Dict, user_id: str, phone: str) -> Dict:
         """Muestra porcentaje de completitud (Tab 4)"""
         language = context.get('language', 'es')
         try:
-            result = self.firebase_service.get_medical_history(user_id=user_id, phone=phone)
+            result = self.firebase_service.get_medical_history_view(user_id=user_id, phone=phone)
             back_mh = language_service.t('back_to_mh', language)
             
             if not result.get('success'):
                 return self._error_response(language, back_mh)
             
-            data = result.get('data', {})
-            # Robust extraction of completeness
-            completitud = self._get_field_robust(data, ['completeness', 'completitud'], 0)
-            
-            try:
-                completitud = int(float(completitud))
-            except:
-                completitud = 0
+            # Solo prueba presencia de campos, sin desencriptar
+            completitud = result['view'].completeness()
             
             # Barra de progreso visual
             filled = int(completitud / 10)
@@ -2176,7 +2201,7 @@ class MenuSystem:
                 'mode': 'menu'
             }
         except Exception as e:
-            print(f"Error mostrando completitud: {e}")
+            logger.error('Error mostrando completitud: %s', e)
             return self._error_response(language, "Volver")
 
     def _error_response(self, language, back_text):
@@ -2229,7 +2254,7 @@ Total: {len(reviews)}
                 'mode': 'menu'
             }
         except Exception as e:
-            print(f"Error mostrando reseñas: {e}")
+            logger.error('Error mostrando reseñas: %s', e)
             return {
                 'response': f"{language_service.t('error_generic', language)}\n\n*9.* {language_service.t('back_to_reviews', language)}\n*0.* {language_service.t('menu_opt_exit', language)}",
                 'action': None,
@@ -2279,7 +2304,7 @@ Total: {len(reviews)}
                 'mode': 'menu'
             }
         except Exception as e:
-            print(f"Error mostrando citas pendientes: {e}")
+            logger.error('Error mostrando citas pendientes: %s', e)
             return {
                 'response': f"{language_service.t('error_generic', language)}\n\n{language_service.t('type_menu', language)}",
                 'action': None,
@@ -2349,7 +2374,7 @@ Total: {len(reviews)}
                     'mode': 'menu'
                 }
         except Exception as e:
-            print(f"Error enviando reseña: {e}")
+            logger.error('Error enviando reseña: %s', e)
             return {
                 'response': f"{language_service.t('error_generic', language)}\n\n{language_service.t('type_menu', language)}",
                 'action': None,
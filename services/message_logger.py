@@ -5,6 +5,7 @@ from database.database import FirebaseConfig
 from datetime import datetime
 from typing import Dict, Optional
 from google.cloud.firestore import SERVER_TIMESTAMP
+from services.registry import lazy_service
 
 class MessageLogger:
     """
@@ -107,5 +108,5 @@ class MessageLogger:
             }
 
 # Instancia global
-message_logger = MessageLogger()
+message_logger = lazy_service('message_logger', MessageLogger)
 
@@ -4,10 +4,17 @@ Usa modelos potentes de OpenAI y Hugging Face para procesamiento de lenguaje nat
 """
 
 import os
-import requests
 import json
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 from datetime import datetime
+from services.entity_extractor import entity_extractor
+from services.hf_inference import create_inference_client
+from services.knowledge_index import knowledge_index
+from services.tracing import traced
+from services.prompt_builder import (
+    prompt_builder, token_usage_tracker,
+    CALL_INTENT, CALL_ENTITIES, CALL_RESPONSE, CALL_QA, CALL_OTHER
+)
 
 class MLService:
     """
@@ -18,6 +25,7 @@ class MLService:
         # Hugging Face API (gratis, sin API key requerida para modelos públicos)
         self.hf_api_url = "https://api-inference.huggingface.co/models"
         self.hf_api_key = os.getenv("HUGGINGFACE_API_KEY", "")  # Opcional, mejora rate limits
+        self.hf_client = create_inference_client(self.hf_api_url, self.hf_api_key)
         
         # Modelos gratuitos de Hugging Face
         self.intent_model = "microsoft/DialoGPT-medium"  # Para conversación
@@ -33,6 +41,9 @@ class MLService:
         # MEJORADO: Usar gpt-4o por defecto para mejor comprensión
         self.openai_model = os.getenv("OPENAI_MODEL", "gpt-4o")
         
+        # Cliente de OpenAI reutilizado entre llamadas (conexiones keep-alive)
+        self._openai_client = None
+        
         # Cache para evitar llamadas repetidas (con TTL de 5 minutos)
         self.cache = {}
         self.cache_ttl = {}  # Timestamps de cuándo expira cada entrada
@@ -45,54 +56,47 @@ class MLService:
         
         print(f"MLService inicializado - OpenAI habilitado: {self.use_openai}, Modelo: {self.openai_model}")
     
-    def _call_huggingface(self, model: str, inputs: str, task: str = "text-generation") -> Optional[Dict]:
-        """Llama a la API de Hugging Face"""
+    @traced('huggingface')
+    def _call_huggingface(self, model: str, inputs: str, task: str = "text-generation",
+                          deadline: float = None) -> Optional[Dict]:
+        """
+        Llama a la API de Hugging Face
+        Nunca duerme esperando un modelo frío: si está cargando retorna None y se calienta
+        en segundo plano. Los errores transitorios se reintentan dentro del deadline.
+        """
         try:
-            url = f"{self.hf_api_url}/{model}"
-            headers = {
-                "Content-Type": "application/json"
-            }
-            
-            if self.hf_api_key:
-                headers["Authorization"] = f"Bearer {self.hf_api_key}"
-            
-            payload = {
-                "inputs": inputs,
-                "parameters": {
-                    "max_length": 150,
-                    "temperature": 0.7,
-                    "return_full_text": False
-                }
-            }
-            
-            response = requests.post(url, headers=headers, json=payload, timeout=10)
-            
-            if response.status_code == 200:
-                return response.json()
-            elif response.status_code == 503:
-                # Modelo cargándose, esperar un poco
-                print(f"Modelo {model} cargándose, esperando...")
-                import time
-                time.sleep(5)
-                return self._call_huggingface(model, inputs, task)
-            else:
-                print(f"Error llamando Hugging Face: {response.status_code} - {response.text}")
-                return None
-                
+            return self.hf_client.infer(model, inputs, parameters={
+                "max_length": 150,
+                "temperature": 0.7,
+                "return_full_text": False
+            }, deadline=deadline)
         except Exception as e:
             print(f"Error en _call_huggingface: {e}")
             return None
     
+    def _get_openai_client(self):
+        """Cliente de OpenAI perezoso, se crea una sola vez por proceso"""
+        if self._openai_client is None:
+            from openai import OpenAI
+            self._openai_client = OpenAI(api_key=self.openai_api_key)
+        return self._openai_client
+    
+    @traced('openai')
     def _call_openai(self, prompt: str, system_prompt: str = None, 
                     messages: List[Dict] = None, model: str = None,
-                    max_tokens: int = 500, temperature: float = 0.7) -> Optional[str]:
-        """Llama a OpenAI API mejorada - Versión actualizada"""
+                    max_tokens: int = 500, temperature: float = 0.7,
+                    call_type: str = CALL_OTHER,
+                    stream_callback: Callable[[str], None] = None) -> Optional[str]:
+        """
+        Llama a OpenAI API mejorada - Versión actualizada
+        Si se pasa stream_callback, la respuesta se pide en streaming y cada fragmento
+        de texto se entrega al callback conforme llega; igual se retorna el texto completo.
+        """
         if not self.use_openai:
             return None
             
         try:
-            from openai import OpenAI
-            client = OpenAI(api_key=self.openai_api_key)
+            client = self._get_openai_client()
             
             # Usar mensajes proporcionados o construir desde prompt
             if messages is None:
@@ -106,6 +110,10 @@ class MLService:
             # Usar modelo configurado o el pasado como parámetro
             model_to_use = model or self.openai_model
             
+            if stream_callback:
+                return self._stream_openai(client, model_to_use, messages_list, max_tokens,
+                                           temperature, call_type, stream_callback)
+            
             response = client.chat.completions.create(
                 model=model_to_use,
                 messages=messages_list,
@@ -113,6 +121,9 @@ class MLService:
                 temperature=temperature
             )
             
+            # Conteo de tokens por tipo de llamada
+            token_usage_tracker.record(call_type, getattr(response, 'usage', None))
+            
             return response.choices[0].message.content.strip()
             
         except Exception as e:
@@ -121,6 +132,47 @@ class MLService:
             traceback.print_exc()
             return None
     
+    def _stream_openai(self, client, model: str, messages: List[Dict], max_tokens: int,
+                       temperature: float, call_type: str,
+                       stream_callback: Callable[[str], None]) -> Optional[str]:
+        """Consume la respuesta de OpenAI en streaming reenviando cada fragmento al callback"""
+        stream = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        
+        parts = []
+        callback_ok = True
+        for chunk in stream:
+            # El último chunk trae el uso de tokens y no trae choices
+            if getattr(chunk, 'usage', None):
+                token_usage_tracker.record(call_type, chunk.usage)
+            if not chunk.choices:
+                continue
+            text = chunk.choices[0].delta.content
+            if not text:
+                continue
+            parts.append(text)
+            if callback_ok:
+                try:
+                    stream_callback(text)
+                except Exception as e:
+                    # El cliente pudo desconectarse; terminar de leer para tener la respuesta completa
+                    print(f"Error en stream_callback, se deja de reenviar: {e}")
+                    callback_ok = False
+        
+        full_text = ''.join(parts).strip()
+        return full_text or None
+    
+    def get_token_usage(self) -> Dict:
+        """Tokens de prompt/completion acumulados por tipo de llamada"""
+        return token_usage_tracker.get_stats()
+    
+    @traced('ml.classify_intent')
     def classify_intent(self, message: str, context: Dict = None) -> Dict:
         """
         Clasifica la intención del mensaje usando ML mejorado
@@ -300,88 +352,13 @@ class MLService:
                 last_messages = context['history'][-3:]  # Últimos 3 mensajes
                 context_info += f"\nHistorial reciente: {', '.join([m.get('message', '')[:50] for m in last_messages])}"
         
-        system_prompt = """Eres un clasificador de intenciones EXPERTO y MUY INTELIGENTE para Densora, el asistente dental más avanzado de México.
-
-Tu trabajo es analizar CUIDADOSAMENTE el mensaje del usuario y clasificarlo en UNA categoría, considerando:
-1. El contexto de la conversación (si está disponible)
-2. Las palabras exactas que usa el usuario
-3. La intención IMPLÍCITA detrás del mensaje
-4. Conversaciones naturales y coloquiales
-
-CATEGORÍAS (elige la MÁS APROPIADA):
-
-agendar_cita: El usuario quiere CREAR una cita nueva
-  Ejemplos: "quiero una cita", "necesito agendar", "puedo ir mañana?", "tienes horario el lunes?", 
-           "me gustaría ver al doctor", "tengo dolor de muela", "necesito un dentista",
-           "cuándo puedo ir?", "está disponible el doctor juan?"
-
-reagendar_cita: El usuario quiere CAMBIAR una cita existente
-  Ejemplos: "cambiar mi cita", "mover la cita del 15", "puedo cambiar de hora?",
-           "mejor otro día", "no puedo ese día", "reagendar"
-
-cancelar_cita: El usuario quiere ELIMINAR una cita
-  Ejemplos: "cancelar mi cita", "no puedo ir", "anular", "borrar cita",
-           "ya no quiero la cita", "tengo que cancelar"
-
-ver_citas: El usuario quiere VER sus citas
-  Ejemplos: "mis citas", "qué citas tengo", "cuándo es mi cita", "cuándo tengo cita",
-           "a qué hora es", "para cuándo está programada", "cuál es mi próxima cita"
-
-consultar_informacion: El usuario quiere INFORMACIÓN
-  Ejemplos: "qué es densora", "cómo funciona", "cuánto cuesta", "qué servicios hay",
-           "horarios", "ubicación", "métodos de pago", "precios"
-
-confirmar_pago: El usuario menciona que YA PAGÓ
-  Ejemplos: "ya pagué", "ya hice el pago", "transferí", "confirmo el pago", "pagado"
-
-consultar_tiempo_pago: El usuario pregunta sobre TIEMPO para pagar
-  Ejemplos: "cuánto tiempo tengo para pagar", "cuándo vence el pago", "deadline de pago",
-           "hasta cuándo puedo pagar", "me queda tiempo"
-
-ver_historial: El usuario quiere ver HISTORIAL completo
-  Ejemplos: "historial", "citas anteriores", "citas pasadas", "registro", "mi histórico"
-
-consultar_servicios: El usuario pregunta por SERVICIOS específicos
-  Ejemplos: "qué servicios ofrecen", "hacen ortodoncia?", "tienen implantes?",
-           "limpiezas dentales", "blanqueamiento"
-
-saludar: SOLO saludos iniciales
-  Ejemplos: "hola", "buenos días", "buenas tardes", "hola densora", "hey", "qué tal"
-
-ayuda: SOLO pide ayuda explícita
-  Ejemplos: "ayuda", "qué puedo hacer", "opciones", "menú", "comandos", "necesito ayuda"
-
-despedirse: Usuario se despide
-  Ejemplos: "adiós", "hasta luego", "gracias", "chao", "nos vemos", "bye"
-
-buscar_dentista: El usuario quiere BUSCAR o encontrar un profesional
-  Ejemplos: "busco dentista", "necesito ortodoncista", "hay doctores en el centro?", "recomienda un doctor"
-
-ver_resenas: El usuario quiere ver OPINIONES o CALIFICACIONES
-  Ejemplos: "qué tal es el dr juan?", "ver reseñas", "tiene buenas opiniones?", "qué dicen los pacientes"
-
-confirmar_pago: El usuario quiere reportar que YA PAGÓ
-  Ejemplos: "ya deposité", "aquí está mi comprobante", "ya hice la transferencia", "confirmar mi pago"
-
-urgencia: El usuario tiene DOLOR, SANGRADO o una EMERGENCIA médica
-  Ejemplos: "me duele mucho la muela", "estoy sangrando", "se me cayó un diente", "ayuda urgente"
-
-otro: Si REALMENTE no encaja en ninguna (úsalo poco)
-
-REGLAS CRITICAS:
-- Si menciona FECHA u HORA junto con dentista/doctor/cita => agendar_cita
-- Si menciona "cambiar" o "mover" + cita => reagendar_cita
-- Si menciona "cancelar" o "no puedo ir" => cancelar_cita
-- Si pregunta "cuando" o "que citas" => ver_citas
-- Si menciona dolor/problema dental => agendar_cita (quiere atencion)
-- Si es ambiguo, PRIORIZA la accion mas util para el usuario
-
-FORMATO DE RESPUESTA: Responde SOLO con la intención en minúsculas (ej: "agendar_cita"), SIN puntos ni explicaciones."""
-        
         prompt = f"Mensaje del usuario: {message}{context_info}\n\n¿Cuál es la intención?"
         
         if self.use_openai:
-            response = self._call_openai(prompt, system_prompt, max_tokens=50, temperature=0.3)
+            # El prefijo de sistema es estático; el contexto va en el mensaje del usuario
+            messages = prompt_builder.build_messages(CALL_INTENT, prompt)
+            response = self._call_openai("", messages=messages, max_tokens=50,
+                                         temperature=0.3, call_type=CALL_INTENT)
             if response:
                 intent = response.strip().lower()
                 # Limpiar respuesta (puede venir con explicaciones)
@@ -406,102 +383,7 @@ FORMATO DE RESPUESTA: Responde SOLO con la intención en minúsculas (ej: "agend
         if not self.use_openai:
             return None
         
-        # Obtener fecha actual para contexto
-        from datetime import datetime, timedelta
-        fecha_actual = datetime.now()
-        fecha_hoy = fecha_actual.strftime('%Y-%m-%d')
-        dia_semana_hoy = fecha_actual.strftime('%A')  # Monday, Tuesday, etc.
-        fecha_manana = (fecha_actual + timedelta(days=1)).strftime('%Y-%m-%d')
-        fecha_pasado_manana = (fecha_actual + timedelta(days=2)).strftime('%Y-%m-%d')
-        
-        system_prompt = f"""Eres un extractor de entidades SUPER INTELIGENTE y PRECISO para Densora.
-
-CONTEXTO TEMPORAL ACTUAL:
-- HOY es: {fecha_hoy} ({dia_semana_hoy})
-- Día de la semana actual: {fecha_actual.weekday()} (0=Lunes, 1=Martes, 2=Miércoles, 3=Jueves, 4=Viernes, 5=Sábado, 6=Domingo)
-- Mañana sería: {fecha_manana}
-- Pasado mañana: {fecha_pasado_manana}
-
-Tu misión es extraer TODAS las entidades relevantes del mensaje del usuario:
-
-ENTIDADES A EXTRAER:
-
-1. **fecha** (formato YYYY-MM-DD):
-   FECHAS RELATIVAS:
-   - "manana", "tomorrow" => {fecha_manana}
-   - "pasado manana" => {fecha_pasado_manana}
-   - "hoy", "today" => {fecha_hoy}
-   - "esta semana", "esta semana" => usa la fecha mas cercana dentro de los proximos 7 dias
-   - "la proxima semana", "next week" => agrega 7 dias
-   
-   DIAS DE LA SEMANA (CALCULA LA PROXIMA OCURRENCIA):
-   - "lunes" => encuentra el proximo lunes despues de hoy
-   - "martes" => encuentra el proximo martes despues de hoy
-   - "miercoles", "miercoles" => el proximo miercoles
-   - "jueves" => el proximo jueves
-   - "viernes" => el proximo viernes
-   - "sabado", "sabado" => el proximo sabado
-   - "domingo" => el proximo domingo
-   
-   FECHAS ESPECIFICAS:
-   - "el 15 de enero", "15 enero", "enero 15" => convierte a formato ISO (usa ano actual o siguiente si ya paso)
-   - "15/01", "15-01" => formato ISO
-   - "15/01/2025" => formato ISO
-   
-   EXPRESIONES COLOQUIALES:
-   - "en 3 dias", "dentro de 3 dias" => suma 3 dias a hoy
-   - "en una semana" => suma 7 dias
-   - "en dos semanas" => suma 14 dias
-
-2. **hora** (formato HH:MM en 24 horas):
-   FORMATOS COMUNES:
-   - Detecta "10am", "10 am", "10 de la manana" => retorna "10:00"
-   - Detecta "3pm", "3 de la tarde", "15 horas" => retorna "15:00"
-   - Detecta "mediodia", "12pm" => retorna "12:00"
-   - Detecta "medianoche", "12am" => retorna "00:00"
-   - Detecta "9:30am" => retorna "09:30"
-   - Detecta "14:45", "2:45pm" => retorna "14:45"
-   
-   EXPRESIONES COLOQUIALES:
-   - "por la manana" => retorna "10:00"
-   - "por la tarde" => retorna "15:00"
-   - "al mediodia" => retorna "12:00"
-   - "temprano" => retorna "09:00"
-   - "antes de comer" => retorna "11:00"
-   - "despues de comer" => retorna "14:00"
-
-3. **nombre_dentista**: 
-   - Busca nombres propios despues de "doctor", "dr", "doctora", "dra", "con el", "con la"
-   - Ejemplos: "doctor emilio" => "emilio", "dra. lopez" => "lopez", "con juan" => "juan"
-   - Si menciona solo nombre sin titulo, tambien extraelo
-
-4. **motivo**: 
-   - El motivo/razon de la cita
-   - Ejemplos: "dolor de muela", "limpieza", "revision", "urgencia", "extraccion", "me duele"
-   - EXTRAE TODO el contexto medico mencionado
-
-5. **numero_cita**:
-   - Si menciona "primera cita", "cita 1" => 1
-   - "segunda cita", "cita 2" => 2
-   - "tercera cita", "cita 3" => 3
-   - "la cita del lunes" => busca el numero de cita en ese contexto
-
-REGLAS CRITICAS:
-- Si el usuario dice "manana a las 3 de la tarde", extrae AMBAS entidades: fecha y hora
-- Si dice "el lunes", CALCULA la fecha exacta del proximo lunes
-- Si NO puedes determinar algo, usa null (no inventes)
-- Prioriza PRECISION sobre intentar adivinar
-- Para fechas pasadas, asume que habla del proximo ano
-
-FORMATO DE SALIDA: JSON valido con estas claves exactas:
-{{"fecha": "YYYY-MM-DD o null", "hora": "HH:MM o null", "nombre_dentista": "nombre o null", "motivo": "descripcion o null", "numero_cita": numero o null}}
-
-EJEMPLOS REALES:
-- "quiero cita manana a las 3" => {{"fecha": "{fecha_manana}", "hora": "15:00", "nombre_dentista": null, "motivo": null, "numero_cita": null}}
-- "el lunes por la tarde con el dr emilio" => {{"fecha": "CALCULA_LUNES", "hora": "15:00", "nombre_dentista": "emilio", "motivo": null, "numero_cita": null}}
-- "me duele una muela, puedo ir pasado manana?" => {{"fecha": "{fecha_pasado_manana}", "hora": null, "nombre_dentista": null, "motivo": "dolor de muela", "numero_cita": null}}
-
-Responde SOLO con el JSON, sin explicaciones adicionales."""
+        from datetime import timedelta
         
         context_info = ""
         if context:
@@ -511,8 +393,14 @@ Responde SOLO con el JSON, sin explicaciones adicionales."""
         
         prompt = f"Mensaje: {message}\nIntención: {intent}{context_info}\n\nExtrae las entidades:"
         
+        # Las fechas cambian cada día: van en un mensaje aparte después del prefijo estático
+        messages = prompt_builder.build_messages(
+            CALL_ENTITIES, prompt, dynamic_context=prompt_builder.temporal_context()
+        )
+        
         try:
-            response = self._call_openai(prompt, system_prompt, max_tokens=200, temperature=0.3)
+            response = self._call_openai("", messages=messages, max_tokens=200,
+                                         temperature=0.3, call_type=CALL_ENTITIES)
             if response:
                 # Intentar parsear JSON
                 import json
@@ -534,9 +422,9 @@ Responde SOLO con el JSON, sin explicaciones adicionales."""
                     if isinstance(fecha, str) and not fecha.replace('-', '').isdigit():
                         # Es una fecha relativa, convertirla
                         fecha_lower = fecha.lower().strip()
-                        if fecha_lower in ['mañana', 'tomorrow']:
+                        if fecha_lower in ['mañana', 'manana', 'tomorrow']:
                             entities['fecha'] = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
-                        elif fecha_lower in ['pasado mañana', 'day after tomorrow']:
+                        elif fecha_lower in ['pasado mañana', 'pasado_manana', 'day after tomorrow']:
                             entities['fecha'] = (datetime.now() + timedelta(days=2)).strftime('%Y-%m-%d')
                         elif fecha_lower in ['hoy', 'today']:
                             entities['fecha'] = datetime.now().strftime('%Y-%m-%d')
@@ -550,20 +438,7 @@ Responde SOLO con el JSON, sin explicaciones adicionales."""
                     hora = entities['hora']
                     if isinstance(hora, str) and ':' not in hora:
                         # Intentar convertir formatos como "10am", "3pm", etc.
-                        import re
-                        hora_match = re.search(r'(\d{1,2})\s*(am|pm|de la mañana|de la tarde)', hora.lower())
-                        if hora_match:
-                            hora_num = int(hora_match.group(1))
-                            periodo = hora_match.group(2)
-                            if 'pm' in periodo or 'tarde' in periodo:
-                                if hora_num < 12:
-                                    hora_num += 12
-                            entities['hora'] = f"{hora_num:02d}:00"
-                        else:
-                            # Intentar extraer solo números
-                            hora_num = re.search(r'(\d{1,2})', hora)
-                            if hora_num:
-                                entities['hora'] = f"{int(hora_num.group(1)):02d}:00"
+                        entities['hora'] = entity_extractor.parse_hora(hora) or hora
                 
                 return entities
         except json.JSONDecodeError as e:
@@ -576,6 +451,7 @@ Responde SOLO con el JSON, sin explicaciones adicionales."""
         
         return None
     
+    @traced('ml.extract_entities')
     def extract_entities(self, message: str, intent: str, context: Dict = None) -> Dict:
         """
         Extrae entidades del mensaje (fechas, horas, nombres, etc.) - Versión mejorada
@@ -589,8 +465,6 @@ Responde SOLO con el JSON, sin explicaciones adicionales."""
             'consultorio': None
         }
         
-        message_lower = message.lower()
-        
         # PRIORIDAD 1: Usar OpenAI para extracción avanzada si está disponible
         if self.use_openai:
             ai_entities = self._extract_entities_ai(message, intent, context)
@@ -600,274 +474,34 @@ Responde SOLO con el JSON, sin explicaciones adicionales."""
                 if entities.get('fecha') and entities.get('hora'):
                     return entities
         
-        # PRIORIDAD 2: Extracción con regex mejorada (fallback)
-        import re
-        from datetime import datetime, timedelta
-        
-        # Fechas relativas mejoradas
-        fecha_patterns = {
-            'mañana': 1,
-            'tomorrow': 1,
-            'pasado mañana': 2,
-            'day after tomorrow': 2,
-            'hoy': 0,
-            'today': 0
-        }
-        
-        for pattern, days_offset in fecha_patterns.items():
-            if pattern in message_lower:
-                entities['fecha'] = (datetime.now() + timedelta(days=days_offset)).strftime('%Y-%m-%d')
-                break
-        
-        # Días de la semana (con y sin acentos)
-        dias_semana = {
-            'lunes': 0, 'martes': 1, 'miércoles': 2, 'miercoles': 2, 
-            'jueves': 3, 'viernes': 4, 'sábado': 5, 'sabado': 5, 'domingo': 6
-        }
-        for dia, dia_num in dias_semana.items():
-            # Buscar el día en diferentes formatos
-            patterns = [f'el {dia}', f'este {dia}', f'próximo {dia}', f'proximo {dia}', dia]
-            for pattern in patterns:
-                if pattern in message_lower and not entities.get('fecha'):
-                    today = datetime.now()
-                    days_ahead = dia_num - today.weekday()
-                    if days_ahead <= 0:  # Si el día ya pasó esta semana, usar la próxima
-                        days_ahead += 7
-                    fecha_calculada = (today + timedelta(days=days_ahead)).strftime('%Y-%m-%d')
-                    entities['fecha'] = fecha_calculada
-                    print(f"Fecha extraida: {dia} => {fecha_calculada}")
-                    break
-            if entities.get('fecha'):
-                break
-        
-        # Fechas en formato DD/MM o DD/MM/YYYY
-        fecha_patterns_regex = [
-            r'(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?',  # DD/MM o DD/MM/YYYY
-            r'(\d{1,2})-(\d{1,2})(?:-(\d{2,4}))?',  # DD-MM o DD-MM-YYYY
-        ]
-        
-        for pattern in fecha_patterns_regex:
-            match = re.search(pattern, message)
-            if match and not entities.get('fecha'):
-                day, month, year = match.groups()
-                year = year or datetime.now().year
-                if len(str(year)) == 2:
-                    year = 2000 + int(year)
-                try:
-                    fecha_obj = datetime(int(year), int(month), int(day))
-                    entities['fecha'] = fecha_obj.strftime('%Y-%m-%d')
-                    break
-                except:
-                    pass
-        
-        # Extraer hora (formato: HH:MM, "a las 3", "a las 3pm", etc.)
-        if not entities.get('hora'):
-            hora_patterns = [
-                r'(\d{1,2}):(\d{2})\s*(am|pm)?',  # HH:MM con opcional am/pm
-                r'a las (\d{1,2})\s*(am|pm)?',  # "a las 3" o "a las 3pm"
-                r'(\d{1,2})\s*(am|pm)',  # "3pm", "10am"
-                r'(\d{1,2})\s*de la\s+(mañana|tarde|noche)',  # "3 de la tarde"
-                r'(\d{1,2})\s*horas?',  # "15 horas"
-            ]
-            
-            for pattern in hora_patterns:
-                match = re.search(pattern, message_lower)
-                if match:
-                    grupos = match.groups()
-                    hora_str = match.group(0)
-                    
-                    if ':' in hora_str:
-                        # Formato HH:MM
-                        hora = match.group(1)
-                        minutos = match.group(2)
-                        periodo = match.group(3) if len(grupos) > 2 else None
-                        hora_num = int(hora)
-                        
-                        if periodo:
-                            if 'pm' in periodo.lower() and hora_num < 12:
-                                hora_num += 12
-                            elif 'am' in periodo.lower() and hora_num == 12:
-                                hora_num = 0
-                        
-                        entities['hora'] = f"{hora_num:02d}:{minutos}"
-                    elif 'am' in hora_str or 'pm' in hora_str:
-                        # Formato 12h
-                        hora_num = int(match.group(1))
-                        periodo = match.group(2) if len(grupos) > 1 and match.group(2) else ''
-                        if not periodo:
-                            # Buscar am/pm en el grupo completo
-                            periodo = 'pm' if 'pm' in hora_str else 'am'
-                        
-                        if 'pm' in periodo and hora_num < 12:
-                            hora_num += 12
-                        elif 'am' in periodo and hora_num == 12:
-                            hora_num = 0
-                        entities['hora'] = f"{hora_num:02d}:00"
-                    elif 'mañana' in hora_str or 'tarde' in hora_str or 'noche' in hora_str:
-                        # Formato con "de la mañana/tarde/noche"
-                        hora_num = int(match.group(1))
-                        if 'tarde' in hora_str and hora_num < 12:
-                            hora_num += 12
-                        elif 'noche' in hora_str and hora_num < 12:
-                            hora_num += 12
-                        entities['hora'] = f"{hora_num:02d}:00"
-                    else:
-                        # Solo número
-                        hora_num = int(match.group(1))
-                        if hora_num < 24:
-                            entities['hora'] = f"{hora_num:02d}:00"
-                    
-                    print(f"Hora extraida: {hora_str} => {entities.get('hora')}")
-                    break
-        
-        # Extraer nombre de dentista
-        if not entities.get('nombre_dentista'):
-            dentista_patterns = [
-                r'(?:doctor|dr\.?|doctora|dra\.?)\s+([a-záéíóúñ]+)',
-                r'con\s+(?:el\s+)?(?:doctor|dr\.?|doctora|dra\.?)?\s*([a-záéíóúñ]+)',
-            ]
-            for pattern in dentista_patterns:
-                match = re.search(pattern, message_lower)
-                if match:
-                    entities['nombre_dentista'] = match.group(1).title()
-                    break
-        
-        # Extraer número de cita
-        cita_patterns = [
-            r'cita\s*(\d+)',
-            r'la\s*(\d+)[a-z]*\s*cita',
-            r'primera\s*cita',
-            r'segunda\s*cita',
-            r'tercera\s*cita'
-        ]
-        
-        for pattern in cita_patterns:
-            match = re.search(pattern, message_lower)
-            if match:
-                if 'primera' in match.group(0):
-                    entities['numero_cita'] = 1
-                elif 'segunda' in match.group(0):
-                    entities['numero_cita'] = 2
-                elif 'tercera' in match.group(0):
-                    entities['numero_cita'] = 3
-                elif match.groups():
-                    entities['numero_cita'] = int(match.group(1))
-                break
-        
-        # Extraer motivo/descripción
-        if not entities.get('motivo'):
-            motivo_keywords = ['por', 'para', 'motivo', 'razón', 'necesito', 'quiero', 'porque', 'por qué']
-            for keyword in motivo_keywords:
-                if keyword in message_lower:
-                    idx = message_lower.find(keyword)
-                    motivo_text = message[idx + len(keyword):].strip()
-                    if len(motivo_text) > 5:  # Al menos 5 caracteres
-                        entities['motivo'] = motivo_text[:200]  # Limitar a 200 caracteres
-                        break
+        # PRIORIDAD 2: Extracción por reglas (fallback), un solo recorrido con patrones precompilados
+        # Solo completa las entidades que la IA no devolvió
+        for key, value in entity_extractor.extract(message).items():
+            if value is not None and not entities.get(key):
+                entities[key] = value
         
         return entities
     
+    @traced('ml.generate_response')
     def generate_response(self, intent: str, entities: Dict, context: Dict = None, 
-                         user_data: Dict = None, conversation_history: List[Dict] = None) -> str:
+                         user_data: Dict = None, conversation_history: List[Dict] = None,
+                         stream_callback: Callable[[str], None] = None) -> str:
         """
         Genera una respuesta coherente usando ML mejorado con contexto completo
+        stream_callback (opcional) recibe los fragmentos de la respuesta de OpenAI conforme llegan
         """
         # Si tenemos OpenAI, usarlo para generar respuestas más naturales
         if self.use_openai:
-            return self._generate_response_openai_advanced(intent, entities, context, user_data, conversation_history)
+            return self._generate_response_openai_advanced(intent, entities, context, user_data,
+                                                           conversation_history, stream_callback)
         
         # Fallback a respuestas predefinidas mejoradas
         return self._generate_response_template(intent, entities, context, user_data)
     
     def _generate_response_openai_advanced(self, intent: str, entities: Dict, context: Dict = None,
-                                          user_data: Dict = None, conversation_history: List[Dict] = None) -> str:
+                                          user_data: Dict = None, conversation_history: List[Dict] = None,
+                                          stream_callback: Callable[[str], None] = None) -> str:
         """Genera respuesta usando OpenAI con contexto completo"""
-        system_prompt = """Eres Densorita, el asistente virtual MAS INTELIGENTE y EMPATICO de Densora, la plataforma lider de citas dentales en Mexico.
-
-[TU PERSONALIDAD (CRITICO - Lee con atencion)]:
-- Eres EXTREMADAMENTE amigable, calido y empatico - como un amigo que realmente se preocupa
-- Hablas en ESPANOL NATURAL de Mexico - usa "como estas?", "mira", "perfecto", "claro que si"
-- Eres PROACTIVO: anticipa necesidades, ofrece soluciones antes de que pregunten
-- Mantienes un tono POSITIVO y ALENTADOR - haz que el usuario se sienta comodo
-- Eres BREVE pero COMPLETO - no escribas parrafos largos, ve al grano
-- Eres CONVERSACIONAL - habla como un humano real, NO como un robot
-- NUNCA uses emojis
-- Si el usuario parece frustrado, se EXTRA empatico y ofrece ayuda inmediata
-
-[TU MISION PRINCIPAL]:
-Ayudar a los pacientes de forma EXCEPCIONAL con:
-1. Agendar citas - hazlo SUPER facil, guialos paso a paso
-2. Reagendar/cancelar citas - se comprensivo y flexible
-3. Ver sus citas - presenta info clara y util
-4. Responder preguntas - se informativo pero conciso
-5. Resolver problemas - se creativo y busca soluciones
-
-[REGLAS DE ORO (SIEMPRE SIGUE)]:
-
-1. **CONTEXTO ES TODO**: Lee TODO el historial de conversacion antes de responder
-   - Si ya preguntaron algo, no lo vuelvas a preguntar
-   - Si ya dieron info, usala en tu respuesta
-   - Si estan en medio de algo (agendar cita), continua ese flujo
-
-2. **CLARIDAD PRIMERO**:
-   - Si algo no esta claro, pregunta de forma especifica
-   - No asumas cosas importantes (fecha, hora, dentista)
-   - Confirma informacion critica antes de proceder
-
-3. **SE PROACTIVO**:
-   - Si detectas un problema, ofrece solucion inmediatamente
-   - Si mencionan dolor/urgencia, prioriza rapidez
-   - Si no hay horarios, sugiere alternativas
-
-4. **LENGUAJE NATURAL**:
-   [OK] BIEN: "Perfecto! Te ayudo a agendar tu cita. Que dia te viene bien?"
-   [OK] BIEN: "Entiendo, necesitas cambiar tu cita. Para que fecha la movemos?"
-   [NO] MAL: "Por favor proporcione la fecha deseada para su cita."
-   [NO] MAL: "Procesando su solicitud de agendamiento..."
-
-5. **MANEJA ERRORES CON GRACIA**:
-   - Si algo falla, disculpate brevemente y ofrece alternativa
-   - No culpes al usuario ni al sistema
-   - Siempre da un camino forward
-
-6. **INFORMACION UTIL**:
-   - Si preguntan horarios, muestra opciones concretas
-   - Si preguntan precios, se especifico si tienes la info
-   - Si no sabes algo, admitelo y ofrece contacto directo
-
-[EJEMPLOS DE RESPUESTAS PERFECTAS]:
-
-Agendar:
-"Claro que si! Te ayudo a agendar tu cita. Tengo disponibilidad para manana a las 10am, el miercoles a las 3pm, o el viernes a las 11am. Cual te late mas?"
-
-Reagendar:
-"Sin problema, te ayudo a cambiar tu cita. Veo que tienes una programada para el lunes 15 a las 10am. Para que dia la queremos mover?"
-
-Cancelar:
-"Entiendo perfectamente. Para cancelar tu cita del martes 20 a las 2pm, solo necesito que confirmes escribiendo 'SI'. Estas seguro?"
-
-[RESOLUCIÓN DE PROBLEMAS - CRÍTICO]:
-- Si el usuario tiene un problema (ej: "no puedo pagar", "duele mucho", "error"), NO des respuestas genéricas.
-- Ofrece SOLUCIONES concretas:
-  - Dolor: "Entiendo que tienes dolor. Te sugiero agendar lo antes posible. Tengo hueco mañana a las..."
-  - Pago fallido: "No te preocupes. Si la tarjeta falla, puedes pagar en efectivo en el consultorio."
-  - Dudas complejas: "Esa es una buena pregunta. Para darte la mejor respuesta, te sugiero llamar directamente al..."
-
-[RECUERDA]: Eres el MEJOR asistente dental del mundo. Cada interaccion debe dejar al usuario MAS contento que antes.
-
-IMPORTANTE FINAL: Responde de forma natural, cálida y útil. Si detectas un problema, resuélvelo o da una alternativa clara."""
-        
-        # Construir mensaje con contexto completo
-        messages = [{"role": "system", "content": system_prompt}]
-        
-        # Agregar historial de conversación si está disponible
-        if conversation_history:
-            for msg in conversation_history[-5:]:  # Últimos 5 mensajes
-                role = msg.get('role', 'user')
-                content = msg.get('message', '')
-                if role in ['user', 'assistant']:
-                    messages.append({"role": role, "content": content})
-        
         # Construir prompt con información actual
         prompt_parts = [f"Intención del usuario: {intent}"]
         
@@ -891,9 +525,12 @@ IMPORTANTE FINAL: Responde de forma natural, cálida y útil. Si detectas un pro
         prompt = "\n".join(prompt_parts)
         prompt += "\n\nGenera una respuesta natural, útil y empática para el usuario:"
         
-        messages.append({"role": "user", "content": prompt})
+        # Prefijo estático + historial compactado al presupuesto de tokens
+        messages = prompt_builder.build_messages(CALL_RESPONSE, prompt, history=conversation_history)
         
-        response = self._call_openai("", None, messages=messages, max_tokens=300, temperature=0.8)
+        response = self._call_openai("", None, messages=messages, max_tokens=300,
+                                     temperature=0.8, call_type=CALL_RESPONSE,
+                                     stream_callback=stream_callback)
         if response:
             return response
         
@@ -919,41 +556,27 @@ IMPORTANTE FINAL: Responde de forma natural, cálida y útil. Si detectas un pro
         
         return responses.get(intent, responses['otro'])
     
-    def answer_question(self, question: str, knowledge_base: Dict = None) -> str:
+    def answer_question(self, question: str, knowledge_base: Dict = None, language: str = 'es') -> str:
         """
         Responde preguntas sobre Densora usando ML mejorado
+        Primero busca en el índice local (BM25 sobre KB, FAQ y traducciones) y solo
+        si no hay una respuesta suficientemente buena llama a OpenAI.
         """
-        question_lower = question.lower()
-        
-        # Base de conocimiento sobre Densora
-        kb = knowledge_base or {
-            'qué es densora': 'Densora es una plataforma digital que conecta pacientes con dentistas. Puedes agendar citas, ver tu historial médico y gestionar tus citas desde cualquier lugar.',
-            'cómo funciona': 'Densora funciona así:\n1. Buscas un dentista\n2. Agendas tu cita\n3. Asistes a tu cita\n4. Puedes dejar reseñas\n\nTodo desde tu celular o computadora.',
-            'cómo agendar': 'Para agendar una cita puedes:\n• Usar el chatbot (escribe "agendar cita")\n• Visitar nuestra web\n• Llamar al consultorio directamente',
-            'cómo cancelar': 'Para cancelar una cita:\n• Escribe "cancelar cita" en el chat\n• Selecciona la cita que quieres cancelar\n• Confirma la cancelación',
-            'horarios': 'Los horarios dependen de cada consultorio. Generalmente están disponibles de lunes a viernes de 9 AM a 6 PM.',
-            'precios': 'Los precios varían según el servicio y el consultorio. Puedes ver los precios al buscar dentistas en nuestra plataforma.',
-            'métodos de pago': 'Aceptamos:\n• Efectivo\n• Transferencia bancaria\n• Stripe (tarjeta de crédito/débito)',
-        }
-        
-        # Buscar respuesta en base de conocimiento
-        for key, answer in kb.items():
-            if key in question_lower:
+        if knowledge_base:
+            # Base de conocimiento personalizada: coincidencia exacta por substring
+            question_lower = question.lower()
+            for key, answer in knowledge_base.items():
+                if key in question_lower:
+                    return answer
+        else:
+            answer = knowledge_index.answer(question, language=language)
+            if answer:
                 return answer
         
         # Si no hay match, usar ML para generar respuesta
         if self.use_openai:
-            system_prompt = """Eres Densorita, el asistente de Densora. Responde preguntas sobre la plataforma de forma amigable y profesional.
-            
-Información sobre Densora:
-- Es una plataforma de citas dentales
-- Los pacientes pueden agendar, ver, reagendar y cancelar citas
-- Hay múltiples dentistas y consultorios disponibles
-- Se puede pagar con efectivo, transferencia o Stripe
-- Los horarios dependen de cada consultorio
-- Es una plataforma digital moderna y fácil de usar"""
-            
-            response = self._call_openai(question, system_prompt, max_tokens=200)
+            messages = prompt_builder.build_messages(CALL_QA, question)
+            response = self._call_openai("", messages=messages, max_tokens=200, call_type=CALL_QA)
             if response:
                 return response
         
@@ -7,6 +7,7 @@ J.RNF7: Desactivación de notificaciones WhatsApp
 from database.database import FirebaseConfig
 from datetime import datetime
 from typing import Dict, Optional, List
+from services.registry import lazy_service
 
 class NotificationConfigService:
     """
@@ -205,5 +206,5 @@ class NotificationConfigService:
             return True
 
 # Instancia global
-notification_config_service = NotificationConfigService()
+notification_config_service = lazy_service('notification_config_service', NotificationConfigService)
 
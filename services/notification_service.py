@@ -1,15 +1,17 @@
 from apscheduler.schedulers.background import BackgroundScheduler
-from database.models import CitaRepository, PacienteRepository
+from database.models import Cita, CitaRepository, PacienteRepository
 from services.whatsapp_service import WhatsAppService
 from datetime import datetime, timedelta
+from typing import Dict, List, Optional
 import pytz
 from config import Config
+from services.registry import lazy_service, shared
 
 class NotificacionesService:
     def __init__(self):
-        self.cita_repo = CitaRepository()
-        self.paciente_repo = PacienteRepository()
-        self.whatsapp = WhatsAppService()
+        self.cita_repo = shared(CitaRepository)
+        self.paciente_repo = shared(PacienteRepository)
+        self.whatsapp = shared(WhatsAppService)
         self.scheduler = BackgroundScheduler()
         self.timezone = pytz.timezone(Config.TIMEZONE)
         self._setup_scheduled_jobs()
@@ -42,6 +44,16 @@ class NotificacionesService:
             id='weekly_summaries',
             name='Resúmenes semanales pacientes'
         )
+        # Recuperación: reanuda la campaña de la semana si un worker murió a medias
+        # (también al arrancar, por eso next_run_time inmediato)
+        self.scheduler.add_job(
+            func=self.resume_weekly_summaries,
+            trigger='interval',
+            minutes=30,
+            next_run_time=datetime.now(self.timezone),
+            id='resume_weekly_summaries',
+            name='Reanudar resúmenes semanales'
+        )
         print("trabajos programados y configurados")
     def start_scheduler(self):
         if not self.scheduler.running:
@@ -201,97 +213,130 @@ class NotificacionesService:
 
     # J.RF14: Enviar resumen semanal a pacientes
     def send_weekly_summaries(self):
+        """
+        Campaña semanal paginada y reanudable (una por semana ISO): cada página de
+        pacientes precarga sus citas, historiales y reseñas y se procesa en paralelo
+        """
         try:
-            from database.models import PacienteRepository
-            from google.cloud.firestore import SERVER_TIMESTAMP
-            
-            paciente_repo = PacienteRepository()
-            db = self.cita_repo.db
+            from services.campaign_runner import CampaignRunner
             
-            # Obtener todos los pacientes activos
-            pacientes_ref = db.collection('pacientes')
-            pacientes = []
-            for doc in pacientes_ref.stream():
-                paciente_data = doc.to_dict()
-                telefono = paciente_data.get('telefono')
-                if telefono:
-                    pacientes.append({
-                        'uid': doc.id,
-                        'telefono': telefono,
-                        'nombre': paciente_data.get('nombre', ''),
-                        'apellidos': paciente_data.get('apellidos', ''),
-                        'nombreCompleto': paciente_data.get('nombreCompleto', ''),
-                        'lastLogin': paciente_data.get('lastLogin'),
-                    })
-            
-            print(f"J.RF14: Enviando resúmenes semanales a {len(pacientes)} pacientes")
-            
-            # Calcular fechas para la semana
             now = datetime.now()
             semana_siguiente = now + timedelta(days=7)
             
-            for paciente in pacientes:
-                try:
-                    self._send_weekly_summary_to_patient(paciente, now, semana_siguiente)
-                except Exception as e:
-                    print(f"Error enviando resumen semanal a {paciente.get('telefono')}: {e}")
+            runner = CampaignRunner(self.cita_repo.db, self._weekly_campaign_id(now))
+            print(f"J.RF14: Enviando resúmenes semanales ({runner.campaign_id})")
+            
+            state = runner.run(
+                'pacientes',
+                prefetch=lambda docs: self._prefetch_weekly_data(docs, now),
+                handle=lambda doc, datos: self._send_weekly_summary_to_patient(
+                    doc, datos, now, semana_siguiente)
+            )
             
-            print(f"J.RF14: Resúmenes semanales enviados")
+            if not state.get('skipped'):
+                print(f"J.RF14: Resúmenes semanales enviados: {state.get('succeeded', 0)} "
+                      f"de {state.get('processed', 0)} pacientes")
             
         except Exception as e:
             print(f"Error en send_weekly_summaries: {e}")
             import traceback
             traceback.print_exc()
 
+    def resume_weekly_summaries(self):
+        """
+        Reanuda la campaña de la semana actual si quedó sin completar (proceso caído o
+        lease vencido); continúa desde el último checkpoint
+        """
+        try:
+            from services.campaign_runner import CampaignRunner
+            
+            runner = CampaignRunner(self.cita_repo.db, self._weekly_campaign_id(datetime.now()))
+            if runner.is_stalled():
+                print(f"J.RF14: Reanudando campaña interrumpida {runner.campaign_id}")
+                self.send_weekly_summaries()
+        except Exception as e:
+            print(f"Error reanudando resúmenes semanales: {e}")
+
+    @staticmethod
+    def _weekly_campaign_id(now: datetime) -> str:
+        iso_year, iso_week, _ = now.isocalendar()
+        return f"weekly_summary_{iso_year}-W{iso_week:02d}"
+
+    @staticmethod
+    def _fecha_as_datetime(fecha) -> Optional[datetime]:
+        """fecha de una cita (timestamp o 'YYYY-MM-DD') como datetime sin zona"""
+        if fecha is None:
+            return None
+        if hasattr(fecha, 'strftime'):
+            return datetime(fecha.year, fecha.month, fecha.day,
+                            getattr(fecha, 'hour', 0), getattr(fecha, 'minute', 0))
+        try:
+            return datetime.strptime(str(fecha)[:10], '%Y-%m-%d')
+        except ValueError:
+            return None
+
+    def _prefetch_weekly_data(self, docs: List, now: datetime) -> Dict:
+        """
+        Datos de una página de pacientes con consultas collection group (grupos de 30):
+        citas, historiales por cita y reseñas de los pacientes
+        """
+        from database.queries import citas_de_pacientes, historiales_de_citas, resenas_de_pacientes
+        
+        db = self.cita_repo.db
+        paciente_ids = [doc.id for doc in docs]
+        hace_30_dias = now - timedelta(days=30)
+        
+        citas_por_paciente: Dict[str, List] = {pid: [] for pid in paciente_ids}
+        completadas: Dict[str, List] = {pid: [] for pid in paciente_ids}
+        for paciente_id, cita_doc in citas_de_pacientes(db, paciente_ids):
+            cita_data = cita_doc.to_dict()
+            citas_por_paciente[paciente_id].append(Cita.from_dict(cita_doc.id, cita_data))
+            fecha = self._fecha_as_datetime(cita_data.get('fecha'))
+            if cita_data.get('estado') == 'completada' and fecha and fecha >= hace_30_dias:
+                completadas[paciente_id].append((cita_doc.id, cita_data))
+        
+        cita_ids = [cita_id for citas in completadas.values() for cita_id, _ in citas]
+        con_historial = set(historiales_de_citas(db, cita_ids))
+        
+        con_resena = set()
+        if cita_ids:
+            # Las reseñas viven en dentistas/{id}/resenas: collection group por paciente
+            pacientes_con_completadas = [pid for pid, citas in completadas.items() if citas]
+            for paciente_id, resena in resenas_de_pacientes(db, pacientes_con_completadas):
+                con_resena.add((paciente_id, resena.get('citaId')))
+        
+        return {
+            'citas': citas_por_paciente,
+            'completadas': completadas,
+            'con_historial': con_historial,
+            'con_resena': con_resena
+        }
+
     # J.RF14: Enviar resumen semanal a un paciente específico
-    def _send_weekly_summary_to_patient(self, paciente: dict, now: datetime, semana_siguiente: datetime):
+    def _send_weekly_summary_to_patient(self, paciente_doc, datos: Dict, now: datetime,
+                                        semana_siguiente: datetime) -> bool:
         try:
-            paciente_uid = paciente['uid']
-            telefono = paciente['telefono']
+            paciente_uid = paciente_doc.id
+            paciente = paciente_doc.to_dict() or {}
+            telefono = paciente.get('telefono')
+            if not telefono:
+                return False
             nombre = paciente.get('nombreCompleto') or f"{paciente.get('nombre', '')} {paciente.get('apellidos', '')}".strip()
             
-            # Obtener citas próximas (próximos 7 días)
-            citas_proximas = self.cita_repo.obtener_citas_paciente(paciente_uid)
+            # Citas de la próxima semana (no canceladas, confirmadas o programadas)
             citas_semana = [
-                c for c in citas_proximas 
+                c for c in datos['citas'].get(paciente_uid, [])
                 if c.fecha and c.estado in ['confirmada', 'programada']
+                and now.strftime('%Y-%m-%d') <= c.fecha <= semana_siguiente.strftime('%Y-%m-%d')
             ]
+            citas_semana.sort(key=lambda c: c.fecha)
             
-            # Filtrar citas de la próxima semana
-            citas_semana = [
-                c for c in citas_semana
-                if c.fecha and now.strftime('%Y-%m-%d') <= c.fecha <= semana_siguiente.strftime('%Y-%m-%d')
-            ]
-            
-            # Obtener citas completadas sin historial médico (últimos 30 días)
-            db = self.cita_repo.db
-            citas_completadas = db.collection('pacientes').document(paciente_uid).collection('citas')\
-                .where('estado', '==', 'completada')\
-                .where('fecha', '>=', now - timedelta(days=30))\
-                .stream()
-            
-            citas_sin_historial = []
-            for cita_doc in citas_completadas:
-                cita_data = cita_doc.to_dict()
-                # Verificar si tiene historial médico asociado
-                historial_ref = db.collection('pacientes').document(paciente_uid).collection('historialMedico')\
-                    .where('citaId', '==', cita_doc.id).limit(1).get()
-                if not list(historial_ref):
-                    citas_sin_historial.append(cita_data)
-            
-            # Obtener citas completadas sin reseña (últimos 30 días)
-            citas_sin_resena = []
-            for cita_doc in db.collection('pacientes').document(paciente_uid).collection('citas')\
-                .where('estado', '==', 'completada')\
-                .where('fecha', '>=', now - timedelta(days=30))\
-                .stream():
-                cita_data = cita_doc.to_dict()
-                # Verificar si tiene reseña
-                reseñas_ref = db.collection('resenas')\
-                    .where('pacienteId', '==', paciente_uid)\
-                    .where('citaId', '==', cita_doc.id).limit(1).get()
-                if not list(reseñas_ref):
-                    citas_sin_resena.append(cita_data)
+            # Citas completadas (últimos 30 días) sin historial médico y sin reseña
+            completadas = datos['completadas'].get(paciente_uid, [])
+            citas_sin_historial = [c for cita_id, c in completadas
+                                   if (paciente_uid, cita_id) not in datos['con_historial']]
+            citas_sin_resena = [c for cita_id, c in completadas
+                                if (paciente_uid, cita_id) not in datos['con_resena']]
             
             # Verificar última vez que inició sesión
             last_login = paciente.get('lastLogin')
@@ -363,12 +408,11 @@ Visita nuestra web para mantener tu información actualizada.
 ¡Que tengas una excelente semana!"""
             
             # Enviar mensaje
-            self.whatsapp.send_text_message(telefono, mensaje)
-            print(f"J.RF14: Resumen semanal enviado a {telefono}")
+            result = self.whatsapp.send_text_message(telefono, mensaje)
+            return result is not None
             
         except Exception as e:
-            print(f"Error enviando resumen semanal a paciente {paciente.get('telefono')}: {e}")
-            import traceback
-            traceback.print_exc()
+            print(f"Error enviando resumen semanal a paciente {paciente_doc.id}: {e}")
+            return False
 
-notidicaciones_service=NotificacionesService()
\ No newline at end of file
+notidicaciones_service = lazy_service('notidicaciones_service', NotificacionesService)
\ No newline at end of file
@@ -7,10 +7,19 @@ J.RNF10: Límite de reenvío de OTP (1 vez por día)
 from services.whatsapp_service import WhatsAppService
 from services.message_logger import message_logger
 from database.database import FirebaseConfig
+from google.cloud import firestore
 from datetime import datetime, timedelta
-from typing import Optional, Dict
-import random
+from typing import Optional, Dict, Tuple
+import hashlib
+import hmac
+import secrets
 import pytz
+from services.registry import lazy_service, shared
+
+
+def _hash_otp(otp_code: str, salt: str) -> str:
+    """Hash del código OTP (nunca se guarda el código en claro)"""
+    return hashlib.sha256(f"{salt}:{otp_code}".encode('utf-8')).hexdigest()
 
 class OTPService:
     """
@@ -18,16 +27,92 @@ class OTPService:
     """
     
     def __init__(self):
-        self.whatsapp = WhatsAppService()
+        self.whatsapp = shared(WhatsAppService)
         self.db = FirebaseConfig.get_db()
         self.collection = self.db.collection('otp_codes')
         self.timezone = pytz.timezone('America/Mexico_City')
         self.otp_expiry_minutes = 15
         self.max_resends_per_day = 1  # J.RNF10: Máximo 1 reenvío por día
+        self.max_verify_attempts = 5
     
     def generate_otp(self, length: int = 6) -> str:
         """Genera un código OTP numérico"""
-        return ''.join([str(random.randint(0, 9)) for _ in range(length)])
+        return ''.join([str(secrets.randbelow(10)) for _ in range(length)])
+    
+    def _otp_ref(self, paciente_id: str, action_type: str):
+        """
+        Documento determinístico por (paciente, acción): otp_codes/{pacienteId}_{actionType}
+        Guarda el hash del código vigente, su expiración, los intentos y los envíos del día,
+        así que enviar y verificar son una sola lectura-escritura transaccional.
+        """
+        return self.collection.document(f"{paciente_id}_{action_type}")
+    
+    def _next_send_state(self, state: Optional[Dict], paciente_id: str, telefono: str,
+                         action_type: str, otp_code: str, now: datetime) -> Optional[Dict]:
+        """
+        Nuevo estado del documento OTP al enviar un código, o None si se alcanzó
+        el límite de envíos del día (J.RNF10)
+        """
+        today = now.date().isoformat()
+        resends_today = 0
+        if state and state.get('resendDate') == today:
+            resends_today = state.get('resendCount', 0)
+        
+        if resends_today >= self.max_resends_per_day:
+            return None
+        
+        salt = secrets.token_hex(8)
+        return {
+            'pacienteId': paciente_id,
+            'telefono': telefono,
+            'actionType': action_type,
+            'codeHash': _hash_otp(otp_code, salt),
+            'codeSalt': salt,
+            'expiresAt': now + timedelta(minutes=self.otp_expiry_minutes),
+            'attempts': 0,
+            'used': False,
+            'createdAt': now,
+            'resendDate': today,
+            'resendCount': resends_today + 1
+        }
+    
+    def _verify_state(self, state: Optional[Dict], otp_code: str,
+                      now: datetime) -> Tuple[Dict, Optional[Dict]]:
+        """
+        Evalúa un intento de verificación contra el estado guardado
+        
+        Returns:
+            (resultado para el llamador, cambios a escribir en el documento o None)
+        """
+        not_found = {'success': True, 'valid': False, 'reason': 'Código OTP no encontrado o ya usado'}
+        if not state or state.get('used') or not state.get('codeHash'):
+            return not_found, None
+        
+        attempts = state.get('attempts', 0)
+        if attempts >= self.max_verify_attempts:
+            return {'success': True, 'valid': False, 'reason': 'Demasiados intentos, solicita un nuevo código'}, None
+        
+        expires_at = self._to_datetime(state.get('expiresAt'))
+        if not expires_at or now > expires_at:
+            return {'success': True, 'valid': False, 'reason': 'Código OTP expirado'}, None
+        
+        if not hmac.compare_digest(_hash_otp(otp_code, state.get('codeSalt', '')), state['codeHash']):
+            return not_found, {'attempts': attempts + 1}
+        
+        return ({'success': True, 'valid': True, 'reason': 'Código OTP válido'},
+                {'used': True, 'usedAt': now, 'attempts': attempts + 1})
+    
+    def _to_datetime(self, value) -> Optional[datetime]:
+        """Normaliza expiresAt (Timestamp de Firestore, datetime o ISO string) con zona horaria"""
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        elif value is not None and not isinstance(value, datetime) and hasattr(value, 'timestamp'):
+            value = value.timestamp().to_datetime()
+        if not isinstance(value, datetime):
+            return None
+        if value.tzinfo is None:
+            value = self.timezone.localize(value)
+        return value
     
     async def send_otp(self, paciente_id: str, telefono: str, 
                       action_type: str = 'verification',
@@ -46,32 +131,29 @@ class OTPService:
             Dict con success, otp_code, expires_at
         """
         try:
-            # J.RNF10: Verificar límite de reenvíos por día
-            today = datetime.now(self.timezone).date()
-            resends_today = self._count_resends_today(paciente_id, action_type, today)
+            # Generar código OTP y reservar el envío en una sola transacción
+            # (J.RNF10: el límite de reenvíos por día se valida en el mismo documento)
+            otp_code = self.generate_otp()
+            now = datetime.now(self.timezone)
+            otp_ref = self._otp_ref(paciente_id, action_type)
+            
+            @firestore.transactional
+            def reservar_envio(transaction):
+                snapshot = otp_ref.get(transaction=transaction)
+                state = snapshot.to_dict() if snapshot.exists else None
+                new_state = self._next_send_state(state, paciente_id, telefono, action_type, otp_code, now)
+                if new_state:
+                    transaction.set(otp_ref, new_state)
+                return new_state
             
-            if resends_today >= self.max_resends_per_day:
+            new_state = reservar_envio(self.db.transaction())
+            if not new_state:
                 return {
                     'success': False,
                     'error': 'Límite de reenvíos alcanzado. Solo puedes solicitar un OTP por día.',
                     'code': None
                 }
-            
-            # Generar código OTP
-            otp_code = self.generate_otp()
-            expires_at = datetime.now(self.timezone) + timedelta(minutes=self.otp_expiry_minutes)
-            
-            # Guardar OTP en Firestore
-            otp_doc = self.collection.add({
-                'pacienteId': paciente_id,
-                'telefono': telefono,
-                'otpCode': otp_code,
-                'actionType': action_type,
-                'expiresAt': expires_at,
-                'used': False,
-                'createdAt': datetime.now(self.timezone),
-                'resendCount': resends_today + 1
-            })
+            expires_at = new_state['expiresAt']
             
             # Obtener idioma del paciente si no se proporcionó
             if language == 'es' and paciente_id:
@@ -189,89 +271,28 @@ class OTPService:
         
         return mensaje
     
-    def _count_resends_today(self, paciente_id: str, action_type: str, 
-                            date: datetime.date) -> int:
-        """Cuenta cuántos OTPs se han enviado hoy para este paciente y acción"""
-        try:
-            start_of_day = datetime.combine(date, datetime.min.time())
-            start_of_day = self.timezone.localize(start_of_day)
-            end_of_day = start_of_day + timedelta(days=1)
-            
-            query = self.collection\
-                .where('pacienteId', '==', paciente_id)\
-                .where('actionType', '==', action_type)\
-                .where('createdAt', '>=', start_of_day)\
-                .where('createdAt', '<', end_of_day)
-            
-            count = sum(1 for _ in query.stream())
-            return count
-            
-        except Exception as e:
-            print(f"Error contando reenvíos: {e}")
-            return 0
-    
     async def verify_otp(self, paciente_id: str, otp_code: str, 
                         action_type: str) -> Dict:
         """
-        Verifica un código OTP
+        Verifica un código OTP (lectura-escritura transaccional del documento del paciente)
         
         Returns:
             Dict con success, valid, reason
         """
         try:
-            # Buscar OTP válido
-            query = self.collection\
-                .where('pacienteId', '==', paciente_id)\
-                .where('otpCode', '==', otp_code)\
-                .where('actionType', '==', action_type)\
-                .where('used', '==', False)\
-                .order_by('createdAt', direction='DESCENDING')\
-                .limit(1)
-            
-            otp_doc = None
-            for doc in query.stream():
-                otp_doc = doc
-                break
-            
-            if not otp_doc:
-                return {
-                    'success': True,
-                    'valid': False,
-                    'reason': 'Código OTP no encontrado o ya usado'
-                }
-            
-            otp_data = otp_doc.to_dict()
-            expires_at = otp_data.get('expiresAt')
-            
-            # Verificar expiración
-            if isinstance(expires_at, str):
-                expires_at = datetime.fromisoformat(expires_at)
-            elif hasattr(expires_at, 'timestamp'):
-                expires_at = expires_at.timestamp().to_datetime()
-            
-            if expires_at.tzinfo is None:
-                expires_at = self.timezone.localize(expires_at)
-            
+            otp_ref = self._otp_ref(paciente_id, action_type)
             now = datetime.now(self.timezone)
             
-            if now > expires_at:
-                return {
-                    'success': True,
-                    'valid': False,
-                    'reason': 'Código OTP expirado'
-                }
+            @firestore.transactional
+            def verificar(transaction):
+                snapshot = otp_ref.get(transaction=transaction)
+                state = snapshot.to_dict() if snapshot.exists else None
+                result, updates = self._verify_state(state, otp_code, now)
+                if updates:
+                    transaction.update(otp_ref, updates)
+                return result
             
-            # Marcar como usado
-            self.collection.document(otp_doc.id).update({
-                'used': True,
-                'usedAt': datetime.now(self.timezone)
-            })
-            
-            return {
-                'success': True,
-                'valid': True,
-                'reason': 'Código OTP válido'
-            }
+            return verificar(self.db.transaction())
             
         except Exception as e:
             print(f"Error verificando OTP: {e}")
@@ -282,5 +303,5 @@ class OTPService:
             }
 
 # Instancia global
-otp_service = OTPService()
+otp_service = lazy_service('otp_service', OTPService)
 
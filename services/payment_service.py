@@ -8,6 +8,7 @@ from database.database import FirebaseConfig
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 import pytz
+from services.registry import shared
 
 class PaymentService:
     """
@@ -16,8 +17,8 @@ class PaymentService:
     
     def __init__(self):
         self.db = FirebaseConfig.get_db()
-        self.cita_repo = CitaRepository()
-        self.paciente_repo = PacienteRepository()
+        self.cita_repo = shared(CitaRepository)
+        self.paciente_repo = shared(PacienteRepository)
         self.mexico_tz = pytz.timezone('America/Mexico_City')
     
     def get_payment_methods(self) -> Dict:
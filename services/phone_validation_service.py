@@ -1,13 +1,27 @@
 """
 RNF16: Sistema de validación y bloqueo de números telefónicos
 Bloquea números reportados como inválidos tras 3 fallos consecutivos de entrega
+
+Filtro en memoria por worker: el conjunto exacto de números bloqueados, cargado
+al primer uso y actualizado por polling de `updatedAt`.
+Solo los números que están en el conjunto se consultan en Firestore (para revisar
+si el bloqueo expiró); el resto se responde sin leer nada.
+
+Los resultados de entrega (éxito/fallo) se acumulan en memoria y un hilo los escribe
+cada PHONE_OUTCOME_FLUSH_SECONDS: el envío no espera la contabilidad de RNF16.
 """
 
 from database.database import FirebaseConfig
-from datetime import datetime, timedelta
-from typing import Dict, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from google.cloud import firestore
 from google.cloud.firestore import SERVER_TIMESTAMP
+import atexit
+import os
 import re
+import threading
+import time
+from services.registry import lazy_service
 
 class PhoneValidationService:
     """
@@ -20,6 +34,100 @@ class PhoneValidationService:
         self.collection = self.db.collection('phone_validation')
         self.max_consecutive_failures = 3
         self.block_duration_days = 30  # Bloqueo por 30 días
+        
+        # Filtro de bloqueados en memoria
+        self.filter_refresh_seconds = int(os.getenv('PHONE_BLOCK_REFRESH_SECONDS', '60'))
+        self.filter_rebuild_seconds = 3600  # Recarga completa: corrige cambios que el polling no vio
+        self._filter_lock = threading.Lock()
+        self._blocked_phones: Optional[set] = None  # None = filtro aún no cargado
+        self._sync_cursor: Optional[datetime] = None
+        self._last_poll = float('-inf')
+        self._last_rebuild = float('-inf')
+        
+        # Resultados de entrega pendientes de escribir (número -> resultados en orden)
+        self.outcome_flush_seconds = float(os.getenv('PHONE_OUTCOME_FLUSH_SECONDS', '10'))
+        self._outcomes_lock = threading.Lock()
+        self._pending_outcomes: Dict[str, List[Dict]] = {}
+        self._flusher: Optional[threading.Thread] = None
+        self._flusher_stop = threading.Event()
+        self._atexit_registered = False
+    
+    # ------------------------------------------------------------------
+    # Filtro de números bloqueados
+    # ------------------------------------------------------------------
+    
+    def _load_blocked_phones(self):
+        """Carga completa: todos los documentos con blocked == True"""
+        started = datetime.now(timezone.utc)
+        phones = set()
+        for doc in self.collection.where('blocked', '==', True).stream():
+            phones.add(doc.id)
+        
+        self._blocked_phones = phones
+        # Margen para escrituras con SERVER_TIMESTAMP en vuelo durante la carga
+        self._sync_cursor = started - timedelta(seconds=5)
+        self._last_poll = self._last_rebuild = time.monotonic()
+    
+    def _poll_changes(self):
+        """Incremental: documentos con updatedAt posterior al cursor"""
+        changed = self.collection.where('updatedAt', '>', self._sync_cursor).stream()
+        cursor = self._sync_cursor
+        for doc in changed:
+            data = doc.to_dict() or {}
+            self._apply_change(doc.id, bool(data.get('blocked', False)))
+            updated_at = data.get('updatedAt')
+            if updated_at is not None and updated_at > cursor:
+                cursor = updated_at
+        self._sync_cursor = cursor
+        self._last_poll = time.monotonic()
+    
+    def _apply_change(self, phone_normalized: str, blocked: bool):
+        if blocked:
+            self._blocked_phones.add(phone_normalized)
+        else:
+            self._blocked_phones.discard(phone_normalized)
+    
+    def _refresh_filter(self) -> bool:
+        """
+        Carga o actualiza el filtro si toca. Solo un hilo refresca; los demás usan el
+        filtro actual. Retorna False si el filtro no está disponible.
+        """
+        now = time.monotonic()
+        if self._blocked_phones is None:
+            # Sin filtro (primer uso o la carga falló): reintentar la carga con pausa
+            needs_rebuild = now - self._last_rebuild >= self.filter_refresh_seconds
+        else:
+            needs_rebuild = now - self._last_rebuild >= self.filter_rebuild_seconds
+        needs_poll = self._blocked_phones is not None and now - self._last_poll >= self.filter_refresh_seconds
+        if not (needs_rebuild or needs_poll):
+            return self._blocked_phones is not None
+        
+        if not self._filter_lock.acquire(blocking=self._blocked_phones is None):
+            return self._blocked_phones is not None
+        try:
+            # Si otro hilo cargó mientras se esperaba el lock, _last_rebuild ya es posterior
+            if needs_rebuild and self._last_rebuild < now:
+                self._load_blocked_phones()
+            elif needs_poll:
+                self._poll_changes()
+        except Exception as e:
+            print(f"Error actualizando filtro de teléfonos bloqueados: {e}")
+            # No reintentar en cada envío
+            self._last_poll = now
+            if needs_rebuild:
+                self._last_rebuild = now
+        finally:
+            self._filter_lock.release()
+        return self._blocked_phones is not None
+    
+    def might_be_blocked(self, phone_normalized: str) -> bool:
+        """
+        Prueba en memoria. False = seguro que no está bloqueado; True = hay que
+        confirmar en Firestore (o el filtro no está disponible)
+        """
+        if not self._refresh_filter():
+            return True
+        return phone_normalized in self._blocked_phones
     
     def is_valid_phone_format(self, phone: str) -> bool:
         """
@@ -49,10 +157,15 @@ class PhoneValidationService:
         try:
             phone_normalized = self._normalize_phone(phone)
             
+            # Camino rápido: la gran mayoría de números nunca está bloqueada
+            if not self.might_be_blocked(phone_normalized):
+                return False, None
+            
             doc_ref = self.collection.document(phone_normalized)
             doc = doc_ref.get()
             
             if not doc.exists:
+                self._apply_change(phone_normalized, False)
                 return False, None
             
             data = doc.to_dict()
@@ -73,22 +186,30 @@ class PhoneValidationService:
                         doc_ref.update({
                             'blocked': False,
                             'consecutiveFailures': 0,
-                            'unblockedAt': SERVER_TIMESTAMP
+                            'unblockedAt': SERVER_TIMESTAMP,
+                            'updatedAt': SERVER_TIMESTAMP
                         })
+                        self._apply_change(phone_normalized, False)
                         return False, None
                 
                 return True, data.get('blockReason', 'Número bloqueado por fallos de entrega')
             
+            self._apply_change(phone_normalized, False)
             return False, None
             
         except Exception as e:
             print(f"Error verificando bloqueo de teléfono: {e}")
             return False, None
     
+    # ------------------------------------------------------------------
+    # Registro de resultados de entrega (en memoria, se escriben por lotes)
+    # ------------------------------------------------------------------
+    
     def record_delivery_failure(self, phone: str, event_type: str, error_message: str) -> Dict:
         """
         RNF16: Registra un fallo de entrega de mensaje
-        Si alcanza 3 fallos consecutivos en eventos distintos, bloquea el número
+        Si alcanza 3 fallos consecutivos en eventos distintos, bloquea el número.
+        El fallo se acumula en memoria y se escribe en el siguiente flush.
         
         Args:
             phone: Número de teléfono
@@ -96,108 +217,188 @@ class PhoneValidationService:
             error_message: Mensaje de error de Twilio
             
         Returns:
-            Dict con información del estado del número
+            Dict con el número normalizado y queued=True
         """
         try:
             phone_normalized = self._normalize_phone(phone)
-            
-            doc_ref = self.collection.document(phone_normalized)
-            doc = doc_ref.get()
-            
-            now = datetime.now()
-            
-            if doc.exists:
-                data = doc.to_dict()
-                consecutive_failures = data.get('consecutiveFailures', 0)
-                failure_events = data.get('failureEvents', [])
-                
-                # Verificar si es un evento distinto
-                last_event_types = [f.get('eventType') for f in failure_events[-3:]] if failure_events else []
-                
-                # Agregar nuevo fallo
-                failure_events.append({
-                    'eventType': event_type,
-                    'errorMessage': error_message,
-                    'timestamp': now.isoformat()
-                })
-                
-                # Solo incrementar si es un evento distinto al último
-                if not last_event_types or event_type != last_event_types[-1]:
-                    consecutive_failures += 1
-                
-                # Verificar si debe bloquearse
-                should_block = consecutive_failures >= self.max_consecutive_failures
-                
-                update_data = {
-                    'consecutiveFailures': consecutive_failures,
-                    'failureEvents': failure_events[-10:],  # Mantener últimos 10
-                    'lastFailure': SERVER_TIMESTAMP,
-                    'lastEventType': event_type,
-                    'lastError': error_message
-                }
-                
-                if should_block and not data.get('blocked', False):
-                    # RNF16: Bloquear número
-                    update_data['blocked'] = True
-                    update_data['blockedAt'] = SERVER_TIMESTAMP
-                    update_data['blockedUntil'] = now + timedelta(days=self.block_duration_days)
-                    update_data['blockReason'] = f'Bloqueado automáticamente tras {consecutive_failures} fallos consecutivos de entrega'
-                    
-                    print(f"RNF16: Número {phone_normalized} bloqueado tras {consecutive_failures} fallos consecutivos")
-                
-                doc_ref.update(update_data)
-                
-                return {
-                    'phone': phone_normalized,
-                    'consecutiveFailures': consecutive_failures,
-                    'blocked': should_block,
-                    'blockReason': update_data.get('blockReason')
-                }
-            else:
-                # Primer fallo registrado
-                doc_ref.set({
-                    'phone': phone_normalized,
-                    'consecutiveFailures': 1,
-                    'failureEvents': [{
-                        'eventType': event_type,
-                        'errorMessage': error_message,
-                        'timestamp': now.isoformat()
-                    }],
-                    'lastFailure': SERVER_TIMESTAMP,
-                    'lastEventType': event_type,
-                    'lastError': error_message,
-                    'blocked': False,
-                    'createdAt': SERVER_TIMESTAMP
-                })
-                
-                return {
-                    'phone': phone_normalized,
-                    'consecutiveFailures': 1,
-                    'blocked': False
-                }
-                
+            self._queue_outcome(phone_normalized, {
+                'success': False,
+                'eventType': event_type,
+                'errorMessage': error_message,
+                'at': datetime.now(timezone.utc)
+            })
+            return {'phone': phone_normalized, 'queued': True}
         except Exception as e:
             print(f"Error registrando fallo de entrega: {e}")
             return {'error': str(e)}
     
     def record_delivery_success(self, phone: str) -> None:
         """
-        Registra una entrega exitosa, reseteando el contador de fallos
+        Registra una entrega exitosa, reseteando el contador de fallos (en el siguiente flush)
         """
         try:
-            phone_normalized = self._normalize_phone(phone)
+            self._queue_outcome(self._normalize_phone(phone), {
+                'success': True,
+                'at': datetime.now(timezone.utc)
+            })
+        except Exception as e:
+            print(f"Error registrando éxito de entrega: {e}")
+    
+    def _queue_outcome(self, phone_normalized: str, outcome: Dict):
+        with self._outcomes_lock:
+            self._pending_outcomes.setdefault(phone_normalized, []).append(outcome)
+        self._ensure_flusher()
+    
+    def _ensure_flusher(self):
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._outcomes_lock:
+            if self._flusher is not None and self._flusher.is_alive():
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name='phone-outcomes', daemon=True)
+            self._flusher.start()
+            if not self._atexit_registered:
+                atexit.register(self.flush_delivery_outcomes)
+                self._atexit_registered = True
+    
+    def _flush_loop(self):
+        while not self._flusher_stop.wait(self.outcome_flush_seconds):
+            self.flush_delivery_outcomes()
+    
+    def _fold_outcomes(self, data: Optional[Dict], outcomes: List[Dict]) -> Optional[Dict]:
+        """
+        Aplica en orden los resultados acumulados de un número sobre su documento.
+        Mismas reglas que el registro uno a uno: un éxito resetea el contador y un fallo
+        solo incrementa si su evento es distinto al del último fallo registrado.
+        Retorna los cambios (None si no hay nada que escribir).
+        """
+        exists = data is not None
+        data = data or {}
+        consecutive_failures = data.get('consecutiveFailures', 0)
+        failure_events = list(data.get('failureEvents', []))
+        blocked = data.get('blocked', False)
+        update_data = {}
+        
+        for outcome in outcomes:
+            if outcome['success']:
+                # Un número sin documento no tiene fallos que resetear
+                if exists or update_data:
+                    consecutive_failures = 0
+                    update_data['lastSuccess'] = outcome['at']
+                continue
             
-            doc_ref = self.collection.document(phone_normalized)
-            doc = doc_ref.get()
+            event_type = outcome['eventType']
+            if not failure_events or event_type != failure_events[-1].get('eventType'):
+                consecutive_failures += 1
+            failure_events.append({
+                'eventType': event_type,
+                'errorMessage': outcome['errorMessage'],
+                'timestamp': outcome['at'].isoformat()
+            })
+            update_data.update({
+                'lastFailure': outcome['at'],
+                'lastEventType': event_type,
+                'lastError': outcome['errorMessage'],
+                'failureEvents': failure_events[-10:]  # Mantener últimos 10
+            })
             
-            if doc.exists:
-                doc_ref.update({
-                    'consecutiveFailures': 0,
-                    'lastSuccess': SERVER_TIMESTAMP
+            if consecutive_failures >= self.max_consecutive_failures and not blocked:
+                # RNF16: Bloquear número
+                blocked = True
+                update_data.update({
+                    'blocked': True,
+                    'blockedAt': outcome['at'],
+                    'blockedUntil': outcome['at'] + timedelta(days=self.block_duration_days),
+                    'blockReason': f'Bloqueado automáticamente tras {consecutive_failures} fallos consecutivos de entrega'
                 })
-                
-        except Exception as e:
-            print(f"Error registrando éxito de entrega: {e}")
+        
+        if not update_data:
+            return None
+        update_data['consecutiveFailures'] = consecutive_failures
+        update_data['updatedAt'] = SERVER_TIMESTAMP
+        if not exists:
+            update_data.setdefault('blocked', False)
+            update_data['createdAt'] = SERVER_TIMESTAMP
+        return update_data
+    
+    def _flush_phone(self, phone_normalized: str, outcomes: List[Dict]):
+        """Un número con fallos: transacción porque puede cruzar el umbral de bloqueo"""
+        doc_ref = self.collection.document(phone_normalized)
+        
+        @firestore.transactional
+        def aplicar(transaction):
+            snapshot = doc_ref.get(transaction=transaction)
+            data = snapshot.to_dict() if snapshot.exists else None
+            update_data = self._fold_outcomes(data, outcomes)
+            if update_data is None:
+                return None
+            if data is None:
+                update_data['phone'] = phone_normalized
+                transaction.set(doc_ref, update_data)
+            else:
+                transaction.update(doc_ref, update_data)
+            return update_data
+        
+        update_data = aplicar(self.db.transaction())
+        if update_data:
+            if update_data.get('blocked'):
+                self._apply_change(phone_normalized, True)
+                print(f"RNF16: Número {phone_normalized} bloqueado tras {update_data['consecutiveFailures']} fallos consecutivos")
+    
+    def flush_delivery_outcomes(self) -> int:
+        """
+        Escribe los resultados acumulados. Retorna cuántos números se procesaron.
+        - Con fallos: transacción por número (umbral de bloqueo)
+        - Solo éxitos: una lectura por lotes (get_all) de esos números; los que tienen
+          fallos registrados (por cualquier worker) se resetean en un batch con
+          precondición sobre update_time. Si otro fallo se escribió entre la lectura y
+          el commit, esos números se reintentan con la transacción por número.
+        """
+        with self._outcomes_lock:
+            pending, self._pending_outcomes = self._pending_outcomes, {}
+        if not pending:
+            return 0
+        
+        solo_exitos = []
+        for phone_normalized, outcomes in pending.items():
+            if all(outcome['success'] for outcome in outcomes):
+                solo_exitos.append(phone_normalized)
+                continue
+            try:
+                self._flush_phone(phone_normalized, outcomes)
+            except Exception as e:
+                print(f"Error escribiendo resultados de entrega de {phone_normalized}: {e}")
+        
+        for i in range(0, len(solo_exitos), 400):
+            grupo = solo_exitos[i:i + 400]
+            try:
+                self._reset_failures(grupo, pending)
+            except Exception as e:
+                print(f"Batch de resets de fallos falló ({e}); aplicando número por número")
+                for phone_normalized in grupo:
+                    try:
+                        self._flush_phone(phone_normalized, pending[phone_normalized])
+                    except Exception as e:
+                        print(f"Error escribiendo resultados de entrega de {phone_normalized}: {e}")
+        return len(pending)
+    
+    def _reset_failures(self, phones: List[str], pending: Dict[str, List[Dict]]) -> int:
+        """Resetea consecutiveFailures de los números (solo éxitos) que tienen fallos en Firestore"""
+        refs = [self.collection.document(phone) for phone in phones]
+        batch = self.db.batch()
+        writes = 0
+        for snapshot in self.db.get_all(refs):
+            if not snapshot.exists or (snapshot.to_dict() or {}).get('consecutiveFailures', 0) <= 0:
+                continue
+            batch.update(snapshot.reference, {
+                'consecutiveFailures': 0,
+                'lastSuccess': pending[snapshot.id][-1]['at'],
+                'updatedAt': SERVER_TIMESTAMP
+            }, option=self.db.write_option(last_update_time=snapshot.update_time))
+            writes += 1
+        if writes:
+            batch.commit()
+        return writes
     
     def unblock_phone(self, phone: str, admin_id: str, reason: str = "") -> bool:
         """
@@ -217,8 +418,10 @@ class PhoneValidationService:
                 'consecutiveFailures': 0,
                 'unblockedAt': SERVER_TIMESTAMP,
                 'unblockedBy': admin_id,
-                'unblockReason': reason
+                'unblockReason': reason,
+                'updatedAt': SERVER_TIMESTAMP
             })
+            self._apply_change(phone_normalized, False)
             
             print(f"RNF16: Número {phone_normalized} desbloqueado manualmente por {admin_id}")
             return True
@@ -266,4 +469,4 @@ class PhoneValidationService:
 
 
 # Instancia global
-phone_validation_service = PhoneValidationService()
+phone_validation_service = lazy_service('phone_validation_service', PhoneValidationService)
@@ -11,6 +11,7 @@ from database.database import FirebaseConfig
 from datetime import datetime, timedelta
 from typing import Dict, Optional
 import pytz
+from services.registry import lazy_service, shared
 
 class PostConsultationService:
     """
@@ -18,9 +19,9 @@ class PostConsultationService:
     """
     
     def __init__(self):
-        self.whatsapp = WhatsAppService()
-        self.paciente_repo = PacienteRepository()
-        self.cita_repo = CitaRepository()
+        self.whatsapp = shared(WhatsAppService)
+        self.paciente_repo = shared(PacienteRepository)
+        self.cita_repo = shared(CitaRepository)
         self.db = FirebaseConfig.get_db()
         self.timezone = pytz.timezone('America/Mexico_City')
     
@@ -177,5 +178,5 @@ Solo toma 30 segundos.
             return None
 
 # Instancia global
-post_consultation_service = PostConsultationService()
+post_consultation_service = lazy_service('post_consultation_service', PostConsultationService)
 
@@ -6,6 +6,7 @@ J.RNF5: Límite de 50 mensajes por hora por paciente
 from database.database import FirebaseConfig
 from datetime import datetime, timedelta
 from typing import Optional, Dict
+from services.registry import lazy_service
 
 class RateLimiter:
     """
@@ -115,5 +116,5 @@ class RateLimiter:
             print(f"Error reseteando rate limit: {e}")
 
 # Instancia global
-rate_limiter = RateLimiter()
+rate_limiter = lazy_service('rate_limiter', RateLimiter)
 
@@ -0,0 +1,108 @@
+"""
+REGISTRO PEREZOSO DE SERVICIOS
+Cada servicio se construye una sola vez, en su primer uso, y se comparte en todo el
+proceso. Importar un módulo ya no conecta a Firebase ni a Twilio: las instancias
+globales (`rate_limiter`, `message_logger`, ...) son proxies que construyen el
+servicio real al acceder al primer atributo.
+
+Repositorios y clientes compartidos: shared(CitaRepository) retorna la única instancia
+del proceso (misma caché, mismas referencias a colecciones y mismo cliente de Twilio
+para todos los servicios), en lugar de construir una por servicio o por solicitud.
+
+Pruebas: registry.override('nombre', mock) reemplaza un servicio sin tocar sys.modules
+y registry.reset() vuelve a dejarlos sin construir.
+"""
+
+import threading
+from typing import Any, Callable, Dict
+
+
+class ServiceRegistry:
+    """Fábricas por nombre e instancias construidas bajo demanda (thread-safe)"""
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._instances: Dict[str, Any] = {}
+        self._lock = threading.RLock()
+
+    def register(self, name: str, factory: Callable[[], Any]):
+        with self._lock:
+            self._factories[name] = factory
+
+    def get(self, name: str) -> Any:
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        with self._lock:
+            instance = self._instances.get(name)
+            if instance is None:
+                factory = self._factories.get(name)
+                if factory is None:
+                    raise KeyError(f"Servicio no registrado: {name}")
+                instance = factory()
+                self._instances[name] = instance
+            return instance
+
+    def shared(self, cls: type) -> Any:
+        """Instancia única por proceso de una clase (la clase es la llave)"""
+        instance = self._instances.get(cls)
+        if instance is not None:
+            return instance
+        with self._lock:
+            instance = self._instances.get(cls)
+            if instance is None:
+                instance = cls()
+                self._instances[cls] = instance
+            return instance
+
+    def is_built(self, name: str) -> bool:
+        return name in self._instances
+
+    def override(self, name, instance: Any):
+        """Fija la instancia de un servicio o clase compartida (pruebas o configuración especial)"""
+        with self._lock:
+            self._instances[name] = instance
+
+    def reset(self, name=None):
+        """Descarta instancias construidas; se vuelven a crear en el siguiente uso"""
+        with self._lock:
+            if name is None:
+                self._instances.clear()
+            else:
+                self._instances.pop(name, None)
+
+
+registry = ServiceRegistry()
+shared = registry.shared
+
+
+class LazyService:
+    """
+    Proxy de una instancia global: delega atributos al servicio registrado,
+    que se construye la primera vez que se usa
+    """
+
+    __slots__ = ('_service_name',)
+
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        object.__setattr__(self, '_service_name', name)
+        registry.register(name, factory)
+
+    def _resolve(self) -> Any:
+        return registry.get(object.__getattribute__(self, '_service_name'))
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._resolve(), attr)
+
+    def __setattr__(self, attr: str, value: Any):
+        setattr(self._resolve(), attr, value)
+
+    def __repr__(self) -> str:
+        name = object.__getattribute__(self, '_service_name')
+        state = 'construido' if registry.is_built(name) else 'sin construir'
+        return f"<LazyService {name} ({state})>"
+
+
+def lazy_service(name: str, factory: Callable[[], Any]) -> LazyService:
+    """Registra la fábrica y retorna el proxy para usarlo como instancia global"""
+    return LazyService(name, factory)
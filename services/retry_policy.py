@@ -0,0 +1,108 @@
+"""
+POLÍTICAS DE REINTENTO POR TIPO DE ERROR
+J.RNF15: Estrategia de reintentos
+
+Cada fallo de Twilio se clasifica por su código de error:
+- throttled: límite de velocidad; backoff corto, varios intentos
+- outage: caída o error interno de Twilio/Meta; backoff largo
+- invalid_number: el número nunca va a recibir; dead-letter inmediato y cuenta para
+  el bloqueo de RNF16 (PhoneValidationService)
+- rejected: permanente pero no es culpa del número (opt-out, fuera de la ventana de
+  24 h); dead-letter inmediato sin afectar el número
+- unknown: sin código (excepción de red, respuesta vacía); la estrategia original de
+  2 intentos cada 30 min
+
+El retraso es exponencial con jitter (mitad fija + mitad aleatoria) para que un lote
+de fallos no se reintente en el mismo segundo.
+"""
+
+import random
+from typing import Dict, Optional
+
+
+class RetryPolicy:
+    """Parámetros de reintento de una clase de error"""
+
+    def __init__(self, error_class: str, max_attempts: int, base_delay_minutes: float = 0,
+                 max_delay_minutes: float = 0, factor: float = 2.0, permanent: bool = False,
+                 blocks_phone: bool = False):
+        self.error_class = error_class
+        self.max_attempts = max_attempts
+        self.base_delay_minutes = base_delay_minutes
+        self.max_delay_minutes = max_delay_minutes
+        self.factor = factor
+        self.permanent = permanent
+        self.blocks_phone = blocks_phone
+
+    def delay_minutes(self, attempt: int, rng: random.Random = None) -> float:
+        """Retraso antes del intento `attempt` (1 = primer reintento)"""
+        delay = min(self.max_delay_minutes, self.base_delay_minutes * (self.factor ** max(0, attempt - 1)))
+        return delay / 2 + (rng or random).uniform(0, delay / 2)
+
+    def should_retry(self, attempt: int) -> bool:
+        return not self.permanent and attempt <= self.max_attempts
+
+    def with_overrides(self, overrides: Dict) -> 'RetryPolicy':
+        params = dict(self.__dict__)
+        params.update(overrides)
+        return RetryPolicy(**params)
+
+
+RETRY_POLICIES = {
+    'throttled': RetryPolicy('throttled', max_attempts=5, base_delay_minutes=1, max_delay_minutes=30),
+    'outage': RetryPolicy('outage', max_attempts=4, base_delay_minutes=10, max_delay_minutes=120),
+    'invalid_number': RetryPolicy('invalid_number', max_attempts=0, permanent=True, blocks_phone=True),
+    'rejected': RetryPolicy('rejected', max_attempts=0, permanent=True),
+    'unknown': RetryPolicy('unknown', max_attempts=2, base_delay_minutes=30, max_delay_minutes=60, factor=1.0),
+}
+
+# Códigos de error de Twilio / WhatsApp
+TWILIO_ERROR_CLASSES = {
+    20429: 'throttled',       # Too many requests
+    14107: 'throttled',       # Message rate limit exceeded
+    63018: 'throttled',       # Rate limit exceeded for WhatsApp sender
+    20500: 'outage',          # Internal server error
+    20503: 'outage',          # Service unavailable
+    30001: 'outage',          # Queue overflow
+    30008: 'outage',          # Unknown error del operador
+    63112: 'outage',          # Cuenta de Meta deshabilitada (no es culpa del número)
+    21211: 'invalid_number',  # Invalid 'To' phone number
+    21614: 'invalid_number',  # 'To' number is not a valid mobile number
+    63003: 'invalid_number',  # Channel could not find the To address
+    63024: 'invalid_number',  # Invalid message recipient
+    30006: 'invalid_number',  # Landline or unreachable carrier
+    21610: 'rejected',        # El destinatario respondió STOP
+    63016: 'rejected',        # Fuera de la ventana de 24 h (requiere plantilla)
+    21408: 'rejected',        # Región no habilitada
+}
+
+# Ajustes por tipo de evento (un mensaje conversacional no sirve horas después)
+EVENT_OVERRIDES = {
+    'user_message_response': {'max_attempts': 1, 'max_delay_minutes': 5},
+}
+
+
+def classify_error(error_code: Optional[int] = None, http_status: Optional[int] = None) -> str:
+    """Clase de error a partir del código de Twilio (o del status HTTP si no hay código)"""
+    if error_code is not None:
+        try:
+            error_class = TWILIO_ERROR_CLASSES.get(int(error_code))
+        except (TypeError, ValueError):
+            error_class = None
+        if error_class:
+            return error_class
+    if http_status == 429:
+        return 'throttled'
+    if http_status is not None and http_status >= 500:
+        return 'outage'
+    return 'unknown'
+
+
+def get_retry_policy(error_code: Optional[int] = None, event_type: Optional[str] = None,
+                     http_status: Optional[int] = None) -> RetryPolicy:
+    """Política para un fallo: clase por código de error y ajustes por tipo de evento"""
+    policy = RETRY_POLICIES[classify_error(error_code, http_status)]
+    overrides = EVENT_OVERRIDES.get(event_type)
+    if overrides and not policy.permanent:
+        policy = policy.with_overrides(overrides)
+    return policy
@@ -1,15 +1,34 @@
 """
 🔄 SISTEMA DE REENVÍO Y REINTENTOS
 J.RF10: Reenvío automático de mensajes
-J.RNF15: Estrategia de reintentos (2 intentos cada 30 min)
+J.RNF15: Estrategia de reintentos (2 intentos cada 30 min; por clase de error en
+services/retry_policy.py)
+
+Cola ordenada por tiempo: cada reintento guarda `dueAt` (timestamp nativo) y los
+workers toman solo los vencidos con una consulta por rango ordenada y con límite.
+Tomar un reintento es un lease: en una transacción se mueve `dueAt` al fin del lease,
+así otro worker no lo ve como vencido; si el worker muere, vuelve a vencer solo.
+
+Un mensaje lógico = un documento: el ID es determinista (paciente, evento, hash del
+contenido) y se crea solo si no existe, así varios fallos del mismo mensaje se funden
+en una entrada con historial de intentos en vez de multiplicar reintentos.
+
+Índice compuesto requerido (whatsapp_retry_queue): status ASC, dueAt ASC
 """
 
+import hashlib
+import os
+import socket
 from database.database import FirebaseConfig
-from datetime import datetime, timedelta
-from typing import Dict, Optional
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from google.api_core.exceptions import Conflict
+from google.cloud import firestore
 from google.cloud.firestore import SERVER_TIMESTAMP
 from services.whatsapp_service import WhatsAppService
 from services.message_logger import message_logger
+from services.retry_policy import get_retry_policy
+from services.registry import lazy_service, shared
 
 class RetryService:
     """
@@ -19,97 +38,264 @@ class RetryService:
     def __init__(self):
         self.db = FirebaseConfig.get_db()
         self.collection = self.db.collection('whatsapp_retry_queue')
-        self.whatsapp = WhatsAppService()
-        self.max_retries = 2
-        self.retry_interval_minutes = 30
+        self.whatsapp = shared(WhatsAppService)
+        self.batch_size = 50
+        self.lease_seconds = 300
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.max_attempt_history = 20
+        self._legacy_migrated = False
+
+    @staticmethod
+    def _now() -> datetime:
+        return datetime.now(timezone.utc)
+
+    def _lease_updates(self, retry_data: Optional[Dict], now: datetime) -> Optional[Dict]:
+        """
+        Cambios para tomar un reintento, o None si ya no está pendiente o aún no vence
+        (otro worker lo tomó entre la consulta y la transacción)
+        """
+        if not retry_data or retry_data.get('status') != 'pending':
+            return None
+        due_at = retry_data.get('dueAt')
+        if due_at is None or due_at > now:
+            return None
+        return {
+            'dueAt': now + timedelta(seconds=self.lease_seconds),
+            'leaseOwner': self.worker_id,
+            'leasedAt': now
+        }
     
+    def _failure_updates(self, retry_count: int, event_type: str, error_info: Optional[Dict],
+                         now: datetime) -> Dict:
+        """
+        Estado tras un fallo según la política de su clase de error: otro intento con
+        backoff, 'failed' si se agotaron los intentos o 'dead_letter' si es permanente
+        """
+        error_info = error_info or {}
+        policy = get_retry_policy(error_info.get('code'), event_type, error_info.get('status'))
+        attempt = retry_count + 1
+        updates = {
+            'retryCount': attempt,
+            'errorCode': error_info.get('code'),
+            'errorClass': policy.error_class,
+            'leaseOwner': None
+        }
+        if policy.permanent:
+            updates.update({'status': 'dead_letter', 'deadLetterReason': policy.error_class})
+        elif policy.should_retry(attempt):
+            updates.update({
+                'status': 'pending',
+                'dueAt': now + timedelta(minutes=policy.delay_minutes(attempt))
+            })
+        else:
+            updates.update({'status': 'failed', 'maxRetriesReached': True})
+        return updates
+
+    def _report_invalid_number(self, paciente_id: str, phone: Optional[str], event_type: str,
+                               error_message: str):
+        """RNF16: un número inválido cuenta para el bloqueo del teléfono"""
+        try:
+            if not phone:
+                from database.models import PacienteRepository
+                paciente = shared(PacienteRepository).buscar_por_id(paciente_id)
+                phone = paciente.telefono if paciente else None
+            if phone:
+                from services.phone_validation_service import phone_validation_service
+                phone_validation_service.record_delivery_failure(phone, event_type, error_message)
+        except Exception as e:
+            print(f"Error reportando número inválido: {e}")
+
+    @staticmethod
+    def _retry_key(paciente_id: str, event_type: str, message_content: str) -> str:
+        """ID determinista del mensaje lógico: mismo paciente, evento y contenido"""
+        content_hash = hashlib.sha256((message_content or '').encode('utf-8')).hexdigest()[:16]
+        return f"{paciente_id}_{event_type}_{content_hash}"
+
+    @staticmethod
+    def _attempt_entry(retry_state: Dict, error: str, now: datetime, source: str) -> Dict:
+        return {
+            'at': now,
+            'source': source,
+            'errorCode': retry_state.get('errorCode'),
+            'errorClass': retry_state.get('errorClass'),
+            'error': error
+        }
+
+    def _coalesce_updates(self, existing: Dict, new_doc: Dict, now: datetime) -> Dict:
+        """
+        Cambios cuando el mensaje ya tiene entrada: si sigue pendiente solo se agrega el
+        intento al historial (no se programa otro reintento); si ya terminó (enviado,
+        fallido, dead-letter) se reabre con el nuevo estado conservando el historial
+        """
+        history = list(existing.get('attempts') or []) + new_doc['attempts']
+        updates = {
+            'attempts': history[-self.max_attempt_history:],
+            'coalescedCount': existing.get('coalescedCount', 0) + 1,
+            'lastAttempt': new_doc['lastAttempt'],
+            'error': new_doc['error']
+        }
+        if existing.get('status') != 'pending':
+            updates.update({key: value for key, value in new_doc.items()
+                            if key not in ('attempts', 'createdAt')})
+            updates['reopenedAt'] = now
+        return updates
+
+    def _merge_existing(self, doc_ref, new_doc: Dict, now: datetime) -> Dict:
+        @firestore.transactional
+        def fundir(transaction):
+            snapshot = doc_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                transaction.set(doc_ref, new_doc)
+                return new_doc
+            existing = snapshot.to_dict()
+            updates = self._coalesce_updates(existing, new_doc, now)
+            transaction.update(doc_ref, updates)
+            existing.update(updates)
+            return existing
+
+        return fundir(self.db.transaction())
+
     def schedule_retry(self, 
                       paciente_id: str,
                       dentista_id: Optional[str],
                       event_type: str,
                       message_content: str,
                       original_message_id: str,
-                      error: str):
+                      error: str,
+                      error_code: Optional[int] = None,
+                      phone: Optional[str] = None):
         """
-        Programa un reintento para un mensaje fallido
+        Programa un reintento para un mensaje fallido.
+        Sin error_code se usa el último error de envío de WhatsAppService en este hilo.
+        Retorna True si el mensaje queda pendiente de reintento.
         """
         try:
-            # Verificar si ya hay reintentos programados
-            existing_retries = self.collection\
-                .where('pacienteId', '==', paciente_id)\
-                .where('eventType', '==', event_type)\
-                .where('status', '==', 'pending')\
-                .stream()
-            
-            retry_count = sum(1 for _ in existing_retries)
-            
-            if retry_count >= self.max_retries:
-                # Ya se intentó el máximo de veces
-                self.collection.add({
-                    'pacienteId': paciente_id,
-                    'dentistaId': dentista_id,
-                    'eventType': event_type,
-                    'messageContent': message_content,
-                    'originalMessageId': original_message_id,
-                    'error': error,
-                    'status': 'failed',
-                    'retryCount': retry_count + 1,
-                    'maxRetriesReached': True,
-                    'createdAt': SERVER_TIMESTAMP,
-                    'lastAttempt': datetime.now().isoformat()
-                })
-                return False
-            
-            # Programar reintento
-            retry_time = datetime.now() + timedelta(minutes=self.retry_interval_minutes)
+            if error_code is not None:
+                error_info = {'code': error_code}
+            else:
+                error_info = self.whatsapp.last_error()
+            now = self._now()
+            retry_state = self._failure_updates(0, event_type, error_info, now)
+            retry_state.pop('leaseOwner')
             
-            self.collection.add({
+            new_doc = {
                 'pacienteId': paciente_id,
                 'dentistaId': dentista_id,
                 'eventType': event_type,
                 'messageContent': message_content,
                 'originalMessageId': original_message_id,
                 'error': error,
-                'status': 'pending',
-                'retryCount': retry_count + 1,
-                'scheduledFor': retry_time.isoformat(),
-                'createdAt': SERVER_TIMESTAMP
-            })
+                'createdAt': SERVER_TIMESTAMP,
+                'lastAttempt': datetime.now().isoformat(),
+                'attempts': [self._attempt_entry(retry_state, error, now, 'send')],
+                **retry_state
+            }
+            
+            doc_ref = self.collection.document(self._retry_key(paciente_id, event_type, message_content))
+            try:
+                # Un solo round trip en el caso común (primer fallo del mensaje)
+                doc_ref.create(new_doc)
+                stored = new_doc
+            except Conflict:
+                stored = self._merge_existing(doc_ref, new_doc, now)
+            
+            if retry_state['errorClass'] == 'invalid_number':
+                self._report_invalid_number(paciente_id, phone, event_type, error)
             
-            return True
+            return stored.get('status') == 'pending'
             
         except Exception as e:
             print(f"Error programando reintento: {e}")
             return False
     
+    def _claim(self, doc_ref, now: datetime) -> Optional[Dict]:
+        """Toma el lease de un reintento en una transacción; None si otro worker lo tiene"""
+        @firestore.transactional
+        def tomar(transaction):
+            snapshot = doc_ref.get(transaction=transaction)
+            retry_data = snapshot.to_dict() if snapshot.exists else None
+            updates = self._lease_updates(retry_data, now)
+            if updates is None:
+                return None
+            transaction.update(doc_ref, updates)
+            retry_data.update(updates)
+            return retry_data
+
+        return tomar(self.db.transaction())
+
+    def claim_due_retries(self, limit: int = None) -> List[Tuple[str, Dict]]:
+        """
+        Reintentos vencidos (dueAt <= ahora), los más antiguos primero, con lease tomado
+        """
+        now = self._now()
+        due = self.collection\
+            .where('status', '==', 'pending')\
+            .where('dueAt', '<=', now)\
+            .order_by('dueAt')\
+            .limit(limit or self.batch_size)\
+            .stream()
+
+        claimed = []
+        for retry_doc in due:
+            try:
+                retry_data = self._claim(retry_doc.reference, now)
+            except Exception as e:
+                print(f"Error tomando reintento {retry_doc.id}: {e}")
+                continue
+            if retry_data is not None:
+                claimed.append((retry_doc.id, retry_data))
+        return claimed
+
+    def _migrate_legacy_retries(self):
+        """
+        Una vez por proceso: los pendientes viejos solo tienen 'scheduledFor' (ISO, hora
+        local) y no aparecen en la consulta por dueAt; se les agrega el timestamp
+        """
+        if self._legacy_migrated:
+            return
+        self._legacy_migrated = True
+        try:
+            batch = self.db.batch()
+            pending_writes = 0
+            for retry_doc in self.collection.where('status', '==', 'pending').stream():
+                retry_data = retry_doc.to_dict()
+                if retry_data.get('dueAt') is not None:
+                    continue
+                try:
+                    due_at = datetime.fromisoformat(retry_data.get('scheduledFor') or '')
+                except ValueError:
+                    due_at = self._now()
+                if due_at.tzinfo is None:
+                    due_at = due_at.astimezone(timezone.utc)
+                batch.update(retry_doc.reference, {'dueAt': due_at})
+                pending_writes += 1
+                if pending_writes >= 400:
+                    batch.commit()
+                    batch = self.db.batch()
+                    pending_writes = 0
+            if pending_writes:
+                batch.commit()
+        except Exception as e:
+            print(f"Error migrando reintentos sin dueAt: {e}")
+
     def process_pending_retries(self):
         """
         Procesa los reintentos pendientes que ya pasaron su tiempo programado
+        (por lotes de batch_size hasta vaciar los vencidos)
         """
         try:
-            now = datetime.now()
-            
-            # Buscar reintentos pendientes que ya deben ejecutarse
-            pending_retries = self.collection\
-                .where('status', '==', 'pending')\
-                .stream()
-            
+            self._migrate_legacy_retries()
+
             processed = 0
-            for retry_doc in pending_retries:
-                retry_data = retry_doc.to_dict()
-                scheduled_for_str = retry_data.get('scheduledFor')
-                
-                if not scheduled_for_str:
-                    continue
-                
-                scheduled_for = datetime.fromisoformat(scheduled_for_str)
-                
-                if scheduled_for <= now:
+            while True:
+                claimed = self.claim_due_retries()
+                for retry_id, retry_data in claimed:
                     # Intentar reenviar
-                    success = self._retry_message(retry_doc.id, retry_data)
-                    if success:
+                    if self._retry_message(retry_id, retry_data):
                         processed += 1
-            
+                if len(claimed) < self.batch_size:
+                    break
+
             return processed
             
         except Exception as e:
@@ -126,7 +312,7 @@ class RetryService:
             
             # Obtener teléfono del paciente
             from database.models import PacienteRepository
-            paciente_repo = PacienteRepository()
+            paciente_repo = shared(PacienteRepository)
             paciente = paciente_repo.buscar_por_id(paciente_id)
             
             if not paciente or not paciente.telefono:
@@ -150,7 +336,8 @@ class RetryService:
                     'status': 'sent',
                     'messageId': result.get('sid'),
                     'sentAt': datetime.now().isoformat(),
-                    'lastAttempt': datetime.now().isoformat()
+                    'lastAttempt': datetime.now().isoformat(),
+                    'leaseOwner': None
                 })
                 
                 # Registrar en logs
@@ -165,26 +352,23 @@ class RetryService:
                 
                 return True
             else:
-                # Falló de nuevo, programar otro reintento si no se alcanzó el máximo
-                retry_count = retry_data.get('retryCount', 0)
-                if retry_count < self.max_retries:
-                    # Programar otro reintento
-                    new_retry_time = datetime.now() + timedelta(minutes=self.retry_interval_minutes)
-                    self.collection.document(retry_id).update({
-                        'status': 'pending',
-                        'retryCount': retry_count + 1,
-                        'scheduledFor': new_retry_time.isoformat(),
-                        'lastAttempt': datetime.now().isoformat(),
-                        'lastError': 'Reintento fallido'
-                    })
-                else:
-                    # Máximo alcanzado
-                    self.collection.document(retry_id).update({
-                        'status': 'failed',
-                        'maxRetriesReached': True,
-                        'lastAttempt': datetime.now().isoformat(),
-                        'lastError': 'Máximo de reintentos alcanzado'
-                    })
+                # Falló de nuevo: la política de la clase de error decide si se reintenta
+                error_info = self.whatsapp.last_error() or {}
+                updates = self._failure_updates(retry_data.get('retryCount', 0),
+                                                retry_data.get('eventType'), error_info, self._now())
+                updates.update({
+                    'lastAttempt': datetime.now().isoformat(),
+                    'lastError': error_info.get('message') or 'Reintento fallido'
+                })
+                # Los reintentos están acotados por la política: ArrayUnion no crece sin límite
+                updates['attempts'] = firestore.ArrayUnion([
+                    self._attempt_entry(updates, updates['lastError'], self._now(), 'retry')
+                ])
+                self.collection.document(retry_id).update(updates)
+                
+                if updates['errorClass'] == 'invalid_number':
+                    self._report_invalid_number(paciente_id, paciente.telefono,
+                                                retry_data.get('eventType'), updates['lastError'])
                 
                 return False
                 
@@ -198,5 +382,5 @@ class RetryService:
             return False
 
 # Instancia global
-retry_service = RetryService()
+retry_service = lazy_service('retry_service', RetryService)
 
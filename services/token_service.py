@@ -1,24 +1,76 @@
 """
 🔐 SISTEMA DE TOKENS FIRMADOS PARA ENLACES
 J.RNF17: Tokens firmados para enlaces con expiración 24h
+
+Formato compacto (v2), base64url sin relleno:
+    versión (1 byte) | key id (1 byte) | emitido (uint32) | expira (uint32) |
+    token id (8 bytes) | payload JSON | HMAC-SHA256 truncado (16 bytes)
+El key id permite rotar secretos (TOKEN_SECRET_KEYS="1:secreto1,2:secreto2" y
+TOKEN_ACTIVE_KEY_ID=2); los tokens firmados con llaves anteriores siguen siendo válidos
+mientras la llave esté configurada.
+TOKEN_SECRET_KEY (llave 0, también la del formato anterior) solo se carga si no hay
+TOKEN_SECRET_KEYS, si aparece en ella como "0:..." o con TOKEN_LEGACY_KEY=true; así
+se retira quitándola de la configuración.
 """
 
 import hmac
 import hashlib
 import json
+import os
+import secrets
+import struct
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Dict, Optional
 import base64
 
+TOKEN_VERSION = 2
+_HEADER = struct.Struct('>BBII8s')
+_SIGNATURE_SIZE = 16
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
 class TokenService:
     """
     Genera y valida tokens firmados para enlaces del bot
+    - Cache LRU de tokens ya validados (no se re-verifica la firma en cada clic)
+    - Registro de tokens consumidos con TTL para rechazar localmente enlaces de un solo uso
     """
     
-    def __init__(self):
-        import os
+    def __init__(self, cache_size: int = 1024):
         self.secret_key = os.getenv('TOKEN_SECRET_KEY', 'densora-secret-key-change-in-production')
         self.token_expiry_hours = 24
+        self.keys = self._load_keys()
+        self.active_key_id = int(os.getenv('TOKEN_ACTIVE_KEY_ID', max(self.keys)))
+        
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._validated: OrderedDict = OrderedDict()  # token -> (datos, expira)
+        self._consumed: Dict[bytes, int] = {}  # token id -> expira (epoch)
+    
+    def _load_keys(self) -> Dict[int, bytes]:
+        """Llaves por key id; TOKEN_SECRET_KEY es la llave 0 solo mientras siga habilitada"""
+        keys = {}
+        for entry in os.getenv('TOKEN_SECRET_KEYS', '').split(','):
+            kid, sep, secret = entry.strip().partition(':')
+            if sep and kid.isdigit() and 0 <= int(kid) <= 255 and secret:
+                keys[int(kid)] = secret.encode()
+        legacy_enabled = os.getenv('TOKEN_LEGACY_KEY', '').lower() in ('1', 'true')
+        if not keys or legacy_enabled:
+            keys.setdefault(0, self.secret_key.encode())
+        return keys
+    
+    def _sign(self, key: bytes, body: bytes) -> bytes:
+        return hmac.new(key, body, hashlib.sha256).digest()[:_SIGNATURE_SIZE]
     
     def generate_token(self, data: Dict) -> str:
         """
@@ -28,37 +80,89 @@ class TokenService:
             data: Datos a incluir en el token (ej: {'action': 'cancel', 'citaId': '123'})
         
         Returns:
-            Token firmado en formato base64
+            Token firmado en formato base64url compacto
         """
         try:
-            # Agregar expiración
-            expires_at = datetime.now() + timedelta(hours=self.token_expiry_hours)
-            token_data = {
-                **data,
-                'expiresAt': expires_at.isoformat(),
-                'issuedAt': datetime.now().isoformat()
-            }
-            
-            # Serializar datos
-            payload = json.dumps(token_data, sort_keys=True)
-            payload_b64 = base64.urlsafe_b64encode(payload.encode()).decode()
-            
-            # Generar firma HMAC
-            signature = hmac.new(
-                self.secret_key.encode(),
-                payload_b64.encode(),
-                hashlib.sha256
-            ).hexdigest()
+            issued_at = int(time.time())
+            expires_at = issued_at + self.token_expiry_hours * 3600
+            payload = json.dumps(data, sort_keys=True, separators=(',', ':')).encode()
             
-            # Combinar payload y firma
-            token = f"{payload_b64}.{signature}"
-            
-            return token
+            body = _HEADER.pack(TOKEN_VERSION, self.active_key_id, issued_at, expires_at,
+                                secrets.token_bytes(8)) + payload
+            return _b64encode(body + self._sign(self.keys[self.active_key_id], body))
             
         except Exception as e:
             print(f"Error generando token: {e}")
             return None
     
+    def _decode_token(self, token: str):
+        """
+        Verifica firma y expiración
+        
+        Returns:
+            (datos, token id, expira en epoch) o None
+        """
+        if '.' in token:
+            return self._decode_legacy_token(token)
+        
+        raw = _b64decode(token)
+        if len(raw) < _HEADER.size + _SIGNATURE_SIZE:
+            return None
+        body, signature = raw[:-_SIGNATURE_SIZE], raw[-_SIGNATURE_SIZE:]
+        version, key_id, _issued_at, expires_at, token_id = _HEADER.unpack_from(body)
+        key = self.keys.get(key_id)
+        if version != TOKEN_VERSION or key is None:
+            return None
+        if not hmac.compare_digest(signature, self._sign(key, body)):
+            return None
+        if time.time() > expires_at:
+            return None
+        return json.loads(body[_HEADER.size:].decode()), token_id, expires_at
+    
+    def _decode_legacy_token(self, token: str):
+        """Formato anterior (payload_b64.firma_hex), firmado con la llave 0"""
+        parts = token.split('.')
+        legacy_key = self.keys.get(0)
+        if len(parts) != 2 or legacy_key is None:
+            return None
+        
+        payload_b64, signature = parts
+        expected_signature = hmac.new(
+            legacy_key,
+            payload_b64.encode(),
+            hashlib.sha256
+        ).hexdigest()
+        if not hmac.compare_digest(signature, expected_signature):
+            return None
+        
+        token_data = json.loads(base64.urlsafe_b64decode(payload_b64.encode()).decode())
+        expires_at = datetime.fromisoformat(token_data.pop('expiresAt')) if token_data.get('expiresAt') else \
+            datetime.now() + timedelta(hours=self.token_expiry_hours)
+        if datetime.now() > expires_at:
+            return None
+        token_data.pop('issuedAt', None)
+        return token_data, bytes.fromhex(signature[:16]), int(expires_at.timestamp())
+    
+    def _validate(self, token: str):
+        """Validación con cache LRU de tokens ya verificados"""
+        now = time.time()
+        with self._lock:
+            cached = self._validated.get(token)
+            if cached is not None:
+                if cached[2] >= now:
+                    self._validated.move_to_end(token)
+                    return cached
+                del self._validated[token]
+        
+        decoded = self._decode_token(token)
+        if decoded is None:
+            return None
+        with self._lock:
+            self._validated[token] = decoded
+            if len(self._validated) > self.cache_size:
+                self._validated.popitem(last=False)
+        return decoded
+    
     def validate_token(self, token: str) -> Optional[Dict]:
         """
         Valida un token y retorna los datos si es válido
@@ -70,42 +174,52 @@ class TokenService:
             Dict con los datos del token si es válido, None si es inválido o expirado
         """
         try:
-            # Separar payload y firma
-            parts = token.split('.')
-            if len(parts) != 2:
+            if not token:
                 return None
+            decoded = self._validate(token)
+            return dict(decoded[0]) if decoded else None
             
-            payload_b64, signature = parts
-            
-            # Verificar firma
-            expected_signature = hmac.new(
-                self.secret_key.encode(),
-                payload_b64.encode(),
-                hashlib.sha256
-            ).hexdigest()
-            
-            if not hmac.compare_digest(signature, expected_signature):
+        except Exception as e:
+            print(f"Error validando token: {e}")
+            return None
+    
+    def is_consumed(self, token: str) -> bool:
+        """True si este proceso ya consumió el token (rechazo local, sin Firestore)"""
+        try:
+            decoded = self._validate(token) if token else None
+        except Exception:
+            return False
+        if not decoded:
+            return False
+        with self._lock:
+            return self._consumed.get(decoded[1], 0) >= time.time()
+    
+    def consume_token(self, token: str) -> Optional[Dict]:
+        """
+        Valida un token de un solo uso y lo marca como consumido en este proceso
+        Un segundo uso del mismo enlace se rechaza localmente (None) sin ir a Firestore.
+        Es solo un atajo: el registro de un solo uso que vale entre workers lo guarda
+        quien consume el enlace (p. ej. el status de la solicitud de autorización).
+        """
+        try:
+            if not token:
                 return None
+            decoded = self._validate(token)
+            if not decoded:
+                return None
+            data, token_id, expires_at = decoded
             
-            # Decodificar payload
-            payload = base64.urlsafe_b64decode(payload_b64.encode()).decode()
-            token_data = json.loads(payload)
-            
-            # Verificar expiración
-            expires_at_str = token_data.get('expiresAt')
-            if expires_at_str:
-                expires_at = datetime.fromisoformat(expires_at_str)
-                if datetime.now() > expires_at:
+            now = time.time()
+            with self._lock:
+                if len(self._consumed) > self.cache_size:
+                    self._consumed = {tid: exp for tid, exp in self._consumed.items() if exp >= now}
+                if self._consumed.get(token_id, 0) >= now:
                     return None
-            
-            # Remover campos internos
-            token_data.pop('expiresAt', None)
-            token_data.pop('issuedAt', None)
-            
-            return token_data
+                self._consumed[token_id] = expires_at
+            return dict(data)
             
         except Exception as e:
-            print(f"Error validando token: {e}")
+            print(f"Error consumiendo token: {e}")
             return None
     
     def generate_cancel_link(self, cita_id: str, paciente_id: str) -> str:
@@ -0,0 +1,266 @@
+"""
+TRAZAS POR SOLICITUD Y PERFILADO DEL CAMINO CALIENTE
+- span(nombre): mide una etapa anidada dentro de la traza de la solicitud actual
+  (contextvars, así que funciona por hilo/solicitud sin pasar objetos)
+- Sin traza activa, span() no hace nada (costo casi nulo)
+- Percentiles agregados por etapa (p50/p90/p99) en memoria del worker
+- Perfilador por muestreo opcional por solicitud: header X-Debug-Profile: 1 (solo
+  con X-Debug-Token = DEBUG_ADMIN_TOKEN) o env TRACE_PROFILE=1; toma el stack del
+  hilo cada TRACE_PROFILE_INTERVAL_MS
+- debug_authorized(): la misma verificación de token protege los endpoints de
+  depuración; sin DEBUG_ADMIN_TOKEN configurado todo queda cerrado
+"""
+
+import contextvars
+import functools
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar('current_trace', default=None)
+
+
+class Trace:
+    """Traza de una solicitud: lista plana de spans con profundidad y padre"""
+
+    def __init__(self, name: str, attrs: Dict = None):
+        self.name = name
+        self.attrs = attrs or {}
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.spans: List[Dict] = []
+        self._stack: List[int] = []
+        self.duration_ms: Optional[float] = None
+        self.profile: Optional[List] = None
+
+    def open_span(self, name: str, attrs: Dict) -> int:
+        index = len(self.spans)
+        self.spans.append({
+            'name': name,
+            'parent': self._stack[-1] if self._stack else None,
+            'depth': len(self._stack),
+            'start_ms': round((time.perf_counter() - self._t0) * 1000, 3),
+            'duration_ms': None,
+            'attrs': attrs
+        })
+        self._stack.append(index)
+        return index
+
+    def close_span(self, index: int, duration_ms: float, error: str = None):
+        span = self.spans[index]
+        span['duration_ms'] = round(duration_ms, 3)
+        if error:
+            span['error'] = error
+        if self._stack and self._stack[-1] == index:
+            self._stack.pop()
+
+    def to_dict(self) -> Dict:
+        data = {
+            'name': self.name,
+            'attrs': self.attrs,
+            'started_at': self.started_at,
+            'duration_ms': self.duration_ms,
+            'spans': self.spans
+        }
+        if self.profile is not None:
+            data['profile'] = self.profile
+        return data
+
+
+class SamplingProfiler:
+    """
+    Perfilador por muestreo de un solo hilo: cada intervalo lee el frame actual del
+    hilo objetivo (sys._current_frames) y acumula stacks "plegados" (a;b;c -> muestras)
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005, max_depth: int = 40):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='trace-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, top: int = 25) -> List[Dict]:
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+        return [{'stack': stack, 'samples': count} for stack, count in self.samples.most_common(top)]
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+
+
+class StageStats:
+    """Duraciones recientes por etapa (ventana acotada) para percentiles"""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._lock = threading.Lock()
+        self._durations: Dict[str, deque] = {}
+        self._counts: Counter = Counter()
+
+    def record(self, name: str, duration_ms: float):
+        with self._lock:
+            bucket = self._durations.get(name)
+            if bucket is None:
+                bucket = self._durations[name] = deque(maxlen=self.window)
+            bucket.append(duration_ms)
+            self._counts[name] += 1
+
+    @staticmethod
+    def _percentile(ordered: List[float], pct: float) -> float:
+        index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+        return round(ordered[index], 3)
+
+    def get_stats(self) -> Dict[str, Dict]:
+        with self._lock:
+            snapshot = {name: sorted(values) for name, values in self._durations.items()}
+            counts = dict(self._counts)
+        stats = {}
+        for name, ordered in snapshot.items():
+            if not ordered:
+                continue
+            stats[name] = {
+                'count': counts.get(name, 0),
+                'p50_ms': self._percentile(ordered, 50),
+                'p90_ms': self._percentile(ordered, 90),
+                'p99_ms': self._percentile(ordered, 99),
+                'max_ms': round(ordered[-1], 3)
+            }
+        return dict(sorted(stats.items(), key=lambda item: item[1]['p90_ms'], reverse=True))
+
+    def reset(self):
+        with self._lock:
+            self._durations.clear()
+            self._counts.clear()
+
+
+class Tracer:
+    """
+    Punto de entrada: tracer.trace() abre la traza de la solicitud (o un span si ya hay
+    una activa) y span() mide etapas internas
+    """
+
+    PROFILE_HEADER = 'X-Debug-Profile'
+    TOKEN_HEADER = 'X-Debug-Token'
+
+    def __init__(self):
+        self.enabled = os.getenv('TRACING_ENABLED', 'true').lower() != 'false'
+        self.profile_by_default = os.getenv('TRACE_PROFILE', '').lower() in ('1', 'true')
+        self.admin_token = os.getenv('DEBUG_ADMIN_TOKEN', '')
+        self.profile_interval = float(os.getenv('TRACE_PROFILE_INTERVAL_MS', '5')) / 1000.0
+        self.slow_trace_ms = float(os.getenv('TRACE_SLOW_MS', '3000'))
+        self.stats = StageStats()
+        self.recent = deque(maxlen=int(os.getenv('TRACE_RECENT', '50')))
+
+    def debug_authorized(self, headers=None) -> bool:
+        """True si la solicitud trae el token de depuración (DEBUG_ADMIN_TOKEN)"""
+        if not self.admin_token or headers is None:
+            return False
+        # En bytes: compare_digest rechaza str con caracteres no ASCII
+        token = str(headers.get(self.TOKEN_HEADER, '')).encode('utf-8')
+        return hmac.compare_digest(token, self.admin_token.encode('utf-8'))
+
+    def profile_requested(self, headers=None) -> bool:
+        """Perfilado activado por env o por header de una solicitud autorizada"""
+        if self.profile_by_default:
+            return True
+        if headers is not None and str(headers.get(self.PROFILE_HEADER, '')).lower() in ('1', 'true'):
+            return self.debug_authorized(headers)
+        return False
+
+    @staticmethod
+    def current() -> Optional[Trace]:
+        return _current_trace.get()
+
+    @contextmanager
+    def trace(self, name: str, profile: bool = False, **attrs):
+        """Abre una traza raíz; si ya hay una activa, se comporta como span()"""
+        if not self.enabled:
+            yield None
+            return
+        if _current_trace.get() is not None:
+            with self.span(name, **attrs) as active:
+                yield active
+            return
+
+        trace = Trace(name, attrs)
+        token = _current_trace.set(trace)
+        profiler = None
+        if profile:
+            profiler = SamplingProfiler(threading.get_ident(), self.profile_interval)
+            profiler.start()
+        try:
+            yield trace
+        finally:
+            trace.duration_ms = round((time.perf_counter() - trace._t0) * 1000, 3)
+            if profiler:
+                trace.profile = profiler.stop()
+            _current_trace.reset(token)
+            self.stats.record(name, trace.duration_ms)
+            self.recent.append(trace)
+            if trace.duration_ms > self.slow_trace_ms:
+                slowest = max(trace.spans, key=lambda s: s['duration_ms'] or 0, default=None)
+                print(f"[TRACE] {name} lento: {trace.duration_ms:.0f}ms"
+                      + (f" (etapa más lenta: {slowest['name']} {slowest['duration_ms']:.0f}ms)" if slowest else ""))
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """Mide una etapa dentro de la traza actual (no-op si no hay traza)"""
+        trace = _current_trace.get()
+        if trace is None:
+            yield None
+            return
+        index = trace.open_span(name, attrs)
+        started = time.perf_counter()
+        error = None
+        try:
+            yield trace.spans[index]
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            trace.close_span(index, duration_ms, error)
+            self.stats.record(name, duration_ms)
+
+    def traced(self, name: str):
+        """Decorador: ejecuta la función dentro de span(name)"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if _current_trace.get() is None:
+                    return func(*args, **kwargs)
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def get_stats(self) -> Dict:
+        return {
+            'stages': self.stats.get_stats(),
+            'recent': [trace.to_dict() for trace in list(self.recent)[-10:]]
+        }
+
+
+# Instancia global
+tracer = Tracer()
+span = tracer.span
+traced = tracer.traced
@@ -1,8 +1,12 @@
 from twilio.rest import Client
 from twilio.base.exceptions import TwilioRestException
 from config import Config
-from typing import Optional
+from services.tracing import traced
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 import json
+import os
+import threading
 import time
 
 class WhatsAppService:
@@ -16,6 +20,13 @@ class WhatsAppService:
         
         # J.RNF2: Tracking de latencia para optimización
         self.latency_tracking = []
+        
+        # Último error de envío por hilo (código de Twilio para las políticas de reintento)
+        self._errors = threading.local()
+    
+    def last_error(self) -> Optional[dict]:
+        """Error del último send_text_message fallido en este hilo: {'code', 'status', 'message'}"""
+        return getattr(self._errors, 'value', None)
     
     def _format_phone_number(self, phone_number: str) -> str:
         """
@@ -68,12 +79,14 @@ class WhatsAppService:
         # Agregar prefijo whatsapp: si no lo tiene
         return f"whatsapp:{cleaned_phone}"
     
+    @traced('twilio.send_text')
     def send_text_message(self, to_number: str, message: str):
         """
         Envía un mensaje de texto a través de Twilio
         J.RF10: Reenvío automático integrado
         J.RNF2: Tracking de latencia (máximo 3 segundos)
         """
+        self._errors.value = None
         try:
             start_time = time.time()  # J.RNF2: Medir latencia
             
@@ -101,6 +114,7 @@ class WhatsAppService:
         except TwilioRestException as e:
             error_code = e.code if hasattr(e, 'code') else None
             error_msg = str(e)
+            self._errors.value = {'code': error_code, 'status': getattr(e, 'status', None), 'message': error_msg}
             
             print("="*60)
             print(f"ERROR ENVIANDO MENSAJE VIA TWILIO")
@@ -118,6 +132,7 @@ class WhatsAppService:
             
             return None
         except Exception as e:
+            self._errors.value = {'code': None, 'status': None, 'message': str(e)}
             print("="*60)
             print(f"ERROR INESPERADO ENVIANDO MENSAJE")
             print("="*60)
@@ -127,6 +142,20 @@ class WhatsAppService:
             print("="*60)
             return None
     
+    def send_bulk(self, messages: List[Tuple[str, str]], max_workers: int = None) -> List[Optional[dict]]:
+        """
+        Envía muchos mensajes de texto en paralelo con un pool acotado.
+        messages: [(to_number, message), ...]. Retorna el resultado de send_text_message
+        de cada uno, en el mismo orden (None si falló).
+        """
+        if not messages:
+            return []
+        workers = max_workers or int(os.getenv('WHATSAPP_BULK_WORKERS', '8'))
+        with ThreadPoolExecutor(max_workers=min(workers, len(messages)),
+                                thread_name_prefix='whatsapp-bulk') as pool:
+            return list(pool.map(lambda m: self.send_text_message(to_number=m[0], message=m[1]), messages))
+    
+    @traced('twilio.send_template')
     def send_template_message(self, to_number: str, template_name: str, language_code: str = "es", components: list = None, content_sid: str = None):
         """
         Envía un mensaje usando una plantilla verificada de WhatsApp a través de Twilio (PRODUCCIÓN)
@@ -201,6 +230,7 @@ class WhatsAppService:
             print("="*60)
             return None
     
+    @traced('twilio.send_buttons')
     def send_interactive_buttons(self, to_number: str, header_text: str, body_text: str, buttons: list, content_sid: str = None):
         """
         Envía mensaje con botones interactivos de WhatsApp usando la API de Twilio
@@ -0,0 +1,69 @@
+import sys
+import os
+import unittest
+from unittest.mock import MagicMock
+from datetime import datetime, timedelta, timezone
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.campaign_runner import CampaignRunner
+
+
+def fake_doc(doc_id):
+    doc = MagicMock()
+    doc.id = doc_id
+    return doc
+
+
+class TestCampaignRunner(unittest.TestCase):
+    def setUp(self):
+        self.runner = CampaignRunner(MagicMock(), 'weekly_summary_2026-W43', page_size=2, max_workers=2)
+        self.now = datetime(2026, 10, 19, tzinfo=timezone.utc)
+
+    def test_01_start_state_resume_skip_and_lease(self):
+        self.assertEqual(self.runner._start_state(None, self.now)['cursor'], None)
+        self.assertIsNone(self.runner._start_state({'status': 'completed'}, self.now))
+
+        other = {'status': 'running', 'owner': 'otro:1', 'cursor': 'p2',
+                 'leaseUntil': self.now + timedelta(minutes=5)}
+        self.assertIsNone(self.runner._start_state(other, self.now))
+
+        crashed = dict(other, leaseUntil=self.now - timedelta(minutes=1))
+        resumed = self.runner._start_state(crashed, self.now)
+        self.assertEqual(resumed['cursor'], 'p2')
+        self.assertEqual(resumed['owner'], self.runner.owner)
+
+    def test_02_pages_prefetch_and_checkpoints(self):
+        pages = {None: [fake_doc('p1'), fake_doc('p2')], 'p2': [fake_doc('p3')]}
+        self.runner._acquire = lambda: {'status': 'running', 'cursor': None}
+        self.runner.fetch_page = lambda collection, cursor: pages[cursor]
+        prefetched = []
+
+        state = self.runner.run(
+            'pacientes',
+            prefetch=lambda docs: prefetched.append([d.id for d in docs]) or {'ok': {'p1', 'p3'}},
+            handle=lambda doc, ctx: doc.id in ctx['ok']
+        )
+
+        self.assertEqual(prefetched, [['p1', 'p2'], ['p3']])
+        self.assertEqual((state['processed'], state['succeeded'], state['failed']), (3, 2, 1))
+        self.assertEqual(state['status'], 'completed')
+        checkpoints = [call.args[0]['cursor'] for call in self.runner.run_ref.set.call_args_list]
+        self.assertEqual(checkpoints, ['p2', 'p3', 'p3'])
+
+
+    def test_03_stalled_detection_and_page_query(self):
+        self.assertFalse(self.runner._stalled(None, self.now))
+        self.assertFalse(self.runner._stalled({'status': 'completed'}, self.now))
+        running = {'status': 'running', 'cursor': 'p2', 'leaseUntil': self.now + timedelta(minutes=5)}
+        self.assertFalse(self.runner._stalled(running, self.now))
+        self.assertTrue(self.runner._stalled(dict(running, leaseUntil=self.now - timedelta(seconds=1)), self.now))
+
+        self.runner.fetch_page('pacientes', 'p2')
+        query = self.runner.db.collection.return_value.order_by.return_value
+        self.assertEqual(list(query.start_after.call_args.args[0].values()), ['p2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import sys
+import os
+import unittest
+from unittest.mock import MagicMock
+from datetime import datetime, timedelta, timezone
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database import cita_writes
+
+
+class TestCitaWrites(unittest.TestCase):
+    def setUp(self):
+        self.db = MagicMock()
+        self.batch = self.db.batch.return_value
+        cita_writes._rekey_state.update(done=False, checked_at=0.0)
+        self.db.collection.return_value.document.return_value.get.return_value.to_dict.return_value = {}
+
+    def test_01_create_writes_both_locations_in_one_commit(self):
+        cita_writes.crear_cita(self.db, 'p1', 'c1', {'estado': 'programada'})
+
+        self.batch.commit.assert_called_once()
+        (sub_ref, sub_data), (global_ref, global_data), (change_ref, change) = \
+            [call.args for call in self.batch.set.call_args_list]
+        self.assertEqual(sub_data, {'estado': 'programada'})
+        self.assertEqual((global_data['id'], global_data['pacienteCitaId']), ('c1', 'c1'))
+        self.assertEqual((change['citaId'], change['tipo']), ('c1', 'created'))
+        # Registro de corto plazo: la política TTL lo borra al vencer expiresAt
+        self.assertGreater(change['expiresAt'], datetime.now(timezone.utc) + timedelta(days=1))
+        self.db.collection.return_value.document.assert_any_call('c1')
+
+    def test_02_update_existing_global_copy_and_notifies(self):
+        cambios = []
+        cita_writes.on_cita_change(cambios.append)
+        self.addCleanup(cita_writes._listeners.remove, cambios.append)
+        self.db.collection.return_value.document.return_value.get.return_value.exists = True
+
+        cita_writes.actualizar_cita(self.db, 'p1', 'c1', {'estado': 'cancelada'}, tipo='cancelled')
+
+        self.assertEqual(self.batch.update.call_count, 2)  # paciente y global, nunca set con merge
+        self.assertEqual([call.args[1] for call in self.batch.update.call_args_list],
+                         [{'estado': 'cancelada'}, {'estado': 'cancelada'}])
+        self.assertEqual(len(self.batch.set.call_args_list), 1)  # solo cita_changes
+        self.db.collection.return_value.where.assert_not_called()
+        self.batch.commit.assert_called_once()
+        self.assertEqual([(c['citaId'], c['tipo']) for c in cambios], [('c1', 'cancelled')])
+
+    def test_03_legacy_global_copy_found_by_paciente_cita_id(self):
+        citas = self.db.collection.return_value
+        citas.document.return_value.get.return_value.exists = False
+        legacy = MagicMock()
+        citas.where.return_value.limit.return_value.stream.return_value = [legacy]
+
+        cita_writes.actualizar_cita(self.db, 'p1', 'c1', {'estado': 'cancelada'})
+
+        citas.where.assert_called_once_with('pacienteCitaId', '==', 'c1')
+        self.assertIs(self.batch.update.call_args_list[1].args[0], legacy.reference)
+
+    def test_04_missing_global_copy_is_not_created(self):
+        citas = self.db.collection.return_value
+        citas.document.return_value.get.return_value.exists = False
+        citas.where.return_value.limit.return_value.stream.return_value = []
+
+        cita_writes.actualizar_cita(self.db, 'p1', 'c1', {'estado': 'cancelada'})
+
+        self.assertEqual(self.batch.update.call_count, 1)  # solo la del paciente
+        self.assertEqual(len(self.batch.set.call_args_list), 1)  # solo cita_changes
+
+    def test_05_rekey_migration_moves_legacy_copies(self):
+        from database.migrations import rekey_citas_globales
+        legacy = MagicMock()
+        legacy.id = 'aleatorio'
+        legacy.to_dict.return_value = {'pacienteCitaId': 'c1', 'estado': 'programada'}
+        al_dia = MagicMock()
+        al_dia.id = 'c2'
+        al_dia.to_dict.return_value = {'pacienteCitaId': 'c2'}
+        citas = self.db.collection.return_value
+        citas.order_by.return_value.limit.return_value.stream.return_value = [legacy, al_dia]
+        stub = citas.document.return_value.get.return_value
+        stub.exists = True
+        stub.to_dict.return_value = {'estado': 'cancelada', 'pacienteCitaId': 'c1'}
+
+        stats = rekey_citas_globales(self.db, page_size=10)
+
+        self.assertEqual(stats, {'revisadas': 2, 'movidas': 1})
+        movida = self.batch.set.call_args.args[1]
+        self.assertEqual((movida['id'], movida['estado']), ('c1', 'cancelada'))
+        self.batch.delete.assert_called_once_with(legacy.reference)
+
+
+if __name__ == '__main__':
+    unittest.main()
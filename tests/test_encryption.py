@@ -0,0 +1,140 @@
+import sys
+import os
+import base64
+import unittest
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from utils.encryption import (DerivedKeyCache, derive_key, decrypt_medical_history,
+                              decrypt_many, decrypt_object, key_cache, LazyDecryptedView)
+from services.medical_history_view import MedicalHistoryView
+
+USER_ID = 'paciente-123'
+
+
+def encrypt_field(text, key, salt):
+    """Cifra igual que el cliente web (AES-256-GCM, base64)"""
+    iv = os.urandom(12)
+    return {
+        'encrypted': base64.b64encode(AESGCM(key).encrypt(iv, text.encode('utf-8'), None)).decode(),
+        'iv': base64.b64encode(iv).decode(),
+        'salt': base64.b64encode(salt).decode(),
+        'algorithm': 'AES-256-GCM'
+    }
+
+
+class TestEncryption(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.salt = os.urandom(16)
+        cls.key = derive_key(USER_ID, cls.salt)
+
+    def setUp(self):
+        key_cache.clear()
+
+    def test_01_decrypt_medical_history_one_derivation_per_salt(self):
+        historial = {
+            '_encrypted': True,
+            '_encryptionVersion': 1,
+            'alergias': encrypt_field('Penicilina', self.key, self.salt),
+            'medicamentos': [encrypt_field('Ibuprofeno', self.key, self.salt)],
+            'contactoEmergencia': {'nombre': encrypt_field('Ana', self.key, self.salt), 'edad': 30},
+            'grupoSanguineo': 'O+'
+        }
+        before = key_cache.stats()['misses']
+        result = decrypt_medical_history(historial, USER_ID)
+        self.assertEqual(result['alergias'], 'Penicilina')
+        self.assertEqual(result['medicamentos'], ['Ibuprofeno'])
+        self.assertEqual(result['contactoEmergencia'], {'nombre': 'Ana', 'edad': 30})
+        self.assertEqual(result['grupoSanguineo'], 'O+')
+        self.assertNotIn('_encryptionVersion', result)
+        self.assertEqual(key_cache.stats()['misses'] - before, 1)
+
+    def test_02_key_cache_ttl_and_eviction_wipe(self):
+        cache = DerivedKeyCache(max_entries=1, ttl_seconds=60)
+        key = cache.get_or_derive(USER_ID, self.salt)
+        self.assertEqual(key, self.key)
+        stored = cache._entries[(USER_ID, self.salt)][0]
+        cache.get_or_derive(USER_ID, os.urandom(16))  # Expulsa la primera llave
+        self.assertEqual(bytes(stored), bytes(32))
+        self.assertEqual(cache.stats()['entries'], 1)
+
+        expired = DerivedKeyCache(ttl_seconds=0)
+        expired.get_or_derive(USER_ID, self.salt)
+        expired.get_or_derive(USER_ID, self.salt)
+        self.assertEqual(expired.stats()['misses'], 2)
+
+    def test_03_bulk_decrypt_matches_serial(self):
+        otro_salt = os.urandom(16)
+        otra_key = derive_key('paciente-456', otro_salt)
+        items = [
+            ({'_encrypted': True,
+              'alergias': encrypt_field('Látex', self.key, self.salt),
+              'notas': [encrypt_field(f'nota {i}', self.key, self.salt) for i in range(100)],
+              'roto': dict(encrypt_field('x', self.key, self.salt), encrypted='AAAA')},
+             USER_ID),
+            ({'_encrypted': True, 'alergias': encrypt_field('Ninguna', otra_key, otro_salt)}, 'paciente-456'),
+        ]
+        before = key_cache.stats()['misses']
+        results = decrypt_many(items)
+        self.assertEqual(key_cache.stats()['misses'] - before, 2)
+        self.assertEqual(results[0]['alergias'], 'Látex')
+        self.assertEqual(results[0]['notas'][99], 'nota 99')
+        self.assertIsNone(results[0]['roto'])
+        self.assertEqual(results[1], {'alergias': 'Ninguna'})
+        self.assertEqual(results[0], decrypt_object(items[0][0], USER_ID))
+
+    def test_04_lazy_view_decrypts_only_accessed_fields(self):
+        historial = {
+            '_encrypted': True,
+            '_encryptionVersion': 1,
+            'alergias': encrypt_field('Penicilina', self.key, self.salt),
+            'motivoConsulta': encrypt_field('Dolor', self.key, self.salt),
+            'grupoSanguineo': encrypt_field('O+', self.key, self.salt),
+            'edad': 30,
+        }
+        view = LazyDecryptedView(historial, USER_ID)
+        self.assertFalse(view.has_value('direccion'))
+        self.assertNotIn('_encryptionVersion', view)
+        self.assertEqual(view.decrypted_fields, [])
+        self.assertEqual(view['alergias'], 'Penicilina')
+        self.assertEqual(view.decrypted_fields, ['alergias'])
+        self.assertTrue(view.has_value('alergias'))
+        self.assertEqual(view.to_dict(), decrypt_medical_history(historial, USER_ID))
+
+        tabs = MedicalHistoryView(USER_ID, {'nombre': 'Ana'}, historial, True)
+        self.assertEqual(tabs.completeness(), 28)  # nombre, edad, alergias, grupoSanguineo
+        self.assertNotIn('motivoConsulta', tabs.historial.decrypted_fields)
+        self.assertEqual(tabs.dental_history()['motivoConsulta'], 'Dolor')
+
+    def test_05_encrypted_empty_value_is_not_filled(self):
+        from services.medical_history_check_service import MedicalHistoryCheckService
+
+        historial = {
+            '_encrypted': True,
+            'alergias': encrypt_field('', self.key, self.salt),
+            'grupoSanguineo': encrypt_field('   ', self.key, self.salt),
+            'edad': 30,
+        }
+        view = LazyDecryptedView(historial, USER_ID)
+        self.assertFalse(view.has_value('alergias'))
+        self.assertFalse(view.has_value('grupoSanguineo'))
+        self.assertTrue(view.has_value('edad'))
+
+        tabs = MedicalHistoryView(USER_ID, {'nombre': 'Ana'}, historial, True)
+        self.assertEqual(tabs.completeness(), 14)  # solo nombre y edad
+
+        checker = MedicalHistoryCheckService.__new__(MedicalHistoryCheckService)
+        checker.required_fields = ['alergias', 'edad']
+        checker.recommended_fields = ['grupoSanguineo']
+        resultado = checker._check_completeness(historial, USER_ID)
+        self.assertEqual(resultado['missing_fields'], ['alergias'])
+        self.assertEqual(resultado['missing_recommended'], ['grupoSanguineo'])
+        self.assertFalse(resultado['is_complete'])
+
+
+if __name__ == '__main__':
+    unittest.main()
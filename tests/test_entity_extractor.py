@@ -0,0 +1,58 @@
+import sys
+import os
+import unittest
+from datetime import datetime
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.entity_extractor import EntityExtractor
+
+
+class TestEntityExtractor(unittest.TestCase):
+    def setUp(self):
+        self.extractor = EntityExtractor()
+        self.now = datetime(2026, 10, 19, 9, 0)  # Lunes
+
+    def test_01_fecha_hora_dentista(self):
+        entities = self.extractor.extract(
+            "quiero una cita mañana a las 3 de la tarde con el doctor Pérez", self.now)
+        self.assertEqual(entities['fecha'], '2026-10-20')
+        self.assertEqual(entities['hora'], '15:00')
+        self.assertEqual(entities['nombre_dentista'], 'Pérez')
+
+    def test_02_prioridad_fechas(self):
+        # "pasado mañana" no debe confundirse con "mañana"
+        self.assertEqual(self.extractor.extract("para pasado mañana", self.now)['fecha'], '2026-10-21')
+        # "por la mañana" es una franja horaria, no una fecha
+        self.assertEqual(self.extractor.extract("el viernes por la mañana", self.now)['fecha'], '2026-10-23')
+        # Un lunes pide el lunes siguiente
+        self.assertEqual(self.extractor.extract("el lunes", self.now)['fecha'], '2026-10-26')
+        self.assertEqual(self.extractor.extract("15/01/27 a las 9 am", self.now)['fecha'], '2027-01-15')
+
+    def test_03_horas(self):
+        self.assertEqual(self.extractor.extract("a las 10:30", self.now)['hora'], '10:30')
+        self.assertEqual(self.extractor.extract("a las 4pm", self.now)['hora'], '16:00')
+        self.assertEqual(self.extractor.extract("12am", self.now)['hora'], '00:00')
+        self.assertEqual(self.extractor.extract("15 horas", self.now)['hora'], '15:00')
+        # Números sueltos no son horas
+        self.assertIsNone(self.extractor.extract("tengo 3 muelas", self.now)['hora'])
+
+    def test_04_numero_cita_y_motivo(self):
+        entities = self.extractor.extract("cancelar mi cita 2 porque estoy enfermo", self.now)
+        self.assertEqual(entities['numero_cita'], 2)
+        self.assertEqual(entities['motivo'], 'estoy enfermo')
+        self.assertEqual(self.extractor.extract("la segunda cita", self.now)['numero_cita'], 2)
+        # Vacío o sin entidades
+        self.assertIsNone(self.extractor.extract("hola", self.now)['motivo'])
+        self.assertIsNone(self.extractor.extract("", self.now)['fecha'])
+
+    def test_05_parse_hora(self):
+        self.assertEqual(self.extractor.parse_hora("3 de la tarde"), '15:00')
+        self.assertEqual(self.extractor.parse_hora("10am"), '10:00')
+        self.assertEqual(self.extractor.parse_hora("09:15"), '09:15')
+        self.assertIsNone(self.extractor.parse_hora("tarde"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import sys
+import os
+import unittest
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.hf_inference import InferenceClient, InferenceResult, StubInferenceBackend
+
+
+class TestInferenceClient(unittest.TestCase):
+    def setUp(self):
+        self.sleeps = []
+
+    def _client(self, scripted, **kwargs):
+        backend = StubInferenceBackend(scripted)
+        client = InferenceClient(backend, sleep=self.sleeps.append, **kwargs)
+        # Evitar que el hilo de calentamiento llame al backend durante la prueba
+        client._schedule_warmup = lambda model: None
+        return client, backend
+
+    def test_01_success(self):
+        client, backend = self._client({})
+        self.assertEqual(client.infer('m', 'hola'), [{"generated_text": "stub:hola"}])
+        self.assertEqual(len(backend.calls), 1)
+
+    def test_02_cold_model_does_not_block(self):
+        client, backend = self._client({'m': [InferenceResult(503, {'estimated_time': 30})]})
+        self.assertIsNone(client.infer('m', 'hola'))
+        self.assertTrue(client.is_cold('m'))
+        # Mientras está frío ni siquiera se llama al backend
+        self.assertIsNone(client.infer('m', 'hola'))
+        self.assertEqual(len(backend.calls), 1)
+        self.assertEqual(self.sleeps, [])
+
+    def test_03_bounded_retries_with_backoff(self):
+        client, backend = self._client({'m': [InferenceResult(502), InferenceResult(502),
+                                              InferenceResult(200, {'ok': True})]})
+        self.assertEqual(client.infer('m', 'hola'), {'ok': True})
+        self.assertEqual(len(backend.calls), 3)
+        self.assertEqual(len(self.sleeps), 2)
+
+        client, backend = self._client({'m': [InferenceResult(502)]}, max_attempts=2)
+        self.assertIsNone(client.infer('m', 'hola'))
+        self.assertEqual(len(backend.calls), 2)
+
+    def test_04_deadline_respected(self):
+        client, backend = self._client({'m': [InferenceResult(429)]}, base_backoff=5.0, max_backoff=5.0)
+        self.assertIsNone(client.infer('m', 'hola', deadline=1.0))
+        self.assertEqual(len(backend.calls), 1)
+        self.assertEqual(self.sleeps, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import sys
+import os
+import unittest
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.knowledge_index import KnowledgeIndex, tokenize
+
+
+class TestKnowledgeIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = KnowledgeIndex()
+
+    def test_01_tokenize_folds_accents_and_stopwords(self):
+        self.assertEqual(tokenize("¿Cómo CANCELO mi cita?"), tokenize("como cancelar citas"))
+        self.assertEqual(tokenize("de la que el"), [])
+
+    def test_02_paraphrased_questions(self):
+        hits = self.index.search("cuanto cuesta una limpieza", language='es')
+        self.assertEqual(hits[0]['id'], 'kb:precios')
+        hits = self.index.search("aceptan tarjeta?", language='es')
+        self.assertIn(hits[0]['id'], ('t:es:faq_a3', 'kb:métodos de pago'))
+        hits = self.index.search("is my data secure", language='en')
+        self.assertEqual(hits[0]['id'], 't:en:faq_a5')
+
+    def test_03_unknown_question_goes_to_llm(self):
+        self.assertIsNone(self.index.answer("me duele la muela", language='es'))
+        self.assertIsNone(self.index.answer("", language='es'))
+
+    def test_04_cache_and_rebuild(self):
+        first = self.index.search("metodos de pago", language='es')
+        self.assertIs(self.index.search("métodos de pago", language='es'), first)
+        self.index.build([
+            {'id': 'x', 'text': 'estacionamiento gratis', 'answer': 'Sí hay',
+             'language': 'es', 'source': 'test'},
+            {'id': 'y', 'text': 'aceptamos pagos con tarjeta', 'answer': 'Tarjeta',
+             'language': 'es', 'source': 'test'},
+            {'id': 'z', 'text': 'abrimos de lunes a viernes', 'answer': 'Horario',
+             'language': 'es', 'source': 'test'},
+        ])
+        self.assertEqual(self.index.search("tienen estacionamiento?", language='es')[0]['answer'], 'Sí hay')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import sys
+import os
+import json
+import logging
+import unittest
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.logging_config import DebugSamplingFilter, JsonFormatter, mask_phone
+
+
+class TestLoggingConfig(unittest.TestCase):
+    def make_record(self, level, msg, args=(), **extra):
+        record = logging.LogRecord('app', level, __file__, 1, msg, args, None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_01_json_formatter_and_masking(self):
+        record = self.make_record(logging.INFO, 'Webhook %s', ('recibido',), message_sid='SM1',
+                                  **{'from': mask_phone('whatsapp:+5215512345678')})
+        data = json.loads(JsonFormatter().format(record))
+        self.assertEqual(data['msg'], 'Webhook recibido')
+        self.assertEqual(data['level'], 'INFO')
+        self.assertEqual(data['message_sid'], 'SM1')
+        self.assertEqual(data['from'], '***5678')
+        self.assertEqual(mask_phone(None), '')
+
+    def test_02_debug_sampling(self):
+        never = DebugSamplingFilter(0.0)
+        self.assertFalse(never.filter(self.make_record(logging.DEBUG, 'detalle')))
+        self.assertTrue(never.filter(self.make_record(logging.WARNING, 'aviso')))
+        self.assertTrue(DebugSamplingFilter(1.0).filter(self.make_record(logging.DEBUG, 'detalle')))
+
+
+if __name__ == '__main__':
+    unittest.main()
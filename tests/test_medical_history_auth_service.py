@@ -0,0 +1,65 @@
+import sys
+import os
+import asyncio
+import unittest
+from unittest.mock import MagicMock, patch
+
+import pytz
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.medical_history_auth_service import MedicalHistoryAuthService
+from services.token_service import TokenService
+
+
+@patch('services.medical_history_auth_service.firestore.transactional', lambda fn: fn)
+class TestAuthorizationResponse(unittest.TestCase):
+    def setUp(self):
+        # Sin __init__: no se conecta a Firestore ni a Twilio
+        self.service = MedicalHistoryAuthService.__new__(MedicalHistoryAuthService)
+        self.service.db = MagicMock()
+        self.service.timezone = pytz.timezone('America/Mexico_City')
+        self.tokens = TokenService()
+        patcher = patch('services.medical_history_auth_service.token_service', self.tokens)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.token = self.tokens.generate_token({'action': 'approve_medical_history', 'pacienteId': 'p1',
+                                                 'dentistaId': 'd1', 'authId': 'a1'})
+        self.auth = MagicMock(exists=True)
+        self.auth.to_dict.return_value = {'status': 'pending'}
+        self.auth_ref = self.service.db.collection.return_value.document.return_value\
+            .collection.return_value.document.return_value
+        self.auth_ref.get.return_value = self.auth
+        self.transaction = self.service.db.transaction.return_value
+
+    def _responder(self):
+        return asyncio.run(self.service.process_authorization_response(self.token, 'approve'))
+
+    def test_01_approves_in_one_transaction_then_consumes(self):
+        self.assertEqual(self._responder(), {'success': True, 'status': 'approved'})
+        self.assertEqual(self.transaction.update.call_args.args[1]['status'], 'approved')
+        self.transaction.set.assert_called_once()  # acceso del dentista, en la misma transacción
+        self.assertTrue(self.tokens.is_consumed(self.token))
+        # Segundo uso en este proceso: rechazo local sin leer la solicitud
+        self.auth_ref.get.reset_mock()
+        self.assertFalse(self._responder()['success'])
+        self.auth_ref.get.assert_not_called()
+
+    def test_02_processed_request_rejects_link_on_any_worker(self):
+        # Otro worker ya respondió: el status de la solicitud es el registro de un solo uso
+        self.auth.to_dict.return_value = {'status': 'approved'}
+        self.assertEqual(self._responder()['error'], 'Solicitud no encontrada o ya procesada')
+        self.transaction.update.assert_not_called()
+
+    def test_03_firestore_error_does_not_burn_the_link(self):
+        self.auth_ref.get.side_effect = Exception('UNAVAILABLE')
+        self.assertFalse(self._responder()['success'])
+        self.assertFalse(self.tokens.is_consumed(self.token))
+
+        self.auth_ref.get.side_effect = None
+        self.assertTrue(self._responder()['success'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import sys
+import os
+import unittest
+from unittest.mock import MagicMock
+from datetime import datetime, timedelta, timezone
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.medical_history_check_service import MedicalHistoryCheckService, WATCH_LEASE_SECONDS
+
+
+def _change(paciente_id, tipo='MODIFIED'):
+    change = MagicMock()
+    change.type.name = tipo
+    change.document.reference.parent.parent.id = paciente_id
+    return change
+
+
+class TestCompletenessWatch(unittest.TestCase):
+    def setUp(self):
+        # Sin __init__: no se conecta a Firestore
+        self.service = MedicalHistoryCheckService.__new__(MedicalHistoryCheckService)
+        self.service.db = MagicMock()
+        self.service._watch_owner = 'host:1'
+        self.service.refresh_completeness = MagicMock()
+        self.now = datetime(2026, 10, 19, 12, 0, tzinfo=timezone.utc)
+
+    def test_01_snapshot_refreshes_each_patient_once_including_removed(self):
+        read_time = self.now
+        changes = [_change('p1', 'ADDED'), _change('p1', 'MODIFIED'), _change('p2', 'REMOVED')]
+
+        self.service._on_history_snapshot([], changes, read_time)
+
+        llamados = sorted(c.args[0] for c in self.service.refresh_completeness.call_args_list)
+        self.assertEqual(llamados, ['p1', 'p2'])
+        for c in self.service.refresh_completeness.call_args_list:
+            self.assertEqual(c.kwargs['version'], read_time)
+        # El cursor avanza al read_time del snapshot
+        self.service.db.collection.return_value.document.return_value.set.assert_called_once_with(
+            {'readTime': read_time}, merge=True)
+
+    def test_02_empty_snapshot_does_not_move_cursor(self):
+        self.service._on_history_snapshot([], [], self.now)
+        self.service.refresh_completeness.assert_not_called()
+        self.service.db.collection.return_value.document.return_value.set.assert_not_called()
+
+    def test_03_version_guard(self):
+        nuevo = self.now
+        viejo = self.now - timedelta(minutes=1)
+        self.assertTrue(MedicalHistoryCheckService._is_newer_version({}, nuevo))
+        self.assertTrue(MedicalHistoryCheckService._is_newer_version({'version': viejo}, nuevo))
+        self.assertFalse(MedicalHistoryCheckService._is_newer_version({'version': nuevo}, nuevo))
+        self.assertFalse(MedicalHistoryCheckService._is_newer_version({'version': nuevo}, viejo))
+        # Sin versión (cálculo directo) siempre escribe
+        self.assertTrue(MedicalHistoryCheckService._is_newer_version({'version': nuevo}, None))
+
+    def test_04_lease_only_for_one_process(self):
+        vigente = {'owner': 'otro:2', 'leaseUntil': self.now + timedelta(seconds=30),
+                   'readTime': self.now}
+        self.assertIsNone(self.service._watch_lease(vigente, self.now))
+
+        vencido = dict(vigente, leaseUntil=self.now - timedelta(seconds=1))
+        state = self.service._watch_lease(vencido, self.now)
+        self.assertEqual(state['owner'], 'host:1')
+        self.assertEqual(state['readTime'], self.now)  # conserva el cursor
+        self.assertEqual(state['leaseUntil'], self.now + timedelta(seconds=WATCH_LEASE_SECONDS))
+
+        propio = dict(vigente, owner='host:1')
+        self.assertIsNotNone(self.service._watch_lease(propio, self.now))
+        self.assertIsNotNone(self.service._watch_lease(None, self.now))
+
+    def test_05_removed_last_history_falls_back_to_patient_doc(self):
+        service = MedicalHistoryCheckService.__new__(MedicalHistoryCheckService)
+        service.db = MagicMock()
+        pacientes = service.db.collection.return_value
+        subcoleccion = pacientes.document.return_value.collection.return_value
+        subcoleccion.order_by.return_value.limit.return_value.stream.return_value = iter([])
+        paciente_doc = MagicMock(exists=True)
+        paciente_doc.to_dict.return_value = {'historialMedico': {'alergias': 'ninguna'}}
+        pacientes.document.return_value.get.return_value = paciente_doc
+
+        historial, doc = service._current_history('p1')
+
+        self.assertEqual(historial, {'alergias': 'ninguna'})
+        self.assertIsNone(doc)
+
+
+if __name__ == '__main__':
+    unittest.main()
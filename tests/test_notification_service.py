@@ -0,0 +1,38 @@
+import sys
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+from datetime import datetime
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.notification_service import NotificacionesService
+
+
+class TestWeeklySummaryRecovery(unittest.TestCase):
+    def setUp(self):
+        # Sin __init__: no se crea el BackgroundScheduler ni conexiones
+        self.service = NotificacionesService.__new__(NotificacionesService)
+        self.service.cita_repo = MagicMock()
+        self.service.send_weekly_summaries = MagicMock()
+
+    def test_01_campaign_id_per_iso_week(self):
+        self.assertEqual(NotificacionesService._weekly_campaign_id(datetime(2026, 10, 19)),
+                         'weekly_summary_2026-W43')
+
+    @patch('services.campaign_runner.CampaignRunner')
+    def test_02_resumes_only_stalled_campaign_of_current_week(self, runner_cls):
+        runner_cls.return_value.is_stalled.return_value = False
+        self.service.resume_weekly_summaries()
+        self.service.send_weekly_summaries.assert_not_called()
+
+        runner_cls.return_value.is_stalled.return_value = True
+        self.service.resume_weekly_summaries()
+        self.service.send_weekly_summaries.assert_called_once()
+        campaign_id = runner_cls.call_args.args[1]
+        self.assertEqual(campaign_id, NotificacionesService._weekly_campaign_id(datetime.now()))
+
+
+if __name__ == '__main__':
+    unittest.main()
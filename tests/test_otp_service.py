@@ -0,0 +1,59 @@
+import sys
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+from datetime import datetime, timedelta
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.registry import registry
+from services.whatsapp_service import WhatsAppService
+from services.otp_service import OTPService
+
+
+class TestOTPService(unittest.TestCase):
+    def setUp(self):
+        # WhatsApp y Firestore simulados: no se leen credenciales ni se abre conexión
+        registry.override(WhatsAppService, MagicMock())
+        with patch('services.otp_service.FirebaseConfig'):
+            self.otp = OTPService()
+        self.now = self.otp.timezone.localize(datetime(2026, 10, 19, 9, 0))
+
+    def tearDown(self):
+        registry.reset()
+
+    def test_01_deterministic_document_and_hashed_code(self):
+        self.otp._otp_ref('pac1', 'cancel')
+        self.otp.collection.document.assert_called_with('pac1_cancel')
+        state = self.otp._next_send_state(None, 'pac1', '+5215500000000', 'cancel', '123456', self.now)
+        self.assertNotIn('123456', str(state.values()))
+        self.assertEqual(state['resendCount'], 1)
+        self.assertEqual(state['expiresAt'], self.now + timedelta(minutes=15))
+
+    def test_02_daily_resend_limit(self):
+        state = self.otp._next_send_state(None, 'pac1', 'tel', 'cancel', '111111', self.now)
+        self.assertIsNone(self.otp._next_send_state(state, 'pac1', 'tel', 'cancel', '222222', self.now))
+        tomorrow = self.now + timedelta(days=1)
+        self.assertEqual(self.otp._next_send_state(state, 'pac1', 'tel', 'cancel', '222222', tomorrow)['resendCount'], 1)
+
+    def test_03_verify_attempts_expiry_and_single_use(self):
+        state = self.otp._next_send_state(None, 'pac1', 'tel', 'cancel', '123456', self.now)
+        result, updates = self.otp._verify_state(state, '000000', self.now)
+        self.assertFalse(result['valid'])
+        self.assertEqual(updates, {'attempts': 1})
+
+        result, updates = self.otp._verify_state(state, '123456', self.now + timedelta(minutes=16))
+        self.assertEqual(result['reason'], 'Código OTP expirado')
+
+        result, updates = self.otp._verify_state(state, '123456', self.now)
+        self.assertTrue(result['valid'])
+        self.assertTrue(updates['used'])
+        self.assertFalse(self.otp._verify_state(dict(state, **updates), '123456', self.now)[0]['valid'])
+
+        bloqueado = dict(state, attempts=self.otp.max_verify_attempts)
+        self.assertFalse(self.otp._verify_state(bloqueado, '123456', self.now)[0]['valid'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import sys
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+from datetime import datetime, timedelta
+
+import pytz
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from scheduler.reminder_scheduler import ReminderScheduler
+
+
+def fake_cita(cita_id, **data):
+    doc = MagicMock()
+    doc.id = cita_id
+    doc.to_dict.return_value = data
+    return doc
+
+
+class TestPaymentDeadlines(unittest.TestCase):
+    def setUp(self):
+        # Sin __init__: no se crea el BackgroundScheduler ni conexiones
+        self.scheduler = ReminderScheduler.__new__(ReminderScheduler)
+        self.scheduler.db = MagicMock()
+        self.scheduler.whatsapp = MagicMock()
+        self.scheduler.paciente_repo = MagicMock()
+        self.scheduler.mexico_tz = pytz.timezone('America/Mexico_City')
+        self.now = datetime(2026, 10, 19, 12, 0, tzinfo=self.scheduler.mexico_tz)
+        self.query = self.scheduler.db.collection.return_value.where.return_value.where.return_value
+
+    @patch('scheduler.reminder_scheduler.cita_writes.actualizar_citas')
+    def test_01_expired_cancelled_in_batch_and_notified_in_bulk(self, actualizar_citas):
+        self.query.where.return_value.stream.return_value = [
+            fake_cita('c1', pacienteId='p1', patientPhone='+5215511111111'),
+            fake_cita('c2', pacienteId='p2', patientPhone='+5215522222222'),
+        ]
+        actualizar_citas.return_value = ['c1']  # c2 se pagó entre la lectura y el commit
+
+        self.assertEqual(self.scheduler._cancel_expired_payments(self.now), 1)
+
+        self.query.where.assert_called_once_with('paymentDeadline', '<=', self.now)
+        actualizaciones = actualizar_citas.call_args.args[1]
+        self.assertEqual([a['citaId'] for a in actualizaciones], ['c1', 'c2'])
+        self.assertEqual(actualizaciones[0]['cambios']['estado'], 'cancelada')
+        avisos = self.scheduler.whatsapp.send_bulk.call_args.args[0]
+        self.assertEqual([telefono for telefono, _ in avisos], ['+5215511111111'])
+
+    def test_02_reminders_marked_only_when_sent(self):
+        deadline = self.now + timedelta(hours=1)
+        self.query.where.return_value.where.return_value.where.return_value.stream.return_value = [
+            fake_cita('c1', patientPhone='+5215511111111', paymentDeadline=deadline),
+            fake_cita('c2', patientPhone='+5215522222222', paymentDeadline=deadline),
+        ]
+        self.scheduler.whatsapp.send_bulk.return_value = [{'status': 'sent'}, None]
+
+        self.assertEqual(self.scheduler._send_payment_reminders(self.now), 1)
+
+        batch = self.scheduler.db.batch.return_value
+        self.assertEqual(batch.update.call_count, 1)
+        self.scheduler.paciente_repo.buscar_por_id.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
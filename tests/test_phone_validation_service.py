@@ -0,0 +1,112 @@
+import sys
+import os
+import unittest
+from unittest.mock import MagicMock
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Mock database module before importing phone_validation_service
+sys.modules['database.database'] = MagicMock()
+sys.modules['database.models'] = MagicMock()
+
+from services.phone_validation_service import PhoneValidationService
+
+
+class TestPhoneValidationService(unittest.TestCase):
+    def setUp(self):
+        self.service = PhoneValidationService()
+        self.service.collection = MagicMock()  # El db mock es compartido entre instancias
+        blocked_doc = MagicMock()
+        blocked_doc.id = '+5215511111111'
+        self.service.collection.where.return_value.stream.return_value = [blocked_doc]
+
+    def test_01_polled_changes_update_exact_set(self):
+        self.assertFalse(self.service.might_be_blocked('+5215522222222'))
+        self.assertTrue(self.service.might_be_blocked('+5215511111111'))
+
+        self.service._apply_change('+5215522222222', True)
+        self.service._apply_change('+5215511111111', False)
+        self.assertTrue(self.service.might_be_blocked('+5215522222222'))
+        self.assertFalse(self.service.might_be_blocked('+5215511111111'))
+
+    def test_02_only_filter_hits_read_firestore(self):
+        self.assertEqual(self.service.is_phone_blocked('whatsapp:+5215522222222'), (False, None))
+        self.service.collection.document.assert_not_called()
+
+        doc = self.service.collection.document.return_value.get.return_value
+        doc.exists = True
+        doc.to_dict.return_value = {'blocked': True, 'blockReason': 'fallos'}
+        self.assertEqual(self.service.is_phone_blocked('+5215511111111'), (True, 'fallos'))
+        self.service.collection.document.assert_called_once_with('+5215511111111')
+
+    def test_03_batched_outcomes_keep_three_strike_rule(self):
+        from datetime import datetime, timezone
+        at = datetime(2026, 10, 19, tzinfo=timezone.utc)
+
+        def fallo(event_type):
+            return {'success': False, 'eventType': event_type, 'errorMessage': 'x', 'at': at}
+
+        # Mismo evento repetido no cuenta dos veces; un éxito resetea
+        updates = self.service._fold_outcomes(None, [fallo('reminder'), fallo('reminder'), fallo('created')])
+        self.assertEqual(updates['consecutiveFailures'], 2)
+        self.assertFalse(updates['blocked'])
+        reset = self.service._fold_outcomes(updates, [{'success': True, 'at': at}])
+        self.assertEqual(reset['consecutiveFailures'], 0)
+
+        # Tercer evento distinto: bloqueo
+        blocked = self.service._fold_outcomes(updates, [fallo('cancelled')])
+        self.assertTrue(blocked['blocked'])
+        self.assertEqual(blocked['consecutiveFailures'], 3)
+
+        # Éxito de un número sin documento: nada que escribir
+        self.assertIsNone(self.service._fold_outcomes(None, [{'success': True, 'at': at}]))
+
+    def test_04_recording_does_not_touch_firestore(self):
+        self.service._ensure_flusher = MagicMock()
+        self.service.record_delivery_success('+5215522222222')
+        self.service.record_delivery_failure('+5215522222222', 'reminder', 'error')
+        self.service.collection.document.assert_not_called()
+        self.assertEqual(len(self.service._pending_outcomes['+5215522222222']), 2)
+
+    def test_05_success_resets_failure_written_by_another_worker(self):
+        from datetime import datetime, timezone
+        at = datetime(2026, 10, 19, tzinfo=timezone.utc)
+        self.service.db = MagicMock()
+        # Fallo escrito por otro worker: este worker no tiene ningún estado local del número
+        snapshot = MagicMock(exists=True, id='+5215533333333', update_time='t1')
+        snapshot.to_dict.return_value = {'consecutiveFailures': 2}
+        sin_fallos = MagicMock(exists=True, id='+5215544444444')
+        sin_fallos.to_dict.return_value = {'consecutiveFailures': 0}
+        sin_documento = MagicMock(exists=False, id='+5215555555555')
+        self.service.db.get_all.return_value = [snapshot, sin_fallos, sin_documento]
+        for phone in ('+5215533333333', '+5215544444444', '+5215555555555'):
+            self.service._pending_outcomes[phone] = [{'success': True, 'at': at}]
+
+        self.assertEqual(self.service.flush_delivery_outcomes(), 3)
+
+        batch = self.service.db.batch.return_value
+        batch.update.assert_called_once()
+        ref, cambios = batch.update.call_args.args
+        self.assertIs(ref, snapshot.reference)
+        self.assertEqual((cambios['consecutiveFailures'], cambios['lastSuccess']), (0, at))
+        self.service.db.write_option.assert_called_once_with(last_update_time='t1')
+        batch.commit.assert_called_once()
+
+    def test_06_reset_conflict_falls_back_to_transaction(self):
+        from datetime import datetime, timezone
+        at = datetime(2026, 10, 19, tzinfo=timezone.utc)
+        self.service.db = MagicMock()
+        snapshot = MagicMock(exists=True, id='+5215533333333')
+        snapshot.to_dict.return_value = {'consecutiveFailures': 1}
+        self.service.db.get_all.return_value = [snapshot]
+        self.service.db.batch.return_value.commit.side_effect = Exception('precondición')
+        self.service._flush_phone = MagicMock()
+        self.service._pending_outcomes['+5215533333333'] = [{'success': True, 'at': at}]
+
+        self.service.flush_delivery_outcomes()
+        self.service._flush_phone.assert_called_once_with('+5215533333333', [{'success': True, 'at': at}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import sys
+import os
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+from datetime import datetime
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.prompt_builder import (PromptBuilder, TokenUsageTracker, estimate_tokens,
+                                     SYSTEM_PROMPT_ENTITIES, SYSTEM_PROMPT_RESPONSE,
+                                     CALL_ENTITIES, CALL_INTENT, CALL_RESPONSE)
+
+
+def _history(n, largo=20):
+    return [{'role': 'user' if i % 2 == 0 else 'assistant', 'message': f"m{i} " + 'x' * largo}
+            for i in range(n)]
+
+
+class TestCompactHistory(unittest.TestCase):
+    def setUp(self):
+        self.builder = PromptBuilder()
+
+    def test_01_short_history_kept_whole(self):
+        result = self.builder.compact_history(_history(3))
+        self.assertEqual([m['content'][:2] for m in result['messages']], ['m0', 'm1', 'm2'])
+        self.assertEqual(result['messages'][1]['role'], 'assistant')
+        self.assertIsNone(result['summary'])
+
+    def test_02_only_most_recent_messages_and_summary_of_the_rest(self):
+        result = self.builder.compact_history(_history(8))
+        self.assertEqual(len(result['messages']), self.builder.max_recent_messages)
+        self.assertEqual(result['messages'][-1]['content'][:2], 'm7')
+        self.assertTrue(result['summary'].startswith('Resumen de mensajes anteriores'))
+        self.assertIn('m0', result['summary'])
+        self.assertNotIn('m7', result['summary'])
+
+    def test_03_budget_is_never_exceeded(self):
+        for budget in (0, 5, 30, 60, 400):
+            result = self.builder.compact_history(_history(10, largo=100), budget_tokens=budget)
+            usado = sum(estimate_tokens(m['content']) for m in result['messages'])
+            usado += estimate_tokens(result['summary']) if result['summary'] else 0
+            self.assertLessEqual(usado, budget + 1, budget)
+        vacio = self.builder.compact_history(_history(4), budget_tokens=0)
+        self.assertEqual(vacio, {'messages': [], 'summary': None})
+
+    def test_04_long_message_is_truncated_and_other_roles_dropped(self):
+        history = [{'role': 'system', 'message': 'interno'},
+                   {'role': 'user', 'message': 'y' * 5000}]
+        result = self.builder.compact_history(history)
+        self.assertEqual(len(result['messages']), 1)
+        content = result['messages'][0]['content']
+        self.assertTrue(content.endswith('...'))
+        self.assertLessEqual(len(content), self.builder.max_message_tokens * 4 + 3)
+
+    def test_05_empty_history(self):
+        self.assertEqual(self.builder.compact_history(None), {'messages': [], 'summary': None})
+
+
+class TestBuildMessages(unittest.TestCase):
+    def setUp(self):
+        self.builder = PromptBuilder()
+
+    def test_01_static_prefix_first_and_identical_between_calls(self):
+        dia1 = self.builder.build_messages(
+            CALL_ENTITIES, 'mañana', dynamic_context=self.builder.temporal_context(datetime(2026, 10, 19)))
+        dia2 = self.builder.build_messages(
+            CALL_ENTITIES, 'mañana', dynamic_context=self.builder.temporal_context(datetime(2026, 10, 20)))
+        self.assertEqual(dia1[0], {'role': 'system', 'content': SYSTEM_PROMPT_ENTITIES})
+        self.assertEqual(dia1[0], dia2[0])
+        # Lo dinámico va en un segundo mensaje de sistema, nunca dentro del prefijo
+        self.assertIn('2026-10-20', dia1[1]['content'])
+        self.assertNotIn('2026-10', dia1[0]['content'])
+        self.assertEqual(dia1[-1], {'role': 'user', 'content': 'mañana'})
+
+    def test_02_layout_with_history(self):
+        messages = self.builder.build_messages(CALL_RESPONSE, 'hola', history=_history(8))
+        self.assertEqual(messages[0]['content'], SYSTEM_PROMPT_RESPONSE)
+        self.assertEqual(messages[1]['role'], 'system')
+        self.assertIn('Resumen de mensajes anteriores', messages[1]['content'])
+        self.assertEqual([m['role'] for m in messages[2:-1]],
+                         ['assistant', 'user', 'assistant', 'user', 'assistant'])
+        self.assertEqual(messages[-1], {'role': 'user', 'content': 'hola'})
+
+    def test_03_no_dynamic_message_when_nothing_dynamic(self):
+        messages = self.builder.build_messages(CALL_INTENT, 'hola')
+        self.assertEqual([m['role'] for m in messages], ['system', 'user'])
+
+
+class TestTokenUsageTracker(unittest.TestCase):
+    def test_01_aggregates_per_call_type(self):
+        tracker = TokenUsageTracker()
+        con_cache = SimpleNamespace(prompt_tokens=1000, completion_tokens=10,
+                                    prompt_tokens_details=SimpleNamespace(cached_tokens=800))
+        tracker.record(CALL_INTENT, con_cache)
+        tracker.record(CALL_INTENT, SimpleNamespace(prompt_tokens=1000, completion_tokens=5))
+        tracker.record(CALL_RESPONSE, SimpleNamespace(prompt_tokens=300, completion_tokens=90))
+        tracker.record(None, SimpleNamespace(prompt_tokens=1, completion_tokens=1))
+        self.assertIsNone(tracker.record(CALL_INTENT, None))
+
+        stats = tracker.get_stats()
+        self.assertEqual(stats[CALL_INTENT], {'calls': 2, 'prompt_tokens': 2000, 'completion_tokens': 15,
+                                              'cached_tokens': 800, 'cache_hit_ratio': 0.4})
+        self.assertEqual(stats[CALL_RESPONSE]['calls'], 1)
+        self.assertEqual(stats[CALL_RESPONSE]['cache_hit_ratio'], 0.0)
+        self.assertEqual(stats['other']['calls'], 1)
+
+        tracker.reset()
+        self.assertEqual(tracker.get_stats(), {})
+
+    def test_02_token_usage_endpoint(self):
+        import app as app_module
+        app_module._schedulers_initialized = True  # sin schedulers en pruebas
+        tracker = TokenUsageTracker()
+        tracker.record(CALL_INTENT, SimpleNamespace(prompt_tokens=10, completion_tokens=2))
+        client = app_module.app.test_client()
+
+        with patch('services.prompt_builder.token_usage_tracker', tracker), \
+                patch.object(app_module.tracer, 'admin_token', 'secreto'):
+            self.assertEqual(client.get('/api/ml/token-usage').status_code, 403)
+            response = client.get('/api/ml/token-usage', headers={'X-Debug-Token': 'secreto'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['usage'][CALL_INTENT]['prompt_tokens'], 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
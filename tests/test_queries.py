@@ -0,0 +1,50 @@
+import sys
+import os
+import unittest
+from unittest.mock import MagicMock
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database.queries import citas_de_dentista, citas_de_pacientes
+
+
+def fake_doc(doc_id, owner=None):
+    doc = MagicMock()
+    doc.id = doc_id
+    if owner is None:
+        doc.reference.parent.parent = None
+    else:
+        doc.reference.parent.parent.id = owner
+    return doc
+
+
+class TestQueries(unittest.TestCase):
+    def test_01_dentist_citas_single_query_without_duplicates(self):
+        db = MagicMock()
+        query = db.collection_group.return_value.where.return_value
+        query.where.return_value.where.return_value.where.return_value.stream.return_value = [
+            fake_doc('c1'), fake_doc('c1', owner='p1'), fake_doc('c2', owner='p2')
+        ]
+
+        citas = citas_de_dentista(db, 'd1', 'desde', 'hasta', ['programada'])
+
+        db.collection_group.assert_called_once_with('citas')
+        self.assertEqual(sorted(c.id for c in citas), ['c1', 'c2'])
+        self.assertEqual([c.reference.parent.parent.id for c in citas if c.id == 'c1'], ['p1'])
+
+    def test_02_patient_citas_chunked_and_only_subcollections(self):
+        db = MagicMock()
+        stream = db.collection_group.return_value.where.return_value.stream
+        stream.return_value = [fake_doc('c1'), fake_doc('c2', owner='p1')]
+
+        resultado = list(citas_de_pacientes(db, [f'p{i}' for i in range(45)]))
+
+        self.assertEqual(stream.call_count, 2)  # 45 pacientes -> grupos de 30 y 15
+        grupos = [len(call.args[2]) for call in db.collection_group.return_value.where.call_args_list]
+        self.assertEqual(grupos, [30, 15])
+        self.assertEqual([(owner, doc.id) for owner, doc in resultado], [('p1', 'c2'), ('p1', 'c2')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+import sys
+import os
+import subprocess
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.registry import ServiceRegistry, LazyService, registry
+
+
+class Contador:
+    construidos = 0
+
+    def __init__(self):
+        Contador.construidos += 1
+        self.valor = 'real'
+
+    def saludar(self):
+        return 'hola'
+
+
+class TestServiceRegistry(unittest.TestCase):
+
+    def setUp(self):
+        Contador.construidos = 0
+        registry.reset('contador_test')
+
+    def test_01_construye_una_sola_vez_en_el_primer_uso(self):
+        proxy = LazyService('contador_test', Contador)
+        self.assertEqual(Contador.construidos, 0)
+        self.assertFalse(registry.is_built('contador_test'))
+
+        self.assertEqual(proxy.saludar(), 'hola')
+        self.assertEqual(proxy.valor, 'real')
+        self.assertEqual(Contador.construidos, 1)
+        self.assertTrue(registry.is_built('contador_test'))
+
+    def test_02_override_y_reset(self):
+        local = ServiceRegistry()
+        local.register('svc', Contador)
+        local.override('svc', 'mock')
+        self.assertEqual(local.get('svc'), 'mock')
+        self.assertEqual(Contador.construidos, 0)
+
+        local.reset('svc')
+        self.assertIsInstance(local.get('svc'), Contador)
+        with self.assertRaises(KeyError):
+            local.get('no_existe')
+
+    def test_03_shared_una_instancia_por_clase(self):
+        local = ServiceRegistry()
+        primero = local.shared(Contador)
+        self.assertIs(local.shared(Contador), primero)
+        self.assertEqual(Contador.construidos, 1)
+
+        local.override(Contador, 'mock')
+        self.assertEqual(local.shared(Contador), 'mock')
+
+    def test_04_importar_servicios_no_construye_nada(self):
+        # Proceso limpio: otras pruebas pueden haber construido servicios en este
+        codigo = (
+            "from services.rate_limiter import rate_limiter\n"
+            "from services.message_logger import message_logger\n"
+            "from services.registry import registry\n"
+            "assert not registry.is_built('rate_limiter')\n"
+            "assert not registry.is_built('message_logger')\n"
+        )
+        raiz = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        resultado = subprocess.run([sys.executable, '-c', codigo], cwd=raiz,
+                                   capture_output=True, text=True, timeout=60)
+        self.assertEqual(resultado.returncode, 0, resultado.stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import sys
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+from datetime import datetime, timedelta, timezone
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.registry import registry
+from services.whatsapp_service import WhatsAppService
+from services.retry_service import RetryService
+
+
+class TestRetryService(unittest.TestCase):
+    def setUp(self):
+        # WhatsApp y Firestore simulados: no se leen credenciales ni se abre conexión
+        registry.override(WhatsAppService, MagicMock())
+        with patch('services.retry_service.FirebaseConfig'):
+            self.retry = RetryService()
+        self.now = datetime(2026, 10, 19, 15, 0, tzinfo=timezone.utc)
+
+    def tearDown(self):
+        registry.reset()
+
+    def test_01_lease_only_due_pending_items(self):
+        due = {'status': 'pending', 'dueAt': self.now - timedelta(minutes=1)}
+        updates = self.retry._lease_updates(due, self.now)
+        self.assertEqual(updates['dueAt'], self.now + timedelta(seconds=self.retry.lease_seconds))
+        self.assertEqual(updates['leaseOwner'], self.retry.worker_id)
+
+        # Ya tomado por otro worker (dueAt movido al futuro) o ya enviado
+        leased = dict(due, **updates)
+        self.assertIsNone(self.retry._lease_updates(leased, self.now))
+        self.assertIsNone(self.retry._lease_updates({'status': 'sent', 'dueAt': self.now}, self.now))
+        self.assertIsNone(self.retry._lease_updates(None, self.now))
+
+    def test_02_due_query_is_ranged_ordered_and_limited(self):
+        query = self.retry.collection.where.return_value
+        query.where.return_value.order_by.return_value.limit.return_value.stream.return_value = []
+
+        self.assertEqual(self.retry.claim_due_retries(limit=10), [])
+        self.retry.collection.where.assert_called_with('status', '==', 'pending')
+        self.assertEqual(query.where.call_args[0][:2], ('dueAt', '<='))
+        query.where.return_value.order_by.assert_called_with('dueAt')
+        query.where.return_value.order_by.return_value.limit.assert_called_with(10)
+
+    def test_03_failure_policy_by_error_class(self):
+        # Throttling: reintento pronto con backoff
+        throttled = self.retry._failure_updates(0, 'appointment_created', {'code': 20429}, self.now)
+        self.assertEqual(throttled['status'], 'pending')
+        self.assertLessEqual(throttled['dueAt'], self.now + timedelta(minutes=1))
+
+        # Sin código: estrategia original (2 reintentos cada ~30 min)
+        unknown = self.retry._failure_updates(0, 'appointment_created', None, self.now)
+        self.assertGreaterEqual(unknown['dueAt'], self.now + timedelta(minutes=15))
+        self.assertEqual(self.retry._failure_updates(2, 'appointment_created', None, self.now)['status'], 'failed')
+
+        # Número inválido: dead-letter inmediato
+        invalid = self.retry._failure_updates(0, 'appointment_created', {'code': 21211}, self.now)
+        self.assertEqual(invalid['status'], 'dead_letter')
+        self.assertNotIn('dueAt', invalid)
+
+    def test_04_duplicate_failures_coalesce(self):
+        key = self.retry._retry_key('pac1', 'reminder', 'Hola')
+        self.assertEqual(key, self.retry._retry_key('pac1', 'reminder', 'Hola'))
+        self.assertNotEqual(key, self.retry._retry_key('pac1', 'reminder', 'Adiós'))
+
+        new_doc = {'status': 'pending', 'retryCount': 1, 'dueAt': self.now, 'error': 'e2',
+                   'lastAttempt': 'ahora', 'attempts': [{'source': 'send'}]}
+        pending = {'status': 'pending', 'retryCount': 1, 'attempts': [{'source': 'send'}]}
+        updates = self.retry._coalesce_updates(pending, new_doc, self.now)
+        self.assertEqual(len(updates['attempts']), 2)
+        self.assertEqual(updates['coalescedCount'], 1)
+        self.assertNotIn('dueAt', updates)  # no se programa otro reintento
+
+        # Un mensaje ya terminado se reabre
+        reopened = self.retry._coalesce_updates(dict(pending, status='sent'), new_doc, self.now)
+        self.assertEqual(reopened['status'], 'pending')
+        self.assertEqual(reopened['dueAt'], self.now)
+
+
+if __name__ == '__main__':
+    unittest.main()
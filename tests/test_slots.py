@@ -0,0 +1,119 @@
+import sys
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+from datetime import datetime, timedelta, timezone
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database import cita_writes, slots
+from database.slots import _slot_libre, fecha_hora_de, slot_id
+
+
+class TestSlots(unittest.TestCase):
+    def setUp(self):
+        self.now = datetime(2026, 10, 19, 15, 0, tzinfo=timezone.utc)
+        self.inicio = fecha_hora_de('2026-10-20', '10:30')
+
+    def test_01_slot_id_per_dentist_and_start_time(self):
+        self.assertEqual(slot_id('d1', self.inicio), 'd1_20261020T1030')
+        self.assertEqual(fecha_hora_de(datetime(2026, 10, 20, 12), '10:30'), self.inicio)
+
+    def test_02_holds_expire_and_belong_to_holder(self):
+        hold = {'status': 'hold', 'holder': 'p1', 'expiresAt': self.now + timedelta(minutes=5)}
+        self.assertTrue(_slot_libre(None, 'p2', self.now))
+        self.assertTrue(_slot_libre(hold, 'p1', self.now))
+        self.assertFalse(_slot_libre(hold, 'p2', self.now))
+        self.assertTrue(_slot_libre(hold, 'p2', self.now + timedelta(minutes=6)))
+
+    def test_03_booked_slot_frees_when_cita_cancelled_or_moved(self):
+        booked = {'status': 'booked', 'dentistaId': 'd1', 'key': '20261020T1030', 'citaId': 'c1'}
+        cita = {'estado': 'programada', 'dentistaId': 'd1', 'fechaHora': self.inicio}
+        self.assertFalse(_slot_libre(booked, 'p2', self.now, cita))
+        self.assertTrue(_slot_libre(booked, 'p2', self.now, dict(cita, estado='cancelada')))
+        self.assertTrue(_slot_libre(booked, 'p2', self.now,
+                                    dict(cita, fechaHora=self.inicio + timedelta(hours=1))))
+        self.assertTrue(_slot_libre(booked, 'p2', self.now, None))
+
+    def test_04_own_booking_does_not_block_its_reschedule(self):
+        booked = {'status': 'booked', 'dentistaId': 'd1', 'key': '20261020T1030', 'citaId': 'c1'}
+        cita = {'estado': 'programada', 'dentistaId': 'd1', 'fechaHora': self.inicio}
+        self.assertTrue(_slot_libre(booked, 'p1', self.now, cita, cita_id='c1'))
+        self.assertFalse(_slot_libre(booked, 'p1', self.now, cita, cita_id='c2'))
+
+
+def _doc(data):
+    snapshot = MagicMock(exists=data is not None)
+    snapshot.to_dict.return_value = data
+    return snapshot
+
+
+@patch('database.slots.firestore.transactional', lambda fn: fn)
+class TestReagendarCita(unittest.TestCase):
+    """reagendar_cita: reserva del horario nuevo y cita en la misma transacción"""
+
+    def setUp(self):
+        cita_writes._rekey_state.update(done=True)
+        self.addCleanup(cita_writes._rekey_state.update, done=False, checked_at=0.0)
+        self.db = MagicMock()
+        self.transaction = self.db.transaction.return_value
+        self.nuevo = fecha_hora_de('2026-10-21', '12:00')
+        self.docs = {}  # path -> datos leídos dentro de la transacción
+
+        def document(path):
+            ref = MagicMock(name=path)
+            ref.path = path
+            ref.get.side_effect = lambda transaction=None: _doc(self.docs.get(path))
+            return ref
+
+        def collection(nombre):
+            col = MagicMock()
+            col.document.side_effect = lambda doc_id='auto': document(f'{nombre}/{doc_id}')
+            return col
+
+        self.db.collection.side_effect = collection
+        self.docs['citas/c1'] = {'dentistaId': 'd1', 'fechaHora': self.inicio_viejo()}
+
+    @staticmethod
+    def inicio_viejo():
+        return fecha_hora_de('2026-10-20', '10:30')
+
+    def _sets(self):
+        return {call.args[0].path: call.args[1] for call in self.transaction.set.call_args_list
+                if call.args[0].path.startswith('slots/')}
+
+    def test_01_books_new_slot_and_updates_both_copies(self):
+        cambio = slots.reagendar_cita(self.db, 'p1', 'c1', self.nuevo, {'horaInicio': '12:00'},
+                                      {'fechaHora': self.nuevo})
+
+        self.assertEqual((cambio['citaId'], cambio['tipo']), ('c1', 'rescheduled'))
+        slot = self._sets()['slots/d1_20261021T1200']
+        self.assertEqual((slot['status'], slot['citaId'], slot['pacienteId']), ('booked', 'c1', 'p1'))
+        actualizados = [call.args[1] for call in self.transaction.update.call_args_list]
+        self.assertEqual(actualizados, [{'horaInicio': '12:00'}, {'fechaHora': self.nuevo}])
+
+    def test_02_slot_taken_by_another_appointment(self):
+        self.docs['slots/d1_20261021T1200'] = {'status': 'booked', 'dentistaId': 'd1',
+                                               'key': '20261021T1200', 'citaId': 'c9'}
+        self.docs['citas/c9'] = {'estado': 'confirmado', 'dentistaId': 'd1', 'fechaHora': self.nuevo}
+
+        self.assertIsNone(slots.reagendar_cita(self.db, 'p1', 'c1', self.nuevo, {'horaInicio': '12:00'}))
+        self.transaction.set.assert_not_called()
+        self.transaction.update.assert_not_called()
+
+    def test_03_own_hold_becomes_the_booking(self):
+        self.docs['slots/d1_20261021T1200'] = {
+            'status': 'hold', 'holder': 'p1',
+            'expiresAt': datetime.now(timezone.utc) + timedelta(minutes=5)}
+        self.assertIsNotNone(slots.reagendar_cita(self.db, 'p1', 'c1', self.nuevo, {'horaInicio': '12:00'}))
+        self.assertEqual(self._sets()['slots/d1_20261021T1200']['status'], 'booked')
+
+        # El hold de otro paciente sí bloquea
+        self.transaction.reset_mock()
+        self.docs['slots/d1_20261021T1200']['holder'] = 'p2'
+        self.assertIsNone(slots.reagendar_cita(self.db, 'p1', 'c1', self.nuevo, {'horaInicio': '12:00'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import sys
+import os
+import unittest
+from unittest.mock import patch
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.token_service import TokenService
+
+
+class TestTokenService(unittest.TestCase):
+    def setUp(self):
+        self.service = TokenService()
+        self.data = {'action': 'approve_medical_history', 'pacienteId': 'pac1', 'authId': 'a1'}
+
+    def test_01_roundtrip_and_tampering(self):
+        token = self.service.generate_token(self.data)
+        self.assertNotIn('.', token)
+        self.assertEqual(self.service.validate_token(token), self.data)
+        tampered = token[:-2] + ('A' if token[-2] != 'A' else 'B') + token[-1]
+        self.assertIsNone(self.service.validate_token(tampered))
+        self.assertIsNone(self.service.validate_token('basura'))
+
+    def test_02_key_rotation(self):
+        with patch.dict(os.environ, {'TOKEN_SECRET_KEYS': '1:viejo', 'TOKEN_ACTIVE_KEY_ID': '1'}):
+            old = TokenService().generate_token(self.data)
+        with patch.dict(os.environ, {'TOKEN_SECRET_KEYS': '1:viejo,2:nuevo', 'TOKEN_ACTIVE_KEY_ID': '2'}):
+            rotated = TokenService()
+        self.assertEqual(rotated.validate_token(old), self.data)
+        self.assertIsNone(self.service.validate_token(old))  # Llave 1 no configurada
+
+    def test_03_expiry_cache_and_replay(self):
+        token = self.service.generate_token(self.data)
+        self.assertEqual(self.service.consume_token(token), self.data)
+        self.assertIsNone(self.service.consume_token(token))
+        self.assertEqual(self.service.validate_token(token), self.data)
+
+        with patch('services.token_service.time.time', return_value=4102444800):
+            self.assertIsNone(self.service.validate_token(token))
+
+    def test_04_legacy_key_can_be_retired(self):
+        with patch.dict(os.environ, {'TOKEN_SECRET_KEY': 'legado', 'TOKEN_SECRET_KEYS': ''}):
+            legacy = TokenService()
+            old = legacy.generate_token(self.data)
+        self.assertEqual(legacy.active_key_id, 0)
+
+        with patch.dict(os.environ, {'TOKEN_SECRET_KEY': 'legado', 'TOKEN_SECRET_KEYS': '1:nuevo'}):
+            retired = TokenService()
+        self.assertEqual(set(retired.keys), {1})
+        self.assertIsNone(retired.validate_token(old))
+
+        for env in ({'TOKEN_SECRET_KEYS': '0:legado,1:nuevo'},
+                    {'TOKEN_SECRET_KEYS': '1:nuevo', 'TOKEN_LEGACY_KEY': 'true'}):
+            with patch.dict(os.environ, dict(env, TOKEN_SECRET_KEY='legado', TOKEN_ACTIVE_KEY_ID='1')):
+                self.assertEqual(TokenService().validate_token(old), self.data)
+
+    def test_05_is_consumed_does_not_consume(self):
+        token = self.service.generate_token(self.data)
+        self.assertFalse(self.service.is_consumed(token))
+        self.assertFalse(self.service.is_consumed(token))
+        self.service.consume_token(token)
+        self.assertTrue(self.service.is_consumed(token))
+        self.assertFalse(self.service.is_consumed('basura'))
+
+
+if __name__ == '__main__':
+    unittest.main()
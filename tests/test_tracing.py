@@ -0,0 +1,77 @@
+import sys
+import os
+import time
+import unittest
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.tracing import Tracer
+
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        self.tracer = Tracer()
+
+    def test_01_nested_spans(self):
+        with self.tracer.trace('process_message') as trace:
+            with self.tracer.span('stage.agent'):
+                with self.tracer.span('openai', call_type='intent'):
+                    pass
+            with self.tracer.span('twilio.send_text'):
+                pass
+        names = [(s['name'], s['depth'], s['parent']) for s in trace.spans]
+        self.assertEqual(names, [('stage.agent', 0, None), ('openai', 1, 0), ('twilio.send_text', 0, None)])
+        self.assertTrue(all(s['duration_ms'] is not None for s in trace.spans))
+        self.assertIsNotNone(trace.duration_ms)
+        self.assertIsNone(self.tracer.current())
+
+    def test_02_noop_without_trace_and_errors(self):
+        with self.tracer.span('huérfano') as span:
+            self.assertIsNone(span)
+        self.assertEqual(self.tracer.get_stats()['stages'], {})
+
+        with self.assertRaises(ValueError):
+            with self.tracer.trace('req') as trace:
+                with self.tracer.span('falla'):
+                    raise ValueError()
+        self.assertEqual(trace.spans[0]['error'], 'ValueError')
+
+    def test_03_percentiles_and_profile(self):
+        for _ in range(20):
+            with self.tracer.trace('req'):
+                with self.tracer.span('rapida'):
+                    pass
+        stats = self.tracer.get_stats()['stages']
+        self.assertEqual(stats['rapida']['count'], 20)
+        self.assertLessEqual(stats['rapida']['p50_ms'], stats['rapida']['p99_ms'])
+
+        self.tracer.admin_token = 'secreto'
+        self.assertTrue(self.tracer.profile_requested({'X-Debug-Profile': '1', 'X-Debug-Token': 'secreto'}))
+        with self.tracer.trace('perfilada', profile=True) as trace:
+            fin = time.time() + 0.05
+            while time.time() < fin:
+                pass
+        self.assertTrue(trace.profile)
+        self.assertIn('test_tracing.py', trace.profile[0]['stack'])
+
+    def test_04_profile_header_and_debug_endpoints_need_token(self):
+        # Sin token configurado: cerrado
+        self.tracer.admin_token = ''
+        self.assertFalse(self.tracer.debug_authorized({'X-Debug-Token': ''}))
+        self.assertFalse(self.tracer.profile_requested({'X-Debug-Profile': '1'}))
+
+        self.tracer.admin_token = 'secreto'
+        self.assertFalse(self.tracer.profile_requested({'X-Debug-Profile': '1'}))
+        self.assertFalse(self.tracer.profile_requested({'X-Debug-Profile': '1', 'X-Debug-Token': 'otro'}))
+        self.assertFalse(self.tracer.profile_requested({'X-Debug-Token': 'secreto'}))
+        self.assertTrue(self.tracer.debug_authorized({'X-Debug-Token': 'secreto'}))
+        self.assertFalse(self.tracer.debug_authorized(None))
+        # Un header no ASCII no debe lanzar TypeError (sería un 500)
+        self.assertFalse(self.tracer.debug_authorized({'X-Debug-Token': 'señal'}))
+        self.tracer.admin_token = 'señal'
+        self.assertTrue(self.tracer.debug_authorized({'X-Debug-Token': 'señal'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
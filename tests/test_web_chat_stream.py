@@ -0,0 +1,146 @@
+import sys
+import os
+import json
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.ml_service import MLService
+from services.prompt_builder import TokenUsageTracker, CALL_RESPONSE
+
+
+def _chunk(text=None, usage=None):
+    choices = [] if text is None else [SimpleNamespace(delta=SimpleNamespace(content=text))]
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+def _events(body):
+    """Eventos SSE de un cuerpo completo; cada uno es 'data: {json}' seguido de una línea vacía"""
+    frames = [f for f in body.split('\n\n') if f]
+    for frame in frames:
+        assert frame.startswith('data: '), frame
+    return [json.loads(f[len('data: '):]) for f in frames]
+
+
+class TestStreamOpenAI(unittest.TestCase):
+    def setUp(self):
+        # Sin __init__: no se crean clientes de OpenAI ni de Hugging Face
+        self.ml = MLService.__new__(MLService)
+        self.client = MagicMock()
+        self.tracker = TokenUsageTracker()
+        patcher = patch('services.ml_service.token_usage_tracker', self.tracker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _stream(self, chunks, callback):
+        self.client.chat.completions.create.return_value = iter(chunks)
+        return self.ml._stream_openai(self.client, 'gpt', [{'role': 'user', 'content': 'hola'}],
+                                      300, 0.8, CALL_RESPONSE, callback)
+
+    def test_01_forwards_fragments_and_records_usage(self):
+        recibidos = []
+        usage = SimpleNamespace(prompt_tokens=50, completion_tokens=3)
+        texto = self._stream([_chunk('Ho'), _chunk(''), _chunk('la '), _chunk(None, usage)],
+                             recibidos.append)
+
+        self.assertEqual(texto, 'Hola')
+        self.assertEqual(recibidos, ['Ho', 'la '])
+        kwargs = self.client.chat.completions.create.call_args.kwargs
+        self.assertTrue(kwargs['stream'])
+        self.assertEqual(kwargs['stream_options'], {'include_usage': True})
+        self.assertEqual(self.tracker.get_stats()[CALL_RESPONSE]['prompt_tokens'], 50)
+
+    def test_02_disconnected_callback_stops_forwarding_but_keeps_full_text(self):
+        recibidos = []
+
+        def callback(text):
+            recibidos.append(text)
+            raise BrokenPipeError('cliente desconectado')
+
+        texto = self._stream([_chunk('uno '), _chunk('dos')], callback)
+        self.assertEqual(texto, 'uno dos')
+        self.assertEqual(recibidos, ['uno '])
+
+    def test_03_empty_stream_returns_none(self):
+        self.assertIsNone(self._stream([_chunk(None)], lambda text: None))
+
+
+class TestWebChatStreamEndpoint(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import app as app_module
+        app_module._schedulers_initialized = True  # sin schedulers en pruebas
+        cls.app_module = app_module
+
+    def setUp(self):
+        self.client = self.app_module.app.test_client()
+        self.body = {'message': 'hola', 'session_id': 's1'}
+
+    def test_01_sse_framing_tokens_then_done(self):
+        def run(stream_callback=None, **params):
+            # Corre en el hilo de trabajo, no en el de la solicitud
+            self.assertIsNot(threading.current_thread(), threading.main_thread())
+            stream_callback('Hola ')
+            stream_callback('Ana')
+            return 'Hola Ana'
+
+        with patch.object(self.app_module, '_run_web_chat', side_effect=run):
+            response = self.client.post('/api/web/chat/stream', json=self.body)
+            body = response.get_data(as_text=True)
+
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        events = _events(body)
+        self.assertEqual(events[:2], [{'type': 'token', 'text': 'Hola '}, {'type': 'token', 'text': 'Ana'}])
+        self.assertEqual(events[-1], {'type': 'done', 'success': True, 'response': 'Hola Ana',
+                                      'session_id': 's1', 'mode': 'hybrid', 'streamed': True})
+
+    def test_02_menu_response_only_in_done_event(self):
+        with patch.object(self.app_module, '_run_web_chat', return_value='1. Agendar'):
+            events = _events(self.client.post('/api/web/chat/stream', json=self.body).get_data(as_text=True))
+        self.assertEqual(len(events), 1)
+        self.assertEqual((events[0]['response'], events[0]['streamed']), ('1. Agendar', False))
+
+    def test_03_worker_error_ends_stream_with_failed_done(self):
+        def run(stream_callback=None, **params):
+            stream_callback('parcial')
+            raise RuntimeError('falló OpenAI')
+
+        with patch.object(self.app_module, '_run_web_chat', side_effect=run):
+            events = _events(self.client.post('/api/web/chat/stream', json=self.body).get_data(as_text=True))
+        self.assertEqual(events[-1], {'type': 'done', 'success': False, 'error': 'falló OpenAI',
+                                      'session_id': 's1', 'streamed': True})
+
+    def test_04_client_disconnect_does_not_block_worker(self):
+        terminado = threading.Event()
+        continuar = threading.Event()
+
+        def run(stream_callback=None, **params):
+            stream_callback('uno')
+            continuar.wait(5)
+            stream_callback('dos')  # ya nadie lee la cola: no debe bloquear
+            terminado.set()
+            return 'uno dos'
+
+        with patch.object(self.app_module, '_run_web_chat', side_effect=run):
+            response = self.client.post('/api/web/chat/stream', json=self.body, buffered=False)
+            primero = next(response.response)
+            response.close()  # el cliente se fue
+            continuar.set()
+            self.assertTrue(terminado.wait(5))
+
+        primero = primero.decode() if isinstance(primero, bytes) else primero
+        self.assertEqual(_events(primero), [{'type': 'token', 'text': 'uno'}])
+
+    def test_05_invalid_request_is_rejected_before_streaming(self):
+        response = self.client.post('/api/web/chat/stream', json={'message': 'hola'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.get_json()['success'])
+
+
+if __name__ == '__main__':
+    unittest.main()
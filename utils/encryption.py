@@ -1,7 +1,12 @@
 import base64
 import os
 import json
-from typing import Union, Dict, List, Any
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, Dict, List, Any, Optional, Tuple
 
 try:
     from cryptography.hazmat.primitives import hashes
@@ -33,6 +38,83 @@ def derive_key(user_id: str, salt: bytes) -> bytes:
     key = kdf.derive(user_id.encode('utf-8'))
     return key
 
+class DerivedKeyCache:
+    """
+    Bounded, memory-only cache of derived AES keys keyed by (user_id, salt).
+    The web client reuses one salt per record, so a record with many encrypted
+    fields needs a single PBKDF2 derivation instead of one per field.
+    Entries expire after a short TTL; evicted/expired keys are zeroed in place
+    (best effort: AESGCM keeps its own copy while a decryption is running).
+    """
+    
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, bytes], Tuple[bytearray, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def _wipe(key: bytearray):
+        for i in range(len(key)):
+            key[i] = 0
+    
+    def get_or_derive(self, user_id: str, salt: bytes) -> bytes:
+        cache_key = (user_id, bytes(salt))
+        now = time.monotonic()
+        
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                key, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(cache_key)
+                    self.hits += 1
+                    return bytes(key)
+                # Expired: drop and wipe
+                del self._entries[cache_key]
+                self._wipe(key)
+        
+        # Derive outside the lock so other users are not blocked by PBKDF2
+        derived = bytearray(derive_key(user_id, salt))
+        
+        with self._lock:
+            self.misses += 1
+            previous = self._entries.pop(cache_key, None)
+            if previous is not None:
+                self._wipe(previous[0])
+            self._entries[cache_key] = (derived, now + self.ttl_seconds)
+            while len(self._entries) > self.max_entries:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._wipe(evicted)
+            return bytes(derived)
+    
+    def clear(self):
+        with self._lock:
+            for key, _ in self._entries.values():
+                self._wipe(key)
+            self._entries.clear()
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+# Process-wide cache (each gunicorn worker has its own)
+key_cache = DerivedKeyCache(
+    max_entries=int(os.getenv('ENCRYPTION_KEY_CACHE_SIZE', '256')),
+    ttl_seconds=float(os.getenv('ENCRYPTION_KEY_CACHE_TTL', '300'))
+)
+
+def derive_key_cached(user_id: str, salt: bytes) -> bytes:
+    """
+    Same as derive_key, but reuses keys already derived for (user_id, salt).
+    """
+    if not user_id:
+        raise ValueError("User ID is required to derive key")
+    return key_cache.get_or_derive(user_id, salt)
+
 def decrypt_string(encrypted_data: Dict[str, str], user_id: str) -> Union[str, None]:
     """
     Decrypts a single encrypted string entry.
@@ -46,8 +128,8 @@ def decrypt_string(encrypted_data: Dict[str, str], user_id: str) -> Union[str, N
         iv = base64.b64decode(encrypted_data['iv'])
         salt = base64.b64decode(encrypted_data['salt'])
         
-        # Derive key
-        key = derive_key(user_id, salt)
+        # Derive key (one PBKDF2 run per distinct salt thanks to the cache)
+        key = derive_key_cached(user_id, salt)
         
         # Decrypt using AES-GCM
         aesgcm = AESGCM(key)
@@ -104,6 +186,142 @@ def decrypt_object(obj: Any, user_id: str) -> Any:
             
     return decrypted
 
+def _is_encrypted_leaf(obj: Any) -> bool:
+    return (isinstance(obj, dict) and bool(obj.get('encrypted')) and bool(obj.get('iv'))
+            and bool(obj.get('salt')) and obj.get('algorithm') == 'AES-256-GCM')
+
+def _is_metadata_key(key: str) -> bool:
+    return key.startswith('_encrypted') or key.startswith('_encryption')
+
+def _collect_leaves(obj: Any, leaves: List[Dict]):
+    """
+    Collects encrypted leaves in the same order decrypt_object visits them.
+    """
+    if not isinstance(obj, dict):
+        return
+    if _is_encrypted_leaf(obj):
+        leaves.append(obj)
+        return
+    for key, value in obj.items():
+        if _is_metadata_key(key):
+            continue
+        if isinstance(value, dict):
+            _collect_leaves(value, leaves)
+        elif isinstance(value, list):
+            for item in value:
+                _collect_leaves(item, leaves)
+
+def _rebuild(obj: Any, plaintexts) -> Any:
+    """
+    Rebuilds the structure like decrypt_object, taking leaf values from an iterator.
+    """
+    if not isinstance(obj, dict):
+        return obj
+    if _is_encrypted_leaf(obj):
+        return next(plaintexts)
+    decrypted = {}
+    for key, value in obj.items():
+        if _is_metadata_key(key):
+            continue
+        if isinstance(value, dict):
+            decrypted[key] = _rebuild(value, plaintexts)
+        elif isinstance(value, list):
+            decrypted[key] = [_rebuild(item, plaintexts) for item in value]
+        else:
+            decrypted[key] = value
+    return decrypted
+
+# Shared pool for bulk decryption. PBKDF2 and AES-GCM in `cryptography`
+# release the GIL, so these threads run on separate cores.
+_decrypt_pool: Optional[ThreadPoolExecutor] = None
+_decrypt_pool_lock = threading.Lock()
+_DECRYPT_CHUNK_SIZE = 64
+
+def _get_decrypt_pool() -> ThreadPoolExecutor:
+    global _decrypt_pool
+    if _decrypt_pool is None:
+        with _decrypt_pool_lock:
+            if _decrypt_pool is None:
+                workers = int(os.getenv('DECRYPT_WORKERS', str(min(8, os.cpu_count() or 1))))
+                _decrypt_pool = ThreadPoolExecutor(max_workers=max(1, workers),
+                                                   thread_name_prefix='decrypt')
+    return _decrypt_pool
+
+def _decrypt_chunk(aesgcm, items: List[Tuple[int, bytes, bytes]]) -> List[Tuple[int, Optional[str]]]:
+    results = []
+    for index, iv, ciphertext in items:
+        try:
+            results.append((index, aesgcm.decrypt(iv, ciphertext, None).decode('utf-8')))
+        except Exception as e:
+            print(f"Error decrypting string: {e}")
+            results.append((index, None))
+    return results
+
+def decrypt_many(records: List[Tuple[Any, str]]) -> List[Any]:
+    """
+    Bulk decryption for one or many records: [(obj, user_id), ...] -> [decrypted_obj, ...]
+    1. Collects every encrypted leaf of every record.
+    2. Groups leaves by (user_id, salt) and derives one key per group (cached, in parallel).
+    3. Decrypts the leaves in the thread pool and rebuilds each structure.
+    Output matches decrypt_object; leaves that fail to decrypt become None.
+    """
+    record_leaves: List[List[Dict]] = []
+    groups: Dict[Tuple[str, bytes], List[Tuple[int, bytes, bytes]]] = {}
+    plaintexts: List[Optional[str]] = []
+    
+    for obj, user_id in records:
+        leaves: List[Dict] = []
+        _collect_leaves(obj, leaves)
+        record_leaves.append(leaves)
+        for leaf in leaves:
+            index = len(plaintexts)
+            plaintexts.append(None)
+            try:
+                ciphertext = base64.b64decode(leaf['encrypted'])
+                iv = base64.b64decode(leaf['iv'])
+                salt = base64.b64decode(leaf['salt'])
+            except Exception as e:
+                print(f"Error decoding encrypted field: {e}")
+                continue
+            if not user_id:
+                print("Error decrypting string: User ID is required to derive key")
+                continue
+            groups.setdefault((user_id, salt), []).append((index, iv, ciphertext))
+    
+    if groups:
+        group_keys = list(groups.keys())
+        parallel = len(plaintexts) > _DECRYPT_CHUNK_SIZE or len(group_keys) > 1
+        pool = _get_decrypt_pool() if parallel else None
+        
+        # One derivation per distinct (user_id, salt)
+        if pool:
+            keys = list(pool.map(lambda gk: derive_key_cached(gk[0], gk[1]), group_keys))
+        else:
+            keys = [derive_key_cached(gk[0], gk[1]) for gk in group_keys]
+        
+        chunks = []
+        for group_key, key in zip(group_keys, keys):
+            aesgcm = AESGCM(key)
+            items = groups[group_key]
+            for start in range(0, len(items), _DECRYPT_CHUNK_SIZE):
+                chunks.append((aesgcm, items[start:start + _DECRYPT_CHUNK_SIZE]))
+        
+        if pool and len(chunks) > 1:
+            chunk_results = pool.map(lambda chunk: _decrypt_chunk(*chunk), chunks)
+        else:
+            chunk_results = [_decrypt_chunk(*chunk) for chunk in chunks]
+        for results in chunk_results:
+            for index, text in results:
+                plaintexts[index] = text
+    
+    decrypted_records = []
+    offset = 0
+    for (obj, _), leaves in zip(records, record_leaves):
+        values = iter(plaintexts[offset:offset + len(leaves)])
+        offset += len(leaves)
+        decrypted_records.append(_rebuild(obj, values))
+    return decrypted_records
+
 def decrypt_medical_history(historial_data: Dict[str, Any], user_id: str) -> Dict[str, Any]:
     """
     Main entry point to decrypt full medical history.
@@ -111,4 +329,69 @@ def decrypt_medical_history(historial_data: Dict[str, Any], user_id: str) -> Dic
     if not historial_data or not historial_data.get('_encrypted'):
         return historial_data
         
-    return decrypt_object(historial_data, user_id)
+    return decrypt_many([(historial_data, user_id)])[0]
+
+
+class LazyDecryptedView(Mapping):
+    """
+    Read-only view over a stored medical history that decrypts a field only when it
+    is accessed and memoizes the result (one view per request).
+    Unencrypted documents are passed through untouched, like decrypt_medical_history.
+    """
+    
+    def __init__(self, data: Dict[str, Any], user_id: str):
+        self._raw = data or {}
+        self._user_id = user_id
+        self._encrypted = bool(self._raw.get('_encrypted'))
+        self._values: Dict[str, Any] = {}
+    
+    def _visible(self, key: str) -> bool:
+        return not (self._encrypted and _is_metadata_key(key))
+    
+    def __getitem__(self, key: str) -> Any:
+        if key in self._values:
+            return self._values[key]
+        if not self._visible(key):
+            raise KeyError(key)
+        raw = self._raw[key]
+        if self._encrypted and isinstance(raw, (dict, list)):
+            value = decrypt_many([({key: raw}, self._user_id)])[0][key]
+        else:
+            value = raw
+        self._values[key] = value
+        return value
+    
+    def __iter__(self):
+        return (key for key in self._raw if self._visible(key))
+    
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+    
+    def __contains__(self, key) -> bool:
+        return key in self._raw and self._visible(key)
+    
+    @property
+    def decrypted_fields(self) -> List[str]:
+        """Fields already materialized by this view"""
+        return list(self._values)
+    
+    def has_value(self, key: str) -> bool:
+        """
+        Presence test with the usual emptiness rules. An encrypted leaf is decrypted
+        (and memoized) first: a ciphertext of '' or whitespace is not a filled field.
+        """
+        if key not in self._values and key not in self:
+            return False
+        value = self[key]
+        if isinstance(value, str):
+            return value.strip() != ''
+        return bool(value)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Materializes every field, decrypting the pending ones in a single batch"""
+        pending = {key: self._raw[key] for key in self if key not in self._values}
+        if pending:
+            if self._encrypted:
+                pending = decrypt_many([(pending, self._user_id)])[0]
+            self._values.update(pending)
+        return {key: self._values[key] for key in self}
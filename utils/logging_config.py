@@ -0,0 +1,112 @@
+"""
+Structured logging configured once at startup.
+
+- Level from LOG_LEVEL (default INFO); debug calls below the level cost only the
+  isEnabledFor check because messages use lazy %-formatting.
+- Records go through a QueueHandler; a QueueListener thread does the formatting
+  and the stdout write, so request threads never block on I/O.
+- LOG_FORMAT=json (default) emits one JSON object per line; LOG_FORMAT=text is
+  meant for local development.
+- LOG_DEBUG_SAMPLE_RATE (0..1) keeps only a fraction of DEBUG records when debug
+  is enabled in a busy environment.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+_configured = False
+_config_lock = threading.Lock()
+_listener: Optional[logging.handlers.QueueListener] = None
+
+# Attributes every LogRecord has; anything else was passed through `extra=`
+_RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, extra fields and exc_info"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'ts': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class DebugSamplingFilter(logging.Filter):
+    """Keeps every INFO+ record and a random fraction of DEBUG records"""
+
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.rate = max(0.0, min(1.0, rate))
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+
+def configure_logging(level: str = None, fmt: str = None, stream=None) -> logging.Logger:
+    """
+    Installs the root handler once per process; later calls are no-ops.
+    Returns the root logger.
+    """
+    global _configured, _listener
+    with _config_lock:
+        root = logging.getLogger()
+        if _configured:
+            return root
+
+        level_name = (level or os.getenv('LOG_LEVEL', 'INFO')).upper()
+        fmt = (fmt or os.getenv('LOG_FORMAT', 'json')).lower()
+
+        output = logging.StreamHandler(stream or sys.stdout)
+        if fmt == 'text':
+            output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        else:
+            output.setFormatter(JsonFormatter())
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(DebugSamplingFilter(float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '1.0'))))
+
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+        root.handlers = [queue_handler]
+        root.setLevel(getattr(logging, level_name, logging.INFO))
+        # Noisy third-party loggers stay at WARNING unless explicitly debugging them
+        for noisy in ('urllib3', 'twilio.http_client', 'google', 'grpc', 'httpx', 'openai'):
+            logging.getLogger(noisy).setLevel(logging.WARNING)
+
+        _configured = True
+        return root
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(name)
+
+
+def mask_phone(phone: Optional[str]) -> str:
+    """Phone numbers are PII: keep only the last 4 digits in logs"""
+    if not phone:
+        return ''
+    digits = ''.join(c for c in str(phone) if c.isdigit())
+    return f"***{digits[-4:]}" if len(digits) > 4 else '***'